@@ -44,7 +44,7 @@ from . import ngamsStorageSet, ngamsStream, ngamsMirroringSource
 from . import utils
 from .ngamsCore import (
     genLog, NGAMS_UNKNOWN_MT, isoTime2Secs, NGAMS_BACK_LOG_DIR,
-    loadPlugInEntryPoint,
+    loadPlugInEntryPoint, NGAMS_CACHE_EVICTION_POLICIES,
 )
 
 
@@ -656,6 +656,56 @@ class ngamsConfig:
         par = "Server[1].TimeOut"
         return getInt(par, self.getVal(par), None)
 
+    def getKeepAlive(self):
+        """
+        Whether the server should speak HTTP/1.1 and keep client connections
+        alive between requests.
+        """
+        par = "Server[1].KeepAlive"
+        return getInt(par, self.getVal(par), 0)
+
+    def getKeepAliveTimeOut(self):
+        """
+        Gets the time, in seconds, an idle kept-alive connection is kept open
+        before the server closes it.
+        """
+        par = "Server[1].KeepAliveTimeOut"
+        return getInt(par, self.getVal(par), 15)
+
+    def getKeepAliveMaxRequests(self):
+        """
+        Gets the maximum number of requests served through a single kept-alive
+        connection before the server closes it.
+        """
+        par = "Server[1].KeepAliveMaxRequests"
+        return getInt(par, self.getVal(par), 100)
+
+    def getFileLocationCacheTime(self):
+        """
+        Gets the time, in seconds, the location of a file found by a previous
+        lookup is reused by later ones. 0 disables the caching of file
+        locations.
+        """
+        par = "Server[1].FileLocationCacheTime"
+        return getInt(par, self.getVal(par), 0)
+
+    def getHostInfoCacheTime(self):
+        """
+        Gets the time, in seconds, the information read from the ngas_hosts
+        table is reused. 0 disables the caching of host information.
+        """
+        par = "Server[1].HostInfoCacheTime"
+        return getInt(par, self.getVal(par), 0)
+
+    def getContainerPrefetch(self):
+        """
+        Gets the number of container members stored in other servers that are
+        opened in advance while sending a container as a tarball. 0 disables
+        prefetching.
+        """
+        par = "Server[1].ContainerPrefetch"
+        return getInt(par, self.getVal(par), 4)
+
     def getPluginsPath(self):
         """
         Get the directory where plug-ins are placed.
@@ -744,11 +794,60 @@ class ngamsConfig:
                  * 0: ``crc32`` (using python's binascii implementation w/o masking)
                  * 1: ``crc32c`` (using Intel's SSE 4.2 implementation via the ``crc32c`` module)
                  * 2: ``crc32z`` (using python's binascii implementation w/ masking)
+                 * 3: ``md5``
+                 * 4: ``sha256``
+                 * 5: ``xxh3`` (64 bits, via the ``xxhash`` module)
+                 * 6: ``blake3`` (via the ``blake3`` module)
         """
         par = "ArchiveHandling[1].CRCVariant"
         return getInt(par, self.getVal(par), 0)
 
 
+    def getChecksumThreads(self):
+        """
+        Number of threads used to checksum big files when verifying them,
+        if their checksum variant allows it (i.e., CRC variants).
+
+        Returns:   Number of checksum threads (integer).
+        """
+        par = "ArchiveHandling[1].ChecksumThreads"
+        return getInt(par, self.getVal(par), 1)
+
+    def getRegisterThreads(self):
+        """
+        Number of threads used by the REGISTER command to run the
+        registration plug-in and calculate the checksum of the files
+        found on a disk.
+
+        Returns:   Number of register threads (integer).
+        """
+        par = "Register[1].Threads"
+        return getInt(par, self.getVal(par), 4)
+
+
+    def getIngestPipelineDepth(self):
+        """
+        Number of blocks that can be in flight between the read, checksum and
+        write stages when receiving data. Values lower than 2 disable the
+        pipelining of these stages, which then run serially.
+
+        Returns:   Ingest pipeline depth (integer).
+        """
+        par = "ArchiveHandling[1].IngestPipelineDepth"
+        return getInt(par, self.getVal(par), 0)
+
+    def getTargetDiskCacheTime(self):
+        """
+        Gets the time, in seconds, the information about the disks that can
+        store each type of data is reused when selecting target disks.
+        0 disables the caching of this information.
+
+        Returns:   Target disk cache time (integer).
+        """
+        par = "ArchiveHandling[1].TargetDiskCacheTime"
+        return getInt(par, self.getVal(par), 0)
+
+
     def getBlockSize(self):
         """
         Get HTTP data read/write block size.
@@ -917,6 +1016,16 @@ class ngamsConfig:
         par = "Db[1].MaxPoolConnections"
         return getInt(par, self.getVal(par), 7)
 
+    def getDbGroupCommit(self):
+        """
+        Whether file registrations from concurrent threads should be grouped
+        and committed together in a single transaction.
+        """
+        val = self.getVal("Db[1].GroupCommit")
+        if val is not None:
+            val = boolean_value(val)
+        return bool(val)
+
     def getDbSessionSql(self):
         """SQL commands to run whenever a connection is established"""
         return self.session_sqls
@@ -932,7 +1041,8 @@ class ngamsConfig:
         for attr in dbEl.getAttrList():
             name = str(attr.getName())
             val = attr.getValue()
-            if name in ('Id', 'Interface', 'Snapshot', 'UseFileIgnore', 'MaxPoolConnections'):
+            if name in ('Id', 'Interface', 'Snapshot', 'UseFileIgnore', 'MaxPoolConnections',
+                        'GroupCommit'):
                 continue
 
             # Simple casting before saving
@@ -1174,6 +1284,17 @@ class ngamsConfig:
         return getInt(par, self.getVal(par))
 
 
+    def getDataCheckMaxDiskRate(self):
+        """
+        Return the maximum rate, in MB/s, at which data is read from each
+        volume by the Data Check Thread. 0 means no limit.
+
+        Returns:     Maximum read rate per volume (integer).
+        """
+        par = "DataCheckThread[1].MaxDiskRate"
+        return getInt(par, self.getVal(par), 0)
+
+
     def getDataCheckScan(self):
         """
         Return the Data Check Scan Flag.
@@ -1184,6 +1305,31 @@ class ngamsConfig:
         return getInt(par, self.getVal(par), 1)
 
 
+    def getDataCheckIncremental(self):
+        """
+        Return the Data Check Incremental Flag. When set, files that haven't
+        changed since they were last verified are checksummed only once
+        every full cycle (see getDataCheckFullCycle()).
+
+        Returns:     Data Check Incremental Flag (integer/0|1).
+        """
+        par = "DataCheckThread[1].Incremental"
+        return getInt(par, self.getVal(par), 0)
+
+
+    def getDataCheckFullCycle(self):
+        """
+        Return the period within which all files are verified when checking
+        incrementally.
+
+        Returns:     Data Check Full Cycle Time (string).
+        """
+        fullCycle = self.getVal("DataCheckThread[1].FullCycle")
+        if not fullCycle:
+            return "30T00:00:00"
+        return fullCycle
+
+
     def getDataCheckMinCycle(self):
         """
         Return the Data Check Service Minimum Cycle Time.
@@ -1893,6 +2039,19 @@ class ngamsConfig:
             return 0
 
 
+    def getCachingEvictionPolicy(self):
+        """
+        Return the policy used to select the files to remove from the cache
+        when the maximum cache size or number of files is exceeded.
+
+        Returns:    FIFO, LRU, LFU or ARC (string).
+        """
+        policy = self.getVal("Caching[1].EvictionPolicy")
+        if not policy:
+            return "FIFO"
+        return policy.strip().upper()
+
+
     def _check_str(self, prop, value):
         """Check that ``value`` is of type string, and is not empty"""
         if not isinstance(value, six.string_types):
@@ -1961,6 +2120,7 @@ class ngamsConfig:
         self._check_str("Server.RootDirectory",
                       self.getRootDirectory())
         self._check_0_1("Server.ProxyMode", self.getProxyMode())
+        self._check_0_1("Server.KeepAlive", self.getKeepAlive())
 
         self._check_str("SystemPlugIns.OnlinePlugIn",
                       self.getOnlinePlugIn())
@@ -2054,8 +2214,29 @@ class ngamsConfig:
             self._check_int("DataCheckThread.DataCheckMaxProcs",
                             self.getDataCheckMaxProcs())
             self._check_0_1("DataCheckThread.DataCheckScan", self.getDataCheckScan())
+            if (self._check_int("DataCheckThread.DataCheckMaxDiskRate",
+                                self.getDataCheckMaxDiskRate()) and
+                self.getDataCheckMaxDiskRate() < 0):
+                errMsg = "Illegal value for property " +\
+                         "DataCheckThread.MaxDiskRate: %d" %\
+                         self.getDataCheckMaxDiskRate()
+                errMsg = genLog("NGAMS_ER_CONF_PROP", [errMsg])
+                logger.error(errMsg)
+                report.append(errMsg)
             self._check_str("DataCheckThread.DataCheckMinCycle",
                           self.getDataCheckMinCycle())
+            self._check_0_1("DataCheckThread.DataCheckIncremental",
+                            self.getDataCheckIncremental())
+            if self.getDataCheckIncremental():
+                try:
+                    isoTime2Secs(self.getDataCheckFullCycle())
+                except (ValueError, IndexError):
+                    errMsg = "Illegal value for property " +\
+                             "DataCheckThread.FullCycle: %s" %\
+                             self.getDataCheckFullCycle()
+                    errMsg = genLog("NGAMS_ER_CONF_PROP", [errMsg])
+                    logger.error(errMsg)
+                    report.append(errMsg)
 
         self._check_0_1("Log.SysLog", self.getSysLog())
         self._check_str("Log.SysLogPrefix", self.getSysLogPrefix())
@@ -2100,6 +2281,12 @@ class ngamsConfig:
             msg = "Permission to execute Remove Requests must be switched " +\
                   "on in order to enable the Caching Service"
             raise Exception(msg)
+        if self.getCachingEvictionPolicy() not in NGAMS_CACHE_EVICTION_POLICIES:
+            errMsg = "Illegal value for property Caching.EvictionPolicy: %s" %\
+                     self.getCachingEvictionPolicy()
+            errMsg = genLog("NGAMS_ER_CONF_PROP", [errMsg])
+            logger.error(errMsg)
+            report.append(errMsg)
 
         # Any errors found?
         if report:
@@ -60,11 +60,13 @@ For more detailed information about the project, consult the URL:
 import calendar
 import collections
 import errno
+import functools
 import glob
 import hashlib
 import importlib
 import logging
 import math
+import multiprocessing.pool
 import os
 import re
 import shutil
@@ -72,6 +74,7 @@ import socket
 import subprocess
 import threading
 import time
+import zlib
 
 import pkg_resources
 import six
@@ -154,11 +157,13 @@ NGAMS_HTTP_INT_AUTH_USER  = "ngas-int"
 
 # HTTP Status Codes.
 NGAMS_HTTP_SUCCESS        = 200
+NGAMS_HTTP_PARTIAL_CONTENT = 206
 NGAMS_HTTP_REDIRECT       = 303
 NGAMS_HTTP_PERM_REDIRECT  = 308
 NGAMS_HTTP_BAD_REQ        = 400
 NGAMS_HTTP_UNAUTH         = 401
 NGAMS_HTTP_UNAUTH_STR     = "Unauthorized"
+NGAMS_HTTP_RANGE_NOT_SATISFIABLE = 416
 NGAMS_HTTP_SERVICE_NA     = 503 # service is not available
 
 # Request Processing Data Types.
@@ -201,6 +206,7 @@ NGAMS_HTTP_PAR_UNIQUE        = "unique"
 NGAMS_HTTP_HDR_FILE_INFO     = "NGAS-File-Info"
 NGAMS_HTTP_HDR_CONTENT_TYPE  = "Content-Type"
 NGAMS_HTTP_HDR_CHECKSUM      = "NGAS-File-CRC"
+NGAMS_HTTP_HDR_CHECKSUM_VARIANT = "NGAS-File-CRC-Variant"
 
 # Types of Notification Events.
 NGAMS_NOTIF_INFO        = "InfoNotification"
@@ -239,6 +245,10 @@ NGAMS_DB_CH_FILE_INSERT = "FILE-INSERT"
 NGAMS_DB_CH_FILE_UPDATE = "FILE-UPDATE"
 NGAMS_DB_CH_FILE_DELETE = "FILE-DELETE"
 
+# Policies that can be used to select the files to remove from the cache when
+# the maximum cache size or number of files is exceeded.
+NGAMS_CACHE_EVICTION_POLICIES = ("FIFO", "LRU", "LFU", "ARC")
+
 # Miscelleneous.
 NGAMS_DISK_INFO          = "NgasDiskInfo"
 NGAMS_VOLUME_ID_FILE     = ".ngas_volume_id"
@@ -575,27 +585,142 @@ def to_valid_filename(fname):
     return re.sub(r"[\?=&]", "_", os.path.basename(fname))
 
 
+# The "gzip" command defaults to compression level 6
+_GZIP_LEVEL = 6
+
+def _gzip_member(data, level=_GZIP_LEVEL):
+    """Compresses `data` into a full gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(fin, fout, block_size=65536, threads=1,
+                    level=_GZIP_LEVEL):
+    """
+    Compresses the contents read from `fin` into `fout` using the gzip format.
+
+    If `threads` is greater than 1, the input is split in blocks of
+    `block_size` bytes that are compressed concurrently as independent gzip
+    members, which are then written in order. The result is a standard
+    multi-member gzip stream that gzip, gunzip and decompress_stream can read.
+
+    fin:          File object to read the data from.
+
+    fout:         File object to write the compressed data to.
+
+    block_size:   Size of the blocks read from `fin` (integer).
+
+    threads:      Number of threads used to compress the data (integer).
+
+    level:        Compression level (integer/[1; 9]).
+
+    Returns:      Void.
+    """
+    if threads <= 1:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for data in iter(functools.partial(fin.read, block_size), b''):
+            fout.write(compressor.compress(data))
+        fout.write(compressor.flush())
+        return
+
+    # zlib releases the GIL while compressing, so threads run in parallel.
+    # Only a couple of blocks per thread are read ahead to bound memory usage
+    compress = functools.partial(_gzip_member, level=level)
+    pool = multiprocessing.pool.ThreadPool(threads)
+    try:
+        written = False
+        while True:
+            blocks = []
+            for _ in range(threads * 2):
+                data = fin.read(block_size)
+                if not data:
+                    break
+                blocks.append(data)
+            if not blocks:
+                break
+            for member in pool.map(compress, blocks):
+                fout.write(member)
+            written = True
+            if len(blocks) < threads * 2:
+                break
+        # An empty input still results in a valid gzip stream
+        if not written:
+            fout.write(_gzip_member(b'', level))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def decompress_stream(fin, fout, block_size=65536):
+    """
+    Decompresses the gzip stream read from `fin` into `fout`. Streams with
+    several members (like those produced by compress_stream) are supported.
+
+    fin:          File object to read the compressed data from.
+
+    fout:         File object to write the decompressed data to.
+
+    block_size:   Size of the blocks read from `fin` (integer).
+
+    Returns:      Void.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for data in iter(functools.partial(fin.read, block_size), b''):
+        while data:
+            fout.write(decompressor.decompress(data))
+            data = decompressor.unused_data
+            if data:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if not _member_ended(decompressor):
+        raise zlib.error("Compressed stream ended before the end of a member")
+    fout.write(decompressor.flush())
+
+
+def _member_ended(decompressor):
+    """
+    Returns whether `decompressor` reached the end of its gzip member.
+    """
+    if hasattr(decompressor, 'eof'):
+        return decompressor.eof
+    # Python 2 decompressors have no eof attribute, but data fed past the
+    # end of a member is left as unused_data
+    try:
+        decompressor.decompress(b'\0')
+    except zlib.error:
+        return False
+    return decompressor.unused_data == b'\0'
+
+
 def compressFile(srcFilename,
-                 method = "gzip"):
+                 method = "gzip",
+                 threads = 1):
     """
     Compress a file and return the resulting filename.
 
-    For now only gzip is supported.
-
-    Note: It might be that the resulting filename is the same as the input
-    filename. This may happen if the file cannot be compressed.
+    For now only gzip is supported. The compression is done in-process,
+    possibly using several threads (see compress_stream). Like with the gzip
+    command, the original file is replaced by the compressed one, whose name
+    has an additional .gz extension.
 
     srcFilename:   Name of file to compress (string).
 
     method:        Method to apply when compressing the file (string/'gzip').
 
+    threads:       Number of threads used to compress the file (integer).
+
     Returns:       Name of resulting file (string).
     """
-    subprocess.check_call(['gzip', '-f', srcFilename])
     trgFilename = '%s.gz' % srcFilename
-    if os.path.exists(trgFilename):
-        return trgFilename
-    return srcFilename
+    try:
+        with open(srcFilename, 'rb') as fin, open(trgFilename, 'wb') as fout:
+            compress_stream(fin, fout, block_size=1024 * 1024,
+                            threads=threads)
+        shutil.copystat(srcFilename, trgFilename)
+    except Exception:
+        rmFile(trgFilename)
+        raise
+    os.remove(srcFilename)
+    return trgFilename
 
 
 def decompressFile(srcFilename,
@@ -603,7 +728,8 @@ def decompressFile(srcFilename,
     """
     Decompress a file and return the resulting filename.
 
-    For now only gzip is supported.
+    For now only gzip is supported. Like with the gunzip command, the
+    compressed file is replaced by the decompressed one.
 
     srcFilename:   Name of file to compress (string).
 
@@ -611,11 +737,18 @@ def decompressFile(srcFilename,
 
     Returns:       Name of resulting file (string).
     """
-    subprocess.check_call(['gunzip', '-f', srcFilename])
+    if not srcFilename.endswith('.gz'):
+        raise Exception("Error decompressing file: %s" % srcFilename)
     trgFilename = srcFilename[:-3]
-    if os.path.exists(trgFilename):
-        return trgFilename
-    raise Exception("Error decompressing file: %s" % srcFilename)
+    try:
+        with open(srcFilename, 'rb') as fin, open(trgFilename, 'wb') as fout:
+            decompress_stream(fin, fout)
+        shutil.copystat(srcFilename, trgFilename)
+    except Exception as e:
+        rmFile(trgFilename)
+        raise Exception("Error decompressing file: %s: %s" % (srcFilename, str(e)))
+    os.remove(srcFilename)
+    return trgFilename
 
 
 def isoTime2Secs(isoTime):
@@ -83,6 +83,7 @@ def from_config(cfg, maxpool=None):
     maxpool  = maxpool or cfg.getDbMaxPoolCons()
     sess_sql = cfg.getDbSessionSql()
     use_file_ignore = cfg.getDbUseFileIgnore()
+    group_commit = cfg.getDbGroupCommit()
 
     # HACK, HACK, HACK
     # The sqlite3 doesn't allow by default to make call to objects created on
@@ -98,9 +99,13 @@ def from_config(cfg, maxpool=None):
     if driver == 'sqlite3':
         drvPars['check_same_thread'] = False
 
+        # Let sqlite3 keep more compiled statements per connection than the
+        # default, since we issue many distinct (but always the same) queries
+        drvPars.setdefault('cached_statements', 256)
+
     logger.info("Connecting to DB with module %s", driver)
     msg = "Additional DB parameters: snapshot: %d, params: %r"
     logger.debug(msg, creSnap, __params_for_log(drvPars))
     return ngamsDb(driver, parameters = drvPars, createSnapshot = creSnap,
                    maxpoolcons = maxpool, use_file_ignore=use_file_ignore,
-                   session_sql=sess_sql)
+                   session_sql=sess_sql, group_commit=group_commit)
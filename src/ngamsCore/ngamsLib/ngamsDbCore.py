@@ -46,6 +46,9 @@ from .ngamsCore import toiso8601, fromiso8601
 # Global DB Semaphore to protect critical, global DB interaction.
 _globalDbSem = threading.Semaphore(1)
 
+# Maximum number of prepared SQL statements kept in memory
+_MAX_CACHED_QUERIES = 1024
+
 logger = logging.getLogger(__name__)
 
 # Define lay-out of ngas_disks table
@@ -128,12 +131,15 @@ for colDef in _ngasFilesDef:
     _ngasFilesNameMap[colName] = idx
     idx += 1
 
+_ngasFilesCols = {}
 def getNgasFilesCols(file_ignore_columnname):
     """
     Return reference to a string defining the lay-out of the table.
 
     Returns:   Reference to string listing all columns (string).
     """
+    if file_ignore_columnname in _ngasFilesCols:
+        return _ngasFilesCols[file_ignore_columnname]
     colnames = []
     for colDef in _ngasFilesDef:
         colname = colDef[0]
@@ -141,7 +147,8 @@ def getNgasFilesCols(file_ignore_columnname):
             colnames.append('nf.%s' % (file_ignore_columnname,))
         else:
             colnames.append(colname)
-    return ', '.join(colnames)
+    cols = _ngasFilesCols[file_ignore_columnname] = ', '.join(colnames)
+    return cols
 
 def getNgasFilesDef():
     """
@@ -570,6 +577,7 @@ class transaction(object):
                 cursor.execute(sql)
             else:
                 cursor.execute(sql, args)
+            self.rowcount = cursor.rowcount
 
             # From PEP-249, regarding .description:
             # This attribute will be None for operations that do not return
@@ -583,6 +591,85 @@ class transaction(object):
                 res = cursor.fetchall()
             return res
 
+class _commit_group_request(object):
+    """A piece of work submitted to a group commit, and its outcome"""
+
+    def __init__(self, func):
+        self.func = func
+        self.result = None
+        self.error = None
+        self.done = False
+
+class commit_group(object):
+    """
+    Runs work submitted by different threads within a single transaction.
+
+    Work submitted while a transaction is being committed is queued, and all
+    queued work is then run together by one of the submitting threads in the
+    next transaction. If a transaction fails then each piece of work is run
+    again in its own transaction, so the failure is reported only to the
+    thread that caused it.
+    """
+
+    def __init__(self, db_core):
+        self.db_core = db_core
+        self.cond = threading.Condition()
+        self.pending = []
+        self.committing = False
+        self.commits = 0
+        self.requests = 0
+
+    def run(self, func):
+        """Runs ``func(t)`` with a transaction ``t`` and returns its result"""
+
+        request = _commit_group_request(func)
+        with self.cond:
+            self.pending.append(request)
+            while self.committing and not request.done:
+                self.cond.wait()
+
+            # Some other thread ran our work already, otherwise we commit
+            # everything that is pending at this point
+            if not request.done:
+                batch, self.pending = self.pending, []
+                self.committing = True
+
+        if not request.done:
+            try:
+                self._commit(batch)
+            finally:
+                with self.cond:
+                    self.committing = False
+                    self.cond.notify_all()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _commit(self, batch):
+        try:
+            with self.db_core.transaction() as t:
+                results = [r.func(t) for r in batch]
+            for r, result in zip(batch, results):
+                r.result = result
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+            else:
+                logger.warning("Group commit of %d requests failed, running them separately", len(batch))
+                for r in batch:
+                    try:
+                        with self.db_core.transaction() as t:
+                            r.result = r.func(t)
+                    except Exception as e:
+                        r.error = e
+        finally:
+            for r in batch:
+                r.done = True
+            self.commits += 1
+            self.requests += len(batch)
+        logger.debug("Group-committed %d requests", len(batch))
+
 class ngamsDbCore(object):
     """
     Core class for the NG/AMS DB interface.
@@ -594,7 +681,8 @@ class ngamsDbCore(object):
                  createSnapshot = 1,
                  maxpoolcons = 6,
                  use_file_ignore=True,
-                 session_sql=None):
+                 session_sql=None,
+                 group_commit=False):
         """
         Creates a new ngamsDbCore object using ``interface`` as the underlying
         PEP-249-compliant database connection driver. Connections creation
@@ -609,6 +697,9 @@ class ngamsDbCore(object):
         table. ``use_file_ignore`` controls this behavior to provide
         backwards-compatibility. If true, the code will use "file_ignore" for
         the column name as opposed to "ignore".
+
+        If ``group_commit`` is true, work submitted via ``run_transaction`` by
+        concurrent threads is grouped and committed in a single transaction.
         """
         self.__dbSem = threading.Lock()
 
@@ -643,6 +734,21 @@ class ngamsDbCore(object):
         self._use_file_ignore = use_file_ignore
         self._file_ignore_columnname = 'file_ignore' if use_file_ignore else 'ignore'
 
+        # SQL statements already prepared for the DB module in use, keyed by
+        # (sql, number of arguments, paramstyle), and parameter markers and
+        # bind keys for a given number of arguments. Hits and misses are
+        # counted without locking, so they are only approximate
+        self._query_cache = {}
+        self._markers_cache = {}
+        self._bind_keys_cache = {}
+        self._query_cache_hits = 0
+        self._query_cache_misses = 0
+
+        self._group_commit = None
+        if group_commit:
+            logger.info('Grouping the commits of concurrent file registrations')
+            self._group_commit = commit_group(self)
+
     def takeGlobalDbSem(self):
         """
         Acquire access to a critical, global DB interaction.
@@ -795,42 +901,113 @@ class ngamsDbCore(object):
         # format    ANSI C printf format codes, e.g. ...WHERE name=%s
         # pyformat  Python extended format codes, e.g. ...WHERE name=%(name)s
         #
+        if howMany in self._markers_cache:
+            return self._markers_cache[howMany]
         s = self.__paramstyle
-        if s == 'qmark':    return ['?'                   for i in range(howMany)]
-        if s == 'numeric':  return [':%d'%(i)             for i in range(howMany)]
-        if s == 'named':    return [self._named_marker(i) for i in range(howMany)]
-        if s == 'format':   return ['%s'                  for i in range(howMany)]
-        if s == 'pyformat': return ['%%(n%d)s'%(i)        for i in range(howMany)]
-        raise Exception('Unknown paramstyle: %s' % (s))
+        if s == 'qmark':      markers = ['?'                   for i in range(howMany)]
+        elif s == 'numeric':  markers = [':%d'%(i)             for i in range(howMany)]
+        elif s == 'named':    markers = [self._named_marker(i) for i in range(howMany)]
+        elif s == 'format':   markers = ['%s'                  for i in range(howMany)]
+        elif s == 'pyformat': markers = ['%%(n%d)s'%(i)        for i in range(howMany)]
+        else: raise Exception('Unknown paramstyle: %s' % (s))
+        self._markers_cache[howMany] = markers
+        return markers
 
     def _format_query(self, sql, args):
         return sql.format(*self._markers(len(args)))
 
-    def _data_to_bind(self, data):
+    def _bind_keys(self, howMany):
+        if howMany in self._bind_keys_cache:
+            return self._bind_keys_cache[howMany]
         if self.__paramstyle == 'named':
-            return {self._named_key(i): d for i,d in enumerate(data)}
-        elif self.__paramstyle == 'pyformat':
-            return {'n%d'%(i): d for i,d in enumerate(data)}
+            keys = [self._named_key(i) for i in range(howMany)]
+        else:
+            keys = ['n%d'%(i) for i in range(howMany)]
+        self._bind_keys_cache[howMany] = keys
+        return keys
+
+    def _data_to_bind(self, data):
+        if self.__paramstyle in ('named', 'pyformat'):
+            return dict(zip(self._bind_keys(len(data)), data))
         return data
 
     def _prepare_query(self, sql, args):
 
-        # Depending on the database vendor and its declared paramstyle
-        # we will need to escape '%' literals so they are not considered
-        # a parameter in the query
-        if self.__paramstyle in ('format', 'pyformat') and '%' in sql:
-            sql = sql.replace('%', '%%')
+        # Statements are prepared only once, then reused. Using the same
+        # statement strings also allows drivers with statement caches
+        # (e.g., sqlite3) to reuse their own compiled version of them
+        key = (sql, len(args) if args else 0, self.__paramstyle)
+        prepared = self._query_cache.get(key)
+        if prepared is not None:
+            self._query_cache_hits += 1
+        else:
+            self._query_cache_misses += 1
+
+            # Depending on the database vendor and its declared paramstyle
+            # we will need to escape '%' literals so they are not considered
+            # a parameter in the query
+            prepared = sql
+            if self.__paramstyle in ('format', 'pyformat') and '%' in prepared:
+                prepared = prepared.replace('%', '%%')
+            if args:
+                prepared = self._format_query(prepared, args)
+
+            # Statements built with literal values instead of parameters could
+            # otherwise make the cache grow indefinitely
+            if len(self._query_cache) >= _MAX_CACHED_QUERIES:
+                self._query_cache.clear()
+            self._query_cache[key] = prepared
 
         if args:
-            sql = self._format_query(sql, args)
             args = self._data_to_bind(args)
 
-        return sql, args
+        return prepared, args
+
+    def getQueryCacheStats(self):
+        """
+        Return the number of hits and misses of the cache of prepared SQL
+        statements, and the number of statements currently held in it.
+
+        Returns:   Tuple with hits, misses and size of the cache (tuple).
+        """
+        return self._query_cache_hits, self._query_cache_misses, len(self._query_cache)
+
+    def getGroupCommitStats(self):
+        """
+        Return the number of transactions committed by the group commit
+        mechanism, and the number of requests run within them.
+
+        Returns:   Tuple with commits and requests, or None if group commits
+                   are disabled (tuple).
+        """
+        if self._group_commit is None:
+            return None
+        return self._group_commit.commits, self._group_commit.requests
+
+    def isIntegrityError(self, e):
+        """
+        Whether ``e`` is an integrity error raised by the DB module in use,
+        like those caused by duplicate keys.
+        """
+        return isinstance(e, self.__dbModule.IntegrityError)
 
     def transaction(self):
         """Creates a new transaction object and return it"""
         return transaction(self, self.__pool)
 
+    def run_transaction(self, func):
+        """
+        Runs ``func`` within a transaction, passing the transaction object
+        down to it, and returns its result. If group commits are enabled the
+        transaction might be shared with work submitted by other threads,
+        so ``func`` might be called more than once if the transaction
+        needs to be retried.
+        """
+        if self._group_commit is not None:
+            return self._group_commit.run(func)
+        with self.transaction() as t:
+            return func(t)
+
     def query2(self, sqlQuery, args = ()):
         """Takes an SQL query and a tuple of arguments to bind to the query"""
         with self.transaction() as t:
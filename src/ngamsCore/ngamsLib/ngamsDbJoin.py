@@ -323,6 +323,37 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
                 yield res
 
 
+    def getFileChecksumFromLocation(self,
+                                    fileId,
+                                    fileVersion,
+                                    mountPoint,
+                                    filename):
+        """
+        Get the checksum value and variant of the file stored under
+        `filename` in the disk mounted at `mountPoint`.
+
+        fileId:          ID of file (string).
+
+        fileVersion:     Version of file (integer).
+
+        mountPoint:      Mount point of the disk hosting the file (string).
+
+        filename:        Name of the file, relative to the mount point
+                         (string).
+
+        Returns:         Tuple with checksum and checksum variant
+                         (tuple/string|None).
+        """
+        sql = ("SELECT nf.checksum, nf.checksum_plugin "
+               "FROM ngas_files nf, ngas_disks nd "
+               "WHERE nf.disk_id=nd.disk_id AND nf.file_id={} AND "
+               "nf.file_version={} AND nd.mount_point={} AND nf.file_name={}")
+        res = self.query2(sql, args=(fileId, fileVersion, mountPoint, filename))
+        if res:
+            return res[0]
+        return None, None
+
+
     def setFileChecksum(self,
                         hostId,
                         fileId,
@@ -601,6 +632,57 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
                 yield res
 
 
+    def _build_sorted_files_in_host_query(self, columns, hostId, from_date, after):
+        sql, vals = self.buildFileSummary1Query(columns, hostId, ignore=0,
+                                                lowLimIngestDate=from_date,
+                                                order=0)
+        if after:
+            fileId, fileVersion, diskId = after
+            cond = "nf.file_id > {} OR (nf.file_id = {} AND (nf.file_version > {}"
+            vals += [fileId, fileId, fileVersion]
+            if diskId is not None:
+                cond += " OR (nf.file_version = {} AND nf.disk_id > {})"
+                vals += [fileVersion, diskId]
+            sql += " AND (" + cond + ")))"
+        return sql, vals
+
+
+    def sorted_files_in_host(self, hostId, from_date=None, after=None):
+        """
+        Like files_in_host, but the files are sorted by File ID, File Version
+        and Disk ID, starting after the position given by `after`. This
+        allows to resume the listing of files from the last file seen.
+
+        after:    None, or a (File ID, File Version, Disk ID) tuple. If the
+                  Disk ID is None, all copies of the given file are skipped.
+
+        Returns:  A generator of file information rows (tuple).
+        """
+        sql, vals = self._build_sorted_files_in_host_query(
+            ngamsDbCore.getNgasFilesCols(self._file_ignore_columnname),
+            hostId, from_date, after)
+        sql += " ORDER BY nf.file_id, nf.file_version, nf.disk_id"
+        with self.dbCursor(sql, args=vals) as cursor:
+            for res in cursor.fetch(1000):
+                yield res
+
+
+    def count_files_in_host(self, hostId, from_date=None, after=None, unique=False):
+        """
+        Counts the files that would be returned by sorted_files_in_host with
+        the given parameters. If `unique` is given, copies of the same file
+        (File ID/Version) are counted only once.
+
+        Returns:  Number of files (integer).
+        """
+        columns = "DISTINCT nf.file_id, nf.file_version" if unique else "COUNT(*)"
+        sql, vals = self._build_sorted_files_in_host_query(columns, hostId,
+                                                           from_date, after)
+        if unique:
+            sql = "SELECT COUNT(*) FROM (%s) unique_files" % sql
+        return int(self.query2(sql, args=vals)[0][0])
+
+
     def getNumberOfFiles(self,
                          diskId = "",
                          fileId = "",
@@ -788,62 +870,32 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
 
         Returns:         Void.
         """
-        # Check if the entry already exists. If yes update it, otherwise
-        # insert a new element.
+        # The entry is updated if it already exists, otherwise a new one is
+        # inserted. This happens in a single transaction, together with the
+        # update of the Disk Info of the disk concerned, if requested and if a
+        # new entry was added.
+        #
+        # Note: In case of an update the columns ngas_disks.avail_mb
+        #       and ngas_disks.bytes_stored should in principle be
+        #       updated according to the actual size of the new
+        #       version of the file.
         if ignore == -1:
             ignore = 0
 
         checksum = str(checksum) if checksum else None
-        ingDate = self.convertTimeStamp(ingestionDate)
-        creDate = self.convertTimeStamp(creationDate)
+        statements = self._file_entry_statements(diskId, filename, fileId,
+                        fileVersion, format, fileSize, uncompressedFileSize,
+                        compression, ingestionDate, ignore, checksum,
+                        checksumPlugIn, fileStatus, creationDate, iotime,
+                        ingestionRate, prev_disk_id)
 
-        sql = []
-        vals = []
-        sql_str = None
+        def write_entry(t):
+            dbOperation = self._write_file_entry(t, *statements)
+            if dbOperation == NGAMS_DB_CH_FILE_INSERT and updateDiskInfo:
+                self._update_disk_file_status(t, diskId, fileSize)
+            return dbOperation
 
-        if (self.fileInDb(prev_disk_id or diskId, fileId, fileVersion)):
-            # We only allow to modify a limited set of columns.
-            sql.append(("UPDATE ngas_files SET "
-                       "file_name={}, format={}, file_size={}, "
-                       "uncompressed_file_size={}, compression={}, "
-                       "%s={}, checksum={}, checksum_plugin={}, "
-                       "file_status={}, creation_date={}, io_time={}, "
-                       "ingestion_rate={}, disk_id={} WHERE file_id={} AND disk_id={}" % (self._file_ignore_columnname,)))
-            vals = [filename, format, fileSize, uncompressedFileSize, compression,\
-                    ignore, checksum, checksumPlugIn, fileStatus, creDate,\
-                    int(iotime*1000), ingestionRate, diskId, fileId, prev_disk_id or diskId]
-
-            if int(fileVersion) != -1:
-                sql.append(" AND file_version={}")
-                vals.append(fileVersion)
-
-            dbOperation = NGAMS_DB_CH_FILE_UPDATE
-            sql_str = ''.join(sql)
-        else:
-            sql_str = ("INSERT INTO ngas_files (disk_id, file_name, file_id,"
-                        "file_version, format, file_size, uncompressed_file_size,"
-                        " compression, ingestion_date, %s, checksum, "
-                        "checksum_plugin, file_status, creation_date, io_time, "
-                        "ingestion_rate) VALUES ({}, {}, {}, {}, {}, {}, {}, {},"
-                        " {}, {}, {},{}, {}, {}, {}, {})" % (self._file_ignore_columnname,))
-            vals = (diskId, filename, fileId, fileVersion, format, fileSize,\
-                    uncompressedFileSize, compression, ingDate, ignore,\
-                    checksum, checksumPlugIn, fileStatus, creDate,\
-                    int(iotime*1000), ingestionRate)
-            dbOperation = NGAMS_DB_CH_FILE_INSERT
-
-        self.query2(sql_str, args = vals)
-
-        # Update the Disk Info of the disk concerned if requested and
-        # if a new entry was added.
-        #
-        # Note: In case of an update the columns ngas_disks.avail_mb
-        #       and ngas_disks.bytes_stored should in principle be
-        #       updated according to the actual size of the new
-        #       version of the file.
-        #print "writeFileEntry".upper(), updateDiskInfo, dbOperation
-        if (updateDiskInfo and (dbOperation == NGAMS_DB_CH_FILE_INSERT)):
-            self.updateDiskFileStatus(diskId, fileSize)
+        dbOperation = self._run_file_entry_transaction(write_entry)
 
         # Create a Temporary DB Change Snapshot Document if requested.
         if (self.getCreateDbSnapshot() and genSnapshot):
@@ -860,6 +912,135 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
         self.triggerEvents([diskId, None])
 
 
+    def writeFileEntries(self,
+                         hostId,
+                         fileInfoList,
+                         genSnapshot = 1):
+        """
+        Writes the information of several files in the NGAS DB in a single
+        transaction. Each entry is updated if it exists already, otherwise a
+        new one is created, as done by writeFileEntry(). The disks hosting
+        the files are not updated; instead, the number of new entries and
+        their total size is returned for each disk, so they can be updated
+        later on via updateDiskFileStatus().
+
+        hostId:          ID of the host where the files were registered
+                         (string).
+
+        fileInfoList:    List with the information of the files
+                         (list/ngamsFileInfo).
+
+        genSnapshot:     Generate a snapshot file (integer/0|1).
+
+        Returns:         Dictionary with Disk IDs as keys, pointing to the
+                         number of new entries and their total size
+                         (dictionary/tuple).
+        """
+        statements = []
+        for fileInfo in fileInfoList:
+            ignore = fileInfo.getIgnore()
+            if ignore == -1:
+                ignore = 0
+            checksum = fileInfo.getChecksum()
+            checksum = str(checksum) if checksum else None
+            statements.append(self._file_entry_statements(fileInfo.getDiskId(),
+                        fileInfo.getFilename(), fileInfo.getFileId(),
+                        fileInfo.getFileVersion(), fileInfo.getFormat(),
+                        fileInfo.getFileSize(), fileInfo.getUncompressedFileSize(),
+                        fileInfo.getCompression(), fileInfo.getIngestionDate(),
+                        ignore, checksum, fileInfo.getChecksumPlugIn(),
+                        fileInfo.getFileStatus(), fileInfo.getCreationDate(),
+                        fileInfo.getIoTime(), fileInfo.getIngestionRate()))
+
+        def write_entries(t):
+            return [self._write_file_entry(t, *s) for s in statements]
+
+        dbOperations = self._run_file_entry_transaction(write_entries)
+
+        newEntries = {}
+        for fileInfo, dbOperation in zip(fileInfoList, dbOperations):
+            diskId = fileInfo.getDiskId()
+            nFiles, nBytes = newEntries.get(diskId, (0, 0))
+            if dbOperation == NGAMS_DB_CH_FILE_INSERT:
+                nFiles, nBytes = nFiles + 1, nBytes + fileInfo.getFileSize()
+            newEntries[diskId] = (nFiles, nBytes)
+
+        # Create Temporary DB Change Snapshot Documents if requested.
+        if (self.getCreateDbSnapshot() and genSnapshot):
+            for op in (NGAMS_DB_CH_FILE_INSERT, NGAMS_DB_CH_FILE_UPDATE):
+                fileInfos = [f for f, dbOp in zip(fileInfoList, dbOperations) if dbOp == op]
+                if fileInfos:
+                    self.createDbFileChangeStatusDoc(hostId, op, fileInfos)
+
+        for diskId in newEntries:
+            self.triggerEvents([diskId, None])
+        return newEntries
+
+
+    def _file_entry_statements(self, diskId, filename, fileId, fileVersion,
+                               format, fileSize, uncompressedFileSize,
+                               compression, ingestionDate, ignore, checksum,
+                               checksumPlugIn, fileStatus, creationDate, iotime,
+                               ingestionRate, prev_disk_id=None):
+        """
+        Returns the UPDATE and INSERT statements (and their values) used to
+        write a file entry in the ngas_files table
+        """
+
+        ingDate = self.convertTimeStamp(ingestionDate)
+        creDate = self.convertTimeStamp(creationDate)
+
+        # We only allow to modify a limited set of columns.
+        update_sql = [("UPDATE ngas_files SET "
+                       "file_name={}, format={}, file_size={}, "
+                       "uncompressed_file_size={}, compression={}, "
+                       "%s={}, checksum={}, checksum_plugin={}, "
+                       "file_status={}, creation_date={}, io_time={}, "
+                       "ingestion_rate={}, disk_id={} WHERE file_id={} AND disk_id={}" % (self._file_ignore_columnname,))]
+        update_vals = [filename, format, fileSize, uncompressedFileSize, compression,\
+                       ignore, checksum, checksumPlugIn, fileStatus, creDate,\
+                       int(iotime*1000), ingestionRate, diskId, fileId, prev_disk_id or diskId]
+        if int(fileVersion) != -1:
+            update_sql.append(" AND file_version={}")
+            update_vals.append(fileVersion)
+        update_sql = ''.join(update_sql)
+
+        insert_sql = ("INSERT INTO ngas_files (disk_id, file_name, file_id,"
+                      "file_version, format, file_size, uncompressed_file_size,"
+                      " compression, ingestion_date, %s, checksum, "
+                      "checksum_plugin, file_status, creation_date, io_time, "
+                      "ingestion_rate) VALUES ({}, {}, {}, {}, {}, {}, {}, {},"
+                      " {}, {}, {},{}, {}, {}, {}, {})" % (self._file_ignore_columnname,))
+        insert_vals = (diskId, filename, fileId, fileVersion, format, fileSize,\
+                       uncompressedFileSize, compression, ingDate, ignore,\
+                       checksum, checksumPlugIn, fileStatus, creDate,\
+                       int(iotime*1000), ingestionRate)
+
+        return update_sql, update_vals, insert_sql, insert_vals
+
+
+    def _run_file_entry_transaction(self, func):
+        # Writing an entry (UPDATE, then INSERT if nothing was updated) is not
+        # atomic: a concurrent transaction can insert the same entry after
+        # our UPDATE. Our INSERT then fails on the primary key, and running
+        # the transaction again updates the entry instead
+        try:
+            return self.run_transaction(func)
+        except Exception as e:
+            if not self.isIntegrityError(e):
+                raise
+            logger.warning("File entry inserted concurrently, retrying: %s", str(e))
+            return self.run_transaction(func)
+
+
+    def _write_file_entry(self, t, update_sql, update_vals, insert_sql, insert_vals):
+        t.execute(update_sql, update_vals)
+        if t.rowcount > 0:
+            return NGAMS_DB_CH_FILE_UPDATE
+        t.execute(insert_sql, insert_vals)
+        return NGAMS_DB_CH_FILE_INSERT
+
+
     def getClusterReadyArchivingUnits(self,
                                       clusterName):
         """
@@ -25,6 +25,7 @@ Module containing SQL queries against the ngas_containers table
 @author rtobar, May 2015
 """
 
+import collections
 import logging
 import time
 import uuid
@@ -34,6 +35,13 @@ from . import ngamsDbCore, ngamsFileInfo, ngamsContainer
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of values bound in a single "IN (...)" clause
+_IN_BATCH_SIZE = 500
+
+def _batches(items, size=_IN_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 class ngamsDbNgasContainers(ngamsDbCore.ngamsDbCore):
     """
     A class containing SQL queries against the ngas_containers table
@@ -98,16 +106,21 @@ class ngamsDbNgasContainers(ngamsDbCore.ngamsDbCore):
             return None
 
         res = res[0]
-        cont = ngamsContainer.ngamsContainer()
-        cont.setContainerId(containerId)
-        cont.setContainerName(res[0])
-        cont.setContainerSize(res[1])
+        parentContainer = None
         if res[2]:
             parentContainer = ngamsContainer.ngamsContainer()
             parentContainer.setContainerId(res[2])
+        return self._unpackContainer(containerId, res[0], res[1], parentContainer, res[3])
+
+    def _unpackContainer(self, containerId, name, size, parentContainer, ingestionDate):
+        cont = ngamsContainer.ngamsContainer()
+        cont.setContainerId(containerId)
+        cont.setContainerName(name)
+        cont.setContainerSize(size)
+        if parentContainer:
             cont.setParentContainer(parentContainer)
-        if res[3]:
-            cont.setIngestionDate(self.fromTimestamp(res[3]))
+        if ingestionDate:
+            cont.setIngestionDate(self.fromTimestamp(ingestionDate))
         return cont
 
     def readHierarchy(self, containerId, includeFiles=False):
@@ -115,35 +128,89 @@ class ngamsDbNgasContainers(ngamsDbCore.ngamsDbCore):
         Reads an ngamsContainer object from the database
         and recursively populates it with its children containers.
 
+        The hierarchy is read one level at a time, with the children (and files)
+        of all the containers of a level queried together in batches. The
+        number of queries therefore depends on the depth of the hierarchy
+        rather than on the number of containers and files it holds.
+
         :param str containerId: the id of the container whose hierarchy is to be read
         :return: The container object recursively populated
         :rtype: ngamsContainer.ngamsContainer
         """
 
         container = self.read(containerId)
+        if container is None:
+            return None
+
+        # Build the tree in memory, level by level
+        containers = {containerId: container}
+        level = [containerId]
+        while level:
+            children = []
+            for ids in _batches(level):
+                sql = ("SELECT container_id, container_name, container_size, parent_container_id, ingestion_date "
+                       "FROM ngas_containers WHERE parent_container_id IN (%s)")
+                sql = sql % (','.join(['{}'] * len(ids)),)
+                for r in self.query2(sql, args=ids):
+                    if r[0] in containers:
+                        continue
+                    parent = containers[r[3]]
+                    cont = self._unpackContainer(r[0], r[1], r[2], parent, r[4])
+                    parent.addContainer(cont)
+                    containers[r[0]] = cont
+                    children.append(r[0])
+            level = children
+
         if includeFiles:
 
             # Always get the latest version of the files
             # We do this on the software side to avoid any complex SQL query
             # that might not work in some engines
-            sql = "SELECT %s FROM ngas_files nf WHERE container_id = {0} ORDER BY nf.file_id, nf.file_version DESC"
-            sql = sql % (ngamsDbCore.getNgasFilesCols(self._file_ignore_columnname),)
-            res = self.query2(sql, args=(containerId,))
-            prevFileId = None
-            for r in res:
-                fileId = r[ngamsDbCore.NGAS_FILES_FILE_ID]
-                if fileId == prevFileId:
-                    continue
-                prevFileId = fileId
-                fileInfo = ngamsFileInfo.ngamsFileInfo().unpackSqlResult(r)
-                container.addFileInfo(fileInfo)
-
-        # Check if it contains children
-        res = self.query2("SELECT container_id FROM ngas_containers WHERE parent_container_id = {0}", args=(containerId,))
-        for r in res:
-            container.addContainer(self.readHierarchy(r[0], includeFiles))
+            for ids in _batches(list(containers)):
+                sql = "SELECT %s FROM ngas_files nf WHERE container_id IN (%s) ORDER BY nf.container_id, nf.file_id, nf.file_version DESC"
+                sql = sql % (ngamsDbCore.getNgasFilesCols(self._file_ignore_columnname), ','.join(['{}'] * len(ids)))
+                res = self.query2(sql, args=ids)
+                prevFile = None
+                for r in res:
+                    thisFile = (r[ngamsDbCore.NGAS_FILES_CONTAINER_ID], r[ngamsDbCore.NGAS_FILES_FILE_ID])
+                    if thisFile == prevFile:
+                        continue
+                    prevFile = thisFile
+                    fileInfo = ngamsFileInfo.ngamsFileInfo().unpackSqlResult(r)
+                    containers[thisFile[0]].addFileInfo(fileInfo)
+
         return container
 
+    def getContainerFileLocations(self, containerIds):
+        """
+        Returns where the files associated to the given containers are stored,
+        querying the containers in batches rather than one file at a time.
+
+        Only copies that are not ignored and have an OK status are considered,
+        like in getFileSummary3. The result is a dictionary indexed by
+        (file_id, file_version), with a list of copies for each file. Each copy
+        looks like a getFileSummary3 result, followed by the file size:
+
+          <Host ID>, <Ip Address>, <Port>, <Mountpoint>, <Filename>,
+          <File Version>, <format>, <File Size>
+
+        :param list containerIds: the ids of the containers
+        :return: the location of all the files of the given containers
+        :rtype: dict
+        """
+
+        locations = collections.defaultdict(list)
+        for ids in _batches(list(containerIds)):
+            sql = ("SELECT nf.file_id, nh.host_id, nh.ip_address, nh.srv_port, "
+                   "nd.mount_point, nf.file_name, nf.file_version, nf.format, nf.file_size "
+                   "FROM ngas_files nf, ngas_disks nd, ngas_hosts nh "
+                   "WHERE nf.container_id IN (%s) AND nf.disk_id=nd.disk_id AND "
+                   "nd.host_id=nh.host_id AND nf.%s=0 AND nf.file_status='00000000'")
+            sql = sql % (','.join(['{}'] * len(ids)), self._file_ignore_columnname)
+            for r in self.query2(sql, args=ids):
+                locations[(r[0], r[6])].append(tuple(r[1:]))
+        return locations
+
     def createContainer(self, containerName, containerSize=0, ingestionDate=None, parentContainerId=None, parentKnownToExist=False):
         """
         Creates a single container with name containerName.
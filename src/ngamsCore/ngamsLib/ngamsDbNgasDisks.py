@@ -49,40 +49,36 @@ class ngamsDbNgasDisks(ngamsDbCore.ngamsDbCore):
     Contains queries for accessing the NGAS Disks Table.
     """
 
-    def updateDiskFileStatus(self, diskId, fileSize):
+    def updateDiskFileStatus(self, diskId, fileSize, nFiles=1):
         """
-        Update the NGAS Disks Table according to a new file archived.
+        Update the NGAS Disks Table according to new files archived.
 
         diskId:       Disk ID (string).
 
-        fileSize:     Size of file as stored on disk (integer).
+        fileSize:     Total size of the files as stored on disk (integer).
+
+        nFiles:       Number of new files (integer).
 
         Returns:      Reference to object itself.
         """
-        try:
-            self.takeGlobalDbSem()
-            sql = ("SELECT number_of_files, available_mb, "
-                    "bytes_stored, mount_point "
-                    "FROM ngas_disks WHERE disk_id={}")
-            res = self.query2(sql, args = (diskId,))
-            if not res:
-                errMsg = "Cannot find entry for disk with ID: %s." % diskId
-                raise Exception(errMsg)
-
-            numberOfFiles = res[0][0]
-            bytesStored = res[0][2]
-            mountPoint = res[0][3]
-            newNumberOfFiles = numberOfFiles + 1
-            newAvailMb = getDiskSpaceAvail(mountPoint)
-            newBytesStored = bytesStored + fileSize
-
-            sql = ("UPDATE ngas_disks SET number_of_files={}, available_mb={},"
-                   " bytes_stored={} WHERE disk_id={}")
-            vals = [newNumberOfFiles, newAvailMb, newBytesStored, diskId]
-            self.query2(sql, args = vals)
-            self.triggerEvents()
-        finally:
-            self.relGlobalDbSem()
+        with self.transaction() as t:
+            mountPoint = self._update_disk_file_status(t, diskId, fileSize, nFiles)
+        self.triggerEvents([diskId, mountPoint])
+
+
+    def _update_disk_file_status(self, t, diskId, fileSize, nFiles=1):
+        # The counters are incremented by the database itself, so there is no
+        # need to serialise concurrent updates on our side
+        res = t.execute("SELECT mount_point FROM ngas_disks WHERE disk_id={}", (diskId,))
+        if not res:
+            errMsg = "Cannot find entry for disk with ID: %s." % diskId
+            raise Exception(errMsg)
+
+        newAvailMb = getDiskSpaceAvail(res[0][0])
+        sql = ("UPDATE ngas_disks SET number_of_files=(number_of_files + {}), "
+               "available_mb={}, bytes_stored=(bytes_stored + {}) WHERE disk_id={}")
+        t.execute(sql, (nFiles, newAvailMb, fileSize, diskId))
+        return res[0][0]
 
 
     def diskInDb(self, diskId):
@@ -187,6 +187,34 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
                 yield x
 
 
+    def getFilenames(self,
+                     diskId,
+                     prefix = "",
+                     fetch_size = 1000):
+        """
+        Returns the (relative) filenames of all the files registered on the
+        given disk, optionally only those starting with the given prefix.
+
+        diskId:        Disk ID of disk hosting the files (string).
+
+        prefix:        Prefix of the filenames to consider (string).
+
+        Returns:       Generator yielding the filenames (string).
+        """
+        sql = "SELECT nf.file_name FROM ngas_files nf WHERE nf.disk_id = {}"
+        args = [diskId]
+        if prefix:
+            # Wildcards in the prefix only make the query return more results
+            sql += " AND nf.file_name LIKE {}"
+            args.append(prefix + '%')
+
+        cursor = self.dbCursor(sql, args=args)
+        with cursor:
+            for x in cursor.fetch(fetch_size):
+                if not prefix or x[0].startswith(prefix):
+                    yield x[0]
+
+
     def getLatestFileVersion(self,
                              fileId):
         """
@@ -293,8 +321,9 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
             sql = "UPDATE ngas_disks SET number_of_files={0}, " +\
                   "available_mb={1}, bytes_stored={2} WHERE disk_id={3}"
             self.query2(sql, args=(newNumberOfFiles, newAvailMb, newBytesStored, diskId))
-
-        self.triggerEvents()
+            self.triggerEvents([diskId, dbDiskInfo[ngamsDbCore.NGAS_DISKS_MT_PT]])
+        else:
+            self.triggerEvents()
         return self
 
 
@@ -600,7 +629,7 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
         with self.transaction() as t:
 
             # select
-            res = t.execute(select_status, args=(file_id, file_version, disk_id))[0][0]
+            res = t.execute(select_status, args=(file_id, file_version, disk_id))
             if not res:
                 logger.error("No file found for id/version/disk = %s/%d/%s, not updating status",
                              file_id, file_version, disk_id)
@@ -608,7 +637,8 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
 
             # str to int, apply bits on/off, and back to str
             # If the bits have the desired value already we don't need to update
-            status = int(res[0][0], 2)
+            old_status = res[0][0]
+            status = int(old_status, 2)
             if on:
                 if (status & bits) == bits:
                     return
@@ -617,7 +647,7 @@ class ngamsDbNgasFiles(ngamsDbCore.ngamsDbCore):
                 if (status & bits) == 0:
                     return
                 status &= ~bits
-            new_status = bin(status)[2:]
+            new_status = bin(status)[2:].zfill(len(old_status))
 
             # apply
             t.execute(update, args=(new_status, file_id, file_version, disk_id))
@@ -570,6 +570,32 @@ class ngamsDbNgasSubscribers(ngamsDbCore.ngamsDbCore):
         return res[0] #get the first row only
 
 
+    def getSubscrQueueStatuses(self, subscrId, fileIds):
+        """
+        Return the status and comment of the entries in the ngas_subscr_queue
+        table 'belonging' to a specific subscriber for several files at once
+
+        subscrId:    subscriber Id (string)
+        fileIds:     the IDs of the files to query (list/string)
+
+        Returns:     Dictionary with (<File ID>, <File Version>, <Disk ID>)
+                     tuples as keys, referring to (<Status>, <Comment>)
+                     tuples (dictionary/tuple).
+        """
+        statuses = {}
+        fileIds = list(set(fileIds))
+        batch_size = 500
+        for i in range(0, len(fileIds), batch_size):
+            batch = fileIds[i:i + batch_size]
+            sql = ("SELECT file_id, file_version, disk_id, status, %s "
+                   "FROM ngas_subscr_queue WHERE subscr_id = {} AND "
+                   "file_id IN (%s)") % (self.comment_colname(), ','.join(['{}'] * len(batch)))
+            res = self.query2(sql, args = [subscrId] + batch)
+            for fileId, fileVersion, diskId, status, comment in res:
+                statuses[(fileId, fileVersion, diskId)] = (status, comment)
+        return statuses
+
+
     def getSubscrQueue(self, subscrId, status = None):
         """
         Read all entries in the ngas_subscr_queue table 'belonging' to a
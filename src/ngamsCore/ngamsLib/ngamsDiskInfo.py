@@ -32,6 +32,7 @@
 Contains tools for handling the disk configuration.
 """
 
+import copy
 import os
 import xml.dom.minidom
 
@@ -901,4 +902,16 @@ class ngamsDiskInfo:
         return os.path.normpath(self.getMountPoint() + "/" + NGAMS_STAGING_DIR)
 
 
+    def clone(self):
+        """
+        Make a copy of the object containing the same data, but no File Info
+        objects, and return this.
+
+        Returns:   Copy of this object (ngamsDiskInfo).
+        """
+        diskInfo = copy.copy(self)
+        diskInfo.__fileList = []
+        return diskInfo
+
+
 # EOF
@@ -37,6 +37,7 @@ import os
 import re
 import threading
 import time
+import weakref
 
 from .ngamsCore import getNgamsVersion, genLog, \
     NGAMS_DB_DIR, checkCreatePath, NGAMS_DB_CH_CACHE, NGAMS_NOTIF_ERROR,\
@@ -899,10 +900,124 @@ def dumpDiskInfo(hostId,
     return ngasDiskInfo
 
 
-# Cache for the findTargetDisk() to make it work more efficiently.
-_diskInfoObjsDic   = {}
-_bestTargetDiskDic = {}
-_diskInfoDic       = {}
+class _db_change_listener(object):
+    """
+    Receives the DB change events triggered by ngamsDbCore.triggerEvents()
+    and forwards them, together with their event information, to a callback.
+    It is used in place of an ngamsEvent object, which cannot tell apart the
+    different events that have set it.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._eventInfo = None
+
+    def addEventInfo(self, eventInfo):
+        self._eventInfo = eventInfo
+        return self
+
+    def isSet(self):
+        # Never set, so every event is passed to set()
+        return False
+
+    def set(self):
+        eventInfo, self._eventInfo = self._eventInfo, None
+        self._callback(eventInfo)
+        return self
+
+
+class _target_disk_cache(object):
+    """
+    Caches the disks that can be used to store files of each mime-type,
+    so that target disks can be selected by findTargetDisk() without querying
+    the DB. Entries expire after a given amount of time. The space used on
+    each disk is kept up to date by the server as files are archived
+    (see findTargetDiskUpdateCache()), while other changes to a disk, signalled
+    by DB change events carrying its Disk ID and Mount Point, drop that disk
+    from the cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listener = _db_change_listener(self._db_changed)
+        self._dbs = weakref.WeakSet()
+        self._cfg = None
+        self._generation = 0
+        self._disks = {}
+        self._diskIds = {}
+
+    def _db_changed(self, eventInfo):
+        # Events without information don't concern ngas_disks, while the
+        # registration of files (which comes with the ID of the disk hosting
+        # them, and no mount point) is accounted for separately.
+        if not eventInfo or len(eventInfo) != 2 or eventInfo[1] is None:
+            return
+        self.invalidate(eventInfo[0])
+
+    def invalidate(self, diskId):
+        """
+        Drops the given disk, and the mime-types it is allocated to, from the
+        cache. A disk unknown to the cache might have just become a target
+        disk, in which case the whole cache is emptied.
+        """
+        with self._lock:
+            self._generation += 1
+            if diskId not in self._disks:
+                self._disks = {}
+                self._diskIds = {}
+                return
+            del self._disks[diskId]
+            for key, (_, diskIds) in list(self._diskIds.items()):
+                if diskId in diskIds:
+                    del self._diskIds[key]
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self._disks = {}
+            self._diskIds = {}
+
+    def get(self, hostId, dbConObj, ngamsCfgObj, mimeType, sendNotification, ttl):
+        """
+        Returns copies of the Disk Info objects for the disks allocated to
+        the given mime-type.
+        """
+        now = time.time()
+        with self._lock:
+            if dbConObj not in self._dbs:
+                dbConObj.addDbChangeEvt(self._listener)
+                self._dbs.add(dbConObj)
+            if ngamsCfgObj is not self._cfg:
+                self._cfg = ngamsCfgObj
+                self._generation += 1
+                self._disks = {}
+                self._diskIds = {}
+            key = (hostId, mimeType)
+            entry = self._diskIds.get(key)
+            if entry is not None and entry[0] >= now:
+                return [self._disks[diskId].clone() for diskId in entry[1]]
+            generation = self._generation
+
+        diskInfoObjs = getDiskInfoObjsFromMimeType(hostId, dbConObj, ngamsCfgObj,
+                                                   mimeType, sendNotification)
+        with self._lock:
+            if generation == self._generation:
+                for diskInfoObj in diskInfoObjs:
+                    self._disks[diskInfoObj.getDiskId()] = diskInfoObj.clone()
+                self._diskIds[key] = (now + ttl, [d.getDiskId() for d in diskInfoObjs])
+        return diskInfoObjs
+
+    def update(self, diskId, fileSize, files):
+        with self._lock:
+            diskInfoObj = self._disks.get(diskId)
+            if diskInfoObj is None:
+                return
+            diskInfoObj.setNumberOfFiles(diskInfoObj.getNumberOfFiles() + files)
+            diskInfoObj.setBytesStored(diskInfoObj.getBytesStored() + fileSize)
+            diskInfoObj.setAvailableMb(diskInfoObj.getAvailableMb() -
+                                       int(fileSize / 1048576.))
+
+_targetDiskCache = _target_disk_cache()
 
 def findTargetDiskResetCache():
     """
@@ -910,10 +1025,47 @@ def findTargetDiskResetCache():
 
     Returns:   Void.
     """
-    global _diskInfoObjsDic, _bestTargetDiskDic, _diskInfoDic
-    _diskInfoObjsDic   = {}
-    _bestTargetDiskDic = {}
-    _diskInfoDic       = {}
+    _targetDiskCache.reset()
+
+
+def findTargetDiskUpdateCache(diskId,
+                              fileSize,
+                              files = 1):
+    """
+    Update the information kept by the cache used by the findTargetDisk()
+    function after a file has been stored on a disk.
+
+    diskId:      ID of the disk where the file was stored (string).
+
+    fileSize:    Number of bytes added to the disk, negative if bytes
+                 were freed (integer).
+
+    files:       Number of files added to the disk (integer).
+
+    Returns:     Void.
+    """
+    _targetDiskCache.update(diskId, fileSize, files)
+
+
+def _getBestTargetDisk(diskIdDic,
+                       diskIds,
+                       rootDir):
+    """
+    Find the best suitable target disk among the given disks, following
+    the same criteria as ngamsDb.getBestTargetDisk(): the fullest mounted
+    disk under the root directory, oldest first.
+    """
+    if not rootDir.endswith('/'):
+        rootDir += '/'
+    candidates = [diskIdDic[diskId] for diskId in diskIds
+                  if diskIdDic[diskId].getMountPoint().startswith(rootDir)]
+    if not candidates:
+        return None
+    # Disks without installation date go last, and are never compared by date
+    candidates.sort(key=lambda d: (-d.getBytesStored(),
+                                   d.getInstallationDate() is None,
+                                   d.getInstallationDate() or 0))
+    return candidates[0].getDiskId()
 
 
 def findTargetDisk(hostId,
@@ -922,11 +1074,14 @@ def findTargetDisk(hostId,
                    mimeType,
                    sendNotification = 1,
                    diskExemptList = [],
-                   caching = 0,
                    reqSpace = None):
     """
     Find a target disk for a file being received.
 
+    The information about the disks can be cached (see the
+    TargetDiskCacheTime configuration parameter), in which case in general
+    no DB queries are carried out by this function.
+
     dbConObj:          DB connection object (ngamsDb).
 
     ngamsCfgObj:       Instance of NG/AMS Configuration Class (ngamsConfig).
@@ -938,26 +1093,21 @@ def findTargetDisk(hostId,
     diskExemptList:    List with Disk IDs of disks, which it is not
                        desirable to consider (list/string).
 
-    caching:           Used to increase the speed of this function
-                       if it is invoked many times sequentially. SHOULD
-                       BE USED WITH GREAT CARE! (integer/0|1).
-
     reqSpace:          The required space needed in bytes (integer).
 
     Returns:           ngamsDiskInfo object containing the necessary
                        information (ngamsDiskInfo).
     """
-    startTime = time.time()
 
     # Get Disk IDs matching the mime-type.
     logger.debug("Finding target disks - mime-type is: %s", mimeType)
-    global _diskInfoObjsDic
-    if (not caching) or (mimeType not in _diskInfoObjsDic):
+    ttl = ngamsCfgObj.getTargetDiskCacheTime()
+    if ttl > 0:
+        diskInfoObjs = _targetDiskCache.get(hostId, dbConObj, ngamsCfgObj,
+                                            mimeType, sendNotification, ttl)
+    else:
         diskInfoObjs = getDiskInfoObjsFromMimeType(hostId, dbConObj, ngamsCfgObj,
                                                    mimeType, sendNotification)
-        if (caching): _diskInfoObjsDic[mimeType] = diskInfoObjs
-    else:
-        diskInfoObjs = _diskInfoObjsDic[mimeType]
 
     # Analyze which of the dynamic Disks Sets are available to be used
     # as Target Disk Set, i.e., only Disk Sets where both Main Disk and
@@ -1014,15 +1164,7 @@ def findTargetDisk(hostId,
         raise Exception(errMsg)
 
     # Find the best target disk.
-    global _bestTargetDiskDic
-    key = str(diskIds)[1:-1].replace("'", "_").replace(", ", "")
-    if ((not caching) or (key not in _bestTargetDiskDic)):
-        diskId = dbConObj.getBestTargetDisk(diskIds,
-                                            ngamsCfgObj.getRootDirectory())
-        if (caching): _bestTargetDiskDic[key] = diskId
-    else:
-        diskId = _bestTargetDiskDic[key]
-
+    diskId = _getBestTargetDisk(diskIdDic, diskIds, ngamsCfgObj.getRootDirectory())
     if (diskId == None):
         errMsg = genLog("NGAMS_AL_NO_STO_SETS", [mimeType])
         logger.warning(errMsg)
@@ -1030,14 +1172,8 @@ def findTargetDisk(hostId,
             ngamsNotification.notify(hostId, ngamsCfgObj, NGAMS_NOTIF_NO_DISKS,
                                      "NO DISKS AVAILABLE", errMsg)
         raise Exception(errMsg)
-    else:
-        global _diskInfoDic
-        key = diskId + "_" + mimeType
-        if ((not caching) or (key not in _diskInfoDic)):
-            diskInfo = ngamsDiskInfo.ngamsDiskInfo()
-            diskInfo.getInfo(dbConObj, ngamsCfgObj, diskId, mimeType)
-            if (caching): _diskInfoDic[key] = diskInfo
-        else:
-            diskInfo = _diskInfoDic[key]
 
-        return diskInfo
\ No newline at end of file
+    diskInfo = diskIdDic[diskId]
+    stoSet = ngamsCfgObj.getStorageSetFromSlotId(diskInfo.getSlotId())
+    diskInfo.setStorageSetId(stoSet.getStorageSetId())
+    return diskInfo
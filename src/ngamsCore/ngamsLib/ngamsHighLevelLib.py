@@ -80,6 +80,84 @@ def getHostInfoFromHostIds(dbConObj,
     return hostDic
 
 
+class _host_info_cache(object):
+    """
+    A cache of the ngamsHostInfo objects read from the ngas_hosts table,
+    indexed by host ID. Entries expire after a given amount of time, and can
+    be explicitly invalidated when the information of a host changes.
+    Copies of the cached objects are handed out, since callers modify them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, dbConObj, hostList, ttl):
+        now = time.time()
+        hostDic = {}
+        with self._lock:
+            for hostId in set(hostList):
+                entry = self._hosts.get(hostId)
+                if entry is not None and entry[0] >= now:
+                    hostDic[hostId] = entry[1].clone()
+            missing = [hostId for hostId in set(hostList) if hostId not in hostDic]
+            self.hits += len(hostDic)
+            self.misses += len(missing)
+            generation = self._generation
+        if not missing:
+            return hostDic
+
+        newHostDic = getHostInfoFromHostIds(dbConObj, missing)
+        with self._lock:
+            # Don't store information read before an invalidation took place
+            if generation == self._generation:
+                for hostId, hostInfo in newHostDic.items():
+                    self._hosts[hostId] = (now + ttl, hostInfo.clone())
+        hostDic.update(newHostDic)
+        return hostDic
+
+    def invalidate(self, hostId=None):
+        with self._lock:
+            self._generation += 1
+            if hostId is None:
+                self._hosts.clear()
+            else:
+                self._hosts.pop(hostId, None)
+
+    def stats(self):
+        with self._lock:
+            return self.hits, self.misses, len(self._hosts)
+
+_host_infos = _host_info_cache()
+
+def invalidate_host_info(hostId=None):
+    """
+    Forgets the cached information of host `hostId`, or of all hosts if
+    no Host ID is given.
+    """
+    _host_infos.invalidate(hostId)
+
+def getHostInfoCacheStats():
+    """
+    Returns the number of hits and misses of the host information cache,
+    and the number of hosts currently in it.
+    """
+    return _host_infos.stats()
+
+
+def _getHostInfos(dbConObj, hostList, cacheTime):
+    """
+    Like getHostInfoFromHostIds, but uses the host information cache
+    if `cacheTime` is greater than 0.
+    """
+    if cacheTime > 0:
+        return _host_infos.get(dbConObj, hostList, cacheTime)
+    return getHostInfoFromHostIds(dbConObj, hostList)
+
+
 def updateSrvHostInfo(dbConObj, hostInfoObj):
     """
     Update the information in the DB, which is managed by the server
@@ -108,11 +186,13 @@ def updateSrvHostInfo(dbConObj, hostInfoObj):
                                 hostInfoObj.getSrvRemove(),
                                 hostInfoObj.getSrvDataChecking(),
                                 hostInfoObj.getSrvState()])
+    invalidate_host_info(hostInfoObj.getHostId())
 
 
 def _addHostInDic(dbConObj,
                   hostId,
-                  hostDic):
+                  hostDic,
+                  cacheTime=0):
     """
     Internal function to add host information in a dictionary.
 
@@ -123,14 +203,14 @@ def _addHostInDic(dbConObj,
     hostDic:     Dictionary with host IDs as keys pointing to instances
                  of ngamsHostInfo (dictionary).
 
+    cacheTime:   Time for which host information can be cached (integer).
+
     Returns:     Void.
     """
-    tmpHostInfo = dbConObj.getHostInfoFromHostIds([hostId])
-    if not tmpHostInfo:
+    tmpHostInfo = _getHostInfos(dbConObj, [hostId], cacheTime)
+    if hostId not in tmpHostInfo:
         raise Exception(genLog("NGAMS_AL_MIS_HOST", [hostId]))
-    sqlHostInfo = tmpHostInfo[0]
-    hostDic[hostId] = ngamsHostInfo.ngamsHostInfo().\
-                      unpackFromSqlQuery(sqlHostInfo)
+    hostDic[hostId] = tmpHostInfo[hostId]
 
 
 def resolveHostAddress(localHostId,
@@ -147,6 +227,9 @@ def resolveHostAddress(localHostId,
     If for a host no information is found in the NGAS DB, the same port
     number as for the contacted host is taken.
 
+    The information of the hosts is cached for the amount of time given by
+    the HostInfoCacheTime configuration parameter.
+
     dbConObj:    DB object used when accessing the DB (ngamsDb).
 
     hostList:    List containing names of hosts for which to find
@@ -155,15 +238,16 @@ def resolveHostAddress(localHostId,
     Returns:     Dictionary with hostnames as keys containing
                  ngamsHostInfo objects (dictionary).
     """
+    cacheTime = ngamsCfgObj.getHostInfoCacheTime()
     try:
-        hostInfoDic = getHostInfoFromHostIds(dbConObj, hostList)
+        hostInfoDic = _getHostInfos(dbConObj, hostList, cacheTime)
     except:
         hostInfoDic = {}
         for host in hostList:
             hostInfoDic[host] = None
 
     if localHostId not in hostInfoDic:
-        _addHostInDic(dbConObj, localHostId, hostInfoDic)
+        _addHostInDic(dbConObj, localHostId, hostInfoDic, cacheTime)
     for hostName in hostList:
         if hostName not in hostInfoDic:
             errMsg = genLog("NGAMS_AL_MIS_HOST", [hostName])
@@ -186,7 +270,7 @@ def resolveHostAddress(localHostId,
                 raise Exception("No Cluster Name specified in NGAS DB for " +\
                       "host: " + hi.getHostId())
             if clusterName not in hostInfoDic:
-                _addHostInDic(dbConObj, clusterName, hostInfoDic)
+                _addHostInDic(dbConObj, clusterName, hostInfoDic, cacheTime)
             hi.\
                  setHostType(NGAMS_HOST_DOMAIN).\
                  setHostId(hostInfoDic[clusterName].getHostId()).\
@@ -196,7 +280,7 @@ def resolveHostAddress(localHostId,
             # about the host to be contacted for handling the request.
             clusterName = hi.getClusterName()
             if clusterName not in hostInfoDic:
-                _addHostInDic(dbConObj, clusterName, hostInfoDic)
+                _addHostInDic(dbConObj, clusterName, hostInfoDic, cacheTime)
             hi.\
                  setHostType(NGAMS_HOST_REMOTE).\
                  setHostId(hostInfoDic[clusterName].getHostId()).\
@@ -633,7 +633,6 @@ class ngamsHostInfo:
                setSrvState(self.getSrvState()).\
                setHostType(self.getHostType()).\
                setSrvSuspended(self.getSrvSuspended()).\
-               setSrvLastHost(self.getSrvLastHost()).\
                setSrvReqWakeUpSrv(self.getSrvReqWakeUpSrv()).\
                setSrvReqWakeUpTime(self.getSrvReqWakeUpTime())
 
@@ -23,15 +23,20 @@
 Module containing HTTP utility code (mostly client-side)
 """
 
+import collections
 import contextlib
 import errno
+import functools
 import io
 import logging
 import os
+import select
 import socket
+import threading
 import time
 import sys
 
+import six
 from six.moves import http_client as httplib  # @UnresolvedImport
 from six.moves.urllib import parse as urlparse  # @UnresolvedImport
 import requests
@@ -49,6 +54,13 @@ if 'NGAS_HTTP_CONNECT_RETRIES' in os.environ:
 if 'NGAS_HTTP_CONNECT_RETRIES_PERIOD_MS' in os.environ:
     _connect_retries_period_ms = int(os.environ['NGAS_HTTP_CONNECT_RETRIES_PERIOD_MS'])
 
+_pool_size = 4
+_pool_idle_time = 10
+if 'NGAS_HTTP_POOL_SIZE' in os.environ:
+    _pool_size = int(os.environ['NGAS_HTTP_POOL_SIZE'])
+if 'NGAS_HTTP_POOL_IDLE_TIME' in os.environ:
+    _pool_idle_time = float(os.environ['NGAS_HTTP_POOL_IDLE_TIME'])
+
 def _connect(conn):
     # If the server on the other side has its backlog of connections full
     # it will react differently depending on the OS it is running on.
@@ -77,6 +89,171 @@ def _connect(conn):
             time.sleep(0.001 * ms)
 
 
+class _pooled_response(httplib.HTTPResponse):
+    """
+    An HTTP response that hands its connection back to the pool it came from
+    once its body has been fully read
+    """
+
+    _release = None
+    _closing = False
+
+    def close(self):
+        # python 2 calls close() itself after reading the full body
+        self._closing = not six.PY2 or self.length != 0
+        httplib.HTTPResponse.close(self)
+        self._done()
+
+    def _close_conn(self):
+        # python 3 calls this after reading the full body, and on close()
+        httplib.HTTPResponse._close_conn(self)
+        self._done()
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release(not self._closing and not self.will_close)
+
+class _pooled_connection(httplib.HTTPConnection):
+    response_class = _pooled_response
+    reused = False
+
+def _is_stale(conn):
+    """Whether the remote end closed (or wrote unexpected data into) an idle connection"""
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (ValueError, select.error):
+        return False
+
+class connection_pool(object):
+    """
+    A thread-safe pool of kept-alive HTTP connections, indexed by host and port.
+
+    At most ``max_idle`` idle connections are kept for each host/port, and
+    connections idle for more than ``idle_time`` seconds are evicted. Hits,
+    misses and evictions are counted.
+    """
+
+    def __init__(self, max_idle, idle_time):
+        self.max_idle = max_idle
+        self.idle_time = idle_time
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conns = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def get(self, host, port, timeout, reuse=True):
+        """
+        Returns a connection to ``host``:``port``, reusing an idle one if
+        possible and allowed by ``reuse``
+        """
+        conn = None
+        if reuse and self.max_idle > 0:
+            now = time.time()
+            with self._lock:
+                conns = self._conns.get((host, port))
+                while conns:
+                    idle_conn, since = conns.pop()
+                    if now - since < self.idle_time and not _is_stale(idle_conn):
+                        conn = idle_conn
+                        break
+                    self.evictions += 1
+                    idle_conn.close()
+                if conn is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        if conn is not None:
+            conn.reused = True
+            conn.timeout = timeout
+            conn.sock.settimeout(timeout)
+            return conn
+
+        conn = _pooled_connection(host, port, timeout=timeout)
+        _connect(conn)
+        return conn
+
+    def release(self, host, port, conn, reusable):
+        """Gives ``conn`` back to the pool, or closes it if not ``reusable``"""
+        if not reusable or self.max_idle <= 0 or conn.sock is None:
+            conn.close()
+            return
+
+        now = time.time()
+        with self._lock:
+            conns = self._conns[(host, port)]
+            while conns and (len(conns) >= self.max_idle or now - conns[0][1] >= self.idle_time):
+                self.evictions += 1
+                conns.popleft()[0].close()
+            conns.append((conn, now))
+
+    def clear(self):
+        """Closes all idle connections"""
+        with self._lock:
+            for conns in self._conns.values():
+                for conn, _ in conns:
+                    conn.close()
+            self._conns.clear()
+
+pool = connection_pool(_pool_size, _pool_idle_time)
+"""The pool of HTTP connections used by this module"""
+
+_requests_sessions = threading.local()
+
+def _requests_session():
+    """A per-thread requests session, which keeps HTTPS connections alive"""
+    session = getattr(_requests_sessions, 'session', None)
+    if session is None:
+        session = _requests_sessions.session = requests.Session()
+    return session
+
+
+def _send_request(conn, method, url, data, hdrs, is_file):
+
+    try:
+        if is_file:
+            conn.request(method, url, headers=hdrs)
+            pysendfile.sendfile(conn.sock, data)
+        else:
+            conn.request(method, url, body=data, headers=hdrs)
+        logger.debug("%s request sent to, waiting for a response", method)
+    except socket.error as e:
+
+        # If the server closes the connection while we write data
+        # we still try to read the response, if any
+        #
+        # In OSX >= 10.10 this error can come up as EPROTOTYPE instead of EPIPE
+        # (although the error code is not mentioned in send(2)). The actual
+        # error recognised by the kernel in this situation is slightly different,
+        # but still due to remote end closing the connection. For a full, nice
+        # explanation of this see:
+        #
+        # https://erickt.github.io/blog/2014/11/19/adventures-in-debugging-a-potential-osx-kernel-bug/
+        tolerate = e.errno in (errno.EPROTOTYPE, errno.EPIPE) and not conn.reused
+        if not tolerate:
+            try:
+                conn.close()
+            except:
+                pass
+            raise
+
+
+def _get_response(conn, method):
+    start = time.time()
+    try:
+        response = conn.getresponse()
+    except:
+        conn.close()
+        raise
+    logger.debug("Response to %s request received within %.4f [s]", method, time.time() - start)
+
+    return response
+
+
 def _http_response(host, port, method, cmd,
                  data=None, timeout=None,
                  pars=[], hdrs={}):
@@ -122,42 +299,54 @@ def _http_response(host, port, method, cmd,
         url += '?' + pars
 
     # Go, go, go!
+    # Requests are sent through an idle kept-alive connection if possible.
+    # Streamed bodies cannot be sent twice, so they always use a new one
     logger.info("About to %s to %s:%d/%s", method, host, port, url)
-    conn = httplib.HTTPConnection(host, port, timeout = timeout)
-    _connect(conn)
-
+    replayable = data is None or isinstance(data, (six.binary_type, six.text_type))
+    conn = pool.get(host, port, timeout, reuse=replayable)
     try:
-        if is_file:
-            conn.request(method, url, headers=hdrs)
-            pysendfile.sendfile(conn.sock, data)
-        else:
-            conn.request(method, url, body=data, headers=hdrs)
-        logger.debug("%s request sent to, waiting for a response", method)
+        _send_request(conn, method, url, data, hdrs, is_file)
     except socket.error as e:
 
-        # If the server closes the connection while we write data
-        # we still try to read the response, if any
-        #
-        # In OSX >= 10.10 this error can come up as EPROTOTYPE instead of EPIPE
-        # (although the error code is not mentioned in send(2)). The actual
-        # error recognised by the kernel in this situation is slightly different,
-        # but still due to remote end closing the connection. For a full, nice
-        # explanation of this see:
-        #
-        # https://erickt.github.io/blog/2014/11/19/adventures-in-debugging-a-potential-osx-kernel-bug/
-        tolerate = e.errno in (errno.EPROTOTYPE, errno.EPIPE)
-        if not tolerate:
-            try:
-                conn.close()
-            except:
-                pass
+        # The server might have closed the idle connection just as we used it.
+        # Only requests that could not be written are sent again: errors
+        # while waiting for the response can happen after the server already
+        # executed the request, which might not be idempotent
+        if not conn.reused or isinstance(e, socket.timeout):
             raise
+        logger.info("Kept-alive connection to %s:%d closed by server, retrying", host, port)
+        conn = pool.get(host, port, timeout, reuse=False)
+        _send_request(conn, method, url, data, hdrs, is_file)
+    response = _get_response(conn, method)
+
+    # Zero-length bodies are fully read already
+    if response.isclosed():
+        pool.release(host, port, conn, not response.will_close)
+    else:
+        response._release = functools.partial(pool.release, host, port, conn)
+    return response
 
-    start = time.time()
-    response = conn.getresponse()
-    logger.debug("Response to %s request received within %.4f [s]", method, time.time() - start)
 
-    return response
+def httpPostStream(host, port, cmd, data, mimeType, pars=[], hdrs={},
+                   timeout=None, contDisp=None, auth=None):
+    """
+    Like `httpPost`, but returns an HTTP response object from which the reply
+    can be read instead of the reply itself.
+    It is the callers' responsibility to close the response object,
+    which in turn will close the HTTP connection.
+    """
+
+    logger.debug("About to POST to %s:%d/%s", host, port, cmd)
+
+    # Prepare all headers that need to be sent
+    hdrs = dict(hdrs)
+    hdrs["Content-Type"] = mimeType
+    if contDisp:
+        hdrs["Content-Disposition"] = contDisp
+    if auth:
+        hdrs["Authorization"] = auth.strip()
+
+    return _http_response(host, port, 'POST', cmd, data, timeout, pars, hdrs)
 
 
 def httpPost(host, port, cmd, data, mimeType, pars=[], hdrs={},
@@ -175,17 +364,8 @@ def httpPost(host, port, cmd, data, mimeType, pars=[], hdrs={},
     Additional headers can be passed as a dictionary via `hdrs`.
     """
 
-    logger.debug("About to POST to %s:%d/%s", host, port, cmd)
-
-    # Prepare all headers that need to be sent
-    hdrs = dict(hdrs)
-    hdrs["Content-Type"] = mimeType
-    if contDisp:
-        hdrs["Content-Disposition"] = contDisp
-    if auth:
-        hdrs["Authorization"] = auth.strip()
-
-    resp = _http_response(host, port, 'POST', cmd, data, timeout, pars, hdrs)
+    resp = httpPostStream(host, port, cmd, data, mimeType, pars=pars, hdrs=hdrs,
+                          timeout=timeout, contDisp=contDisp, auth=auth)
     with contextlib.closing(resp):
 
         # Receive + unpack reply.
@@ -240,7 +420,7 @@ def httpPostUrl(url, data, mimeType, hdrs={},
             hdrs["Authorization"] = auth.strip()
             auth = None
 
-        resp = requests.post(
+        resp = _requests_session().post(
             url, data=data, headers=hdrs, timeout=timeout, auth=auth,
             params=pars, verify=cert_path if cert_path is not None else True,
             cert=(client_cert, client_key),
@@ -289,10 +469,13 @@ def httpGetUrl(url, pars=[], hdrs={}, timeout=None, auth=None):
             # this passes on the internals of ngas' auth setup
             hdrs["Authorization"] = auth.strip()
             auth = None
-        resp = requests.get(
+        # Bodies are streamed (like in the plain HTTP case) so large replies
+        # are not held in memory; ``content`` is still available for callers
+        # reading small replies in one go
+        resp = _requests_session().get(
             url, headers=hdrs, timeout=timeout, auth=auth, params=pars,
             verify=cert_path if cert_path is not None else True,
-            cert=(client_cert, client_key),
+            cert=(client_cert, client_key), stream=True,
         )
         resp.status = resp.status_code
         return resp
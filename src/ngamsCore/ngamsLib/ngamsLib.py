@@ -34,7 +34,6 @@ NG/AMS implementation.
 The functions in this module can be used in all the NG/AMS code.
 """
 
-import gzip
 import logging
 import os
 import shutil
@@ -43,7 +42,7 @@ import socket
 from six.moves.urllib import parse as urlparse  # @UnresolvedImport
 from six.moves import cPickle # @UnresolvedImport
 
-from .ngamsCore import genLog, NGAMS_UNKNOWN_MT, rmFile
+from .ngamsCore import genLog, NGAMS_UNKNOWN_MT, rmFile, compress_stream
 
 
 logger = logging.getLogger(__name__)
@@ -349,59 +348,32 @@ def trueArchiveProxySrv(cfgObj):
     return trueArchProxySrv
 
 
-class GzipFile(gzip.GzipFile):
-    """
-    Our version of GzipFile which calculates (if indicated) a given checksum on
-    the *compressed* data as it gets written into the output file.
-    """
-
-    def __init__(self, filename, mode, crc_info=None):
-
-        fileobj = open(filename, mode)
-
-        # Checksum requested, create the wrapper for checksum calculation at
-        # write time and pass the wrapped object down instead
-        if crc_info:
-
-            class wrapper(object):
-
-                def __init__(self, f):
-                    self.f = f
-                    self.crc = crc_info.init
-                    self.mode = mode
-
-                def write(self, data):
-                    self.crc = crc_info.method(data, self.crc)
-                    return self.f.write(data)
-
-                def flush(self):
-                    return self.f.flush()
-
-                def close(self):
-                    self.crc = crc_info.final(self.crc)
-                    return self.f.close()
-
-            # set self.myfileobj so gzip.GzipFile.close() closes fileobj
-            fileobj = self.myfileobj = wrapper(fileobj)
-
-        # The "gzip" command defaults to compression level 6
-        gzip.GzipFile.__init__(self, fileobj=fileobj, compresslevel=6)
-
-def gzip_compress(fin, fout_name, block_size, crc_info=None):
+def gzip_compress(fin, fout_name, block_size, crc_info=None, threads=1):
     """
     Compresses the contents read from `fin` into file `fout_name`. Reading from
     `fin` is done by reading `block_size` bytes at a time.
 
-    If `crc_init` and `crc_m` are provided then a checksum on the compressed
-    data is calculated as data gets compressed using `crc_m` as the checksum
-    method, and `crc_init` as the initial checksum value.
+    If `crc_info` is provided then a checksum on the compressed data is
+    calculated as data gets compressed, and returned. If `threads` is greater
+    than 1 the data is compressed concurrently in blocks of `block_size`
+    bytes (see ngamsCore.compress_stream).
     """
-    with GzipFile(fout_name, 'wb', crc_info=crc_info) as fout:
+    class crc_writer(object):
+
+        def __init__(self, f):
+            self.f = f
+            self.crc = crc_info.init
+
+        def write(self, data):
+            self.crc = crc_info.method(data, self.crc)
+            return self.f.write(data)
+
+    with open(fout_name, 'wb') as fout:
         if crc_info:
-            fileobj = fout.fileobj
-        shutil.copyfileobj(fin, fout, block_size)
+            fout = crc_writer(fout)
+        compress_stream(fin, fout, block_size=block_size, threads=threads)
 
     if crc_info:
-        return fileobj.crc
+        return crc_info.final(fout.crc)
 
 # EOF
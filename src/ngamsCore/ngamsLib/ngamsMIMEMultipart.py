@@ -239,6 +239,12 @@ class MIMEMultipartParser(object):
     headers have been read, when the headers of each part of the multipart message
     have been read (meaning that the contents of a file follow), the file contents
     themselves, and when the file contents have ended.
+
+    Data is read into a buffer that is reused throughout the parsing, and only
+    the bytes that could still belong to a delimiter are searched again after
+    each read, so parsing takes linear time regardless of the read size. File
+    contents are passed down to the handler as memoryview slices of this
+    buffer, which are valid only during the call to handleData.
     """
 
     class _ReadingState:
@@ -251,9 +257,10 @@ class MIMEMultipartParser(object):
 
         The new parser will notify the given handler about important events
         that occur during parsing. The parser will read the stream pointed out
-        by fd in readSize blocks (or less, if there is less than
-        readSize bytes left on fd to read) until totalSize
-        has been read.
+        by fd in blocks of at least readSize bytes (or less, if there is less
+        than readSize bytes left on fd to read) until totalSize
+        has been read. Blocks are at most as big as the parser's buffer, which
+        can hold at least two readSize blocks.
         """
         self._handler = handler
         self._fd = fd
@@ -262,6 +269,10 @@ class MIMEMultipartParser(object):
         self._bytesRead = 0
         self._bytesToRead = self._totalSize
         self._readingTime = 0
+        self._readinto = getattr(fd, 'readinto', None)
+        self._buf = bytearray(max(2 * readSize, 65536))
+        self._view = memoryview(self._buf)
+        self._start = self._end = self._scan = 0
 
     def getReadingTime(self):
         """
@@ -286,148 +297,161 @@ class MIMEMultipartParser(object):
         lead potentially to partial files being received, so users should be
         careful about it
         """
-        self._recurse()
+        self._parse()
         logger.debug('Bytes expected/bytes received: %d/%d', self._totalSize, self._bytesRead)
 
-    def _recurse(self):
+    def _consume(self, pos):
+        """Marks all data in the buffer before pos as processed"""
+        self._start = self._scan = pos
+
+    def _read(self):
+        """
+        Reads more data from the stream into the end of the buffer, making room
+        for it first if necessary. Returns the number of bytes read.
+        """
+
+        rdSize = min(self._readSize, self._bytesToRead)
+        if rdSize <= 0:
+            return 0
+
+        # Move the unprocessed data to the beginning of the buffer,
+        # or into a bigger one if there is still no room for a full read
+        if len(self._buf) - self._end < rdSize:
+            start, end = self._start, self._end
+            retained = end - start
+            buf = self._buf
+            if len(buf) - retained < rdSize:
+                buf = bytearray(max(2 * len(buf), retained + rdSize))
+            buf[:retained] = self._buf[start:end]
+            if buf is not self._buf:
+                self._buf = buf
+                self._view = memoryview(buf)
+            self._scan -= start
+            self._start = 0
+            self._end = retained
+
+        # Fill as much of the buffer as possible
+        end = self._end
+        rdSize = min(len(self._buf) - end, self._bytesToRead)
+
+        t = time.time()
+        if self._readinto:
+            bytesRead = self._readinto(self._view[end:end + rdSize]) or 0
+        else:
+            data = self._fd.read(rdSize)
+            bytesRead = len(data)
+            self._buf[end:end + bytesRead] = data
+        self._readingTime += (time.time() - t)
 
-        rdSize = self._readSize
-        readingFile = False
+        self._end += bytesRead
+        self._bytesToRead -= bytesRead
+        self._bytesRead += bytesRead
+        return bytesRead
+
+    def _parse(self):
+
+        handler = self._handler
         state = self._ReadingState.headers
-        prevBuf = None
-        boundary = None
-        boundaries = []
+        filename = None
+        delimiters = []
 
-        # Kick the loop of with bytesRead = 1, but stop
-        # if any reading yields 0 bytes
-        bytesRead = 1
         while True:
 
-            # Don't try to over-read during the last reading
-            if self._bytesToRead < rdSize:
-                rdSize = self._bytesToRead
+            buf, start, end = self._buf, self._start, self._end
 
-            # Read, read, read...
-            t = time.time()
-            buf = self._fd.read(rdSize)
-            self._readingTime += (time.time() - t)
+            # Read the headers of the next part and parse them. If it's a
+            # container we start reading delimiters; otherwise file data
+            if state == self._ReadingState.headers:
+                idx = buf.find(CRLF + CRLF, self._scan, end)
+                if idx == -1:
+                    self._scan = max(start, end - 3)
+                    if not self._read():
+                        break
+                    continue
 
-            bytesRead = len(buf)
-            self._bytesToRead -= bytesRead
-            self._bytesRead   += bytesRead
+                logger.debug('Processing headers')
+                headers = bytes(buf[start:idx + 4])
+                self._consume(idx + 4)
+                if six.PY3:
+                    msg = email.parser.BytesHeaderParser().parsebytes(headers, headersonly=True)  # @UndefinedVariable
+                else:
+                    msg = email.parser.HeaderParser().parsestr(headers, headersonly=True)
 
-            # Anything coming from a previous iteration gets prefixed
-            if prevBuf:
-                buf = prevBuf + buf
-            prevBuf = None
+                # It's a new container
+                if 'multipart/mixed' == msg.get_content_type():
+                    boundary = msg.get_param('boundary')
+                    containerName = msg.get_param('container_name')
+                    logger.debug('MIME multipart boundary: %s', boundary)
 
-            # On the first stage we read the MIME multipart headers and parse them
-            # If found, we start reading delimiters; otherwise we keep reading data
-            if state == self._ReadingState.headers:
-                idx = buf.find(CRLF + CRLF)
-                if idx != -1:
-                    logger.debug('Processing headers')
-                    headers  = buf[:idx+4]
-                    buf      = buf[idx+4:]
-                    if six.PY3:
-                        msg = email.parser.BytesHeaderParser().parsebytes(headers, headersonly=True)  # @UndefinedVariable
-                    else:
-                        msg = email.parser.HeaderParser().parsestr(headers, headersonly=True)
-
-                    # It's a new container, recurse
-                    mimeType = msg.get_content_type()
-                    if 'multipart/mixed' == mimeType:
-
-                        # Save the current boundary for later
-                        if boundary:
-                            boundaries.append(boundary)
-
-                        boundary      = six.b(msg.get_param('boundary'))
-                        containerName = msg.get_param('container_name')
-                        logger.debug('MIME multipart boundary: %s', boundary)
-
-                        # Fail if we're missing any of these
-                        if not boundary or not containerName:
-                            msg = 'Either \'boundary\' or \'container_name\' are not specified in the Content-Type header'
-                            raise Exception(msg)
-
-                        self._handler.startContainer(containerName)
-                        state = self._ReadingState.delimiter
-
-                    # It's a file within the container
-                    else:
-                        filename = msg.get_filename()
-                        if not filename:
-                            raise Exception('No filename found in internal multipart part header')
-                        state = self._ReadingState.data
-                        self._handler.startFile(filename)
-                        readingFile = True
-
-                # Read more data until we reach the end of the headers
+                    # Fail if we're missing any of these
+                    if not boundary or not containerName:
+                        msg = 'Either \'boundary\' or \'container_name\' are not specified in the Content-Type header'
+                        raise Exception(msg)
+
+                    delimiters.append(CRLF + b'--' + six.b(boundary))
+                    handler.startContainer(containerName)
+                    state = self._ReadingState.delimiter
+
+                # It's a file within the container
                 else:
-                    prevBuf = buf
+                    filename = msg.get_filename()
+                    if not filename:
+                        raise Exception('No filename found in internal multipart part header')
+                    if not delimiters:
+                        raise Exception('File %s found outside of a container' % (filename,))
+                    handler.startFile(filename)
+                    state = self._ReadingState.data
+
+            # Look for the next delimiter, which is followed either by CRLF
+            # (another part follows) or by "--" (the container has finished).
+            # Anything before it is discarded
+            elif state == self._ReadingState.delimiter:
+                delimiter = delimiters[-1]
+                idx = buf.find(delimiter, self._scan, end)
+                if idx == -1 or idx + len(delimiter) + 2 > end:
+                    self._consume(idx if idx != -1 else max(start, end - len(delimiter) + 1))
+                    if not self._read():
+                        break
                     continue
 
-            # We can read delimiters either because we've just started
-            # reading the body of the MIME multipart message or because
-            # we just finished reading a particular part of the multipart
-            if state == self._ReadingState.delimiter:
-
-                # We come from reading a previous multipart part
-                if readingFile:
-                    self._handler.endFile()
-                readingFile = False
-
-                # Look for both delimiter and final delimiter
-                delIdx  = buf.find(CRLF + b'--' + boundary + CRLF)
-                fDelIdx = buf.find(CRLF + b'--' + boundary + b'--')
-                if delIdx != -1:
-                    # We don't actually need the delimiter itself
-                    # delimiter = buf[:delIdx + 4 + len(boundary) + 2]
+                afterIdx = idx + len(delimiter) + 2
+                suffix = buf[afterIdx - 2:afterIdx]
+                if suffix == CRLF:
                     logger.debug('File delimiter found')
-                    buf       = buf[delIdx + 4 + len(boundary) + 2:]
-                    state     = self._ReadingState.headers
-                    prevBuf = buf
-                    continue
-                elif fDelIdx != -1:
-                    # delimiter = buf[:fDelIdx + 4 + len(boundary) + 2]
+                    self._consume(afterIdx)
+                    state = self._ReadingState.headers
+                elif suffix == b'--':
                     logger.debug('Final delimiter found')
-                    # Take out the final delimiter and start
-                    # using the previous boundary
-                    self._handler.endContainer()
-                    state = self._ReadingState.delimiter
-                    if boundaries:
-                        boundary = boundaries.pop()
-                        buf = buf[fDelIdx + 4 + len(boundary) + 2:]
-                        prevBuf = buf
-                        continue;
-                    else:
+                    self._consume(afterIdx)
+                    handler.endContainer()
+                    delimiters.pop()
+                    if not delimiters:
                         break
                 else:
-                    prevBuf = buf
-                    continue
+                    self._consume(idx + 1)
 
-            # When reading data, look for the next delimiter
-            # When found, finish writing data, and pass the
-            # delimiter to the ReadingState.delimiter state
-            if state == self._ReadingState.data:
-                delIdx  = buf.find(CRLF + b'--' + boundary)
-                if delIdx != -1:
-                    logger.debug('Found end of file %s because we found boundary: %s', filename, boundary)
+            # When reading data, look for the next delimiter. All data that
+            # cannot be part of a delimiter is passed down to the handler
+            # straight from the buffer; anything it doesn't handle is kept in
+            # the buffer and passed down again during the next call
+            else:
+                delimiter = delimiters[-1]
+                idx = buf.find(delimiter, self._scan, end)
+                if idx != -1:
+                    logger.debug('Found end of file %s because we found its delimiter', filename)
+                    handler.handleData(self._view[start:idx], False)
+                    handler.endFile()
+                    self._consume(idx)
                     state = self._ReadingState.delimiter
-                    prevBuf = buf[delIdx:]
-                    buf = buf[:delIdx]
-
-                buf = self._handler.handleData(buf, state == self._ReadingState.data)
-                if buf and len(buf):
-                    if prevBuf:
-                        raise Exception('No data should be returned when delimiter has been found')
-                    prevBuf = buf
-
-            # If nothing was read, and nothing
-            # was left for the next iteration, stop
-            if not prevBuf and not bytesRead:
-                break
+                    continue
+
+                safeEnd = end - len(delimiter) + 1
+                if safeEnd > start:
+                    rest = handler.handleData(self._view[start:safeEnd], True)
+                    self._consume(safeEnd - (len(rest) if rest else 0))
+                self._scan = max(self._start, safeEnd)
+                if not self._read():
+                    break
 
 
 class BufferedReader(object):
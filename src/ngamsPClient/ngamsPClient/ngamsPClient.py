@@ -38,28 +38,37 @@ can be used to build up Python applications communicating with NG/AMS.
 
 import argparse
 import base64
+import binascii
 import contextlib
+import csv
+import functools
+import hashlib
+import json
 import logging
+import multiprocessing.pool
 import os
 import random
-import shutil
 import socket
 import sys
 import tarfile
+import threading
 import time
 from xml.dom import minidom
 
+from six.moves import queue  # @UnresolvedImport
+
 from ngamsLib import ngamsLib, ngamsFileInfo, ngamsStatus, ngamsMIMEMultipart,\
     ngamsHttpUtils, logutils
 from ngamsLib.ngamsCore import NGAMS_EXIT_CMD, NGAMS_INIT_CMD,\
-    NGAMS_HTTP_SUCCESS
+    NGAMS_HTTP_SUCCESS, NGAMS_HTTP_PARTIAL_CONTENT
 from ngamsLib.ngamsCore import NGAMS_ARCHIVE_CMD, NGAMS_REARCHIVE_CMD, NGAMS_HTTP_PAR_FILENAME, NGAMS_HTTP_HDR_FILE_INFO, NGAMS_HTTP_HDR_CONTENT_TYPE, \
     NGAMS_LABEL_CMD, NGAMS_ONLINE_CMD, NGAMS_OFFLINE_CMD, NGAMS_REMDISK_CMD, \
     NGAMS_REMFILE_CMD, NGAMS_REGISTER_CMD, NGAMS_RETRIEVE_CMD, NGAMS_STATUS_CMD, \
     NGAMS_FAILURE, NGAMS_SUBSCRIBE_CMD, NGAMS_UNSUBSCRIBE_CMD, NGAMS_ARCH_REQ_MT, \
     NGAMS_CACHEDEL_CMD, NGAMS_CLONE_CMD, \
     NGAMS_HTTP_REDIRECT, getNgamsVersion, \
-    getNgamsLicense, toiso8601, NGAMS_CONT_MT
+    getNgamsLicense, toiso8601, NGAMS_CONT_MT, NGAMS_HTTP_HDR_CHECKSUM, \
+    NGAMS_HTTP_HDR_CHECKSUM_VARIANT
 
 
 logger = logging.getLogger(__name__)
@@ -551,18 +560,31 @@ class ngamsPClient:
 
 
     def retrieve(self, fileId, fileVersion=-1, pars=[], hdrs={},
-                 targetFile=None, processing=None, processingPars=None):
+                 targetFile=None, processing=None, processingPars=None,
+                 block_size=65536, verify_checksum=False, n_streams=1):
         """
         Request file `fileId` from the NG/AMS Server, store it locally
         in `targetFile`, and return the result of the operation as an
         ngamsStatus object. If `targetFile` is a directory, the name of the
-        retrieved file is appended to the directory name.
+        retrieved file is appended to the directory name. Data is written
+        to `targetFile` in blocks of `block_size` bytes as it is received.
 
         If `file_version` is given then that specific of the version will be
         retrieved.
         If `processing` and `processingPars` are given, they are passed down
         as the processing plug-in name and parameters to be applied to the
         retrieved data *on the server side*, respectively.
+
+        If `verify_checksum` is given the server is asked to send the
+        checksum of the file, which is calculated on the data as it is
+        received (in a separate thread) and then compared to it. A mismatch
+        results in an exception being raised.
+
+        If `n_streams` is greater than 1 the file is split into that many byte
+        ranges which are retrieved concurrently, each from any of the servers
+        this client knows about, and written in place into `targetFile`.
+        This is useful to make better use of high-latency links, where a single
+        TCP stream doesn't achieve the full link throughput.
         """
 
         pars = list(pars)
@@ -573,41 +595,169 @@ class ngamsPClient:
             pars.append(("processing", processing))
             if processingPars:
                 pars.append(("processingPars", processingPars))
+        if verify_checksum:
+            pars.append(("send_checksum", "1"))
 
         targetFile = targetFile or '.'
 
+        if n_streams > 1:
+            if processing:
+                raise ValueError("Processed data cannot be retrieved in multiple streams")
+            return self._parallel_retrieve(pars, hdrs, targetFile, block_size,
+                                           verify_checksum, n_streams)
+
         resp, host, port = self._get('RETRIEVE', pars, hdrs)
         host_id = "%s:%d" % (host, port)
         with contextlib.closing(resp):
 
-            if resp.status != NGAMS_HTTP_SUCCESS:
+            if resp.status not in (NGAMS_HTTP_SUCCESS, NGAMS_HTTP_PARTIAL_CONTENT):
                 return ngamsStatus.to_status(resp, host_id, 'RETRIEVE')
 
-            # If the target path is a directory, take the filename
-            # of the incoming data as the filename
-            fname = targetFile
-            if os.path.isdir(fname):
-                try:
-                    h = resp.headers
-                    cdisp = h['Content-Disposition']
-                except AttributeError:
-                    cdisp = resp.getheader('Content-Disposition')
-                parts = ngamsLib.parseHttpHdr(cdisp)
-                if 'filename' not in parts:
-                    msg = "Missing or invalid Content-Disposition header in HTTP response"
-                    raise Exception(msg)
-                fname = os.path.join(fname, os.path.basename(parts['filename']))
-
-            # Dump the data into the target file
-            with open(fname, 'wb') as f:
-                if hasattr(resp, 'content'):
-                    f.write(resp.content)
-                else:
-                    shutil.copyfileobj(resp, f)
+            fname = _target_filename(resp, targetFile)
+            verifier = None
+            if verify_checksum:
+                verifier = _checksum_verifier.from_response(resp)
+            _write_response(resp, fname, block_size, verifier)
 
             return ngamsStatus.dummy_success_stat(host_id)
 
 
+    def _parallel_retrieve(self, pars, hdrs, targetFile, block_size,
+                           verify_checksum, n_streams):
+        """
+        Retrieves a file using `n_streams` concurrent requests, each for a
+        different byte range of the file, which is preallocated on disk and
+        written in place.
+        """
+
+        start = time.time()
+
+        # A first request for a single byte tells us the name, size and
+        # checksum of the file. If the server sends back the full file instead
+        # we simply keep it
+        probe_hdrs = dict(hdrs)
+        probe_hdrs['Range'] = 'bytes=0-0'
+        resp, host, port = self._get('RETRIEVE', pars, probe_hdrs)
+        host_id = "%s:%d" % (host, port)
+        with contextlib.closing(resp):
+
+            if resp.status not in (NGAMS_HTTP_SUCCESS, NGAMS_HTTP_PARTIAL_CONTENT):
+                return ngamsStatus.to_status(resp, host_id, 'RETRIEVE')
+
+            fname = _target_filename(resp, targetFile)
+            verifier = None
+            if verify_checksum:
+                verifier = _checksum_verifier.from_response(resp)
+
+            content_range = _getheader(resp, 'Content-Range')
+            if content_range is None:
+                logger.info("Server doesn't support ranges, retrieving %s in one stream", fname)
+                _write_response(resp, fname, block_size, verifier)
+                return ngamsStatus.dummy_success_stat(host_id)
+            for _ in _read_blocks(resp, block_size):
+                pass
+            size = int(content_range.rsplit('/', 1)[1])
+
+        with open(fname, 'wb') as f:
+            _preallocate(f, size)
+
+        byte_ranges = _split_range(size, n_streams)
+        retrieve_range = functools.partial(self._retrieve_range, pars, hdrs,
+                                           fname, block_size)
+        pool = multiprocessing.pool.ThreadPool(len(byte_ranges))
+        try:
+            pool.map(retrieve_range, byte_ranges)
+        finally:
+            pool.close()
+            pool.join()
+
+        # The data is checksummed only after it has all been written
+        if verifier:
+            try:
+                with open(fname, 'rb') as f:
+                    for block in iter(lambda: f.read(block_size), b''):
+                        verifier.update(block)
+            finally:
+                verifier.finish()
+            verifier.check(fname)
+
+        howlong = time.time() - start
+        msg = "Retrieved %d bytes in %d streams at %.3f [MB/s]" % (
+            size, len(byte_ranges), size / 1024. / 1024. / howlong)
+        logger.info(msg)
+        stat = ngamsStatus.dummy_success_stat(host_id)
+        stat.setMessage(msg)
+        return stat
+
+
+    def _retrieve_range(self, pars, hdrs, fname, block_size, byte_range):
+        """Retrieves `byte_range` of a file and writes it in place into `fname`"""
+
+        first, last = byte_range
+        hdrs = dict(hdrs)
+        hdrs['Range'] = 'bytes=%d-%d' % byte_range
+        resp, host, port = self._get('RETRIEVE', pars, hdrs)
+        with contextlib.closing(resp):
+
+            if resp.status not in (NGAMS_HTTP_SUCCESS, NGAMS_HTTP_PARTIAL_CONTENT):
+                stat = ngamsStatus.to_status(resp, "%s:%d" % (host, port), 'RETRIEVE')
+                raise Exception(stat.getMessage())
+
+            content_range = _getheader(resp, 'Content-Range') or ''
+            if not content_range.startswith('bytes %d-%d/' % byte_range):
+                msg = "Server at %s:%d sent range %r instead of bytes %d-%d"
+                raise Exception(msg % (host, port, content_range, first, last))
+
+            offset = first
+            fd = os.open(fname, os.O_WRONLY)
+            try:
+                for block in _read_blocks(resp, block_size):
+                    _pwrite(fd, block, offset)
+                    offset += len(block)
+            finally:
+                os.close(fd)
+
+        if offset != last + 1:
+            msg = "Incomplete data received from %s:%d for bytes %d-%d"
+            raise Exception(msg % (host, port, first, last))
+
+
+    def query(self, query, out_format='jsonl', pars=[], block_size=65536):
+        """
+        Runs the QUERY command `query` and yields the resulting rows
+        as they are received from the server, without holding the full
+        result set in memory. `out_format` must be one of the formats the server
+        streams back (``jsonl`` or ``csv``). Rows are yielded as dictionaries
+        mapping column names to values; values of ``csv`` results are strings.
+        """
+
+        if out_format not in ('jsonl', 'csv'):
+            raise ValueError("Only jsonl and csv results can be streamed")
+
+        pars = list(pars)
+        pars.append(("query", query))
+        pars.append(("format", out_format))
+
+        resp, host, port = self._get('QUERY', pars)
+        with contextlib.closing(resp):
+
+            if resp.status != NGAMS_HTTP_SUCCESS:
+                stat = ngamsStatus.to_status(resp, "%s:%d" % (host, port), 'QUERY')
+                raise Exception(stat.getMessage())
+
+            lines = _read_lines(resp, block_size)
+            if out_format == 'jsonl':
+                for line in lines:
+                    yield json.loads(line.decode('utf-8'))
+            else:
+                if sys.version_info[0] > 2:
+                    lines = (line.decode('utf-8') for line in lines)
+                reader = csv.reader(lines)
+                colnames = next(reader, None)
+                for row in reader:
+                    yield dict(zip(colnames, row))
+
+
     def status(self, pars=[], output=None):
         """
         Request a general status from the NG/AMS Server
@@ -622,7 +772,8 @@ class ngamsPClient:
 
             output = output or 'file_list.xml.gz'
             with open(output, 'wb') as fout, contextlib.closing(resp):
-                shutil.copyfileobj(resp, fout)
+                for block in _read_blocks(resp, 65536):
+                    fout.write(block)
             return ngamsStatus.dummy_success_stat("%s:%d" % (host, port))
 
         return self.get_status(NGAMS_STATUS_CMD, pars=pars)
@@ -792,6 +943,171 @@ class ngamsPClient:
                     raise
 
 
+def _getheader(resp, name):
+    """Returns the value of header `name` of `resp`, or None"""
+    if hasattr(resp, 'iter_content'):
+        return resp.headers.get(name)
+    return resp.getheader(name)
+
+
+def _target_filename(resp, targetFile):
+    """
+    Returns the name of the file where the data of `resp` should be written.
+    If `targetFile` is a directory the filename advertised by the server
+    is appended to it.
+    """
+    if not os.path.isdir(targetFile):
+        return targetFile
+    cdisp = _getheader(resp, 'Content-Disposition')
+    parts = ngamsLib.parseHttpHdr(cdisp)
+    if 'filename' not in parts:
+        msg = "Missing or invalid Content-Disposition header in HTTP response"
+        raise Exception(msg)
+    return os.path.join(targetFile, os.path.basename(parts['filename']))
+
+
+def _write_response(resp, fname, block_size, verifier=None):
+    """Writes the body of `resp` into `fname`, checksumming it if required"""
+    try:
+        with open(fname, 'wb') as f:
+            for block in _read_blocks(resp, block_size):
+                f.write(block)
+                if verifier:
+                    verifier.update(block)
+    finally:
+        if verifier:
+            verifier.finish()
+    if verifier:
+        verifier.check(fname)
+
+
+def _split_range(size, n_parts):
+    """Splits `size` bytes into at most `n_parts` (first, last) byte ranges"""
+    part_size = max(1, -(-size // n_parts))
+    return [(first, min(first + part_size, size) - 1)
+            for first in range(0, size, part_size)]
+
+
+def _preallocate(f, size):
+    """Allocates `size` bytes on disk for file `f`"""
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        f.truncate(size)
+
+
+def _pwrite(fd, data, offset):
+    """Writes all of `data` into file descriptor `fd` at `offset`"""
+    while data:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, data, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, data)
+        data = data[written:]
+        offset += written
+
+
+def _read_blocks(resp, block_size):
+    """Yields the body of `resp` in blocks of up to `block_size` bytes"""
+    if hasattr(resp, 'iter_content'):
+        return resp.iter_content(block_size)
+    return iter(lambda: resp.read(block_size), b'')
+
+
+def _crc_function(variant):
+    """Returns the function used to calculate the CRC of the given variant"""
+    if variant in ('crc32', 'crc32z'):
+        return binascii.crc32
+    elif variant == 'crc32c':
+        import crc32c
+        return crc32c.crc32
+    raise ValueError('Unsupported CRC variant: %r' % (variant,))
+
+
+def _hash_function(variant):
+    """Returns the constructor of the hash of the given variant, if any"""
+    if variant in ('md5', 'sha256'):
+        return getattr(hashlib, variant)
+    elif variant == 'xxh3':
+        import xxhash
+        return xxhash.xxh3_64
+    elif variant == 'blake3':
+        import blake3
+        return blake3.blake3
+    return None
+
+
+class _checksum_verifier(object):
+    """
+    Calculates the checksum of a stream of blocks in a separate thread, so
+    the calculation overlaps with the reception and writing of the data, and
+    compares it against an expected value.
+    """
+
+    def __init__(self, variant, expected, max_pending=8):
+        self._hash_function = _hash_function(variant)
+        if self._hash_function:
+            self.expected = expected.strip().lower()
+            self._crc_function = None
+        else:
+            self.expected = int(expected) & 0xffffffff
+            self._crc_function = _crc_function(variant)
+        self.crc = None
+        self._blocks = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._calculate,
+                                        name='ChecksumVerifier')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def from_response(cls, resp):
+        checksum = _getheader(resp, NGAMS_HTTP_HDR_CHECKSUM)
+        variant = _getheader(resp, NGAMS_HTTP_HDR_CHECKSUM_VARIANT)
+        if checksum is None or variant is None:
+            logger.warning("Server didn't send checksum information, "
+                           "retrieved data will not be verified")
+            return None
+        return cls(variant, checksum)
+
+    def _calculate(self):
+        if self._hash_function:
+            h = self._hash_function()
+            for block in iter(self._blocks.get, None):
+                h.update(block)
+            self.crc = h.hexdigest()
+            return
+        crc, crc_function = 0, self._crc_function
+        for block in iter(self._blocks.get, None):
+            crc = crc_function(block, crc)
+        self.crc = crc & 0xffffffff
+
+    def update(self, block):
+        self._blocks.put(block)
+
+    def finish(self):
+        self._blocks.put(None)
+        self._thread.join()
+
+    def check(self, fname):
+        if self.crc != self.expected:
+            msg = "Checksum mismatch for retrieved file %s: expected %s, got %s"
+            raise Exception(msg % (fname, self.expected, self.crc))
+
+
+def _read_lines(resp, block_size):
+    """Yields the lines of the body of `resp`, reading it in blocks"""
+
+    pending = b''
+    for block in _read_blocks(resp, block_size):
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
 def setup_logging(opts):
 
     logging.root.addHandler(logging.NullHandler())
@@ -855,6 +1171,9 @@ def main():
     parser.add_argument(      '--host-id',       help='The Host ID')
     parser.add_argument(      '--p-plugin',      help='Processing plug-in to apply before retrieving data')
     parser.add_argument(      '--p-plugin-pars', help='Parameters for the processing plug-in, can be specified more than once', action='append')
+    parser.add_argument(      '--block-size',    help='Block size used to write retrieved data, in bytes', type=int, default=65536)
+    parser.add_argument(      '--verify-checksum', help='Verify the checksum of the retrieved data', action='store_true')
+    parser.add_argument(      '--streams',       help='Number of concurrent streams used to retrieve data', type=int, default=1)
 
     sparser = parser.add_argument_group('Subscription options')
     sparser.add_argument('-u', '--url',           help='URL to subscribe/unsubscribe')
@@ -951,7 +1270,10 @@ def main():
     elif (cmd == NGAMS_RETRIEVE_CMD):
         stat = client.retrieve(opts.file_id, opts.file_version, pars=pars,
                                targetFile=opts.output, processing=opts.p_plugin,
-                               processingPars=opts.p_plugin_pars)
+                               processingPars=opts.p_plugin_pars,
+                               block_size=opts.block_size,
+                               verify_checksum=opts.verify_checksum,
+                               n_streams=opts.streams)
     elif (cmd == NGAMS_STATUS_CMD):
         stat = client.status(pars, opts.output)
     elif (cmd == NGAMS_SUBSCRIBE_CMD):
@@ -104,7 +104,7 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
 
     if start_byte != 0 and download_resume_supported:
         logger.info("Resume requested and mirroring source supports resume. Appending data to previous staging file")
-        crc = ngamsFileUtils.get_checksum(65536, target_filename, crc_variant)
+        crc = ngamsFileUtils.get_checksum(65536, target_filename, crc_variant, final=False)
         request_properties.setBytesReceived(start_byte)
         fd_out = open(target_filename, "ab")
     else:
@@ -179,9 +179,9 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
         raise ngamsFailedDownloadException.FailedDownloadException(msg)
 
     # Now check the freshly calculated CRC value against the stored CRC value
-    logger.info('Source checksum: %s - received checksum: %d', checksum, crc)
+    logger.info('Source checksum: %s - received checksum: %s', checksum, crc)
     if not crc_info.equals(checksum, crc):
-        msg = "checksum mismatch: source={:s}, received={:d}".format(checksum, crc)
+        msg = "checksum mismatch: source={}, received={}".format(checksum, crc)
         raise ngamsFailedDownloadException.FailedDownloadException(msg)
 
     return archiving_results(read_total_bytes, read_duration, write_duration, crc_duration, fetch_duration,
@@ -123,9 +123,9 @@ def save_to_file(ngams_server, request_properties, target_filename):
     crc = ngamsFileUtils.get_checksum(65536, target_filename, crc_variant)
     crc_duration = time.time() - crc_start_time
     logger.info("CRC computed in %f [s]", crc_duration)
-    logger.info('Cource checksum: %s - current checksum: %d', checksum, crc)
-    if crc != int(checksum):
-        msg = "Checksum mismatch: source={:s}, received={:d}".format(checksum, crc)
+    logger.info('Cource checksum: %s - current checksum: %s', checksum, crc)
+    if not ngamsFileUtils.get_checksum_info(crc_variant).equals(checksum, crc):
+        msg = "Checksum mismatch: source={:s}, received={!s}".format(checksum, crc)
         raise ngamsFailedDownloadException.FailedDownloadException(msg)
 
     # We half the total time for reading and writing because we do not have enough data for an accurate measurement
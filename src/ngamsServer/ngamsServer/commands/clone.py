@@ -203,7 +203,7 @@ def cloneCheckDiskSpace(srvObj,
                               findTargetDisk(srvObj.getHostId(),
                                              srvObj.getDb(), srvObj.getCfg(),
                                              fio.getFormat(), 0,
-                                             diskExemptList, 1)
+                                             diskExemptList)
             except Exception as e:
                 if (str(e).find("NGAMS_AL_NO_STO_SETS") != -1):
                     # No more candidate Target Disks for this type
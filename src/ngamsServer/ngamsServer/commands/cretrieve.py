@@ -23,11 +23,13 @@
 Function + code to handle the CRETRIEVE Command.
 """
 
+import collections
 import contextlib
 import functools
 import logging
 import os
 import tarfile
+from multiprocessing.pool import ThreadPool
 
 from ngamsLib.ngamsCore import genLog, getFileSize
 from ngamsLib.ngamsCore import NGAMS_CONT_MT
@@ -39,6 +41,12 @@ from .. import ngamsSrvUtils, ngamsFileUtils, containers
 
 logger = logging.getLogger(__name__)
 
+# Amount of data of each remote container member read in advance
+_PREFETCH_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Block size used to copy remote container members
+_COPY_BLOCK_SIZE = 65536
+
 def fopener(fname):
     return functools.partial(open, fname, 'rb')
 
@@ -48,14 +56,23 @@ def http_opener(host, port, file_id, file_version, srvObj):
     return functools.partial(ngamsHttpUtils.httpGet, host, port,
                              NGAMS_RETRIEVE_CMD, pars=pars, timeout=30, auth=authHdr)
 
-def finfo_from_database(fileInfo, srvObj, reqPropsObj):
+def finfo_from_database(fileInfo, srvObj, reqPropsObj, locations=None):
 
     fileId = fileInfo.getFileId()
     fileVer = fileInfo.getFileVersion()
 
-    # Locate the file best suiting the query and send it back if possible.
-    location, _, ipAddress, port, mountPoint, filename, fileVersion, mimeType = \
-       ngamsFileUtils.quickFileLocate(srvObj, reqPropsObj, fileId, fileVersion=fileVer)
+    # Use the bulk-loaded locations if available (preferring local copies),
+    # otherwise locate the file best suiting the query.
+    size = None
+    copies = locations.get((fileId, fileVer)) if locations else None
+    if copies:
+        hostId = srvObj.getHostId()
+        copy = next((c for c in copies if c[0] == hostId), copies[0])
+        location = NGAMS_HOST_LOCAL if copy[0] == hostId else NGAMS_HOST_CLUSTER
+        _, ipAddress, port, mountPoint, filename, fileVersion, mimeType, size = copy
+    else:
+        location, _, ipAddress, port, mountPoint, filename, fileVersion, mimeType = \
+           ngamsFileUtils.quickFileLocate(srvObj, reqPropsObj, fileId, fileVersion=fileVer)
 
     basename = os.path.basename(filename)
 
@@ -65,16 +82,26 @@ def finfo_from_database(fileInfo, srvObj, reqPropsObj):
         opener = fopener(absname)
     elif location == NGAMS_HOST_CLUSTER or location == NGAMS_HOST_REMOTE:
         # TODO: int in python2 guarantees at least 32 bits, so we may overflow here
-        size = int(srvObj.getDb().getFileSize(fileId, fileVersion))
+        if size is None:
+            size = srvObj.getDb().getFileSize(fileId, fileVersion)
+        size = int(size)
         opener = http_opener(ipAddress, port, fileId, fileVersion, srvObj)
     else:
         raise Exception("Unknown location type: %s" % (location,))
 
     return ngamsMIMEMultipart.file_info(mimeType, basename, size, opener)
 
-def cinfo_from_database(cont, srvObj, reqPropsObj):
-    finfos = [cinfo_from_database(c, srvObj, reqPropsObj) for c in cont.getContainers()] + \
-             [finfo_from_database(f, srvObj, reqPropsObj) for f in cont.getFilesInfo()]
+def _container_ids(cont, ids):
+    ids.append(cont.getContainerId())
+    for c in cont.getContainers():
+        _container_ids(c, ids)
+    return ids
+
+def cinfo_from_database(cont, srvObj, reqPropsObj, locations=None):
+    if locations is None:
+        locations = srvObj.getDb().getContainerFileLocations(_container_ids(cont, []))
+    finfos = [cinfo_from_database(c, srvObj, reqPropsObj, locations) for c in cont.getContainers()] + \
+             [finfo_from_database(f, srvObj, reqPropsObj, locations) for f in cont.getFilesInfo()]
     return ngamsMIMEMultipart.container_info(cont.getContainerName(), finfos)
 
 def round_up(size, mul):
@@ -97,20 +124,117 @@ def _tarsize_cinfo(cinfo):
             size += round_up(finfo.size, 512)
     return size
 
-def send_toplevel_cinfo(cinfo, http_ref):
+def _is_remote(finfo):
+    return finfo.opener.func == ngamsHttpUtils.httpGet
+
+def _members(cinfo):
+    """Yields the files of a container in the order they are tarballed"""
+    for finfo in cinfo.files:
+        if isinstance(finfo, ngamsMIMEMultipart.container_info):
+            for f in _members(finfo):
+                yield f
+        else:
+            yield finfo
+
+def _prefetch(finfo):
+    """Opens a remote member and reads the first bytes of its contents"""
+    fobj = finfo.opener()
+    try:
+        data = []
+        remaining = min(finfo.size, _PREFETCH_BUFFER_SIZE)
+        while remaining:
+            buf = fobj.read(remaining)
+            if not buf:
+                break
+            data.append(buf)
+            remaining -= len(buf)
+        return fobj, b''.join(data)
+    except:
+        fobj.close()
+        raise
+
+class _Prefetcher(object):
+    """
+    Opens the remote members of a container in advance, following the order
+    in which they are sent, so the latency of each request to other servers
+    is overlapped with the sending of the previous members. At most ``depth``
+    members are prefetched at any given time. The threads are started only
+    if the container has remote members.
+    """
+
+    def __init__(self, cinfo, depth):
+        self._remote = (f for f in _members(cinfo) if _is_remote(f))
+        self._pending = collections.deque()
+        self._depth = depth
+        self._pool = None
+        for _ in range(depth):
+            self._submit()
+
+    def _submit(self):
+        finfo = next(self._remote, None)
+        if finfo is None:
+            return
+        if self._pool is None:
+            self._pool = ThreadPool(self._depth)
+        self._pending.append((finfo, self._pool.apply_async(_prefetch, (finfo,))))
+
+    def get(self, finfo):
+        """Returns the opened response and the prefetched data of ``finfo``"""
+        prefetched, result = self._pending.popleft()
+        if prefetched is not finfo:
+            raise Exception("Remote container members requested out of order")
+        self._submit()
+        return result.get()
+
+    def close(self):
+        if self._pool is None:
+            return
+        self._pool.close()
+        for _, result in self._pending:
+            try:
+                fobj, _ = result.get()
+                fobj.close()
+            except Exception:
+                logger.exception("Error while prefetching a container member")
+        self._pool.join()
+
+def send_toplevel_cinfo(cinfo, http_ref, prefetch=0):
     tinfo = tarfile.TarInfo(name=cinfo.name)
     tinfo.type = tarfile.DIRTYPE
     tinfo.mode = 0o755
     http_ref.write_data(tinfo.tobuf())
-    _send_cinfo(cinfo, http_ref, cinfo.name + '/')
+    prefetcher = _Prefetcher(cinfo, prefetch) if prefetch > 0 else None
+    try:
+        _send_cinfo(cinfo, http_ref, cinfo.name + '/', prefetcher)
+    finally:
+        if prefetcher:
+            prefetcher.close()
     http_ref.write_data(b'\x00' * 1024)
 
-def _send_finfo(finfo, http_ref):
+def _send_remote_finfo(finfo, http_ref, prefetcher):
+    """Send a file from another server, exactly as big as announced"""
+
+    if prefetcher:
+        fobj, data = prefetcher.get(finfo)
+    else:
+        fobj, data = finfo.opener(), b''
+
+    with contextlib.closing(fobj):
+        http_ref.write_data(data)
+        remaining = finfo.size - len(data)
+        while remaining > 0:
+            buf = fobj.read(min(remaining, _COPY_BLOCK_SIZE))
+            if not buf:
+                raise Exception("%s ended after %d bytes, expected %d" %
+                                (finfo.name, finfo.size - remaining, finfo.size))
+            http_ref.write_data(buf)
+            remaining -= len(buf)
+
+def _send_finfo(finfo, http_ref, prefetcher=None):
     """Send a file through for tarballing"""
 
-    if finfo.opener.func == ngamsHttpUtils.httpGet:
-        with contextlib.closing(finfo.opener()) as fobj:
-            http_ref.write_data(fobj)
+    if _is_remote(finfo):
+        _send_remote_finfo(finfo, http_ref, prefetcher)
     else:
         absfname = finfo.opener.args[0]
         http_ref.write_file_data(absfname, finfo.size)
@@ -119,7 +243,7 @@ def _send_finfo(finfo, http_ref):
     http_ref.write_data(padding)
 
 
-def _send_cinfo(cinfo, http_ref, dirname=''):
+def _send_cinfo(cinfo, http_ref, dirname='', prefetcher=None):
     """recursively send containers' files through http connection"""
     for finfo in cinfo.files:
         arcname = dirname + finfo.name
@@ -128,13 +252,13 @@ def _send_cinfo(cinfo, http_ref, dirname=''):
             tinfo.type = tarfile.DIRTYPE
             tinfo.mode = 0o755
             http_ref.write_data(tinfo.tobuf())
-            _send_cinfo(finfo, http_ref, arcname + '/')
+            _send_cinfo(finfo, http_ref, arcname + '/', prefetcher)
         else:
             tinfo.type = tarfile.REGTYPE
             tinfo.mode = 0o644
             tinfo.size = finfo.size
             http_ref.write_data(tinfo.tobuf())
-            _send_finfo(finfo, http_ref)
+            _send_finfo(finfo, http_ref, prefetcher)
 
 def _handleCmdCRetrieve(srvObj,
                        reqPropsObj,
@@ -170,14 +294,14 @@ def _handleCmdCRetrieve(srvObj,
     container_id = containers.get_container_id(reqPropsObj, srvObj.db)
     logger.debug("Handling request for file with containerId: %s", container_id)
 
-    # Build the container hierarchy and get all file references
+    # Build the container hierarchy and get all file references and locations
     container = srvObj.getDb().readHierarchy(container_id, True)
     cinfo = cinfo_from_database(container, srvObj, reqPropsObj)
 
     # Send all the data back, either as a multipart message or as a tarball
     if return_tar:
         httpRef.send_file_headers(cinfo.name, 'application/x-tar', tarsize_cinfo(cinfo))
-        send_toplevel_cinfo(cinfo, httpRef)
+        send_toplevel_cinfo(cinfo, httpRef, srvObj.getCfg().getContainerPrefetch())
     else:
         reader = ngamsMIMEMultipart.ContainerReader(cinfo)
         httpRef.send_data(reader, NGAMS_CONT_MT)
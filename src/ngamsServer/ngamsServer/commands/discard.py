@@ -55,6 +55,7 @@ import os
 from ngamsLib.ngamsCore import getHostName, genLog, rmFile, \
     NGAMS_DISCARD_CMD, NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, NGAMS_FAILURE
 from ngamsLib import ngamsLib
+from .. import ngamsFileUtils
 
 
 _help = """
@@ -161,6 +162,7 @@ def _discardFile(srvObj,
         _delFile(srvObj, filename, hostId, execute)
         if (execute):
             srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskId, fileId, fileVersion)
+            ngamsFileUtils.invalidate_file_location(fileId)
             msg = genLog("NGAMS_INFO_DISCARD_OK",
                          ["Disk ID: %s/File ID: %s/File Version: %s" %\
                           (str(diskId), str(fileId), str(fileVersion)),
@@ -31,9 +31,12 @@
 Dynamic loadable command to query the DB associated with the NG/AMS instance.
 """
 
+import collections
+import csv
 import decimal
 import io
 import json
+import itertools
 import logging
 import os
 
@@ -51,6 +54,13 @@ CURSOR_IDX           = "__CURSOR_IDX__"
 NGAMS_PYTHON_LIST_MT = "application/python-list"
 NGAMS_PYTHON_PICKLE_MT = "application/python-pickle"
 NGAMS_JSON_MT = "application/json"
+NGAMS_JSONL_MT = "application/x-ndjson"
+NGAMS_CSV_MT = "text/csv"
+
+# Number of rows fetched from the database at a time, and approximate size of
+# the data chunks sent to the client, when streaming results
+_FETCH_SIZE = 1000
+_STREAM_CHUNK_SIZE = 65536
 
 # Dirty trick to get the simple columnnames from these tables
 class columns(object):
@@ -148,6 +158,62 @@ def formatAsList(resultSet, colnames):
     return buf.getvalue()
 
 
+def _jsonl_formatter(colnames):
+    """Returns a function formatting a row as a JSON document on its own line"""
+    def formatter(row):
+        obj = collections.OrderedDict(zip(colnames, row))
+        return json.dumps(obj, default=encode_decimal) + '\n'
+    return formatter
+
+
+def _csv_formatter(colnames):
+    """Returns a function formatting a row as a line of CSV"""
+    buf = six.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    def formatter(row):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        return buf.getvalue()
+    return formatter
+
+
+# Output formats whose results are streamed to the client
+# format: (MIME type, formatter factory, whether a header with column names is written)
+streaming_formats = {
+    'jsonl': (NGAMS_JSONL_MT, _jsonl_formatter, False),
+    'csv': (NGAMS_CSV_MT, _csv_formatter, True),
+}
+
+
+def streamResults(rows, colnames, out_format, chunk_size=_STREAM_CHUNK_SIZE):
+    """
+    Formats the rows yielded by ``rows`` using one of the streaming output
+    formats, yielding chunks of around ``chunk_size`` bytes to be sent to the
+    client. Only one chunk is held in memory at any given time.
+    """
+
+    _, formatter, with_header = streaming_formats[out_format]
+    fmt = formatter(colnames)
+    if with_header:
+        rows = itertools.chain([colnames], rows)
+
+    lines = []
+    size = 0
+    for row in rows:
+        line = fmt(row)
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b''.join(lines)
+
+
 def genCursorDbmName(rootDir,
                      cursorId):
     """
@@ -216,29 +282,29 @@ def handleCmd(srvObj,
         if param1 and param2:
             args = (param1, param2)
         elif param1:
-            sql = queries['files_greater']
+            colnames, sql = queries['files_greater']
             args = (param1,)
         else:
-            sql = queries['files_list']
+            colnames, sql = queries['files_list']
 
     # Execute the query.
-    if not cursorId:
+    if not cursorId and out_format in streaming_formats:
+
+        # Rows are read from a database cursor and sent to the client as they
+        # come, so the full result set is never held in memory
+        mimeType = streaming_formats[out_format][0]
+        with srvObj.db.dbCursor(sql, args=args) as cursor:
+            chunks = streamResults(cursor.fetch(_FETCH_SIZE), colnames, out_format)
+            size = httpRef.send_chunked_data(chunks, mimeType)
+        logger.info("Streamed %d bytes of results for query: '%s' with args: %r", size, sql, args)
+        return
+
+    elif not cursorId:
 
         # TODO: Make possible to return an XML document
-        # TODO: Potential problem with very large result sets.
-        #       Implement streaming result directly3
-        # rtobar, 2018 Feb: for the streaming result functionality to work
-        #                   correctly we need to support sending content with
-        #                   chunked transfer encoding first. This is not
-        #                   difficult to add on the server side, but needs
-        #                   to be also added on the client side (which I suppose
-        #                   means all languages, not only python, if we really
-        #                   need to maintain those).
-        #                   We already support proper cursors at the database
-        #                   access level, so it's not difficult to change
-        #                   the query below to use a cursor and work as a
-        #                   generator instead of returning the full list of
-        #                   results in one go.
+        # Results for the formats below are fully loaded into memory before
+        # they are sent; for large result sets use one of the streaming
+        # formats instead
         res = list(srvObj.db.query2(sql, args=args))
         logger.info("Retrieved %d results for query: '%s' with args: %r", len(res), sql, args)
         if out_format in ("list", 'text'):
@@ -31,10 +31,13 @@
 Contains functions for handling the REGISTER command.
 """
 
+import collections
+import itertools
 import logging
 import os
 import threading
 import time
+from multiprocessing.pool import ThreadPool
 
 import six
 
@@ -44,14 +47,354 @@ from ngamsLib.ngamsCore import rmFile, NGAMS_HTTP_GET, \
     NGAMS_NOTIF_INFO, NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, \
     NGAMS_VOLUME_INFO_FILE, NGAMS_REGISTER_THR, \
     NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, \
-    NGAMS_BUSY_SUBSTATE, loadPlugInEntryPoint, toiso8601
-from ngamsLib import ngamsDbm, ngamsReqProps, ngamsFileInfo, ngamsDbCore, \
-    ngamsHighLevelLib, ngamsDiskUtils, ngamsLib, ngamsFileList, \
-    ngamsNotification, ngamsDiskInfo, ngamsPlugInApi, ngamsCore
-from .. import ngamsArchiveUtils, ngamsCacheControlThread, ngamsFileUtils
+    NGAMS_BUSY_SUBSTATE, NGAMS_FAILURE, loadPlugInEntryPoint, toiso8601
+from ngamsLib import ngamsDbm, ngamsReqProps, ngamsFileInfo, \
+    ngamsHighLevelLib, ngamsLib, ngamsFileList, \
+    ngamsNotification, ngamsDiskInfo, ngamsPlugInApi
+from .. import ngamsCacheControlThread, ngamsFileUtils
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of files registered in the NGAS DB in a single transaction
+_REGISTER_BATCH_SIZE = 1000
+
+
+def _regPlugIn(srvObj, mimeType):
+    try:
+        return srvObj.cfg.register_plugins[mimeType]
+    except KeyError:
+        raise ValueError("No registration plug-in defined for mime-type '%s'" % (mimeType,))
+
+
+def _runRegPlugIn(srvObj, regPi, filename, diskInfo, mimeType):
+    """
+    Runs the Registration Plug-In on a file.
+
+    Returns:    Status returned by the plug-in (ngamsDapiStatus).
+    """
+    logger.debug("Plugin found for %s: %s", mimeType, regPi)
+    params = ngamsPlugInApi.parseRawPlugInPars(regPi.pars)
+    tmpReqPropsObj = ngamsReqProps.ngamsReqProps().\
+                     setMimeType(mimeType).\
+                     setStagingFilename(filename).\
+                     setTargDiskInfo(diskInfo).\
+                     setHttpMethod(NGAMS_HTTP_GET).\
+                     setCmd(NGAMS_REGISTER_CMD).\
+                     setSize(os.path.getsize(filename)).\
+                     setFileUri(filename).\
+                     setNoReplication(1)
+
+    # Invoke Registration Plug-In.
+    plugInMethod = loadPlugInEntryPoint(regPi.name)
+    piRes = plugInMethod(srvObj, tmpReqPropsObj, params)
+    if piRes.getStatus() == NGAMS_FAILURE:
+        raise Exception("Registration Plug-In %s failed" % (regPi.name,))
+    return piRes
+
+
+def _registerFile(srvObj, regPi, filename, diskInfo, mimeType, crc_variant):
+    """
+    Runs the Registration Plug-In on a file and calculates its checksum. This
+    is run by the worker threads of the disk hosting the file.
+
+    Returns:    Tuple with the status returned by the plug-in
+                (ngamsDapiStatus), the checksum of the file (string) and the
+                time it took to handle the file (float).
+    """
+    reg_start = time.time()
+    piRes = _runRegPlugIn(srvObj, regPi, filename, diskInfo, mimeType)
+    checksum = ngamsFileUtils.get_checksum(65536, filename, crc_variant) or ''
+    return piRes, checksum, time.time() - reg_start
+
+
+def _moveFile(filename, piRes, checksum, crc_variant):
+    """
+    Moves a file to the location given by the Registration Plug-In.
+
+    Returns:    Information about the file to be written in the NGAS DB
+                (ngamsFileInfo).
+    """
+    mvFile(filename, piRes.getCompleteFilename())
+    return ngamsFileInfo.ngamsFileInfo().\
+           setDiskId(piRes.getDiskId()).\
+           setFilename(piRes.getRelFilename()).\
+           setFileId(piRes.getFileId()).\
+           setFileVersion(piRes.getFileVersion()).\
+           setFormat(piRes.getFormat()).\
+           setFileSize(piRes.getFileSize()).\
+           setUncompressedFileSize(piRes.getUncomprSize()).\
+           setCompression(piRes.getCompression()).\
+           setIngestionDate(time.time()).\
+           setChecksum(checksum).setChecksumPlugIn(crc_variant).\
+           setFileStatus(NGAMS_FILE_STATUS_OK).\
+           setCreationDate(getFileCreationTime(piRes.getCompleteFilename())).\
+           setIoTime(piRes.getIoTime()).\
+           setIgnore(0)
+
+
+class _Registration(object):
+    """
+    Keeps track of the files handled by a REGISTER command, and registers
+    them in the NGAS DB in batches.
+    """
+
+    def __init__(self, srvObj, reqPropsObj, regDbm):
+        self.srvObj = srvObj
+        self.reqPropsObj = reqPropsObj
+        self.regDbm = regDbm
+        self.fileCount = 0
+        self.fileRegCount = 0
+        self.fileFailCount = 0
+        self.fileRejectCount = 0
+        self.regTimeAccu = 0.0
+        self.batch = []
+        self.newEntries = {}
+
+    def _handled(self, regTime, tmpFileObj):
+
+        # Add the file information in the registration report.
+        if self.regDbm is not None:
+            self.regDbm.addIncKey(tmpFileObj)
+
+        # Update request status time information.
+        self.regTimeAccu += regTime
+        if self.reqPropsObj:
+            self.reqPropsObj.incActualCount(1)
+            ngamsHighLevelLib.stdReqTimeStatUpdate(self.srvObj, self.reqPropsObj,
+                                                   self.regTimeAccu)
+        self.fileCount += 1
+
+    def rejected(self, filename, diskId, regTime):
+        self.fileRejectCount += 1
+        tmpMsg = "REJECTED: File with path: %s is already registered on " +\
+                 "disk with Disk ID: %s"
+        tmpMsg = tmpMsg % (filename, diskId)
+        logger.warning(tmpMsg + ". File is not registered again.")
+        tmpFileObj = ngamsFileInfo.ngamsFileInfo().\
+                     setDiskId(diskId).setFilename(filename).setTag(tmpMsg)
+        self._handled(regTime, tmpFileObj)
+
+    def failed(self, filename, diskId, error, regTime):
+        errMsg = genLog("NGAMS_ER_FILE_REG_FAILED", [filename, str(error)])
+        logger.error(errMsg)
+        self.fileFailCount += 1
+        tmpFileObj = ngamsFileInfo.ngamsFileInfo().\
+                     setDiskId(diskId).setFilename(filename).setTag(errMsg)
+        # TODO (rtobar, 2016-01): Why don't we raise an exception here?
+        #      Otherwise the command appears as successful on the
+        #      client-side
+        self._handled(regTime, tmpFileObj)
+
+    def _registered(self, filename, diskId, piRes, fileInfo, regTime):
+        srvObj = self.srvObj
+
+        # If there was a previous version of this file, and it had a container
+        # associated with it, associate the new version with the container too
+        fileId, fileVersion = fileInfo.getFileId(), fileInfo.getFileVersion()
+        if fileVersion > 1:
+            prevInfo = ngamsFileInfo.ngamsFileInfo()
+            try:
+                prevInfo.read(srvObj.getHostId(), srvObj.getDb(), fileId,
+                              fileVersion=(fileVersion - 1))
+            except Exception:
+                logger.debug("No previous version found for file %s/%d",
+                             fileId, fileVersion)
+            else:
+                containerId = prevInfo.getContainerId()
+                if containerId:
+                    prevSize = prevInfo.getUncompressedFileSize()
+                    newSize = fileInfo.getUncompressedFileSize()
+                    srvObj.getDb().addFileToContainer(containerId, fileId, True)
+                    srvObj.getDb().addToContainerSize(containerId, (newSize - prevSize))
+
+        ngamsFileUtils.invalidate_file_location(fileId)
+        ngamsLib.makeFileReadOnly(piRes.getCompleteFilename())
+        self.fileRegCount += 1
+
+        # If running as a cache archive, update the Cache New Files DBM
+        # with the information about the new file.
+        if (srvObj.getCachingActive()):
+            ngamsCacheControlThread.addEntryNewFilesDbm(srvObj, diskId,
+                                                        fileInfo.getFileId(),
+                                                        fileInfo.getFileVersion(),
+                                                        filename)
+
+        # Generate a confirmation log entry.
+        msg = genLog("NGAMS_INFO_FILE_REGISTERED",
+                     [filename, fileInfo.getFileId(), fileInfo.getFileVersion(),
+                      fileInfo.getFormat()])
+        msg = msg + ". Time: %.3fs." % (regTime)
+        logger.info(msg, extra={'to_syslog': 1})
+
+        tmpFileObj = ngamsFileInfo.ngamsFileInfo().\
+                     setDiskId(diskId).\
+                     setFilename(filename).\
+                     setFileId(fileInfo.getFileId()).\
+                     setFileVersion(fileInfo.getFileVersion()).\
+                     setFormat(fileInfo.getFormat()).\
+                     setFileSize(fileInfo.getFileSize()).\
+                     setUncompressedFileSize(fileInfo.getUncompressedFileSize()).\
+                     setCompression(fileInfo.getCompression()).\
+                     setIngestionDate(fileInfo.getIngestionDate()).\
+                     setIgnore(0).\
+                     setChecksum(fileInfo.getChecksum()).\
+                     setChecksumPlugIn(fileInfo.getChecksumPlugIn()).\
+                     setFileStatus(NGAMS_FILE_STATUS_OK).\
+                     setCreationDate(fileInfo.getCreationDate()).\
+                     setTag("REGISTERED")
+        self._handled(regTime, tmpFileObj)
+
+    def add(self, filename, diskId, piRes, fileInfo, regTime):
+        self.batch.append((filename, diskId, piRes, fileInfo, regTime))
+        if len(self.batch) >= _REGISTER_BATCH_SIZE:
+            self.flush()
+
+    def _write(self, batch):
+        # Check that the files are really contained in their final location
+        ngamsFileUtils.syncCachesCheckFiles(self.srvObj,
+                                            [e[2].getCompleteFilename() for e in batch])
+        newEntries = self.srvObj.getDb().writeFileEntries(self.srvObj.getHostId(),
+                                                          [e[3] for e in batch])
+        for diskId, (nFiles, nBytes) in newEntries.items():
+            prevFiles, prevBytes = self.newEntries.get(diskId, (0, 0))
+            self.newEntries[diskId] = (prevFiles + nFiles, prevBytes + nBytes)
+
+    def flush(self):
+        """Registers the files of the current batch in the NGAS DB"""
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+
+        failed = []
+        try:
+            self._write(batch)
+        except Exception:
+            # Register the files one by one, so errors are reported
+            # only for the files causing them
+            logger.warning("Failed to register %d files in a single "
+                           "transaction, registering them separately",
+                           len(batch), exc_info=True)
+            written = []
+            for entry in batch:
+                try:
+                    self._write([entry])
+                    written.append(entry)
+                except Exception as e:
+                    failed.append((entry, e))
+            batch = written
+
+        for entry in batch:
+            self._registered(*entry)
+        for (filename, diskId, _, _, regTime), e in failed:
+            self.failed(filename, diskId, e, regTime)
+
+    def updateDisks(self):
+        """Updates the disks with the files registered so far in one go"""
+        for diskId, (nFiles, nBytes) in self.newEntries.items():
+            if nFiles:
+                self.srvObj.getDb().updateDiskFileStatus(diskId, nBytes, nFiles)
+        self.newEntries = {}
+
+
+def _registerDiskFiles(srvObj,
+                       registration,
+                       diskInfo,
+                       files,
+                       nThreads,
+                       crc_variant,
+                       path = None):
+    """
+    Register the files found on a disk.
+
+    The Registration Plug-In and the checksum calculation of each file are
+    carried out by a pool of worker threads, while the calling thread collects
+    their results in order, moves the files to their final location and
+    registers them in the NGAS DB in batches via the given _Registration
+    object.
+
+    files:        Iterable with (<Filename>, <Mime-Type>) tuples (iterable).
+
+    nThreads:     Number of worker threads (integer).
+
+    path:         Path under which the files were searched for. It narrows
+                  the query for files already registered on the disk
+                  (string|None).
+    """
+    diskId = diskInfo.getDiskId()
+    mtPt = diskInfo.getMountPoint()
+
+    # Find out which files are already registered on this disk with a single
+    # query, instead of checking each file separately.
+    prefix = ""
+    if path:
+        relPath = os.path.relpath(os.path.normpath(path), mtPt)
+        if relPath != os.curdir and not relPath.startswith(os.pardir):
+            prefix = relPath
+    registered = set(os.path.normpath(mtPt + "/" + f)
+                     for f in srvObj.getDb().getFilenames(diskId, prefix))
+    logger.debug("Found %d files already registered on disk %s under %s",
+                 len(registered), diskId, prefix or mtPt)
+
+    # The plug-in might have calculated the version of a file (and with it
+    # possibly its final name) before a previous file with the same ID was
+    # registered in the DB. We keep track of the versions of the last files,
+    # which are the only ones this can happen with, and run the plug-in again
+    # for those files once the previous ones are in the DB.
+    window = 4 * nThreads
+    recentVersions = collections.OrderedDict()
+    maxRecentVersions = window + _REGISTER_BATCH_SIZE
+
+    def handleResult():
+        filename, regPi, mimeType, result = pending.popleft()
+        try:
+            piRes, checksum, regTime = result.get()
+            if piRes.getFileVersion() <= recentVersions.get(piRes.getFileId(), 0):
+                registration.flush()
+                reg_start = time.time()
+                piRes = _runRegPlugIn(srvObj, regPi, filename, diskInfo, mimeType)
+                regTime += time.time() - reg_start
+            fileInfo = _moveFile(filename, piRes, checksum, crc_variant)
+        except Exception as e:
+            registration.failed(filename, diskId, e, 0)
+            return
+
+        fileId = fileInfo.getFileId()
+        recentVersions.pop(fileId, None)
+        recentVersions[fileId] = fileInfo.getFileVersion()
+        if len(recentVersions) > maxRecentVersions:
+            recentVersions.popitem(last=False)
+
+        registration.add(filename, diskId, piRes, fileInfo, regTime)
+
+    pending = collections.deque()
+    pool = ThreadPool(nThreads)
+    try:
+        for filename, mimeType in files:
+            reg_start = time.time()
+
+            # Check first, that exactly this file is not already registered.
+            # In case it is, the file will be rejected.
+            if filename in registered:
+                registration.rejected(filename, diskId, time.time() - reg_start)
+                continue
+
+            regPi = _regPlugIn(srvObj, mimeType)
+            args = (srvObj, regPi, filename, diskInfo, mimeType, crc_variant)
+            pending.append((filename, regPi, mimeType,
+                            pool.apply_async(_registerFile, args)))
+            while len(pending) > window:
+                handleResult()
+    finally:
+        # Files already being handled are registered even when aborting
+        try:
+            while pending:
+                handleResult()
+            registration.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+
 def _registerExec(srvObj,
                   fileListDbmName,
                   tmpFilePat,
@@ -135,187 +478,39 @@ def _registerExec(srvObj,
         regDbm = ngamsDbm.ngamsDbm(regDbmName, writePerm = 1)
 
     # Open the DBM containing the list of files to (possibly) register.
+    # Files were added in alphabetical order with incremental keys.
     fileListDbm = ngamsDbm.ngamsDbm(fileListDbmName, writePerm = 1)
+    files = (fileListDbm.get(str(i)) for i in range(1, fileListDbm.getCount() + 1))
 
-    # Want to parse files in alphabetical order.
-    # TODO: Portatibility issue. Try to avoid UNIX shell commands for sorting.
-    tmpFileList = tmpFilePat + "_FILE_LIST"
-    rmFile(tmpFileList)
-    with open(tmpFileList, "wb") as fo:
-        fileListDbm.initKeyPtr()
-        while (1):
-            dbmKey, fileInfo = fileListDbm.getNext()
-            if (not dbmKey): break
-            fo.write(dbmKey + b"\n")
-    sortFileList = tmpFilePat + "_SORT_FILE_LIST"
-    rmFile(sortFileList)
-    shellCmd = "sort %s > %s" % (tmpFileList, sortFileList)
-    stat, out, err = ngamsCore.execCmd(shellCmd)
-    if (stat != 0):
-        raise Exception("Error executing command: %s. Error: %s, %s" %\
-              (shellCmd, str(out), str(err)))
-    rmFile(tmpFileList)
-
-    # Go through each file in the list, check if the mime-type is among the
-    # ones, which apply for registration. If yes try to register the file
-    # by invoking the corresponding DAPI on the file.
-    fileRegCount    = 0
-    fileFailCount   = 0
-    fileRejectCount = 0
-    regTimeAccu     = 0.0
-    fileCount       = 0
-    fo = open(sortFileList)
-    run = 1
-    while (run):
-        reg_start = time.time()
-        dbmKey = fo.readline()
-        if (dbmKey.strip() == ""):
-            run = 0
-            continue
-        fileInfo    = fileListDbm.get(dbmKey[0:-1])
-        filename    = fileInfo[0]
-        diskId      = fileInfo[1]
-        mimeType    = fileInfo[2]
-
-        # Register the file. Check first, that exactly this file is
-        # not already registered. In case it is, the file will be rejected.
-        try:
-            regPi = srvObj.cfg.register_plugins[mimeType]
-        except KeyError:
-            raise ValueError("No registration plug-in defined for mime-type '%s'" % (mimeType,))
-        logger.debug("Plugin found for %s: %s", mimeType, regPi)
-        params = ngamsPlugInApi.parseRawPlugInPars(regPi.pars)
-        tmpReqPropsObj = ngamsReqProps.ngamsReqProps().\
-                         setMimeType(mimeType).\
-                         setStagingFilename(filename).\
-                         setTargDiskInfo(diskInfoDic[diskId]).\
-                         setHttpMethod(NGAMS_HTTP_GET).\
-                         setCmd(NGAMS_REGISTER_CMD).\
-                         setSize(os.path.getsize(filename)).\
-                         setFileUri(filename).\
-                         setNoReplication(1)
-
-        tmpFileObj = ngamsFileInfo.ngamsFileInfo()
-        try:
-            # Invoke Registration Plug-In.
-            piName = regPi.name
-            plugInMethod = loadPlugInEntryPoint(piName)
-            piRes = plugInMethod(srvObj, tmpReqPropsObj, params)
-            del tmpReqPropsObj
-
-            # Check if this file is already registered on this disk. In case
-            # yes, it is not registered again.
-            files = srvObj.db.getFileSummary1(srvObj.getHostId(), [piRes.getDiskId()],
-                                              [piRes.getFileId()])
-            fileRegistered = 0
-            for tmpFileInfo in files:
-                tmpMtPt = tmpFileInfo[ngamsDbCore.SUM1_MT_PT]
-                tmpFilename = tmpFileInfo[ngamsDbCore.SUM1_FILENAME]
-                tmpComplFilename = os.path.normpath(tmpMtPt + "/" +\
-                                                    tmpFilename)
-                if (tmpComplFilename == filename):
-                    fileRegistered = 1
-                    break
-
-            if (fileRegistered):
-                fileRejectCount += 1
-                tmpMsgForm = "REJECTED: File with File ID/Version: %s/%d " +\
-                             "and path: %s is already registered on disk " +\
-                             "with Disk ID: %s"
-                tmpMsg = tmpMsgForm % (piRes.getFileId(),
-                                       piRes.getFileVersion(), filename,
-                                       piRes.getDiskId())
-                logger.warning(tmpMsg + ". File is not registered again.")
-                if (emailNotif):
-                    tmpFileObj.\
-                                 setDiskId(diskId).setFilename(filename).\
-                                 setTag(tmpMsg)
-                    regDbm.addIncKey(tmpFileObj)
-                if (reqPropsObj):
-                    reqPropsObj.incActualCount(1)
-                    ngamsHighLevelLib.stdReqTimeStatUpdate(srvObj, reqPropsObj,
-                                                           regTimeAccu)
-                regTimeAccu += time.time() - reg_start
-                fileCount += 1
-                continue
-
-            # Calculate checksum. We maintain the old name for backwards
-            # compatibility
-            crc_variant = srvObj.cfg.getCRCVariant()
-            if crc_variant == ngamsFileUtils.CHECKSUM_CRC32_INCONSISTENT:
-                crc_variant = 'ngamsGenCrc32'
-            checksum = ngamsFileUtils.get_checksum(65536, filename, crc_variant) or ''
-
-            # Move file and update information about file in the NGAS DB.
-            mvFile(filename, piRes.getCompleteFilename())
-            ngamsArchiveUtils.updateFileInfoDb(srvObj, piRes, checksum,
-                                               crc_variant)
-            ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(), piRes)
-            ngamsLib.makeFileReadOnly(piRes.getCompleteFilename())
-
-            if (emailNotif):
-                uncomprSize = piRes.getUncomprSize()
-                ingestDate  = time.time()
-                creDateSecs = getFileCreationTime(filename)
-                tmpFileObj.\
-                             setDiskId(diskId).\
-                             setFilename(filename).\
-                             setFileId(piRes.getFileId()).\
-                             setFileVersion(piRes.getFileVersion()).\
-                             setFormat(piRes.getFormat()).\
-                             setFileSize(piRes.getFileSize()).\
-                             setUncompressedFileSize(uncomprSize).\
-                             setCompression(piRes.getCompression()).\
-                             setIngestionDate(ingestDate).\
-                             setIgnore(0).\
-                             setChecksum(checksum).\
-                             setChecksumPlugIn(crc_variant).\
-                             setFileStatus(NGAMS_FILE_STATUS_OK).\
-                             setCreationDate(creDateSecs).\
-                             setTag("REGISTERED")
-            fileRegCount += 1
-
-            # If running as a cache archive, update the Cache New Files DBM
-            # with the information about the new file.
-            if (srvObj.getCachingActive()):
-                fileVer = fio.getFileVersion()
-                ngamsCacheControlThread.addEntryNewFilesDbm(srvObj, diskId,
-                                                            piRes.getFileId(),
-                                                            fileVer, filename)
-
-            # Generate a confirmation log entry.
-            msg = genLog("NGAMS_INFO_FILE_REGISTERED",
-                         [filename, piRes.getFileId(), piRes.getFileVersion(),
-                          piRes.getFormat()])
-            time.sleep(0.005)
-            regTime = time.time() - reg_start
-            msg = msg + ". Time: %.3fs." % (regTime)
-            logger.info(msg, extra={'to_syslog': 1})
-        except Exception as e:
-            errMsg = genLog("NGAMS_ER_FILE_REG_FAILED", [filename, str(e)])
-            logger.error(errMsg)
-            if (emailNotif):
-                tmpFileObj.\
-                             setDiskId(diskId).setFilename(filename).\
-                             setTag(errMsg)
-            fileFailCount += 1
-            regTime = time.time() - reg_start
-            # TODO (rtobar, 2016-01): Why don't we raise an exception here?
-            #      Otherwise the command appears as successful on the
-            #      client-side
+    # Calculate checksum. We maintain the old name for backwards
+    # compatibility
+    crc_variant = srvObj.cfg.getCRCVariant()
+    if crc_variant == ngamsFileUtils.CHECKSUM_CRC32_INCONSISTENT:
+        crc_variant = 'ngamsGenCrc32'
 
-        # Add the file information in the registration report.
-        if (emailNotif): regDbm.addIncKey(tmpFileObj)
+    path = None
+    if reqPropsObj and reqPropsObj.hasHttpPar("path"):
+        path = reqPropsObj.getHttpPar("path")
 
-        # Update request status time information.
-        regTimeAccu += regTime
-        if (reqPropsObj):
-            reqPropsObj.incActualCount(1)
-            ngamsHighLevelLib.stdReqTimeStatUpdate(srvObj, reqPropsObj,
-                                                   regTimeAccu)
-        fileCount += 1
-    fo.close()
-    rmFile(sortFileList)
+    # Go through the files of each disk, check if the mime-type is among the
+    # ones, which apply for registration. If yes try to register the file
+    # by invoking the corresponding DAPI on the file.
+    registration = _Registration(srvObj, reqPropsObj,
+                                 regDbm if emailNotif else None)
+    nThreads = max(1, srvObj.getCfg().getRegisterThreads())
+    try:
+        for diskId, diskFiles in itertools.groupby(files, key=lambda f: f[1]):
+            _registerDiskFiles(srvObj, registration, diskInfoDic[diskId],
+                               ((f[0], f[2]) for f in diskFiles),
+                               nThreads, crc_variant, path)
+    finally:
+        registration.updateDisks()
+
+    fileCount       = registration.fileCount
+    fileRegCount    = registration.fileRegCount
+    fileFailCount   = registration.fileFailCount
+    fileRejectCount = registration.fileRejectCount
+    regTimeAccu     = registration.regTimeAccu
     if (emailNotif): regDbm.sync()
     del fileListDbm
     rmFile(fileListDbmName + "*")
@@ -556,7 +751,9 @@ def register(srvObj,
             foundVolume = True
             if os.path.isdir(searchPath):
                 for root, dirs, files in os.walk(searchPath):
-                    for nextFile in files:
+                    # Files are registered in alphabetical order
+                    dirs.sort()
+                    for nextFile in sorted(files):
                         if nextFile not in \
                         [NGAMS_DISK_INFO, \
                          NGAMS_VOLUME_ID_FILE, \
@@ -566,7 +763,8 @@ def register(srvObj,
                             tmpFileInfo = [os.path.join(root,nextFile),
                                             mtPt2DiskInfo[mtPt].getDiskId(),
                                             mimeType]
-                            fileListDbm.add(os.path.join(root,nextFile), tmpFileInfo)
+                            fileListDbm.addIncKey(tmpFileInfo)
+                            fileCount += 1
 
             elif os.path.isfile(searchPath):  # the path is actually pointing to a file
                 nextFile = os.path.basename(searchPath)
@@ -580,7 +778,8 @@ def register(srvObj,
                     tmpFileInfo = [os.path.join(root,nextFile),
                                     mtPt2DiskInfo[mtPt].getDiskId(),
                                     mimeType]
-                    fileListDbm.add(os.path.join(root,nextFile), tmpFileInfo)
+                    fileListDbm.addIncKey(tmpFileInfo)
+                    fileCount += 1
         if foundVolume: break
 
 
@@ -40,7 +40,7 @@ from ngamsLib import ngamsDiskInfo, ngamsDbm, ngamsDiskUtils, ngamsHighLevelLib
 from ngamsLib.ngamsCore import getHostName, \
     getDiskSpaceAvail, genLog, NGAMS_XML_MT, NGAMS_SUCCESS, rmFile, \
     NGAMS_REMDISK_CMD, NGAMS_HTTP_SUCCESS, NGAMS_HTTP_BAD_REQ
-from .. import ngamsRemUtils
+from .. import ngamsRemUtils, ngamsFileUtils
 
 
 logger = logging.getLogger(__name__)
@@ -117,6 +117,7 @@ def _remDisk(srvObj,
         try:
             tmpDir = os.path.dirname(tmpFilePat)
             srvObj.getDb().deleteDiskInfo(diskId, 1)
+            ngamsFileUtils.invalidate_file_location()
         except Exception as e:
             errMsg = genLog("NGAMS_ER_DEL_DISK_DB", [diskId, str(e)])
             raise Exception(errMsg)
@@ -40,7 +40,7 @@ from six.moves import filter
 from ngamsLib import ngamsDbm, ngamsDbCore, ngamsHighLevelLib
 from ngamsLib.ngamsCore import genLog, NGAMS_REMFILE_CMD, \
     rmFile, NGAMS_SUCCESS, NGAMS_XML_MT
-from .. import ngamsRemUtils
+from .. import ngamsRemUtils, ngamsFileUtils
 
 
 logger = logging.getLogger(__name__)
@@ -136,6 +136,7 @@ def _remFile(srvObj,
                 # for the number of available copies.
                 try:
                     srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskId, fileId, fileVer)
+                    ngamsFileUtils.invalidate_file_location(fileId)
                     infoMsg = genLog("NGAMS_INFO_DEL_FILE",
                                      [diskId, fileId, fileVer])
                     logger.debug(infoMsg)
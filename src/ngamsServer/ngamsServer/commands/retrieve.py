@@ -33,6 +33,7 @@ Function + code to handle the RETRIEVE Command.
 
 import logging
 import os
+import re
 import shutil
 import socket
 import time
@@ -42,8 +43,9 @@ from ngamsLib.ngamsCore import NGAMS_TEXT_MT, getFileSize, \
     genLog, NGAMS_PROC_FILE, NGAMS_HOST_LOCAL, \
     NGAMS_HOST_CLUSTER, NGAMS_HOST_REMOTE, \
     NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, \
-    NGAMS_BUSY_SUBSTATE, loadPlugInEntryPoint
-from .. import ngamsFileUtils
+    NGAMS_BUSY_SUBSTATE, loadPlugInEntryPoint, NGAMS_HTTP_HDR_CHECKSUM, \
+    NGAMS_HTTP_HDR_CHECKSUM_VARIANT
+from .. import ngamsCacheControlThread, ngamsFileUtils
 
 
 logger = logging.getLogger(__name__)
@@ -178,7 +180,7 @@ def inform_compression(httpRef, result, compression):
 def genReplyRetrieve(srvObj,
                      reqPropsObj,
                      httpRef,
-                     statusObj, compression):
+                     statusObj, compression, checksum=None):
     """
     Function to send back a reply with the result queried with the
     RETRIEVE command. After having send back the result, the
@@ -197,6 +199,10 @@ def genReplyRetrieve(srvObj,
                      ngamsCmdHandling.performProcessing()
                      (list/ngamsDppiStatus objects).
 
+    checksum:        Checksum value and variant name of the file being
+                     sent, if any. They are sent back to the client only
+                     if the file is sent as stored (tuple|None).
+
     Returns:         Void.
     """
 
@@ -206,15 +212,20 @@ def genReplyRetrieve(srvObj,
         resObj = statusObj.getResultObject(0)
 
         if resObj.getObjDataType() == NGAMS_PROC_FILE:
+            fname, hdrs = inform_compression(httpRef, resObj, compression)
+            if checksum and not hdrs:
+                hdrs[NGAMS_HTTP_HDR_CHECKSUM] = checksum[0]
+                hdrs[NGAMS_HTTP_HDR_CHECKSUM_VARIANT] = checksum[1]
+
             # See if client requested partial content
             # This applies (currently) to files only
-            start_byte = 0
-            if reqPropsObj.retrieve_offset > 0:
-                start_byte = reqPropsObj.retrieve_offset
-
-            fname, hdrs = inform_compression(httpRef, resObj, compression)
-            httpRef.send_file(resObj.getDataRef(), resObj.getMimeType(),
-                              start_byte=start_byte, fname=fname, hdrs=hdrs)
+            if reqPropsObj.retrieve_ranges:
+                httpRef.send_file_ranges(resObj.getDataRef(), resObj.getMimeType(),
+                                         reqPropsObj.retrieve_ranges,
+                                         fname=fname, hdrs=hdrs)
+            else:
+                httpRef.send_file(resObj.getDataRef(), resObj.getMimeType(),
+                                  fname=fname, hdrs=hdrs)
         else:
             httpRef.send_data(resObj.getDataRef(), resObj.getMimeType(), fname=resObj.getRefFilename())
 
@@ -222,6 +233,18 @@ def genReplyRetrieve(srvObj,
         cleanUpAfterProc(statusObj)
 
 
+def _get_checksum(srvObj, fileId, fileVersion, mountPoint, filename):
+    """Returns the checksum value and variant name of the given file, if known"""
+    value, variant = srvObj.db.getFileChecksumFromLocation(fileId, fileVersion,
+                                                           mountPoint, filename)
+    name = ngamsFileUtils.get_checksum_name(variant) if variant else None
+    if value is None or name is None:
+        logger.warning("No checksum information found for file %s/%d",
+                       fileId, fileVersion)
+        return None
+    return value, name
+
+
 def _handleCmdRetrieve(srvObj,
                        reqPropsObj,
                        httpRef):
@@ -278,6 +301,7 @@ def _handleCmdRetrieve(srvObj,
     # (and best?) suitable file which is online and located on a node in the
     # same domain as the contacted node.
     location, ipAddress, host, port = None, None, None, None
+    checksum = None
     if quickLocation:
         location, host, ipAddress, port, mountPoint, filename,\
         fileVersion, mimeType, compression =\
@@ -308,6 +332,10 @@ def _handleCmdRetrieve(srvObj,
     if host_address == "0.0.0.0" or not host_address:
         host_address = ngamsFileUtils.get_fqdn(location, host, domain)
 
+    # Keep track of the accesses to the cache when acting as a cache archive
+    ngamsCacheControlThread.recordCacheAccess(srvObj, fileId, fileVersion,
+                                              location == NGAMS_HOST_LOCAL)
+
     if location == NGAMS_HOST_LOCAL:
         # Get the file and send back the contents from this NGAS host.
         srcFilename = os.path.normpath("{0}/{1}".format(mountPoint, filename))
@@ -319,6 +347,11 @@ def _handleCmdRetrieve(srvObj,
         procResult, compression = performProcessing(srvObj, reqPropsObj, srcFilename,
                                                     mimeType, compression)
 
+        # Clients can ask for the checksum of the file so they can verify
+        # the data as it is received
+        if 'send_checksum' in reqPropsObj and 'processing' not in reqPropsObj:
+            checksum = _get_checksum(srvObj, fileId, fileVersion, mountPoint, filename)
+
     elif location == NGAMS_HOST_CLUSTER and srvObj.getCfg().getProxyMode():
         logger.info("NG/AMS Server acting as proxy - requesting file with ID: %s " +\
                      "from NG/AMS Server on host/port: %s/%s",
@@ -349,7 +382,37 @@ def _handleCmdRetrieve(srvObj,
         return
 
     # Send back reply with the result(s) queried and possibly processed.
-    genReplyRetrieve(srvObj, reqPropsObj, httpRef, procResult, compression)
+    genReplyRetrieve(srvObj, reqPropsObj, httpRef, procResult, compression,
+                     checksum=checksum)
+
+
+_range_spec_re = re.compile(r'^(\d*)-(\d*)$')
+def _parse_range_spec(spec):
+    match = _range_spec_re.match(spec.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = [int(x) if x else None for x in match.groups()]
+    if first is not None and last is not None and last < first:
+        return None
+    return first, last
+
+def _parse_range(range_hdr):
+    """
+    Parses a Range header of the form 'bytes=spec[,spec...]', where each spec
+    is either 'first-[last]' or '-suffix_length'. Returns a list with the
+    (first, last) inclusive byte positions of each requested range; the first
+    position is None for suffix ranges (in which case the last one is the
+    suffix length), and the last one is None for ranges extending to the end
+    of the file.
+    """
+    unit, _, specs = range_hdr.partition('=')
+    if unit.strip() == 'bytes':
+        ranges = [_parse_range_spec(spec) for spec in specs.split(',')]
+        if None not in ranges:
+            return ranges
+    raise ValueError("Invalid Range header, must have the form "
+                     "'bytes=first-[last]' or 'bytes=-suffix_length', "
+                     "optionally with multiple comma-separated ranges")
 
 
 def handleCmd(srvObj,
@@ -380,17 +443,12 @@ def handleCmd(srvObj,
         srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
         raise Exception(errMsg)
 
-    # See if client requested partial content and remember the starting offset
-    retrieve_offset = 0
+    # See if client requested partial content and remember the byte ranges
+    retrieve_ranges = None
     range_hdr = reqPropsObj.getHttpHdr('range')
     if range_hdr:
-        try:
-            retrieve_offset = int(range_hdr[6:-1])
-            if retrieve_offset < 0:
-                raise
-        except:
-            raise ValueError("Invalid Range header, must have the form 'bytes=start-' (start offset only)")
-    reqPropsObj.retrieve_offset = retrieve_offset
+        retrieve_ranges = _parse_range(range_hdr)
+    reqPropsObj.retrieve_ranges = retrieve_ranges
 
     _handleCmdRetrieve(srvObj, reqPropsObj, httpRef)
     srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
@@ -32,12 +32,15 @@ Function + code to handle the STATUS command.
 """
 import contextlib
 import glob
+import json
 import logging
 import os
 import pkg_resources
 import re
 import sys
 import types
+from xml.sax.saxutils import quoteattr
+import zlib
 
 import six
 
@@ -45,7 +48,7 @@ from ngamsLib.ngamsCore import NGAMS_HOST_LOCAL, NGAMS_HOST_REMOTE,\
     getHostName, genLog, genUniqueId, rmFile,\
     compressFile, NGAMS_GZIP_XML_MT, getNgamsVersion,\
     NGAMS_SUCCESS, NGAMS_XML_MT, fromiso8601, toiso8601
-from ngamsLib import ngamsDbm, ngamsStatus, ngamsDiskInfo, ngamsHttpUtils
+from ngamsLib import ngamsDbm, ngamsDbCore, ngamsStatus, ngamsDiskInfo, ngamsHttpUtils
 from ngamsLib import ngamsFileInfo, ngamsHighLevelLib
 from .. import ngamsFileUtils
 
@@ -397,6 +400,150 @@ def _handleFileListReply(srvObj,
         rmFile(fileListXmlDoc)
 
 
+STATUS_FILE_LIST_STREAM_TAG = "STATUS_FILE_LIST_%s_STREAM"
+
+def _fileListStreamState(srvObj, fileListId):
+    """
+    Returns the name of the file holding the state of a streamed
+    STATUS?file_list request, or None if the given File List ID does not
+    refer to a streamed request.
+    """
+    stateFile = os.path.join(ngamsHighLevelLib.getNgasTmpDir(srvObj.getCfg()),
+                             STATUS_FILE_LIST_STREAM_TAG % fileListId)
+    if os.path.exists(stateFile):
+        return stateFile
+    return None
+
+
+def _fileStatusXml(fileInfo):
+    """
+    Generates the FileStatus XML element for the given file information
+    row. This produces the same output as ngamsFileInfo.genXml(storeDiskId=1)
+    without going through a DOM.
+    """
+    fileInfoObj = ngamsFileInfo.ngamsFileInfo().unpackSqlResult(fileInfo)
+    attrs = ['%s=%s' % (name, quoteattr(str(val)))
+             for name, val in fileInfoObj.getObjStatus()]
+    return '\n<FileStatus %s/>' % ' '.join(attrs)
+
+
+def _handleFileListStream(srvObj,
+                          reqPropsObj,
+                          httpRef,
+                          fileListId,
+                          maxElements = None):
+    """
+    Handle a STATUS?file_list request in streaming mode. The file information
+    is read through a DB cursor sorted by File ID, File Version and Disk ID
+    and written into a gzip stream that is sent in chunks to the requestor,
+    without intermediate files. The position of the last file sent is kept
+    in a small state file in the NG/AMS temporary directory, so that further
+    pages can be requested with the file_list_id parameter.
+
+    srvObj:         Reference to NG/AMS server class object (ngamsServer).
+
+    reqPropsObj:    Request Property object to keep track of actions done
+                    during the request handling (ngamsReqProps).
+
+    httpRef:        Reference to the HTTP request handler object
+                    (ngamsHttpRequestHandler).
+
+    fileListId:     File List ID of a previous streamed request, or None
+                    for a new request (string).
+
+    maxElements:    Maximum number of elements to extract and return to the
+                    requestor (integer).
+
+    Returns:        Void.
+    """
+    newList = not fileListId
+    if not newList:
+        stateFile = _fileListStreamState(srvObj, fileListId)
+        if not stateFile:
+            msg = "Referenced File List ID: %s in connection with " +\
+                  "STATUS/file_list request, is not (or no longer) known"
+            raise Exception(msg % fileListId)
+        with open(stateFile) as f:
+            state = json.load(f)
+    else:
+        fileListId = genUniqueId()
+        stateFile = os.path.join(ngamsHighLevelLib.getNgasTmpDir(srvObj.getCfg()),
+                                 STATUS_FILE_LIST_STREAM_TAG % fileListId)
+        fromIngDate = None
+        if (reqPropsObj.hasHttpPar("from_ingestion_date")):
+            fromIngDate = reqPropsObj.getHttpPar("from_ingestion_date")
+        unique = False
+        if (reqPropsObj.hasHttpPar("unique")):
+            unique = bool(int(reqPropsObj.getHttpPar("unique")))
+        state = {'from_ingestion_date': fromIngDate, 'unique': unique,
+                 'after': None}
+
+    hostId = srvObj.getHostId()
+    fromIngDate = state['from_ingestion_date']
+    if fromIngDate:
+        fromIngDate = fromiso8601(fromIngDate)
+    unique = state['unique']
+    after = state['after']
+    if after and unique:
+        # All copies of the last file sent have been dealt with already
+        after = after[:2] + [None]
+
+    remainingObjects = 0
+    if maxElements:
+        total = srvObj.db.count_files_in_host(hostId, from_date=fromIngDate,
+                                              after=after, unique=unique)
+        remainingObjects = max(total - maxElements, 0)
+
+    def saveState(state):
+        if state is None:
+            rmFile(stateFile)
+            return
+        with open(stateFile, 'w') as f:
+            json.dump(state, f)
+
+    # The position of the last file sent is stored before the last chunk of
+    # data is sent, so it is in place when the requestor asks for the next
+    # elements. If sending the data fails the previous state is restored.
+    prevState = None if newList else state
+    def chunks():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        hdr = _fileListXmlHdr % (fileListId, str(remainingObjects))
+        yield compressor.compress(six.b(hdr))
+
+        buf = []
+        count = 0
+        last = None
+        for fileInfo in srvObj.db.sorted_files_in_host(hostId,
+                                                       from_date=fromIngDate,
+                                                       after=after):
+            key = [fileInfo[ngamsDbCore.NGAS_FILES_FILE_ID],
+                   fileInfo[ngamsDbCore.NGAS_FILES_FILE_VER],
+                   fileInfo[ngamsDbCore.NGAS_FILES_DISK_ID]]
+            if unique and last and last[:2] == key[:2]:
+                continue
+            if maxElements and count >= maxElements:
+                break
+            buf.append(_fileStatusXml(fileInfo))
+            last = key
+            count += 1
+            if len(buf) == 1000:
+                data = compressor.compress(six.b(''.join(buf)))
+                buf = []
+                if data:
+                    yield data
+
+        saveState(dict(state, after=last) if remainingObjects and last else None)
+        buf.append(_fileListXmlFooter)
+        yield compressor.compress(six.b(''.join(buf))) + compressor.flush()
+
+    try:
+        httpRef.send_chunked_data(chunks(), NGAMS_GZIP_XML_MT)
+    except Exception as e:
+        saveState(prevState)
+        msg = "Error returning response to STATUS?file_list request. Error: %s"
+        raise Exception(msg % str(e))
+
+
 def handleCmd(srvObj,
               reqPropsObj,
               httpRef):
@@ -432,6 +579,7 @@ def handleCmd(srvObj,
     requestId         = ""
     dbTime            = ""
     dbTimeReset       = ""
+    cacheStats        = ""
     fileList          = ""
     fileListId        = ""
     maxElements       = 100000
@@ -458,6 +606,8 @@ def handleCmd(srvObj,
     if (reqPropsObj.hasHttpPar("request_id")):
         requestId = reqPropsObj.getHttpPar("request_id")
 
+    if (reqPropsObj.hasHttpPar("cache_stats")):
+        cacheStats = True
     if (reqPropsObj.hasHttpPar("db_time")):
         dbTime = True
     if (reqPropsObj.hasHttpPar("db_time_reset")):
@@ -512,12 +662,20 @@ def handleCmd(srvObj,
                 raise Exception(errMsg)
             return
     elif (fileList):
-        if (not fileListId):
-            # It's a new STATUS?file_list request.
-            fileListId = _handleFileList(srvObj, reqPropsObj, httpRef)
-        # Send back data from the request.
-        _handleFileListReply(srvObj, reqPropsObj, httpRef, fileListId,
-                             maxElements)
+        stream = False
+        if (reqPropsObj.hasHttpPar("stream")):
+            stream = bool(int(reqPropsObj.getHttpPar("stream")))
+        if (stream and not fileListId) or \
+           (fileListId and _fileListStreamState(srvObj, fileListId)):
+            _handleFileListStream(srvObj, reqPropsObj, httpRef, fileListId,
+                                  maxElements)
+        else:
+            if (not fileListId):
+                # It's a new STATUS?file_list request.
+                fileListId = _handleFileList(srvObj, reqPropsObj, httpRef)
+            # Send back data from the request.
+            _handleFileListReply(srvObj, reqPropsObj, httpRef, fileListId,
+                                 maxElements)
     elif (diskId):
         diskObj = ngamsDiskInfo.ngamsDiskInfo()
         diskObj.read(srvObj.getDb(), diskId)
@@ -571,7 +729,17 @@ def handleCmd(srvObj,
                                fileVersion, diskId)
     elif (dbTime):
         logger.debug("Querying total DB time")
-        msg = "Total DB time: %.6fs" % srvObj.getDb().getDbTime()
+        hits, misses, size = srvObj.getDb().getQueryCacheStats()
+        host_hits, host_misses, host_size = ngamsHighLevelLib.getHostInfoCacheStats()
+        msg = ("Total DB time: %.6fs. SQL statement cache: %d hits, %d misses, %d statements. "
+               "Host information cache: %d hits, %d misses, %d hosts" %
+               (srvObj.getDb().getDbTime(), hits, misses, size,
+                host_hits, host_misses, host_size))
+    elif (cacheStats):
+        if not srvObj.getCachingActive():
+            msg = "Server is not operating as a cache archive"
+        else:
+            msg = "Cache usage: %s" % srvObj.getCacheAccessLog()
     elif (dbTimeReset):
         msg = "Resetting DB timer"
         logger.debug(msg)
@@ -24,7 +24,7 @@
 import logging
 import time
 
-from ngamsLib import ngamsNotification
+from ngamsLib import ngamsNotification, ngamsHighLevelLib
 from ngamsLib.ngamsCore import NGAMS_NOTIF_ERROR, loadPlugInEntryPoint
 
 
@@ -55,6 +55,7 @@ def run(srvObj, stopEvt):
 
     # Now, suspend this host.
     srvObj.getDb().markHostSuspended(hostId)
+    ngamsHighLevelLib.invalidate_host_info(hostId)
     suspPi = cfg.getSuspensionPlugIn()
     logger.debug("Invoking Suspension Plug-In: %s to " +\
          "suspend NG/AMS Server: %s", suspPi, hostId)
@@ -38,8 +38,10 @@ import logging
 import operator
 import os
 import random
+import threading
 import time
 
+from six.moves import queue as Queue # @UnresolvedImport
 from six.moves.urllib import parse as urlparse # @UnresolvedImport
 from six.moves.urllib import request as urlrequest # @UnresolvedImport
 from six.moves import cPickle # @UnresolvedImport
@@ -90,8 +92,7 @@ def _stream_target_volume(srvObj, mimeType, file_uri, size):
     try:
         return ngamsDiskUtils.findTargetDisk(srvObj.getHostId(),
                                              srvObj.getDb(), srvObj.getCfg(),
-                                             mimeType, 0, caching=0,
-                                             reqSpace=size)
+                                             mimeType, 0, reqSpace=size)
     except Exception as e:
         errMsg = str(e) + ". Attempting to archive file: %s" % file_uri
         ngamsNotification.notify(srvObj.getHostId(), srvObj.getCfg(), NGAMS_NOTIF_NO_DISKS,
@@ -115,60 +116,36 @@ archiving_results = collections.namedtuple('archiving_results',
 previous_file_info = collections.namedtuple('previous_file_info', 'disk_id size path')
 
 
-def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False):
+def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False,
+                     pipeline_depth=0):
     """
     Archives the contents read from `fin` (a file-like object with .read()
     support) and writes it to file `out_fname`, which is opened in write mode
     and truncated. While reading the data its checksum is calculated using the
     checksum method indicated by `crc_variant`.
 
+    If `pipeline_depth` is 2 or more the reading, writing and checksuming of
+    the data happen concurrently, with up to `pipeline_depth` blocks waiting
+    to be processed by each stage; otherwise they happen serially.
+
     This method returns an archiving_results tuple populated with all the
     corresponding fields.
     """
 
     # Get the CRC method to be used and initialize CRC value
     crc_info = None
-    crc_m = None
-    crc = None
     if not skip_crc:
         crc_info = ngamsFileUtils.get_checksum_info(crc_name)
-        if crc_info:
-            crc_m = crc_info.method
-            crc = crc_info.init
-
-    crctime = 0
-    rtime = 0
-    wtime = 0
-    readin = 0
 
     logger.debug("Saving data in file: %s", out_fname)
 
     start = time.time()
-    with open(out_fname, 'wb') as fout:
-        while readin < fsize:
-
-            left = fsize - readin
-
-            # Read
-            rstart = time.time()
-            buff = fin.read(block_size if left >= block_size else left)
-            rtime += time.time() - rstart
-            readin += len(buff)
-
-            if not buff:
-                raise eof_found("Only read %d out of %d bytes (%d bytes missing)"
-                                % (readin, fsize, fsize - readin))
-
-            # Write
-            wstart = time.time()
-            fout.write(buff)
-            wtime += time.time() - wstart
-
-            # CRC
-            if crc_m:
-                crcstart = time.time()
-                crc = crc_m(buff, crc)
-                crctime += time.time() - crcstart
+    if pipeline_depth >= 2:
+        readin, rtime, wtime, crctime, crc = _archive_contents_pipelined(
+            out_fname, fin, fsize, block_size, crc_info, pipeline_depth)
+    else:
+        readin, rtime, wtime, crctime, crc = _archive_contents_serial(
+            out_fname, fin, fsize, block_size, crc_info)
 
     if crc_info:
         crc = crc_info.final(crc)
@@ -212,6 +189,118 @@ def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False
     return archiving_results(readin, rtime, wtime, crctime, total_time, crc_name, crc)
 
 
+def _read_block(fin, readin, fsize, block_size):
+    left = fsize - readin
+    buff = fin.read(block_size if left >= block_size else left)
+    if not buff:
+        raise eof_found("Only read %d out of %d bytes (%d bytes missing)"
+                        % (readin, fsize, fsize - readin))
+    return buff
+
+def _archive_contents_serial(out_fname, fin, fsize, block_size, crc_info):
+    """Reads, writes and checksums each block of data, one after the other"""
+
+    crc_m = crc_info.method if crc_info else None
+    crc = crc_info.init if crc_info else None
+    crctime = 0
+    rtime = 0
+    wtime = 0
+    readin = 0
+
+    with open(out_fname, 'wb') as fout:
+        while readin < fsize:
+
+            # Read
+            rstart = time.time()
+            buff = _read_block(fin, readin, fsize, block_size)
+            rtime += time.time() - rstart
+            readin += len(buff)
+
+            # Write
+            wstart = time.time()
+            fout.write(buff)
+            wtime += time.time() - wstart
+
+            # CRC
+            if crc_m:
+                crcstart = time.time()
+                crc = crc_m(buff, crc)
+                crctime += time.time() - crcstart
+
+    return readin, rtime, wtime, crctime, crc
+
+class _pipeline_stage(threading.Thread):
+    """
+    A thread consuming blocks of data from a bounded queue. If an error occurs
+    the stage keeps draining its queue so the producer is never blocked.
+    """
+
+    def __init__(self, name, depth, process):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.queue = Queue.Queue(depth)
+        self.process = process
+        self.time = 0
+        self.error = None
+
+    def run(self):
+        while True:
+            buff = self.queue.get()
+            if buff is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                start = time.time()
+                self.process(buff)
+                self.time += time.time() - start
+            except Exception as e:
+                self.error = e
+
+def _archive_contents_pipelined(out_fname, fin, fsize, block_size, crc_info, depth):
+    """
+    Reads blocks of data in this thread while previous blocks are written and
+    checksumed concurrently in two other threads
+    """
+
+    crc = [crc_info.init if crc_info else None]
+    def update_crc(buff):
+        crc[0] = crc_info.method(buff, crc[0])
+
+    rtime = 0
+    readin = 0
+    with open(out_fname, 'wb') as fout:
+
+        stages = [_pipeline_stage('ArchiveWriter', depth, fout.write)]
+        if crc_info:
+            stages.append(_pipeline_stage('ArchiveChecksum', depth, update_crc))
+        for stage in stages:
+            stage.start()
+
+        try:
+            while readin < fsize:
+                rstart = time.time()
+                buff = _read_block(fin, readin, fsize, block_size)
+                rtime += time.time() - rstart
+                readin += len(buff)
+                for stage in stages:
+                    if stage.error is not None:
+                        raise stage.error
+                    stage.queue.put(buff)
+        finally:
+            for stage in stages:
+                stage.queue.put(None)
+            for stage in stages:
+                stage.join()
+
+        for stage in stages:
+            if stage.error is not None:
+                raise stage.error
+
+    wtime = stages[0].time
+    crctime = stages[1].time if crc_info else 0
+    return readin, rtime, wtime, crctime, crc[0]
+
 def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, transfer=None):
     """
     Inspects the given configuration and request objects, and calls
@@ -231,7 +320,8 @@ def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, tr
     def http_transfer(req, out_fname, crc_name, skip_crc):
         block_size = cfg.getBlockSize()
         size = req.getSize()
-        return archive_contents(out_fname, rfile, size, block_size, crc_name, skip_crc)
+        return archive_contents(out_fname, rfile, size, block_size, crc_name, skip_crc,
+                                pipeline_depth=cfg.getIngestPipelineDepth())
 
     transfer = transfer or http_transfer
     result = transfer(req, out_fname, crc_name, skip_crc=skip_crc)
@@ -261,7 +351,7 @@ def updateFileInfoDb(srvObj,
                      piStat,
                      checksum,
                      checksumPlugIn, sync_disk=True, ingestion_rate=None,
-                     prev_disk_id=None):
+                     prev_disk_id=None, update_disk_info=False):
     """
     Update the information for the file in the NGAS DB.
 
@@ -274,6 +364,9 @@ def updateFileInfoDb(srvObj,
 
     checksumPlugIn:   Checksum Plug-In (string).
 
+    update_disk_info: Update the disk info for the disk hosting this file
+                      in the same transaction (bool).
+
     Returns:          Void.
     """
     logger.debug("Updating file info in NGAS DB for file with ID: %s", piStat.getFileId())
@@ -327,7 +420,9 @@ def updateFileInfoDb(srvObj,
     if ingestion_rate is not None:
         fileInfo.setIngestionRate(ingestion_rate)
 
-    fileInfo.write(srvObj.getHostId(), srvObj.getDb(), prev_disk_id=prev_disk_id)
+    fileInfo.write(srvObj.getHostId(), srvObj.getDb(), updateDiskInfo=update_disk_info,
+                   prev_disk_id=prev_disk_id)
+    ngamsFileUtils.invalidate_file_location(piStat.getFileId())
     logger.debug("Updated file info in NGAS DB for file with ID: %s", piStat.getFileId())
 
     # Update the container size with the new size
@@ -610,10 +705,12 @@ def postFileRecepHandling(srvObj,
     else:
         checksum, checksumPlugIn = cksum
 
-    # Update information for File in DB.
+    # Update information for File in DB. For new files the DB information
+    # about the main disk is updated in the same transaction
     fileInfo = updateFileInfoDb(srvObj, resultPlugIn, checksum, checksumPlugIn,
                      sync_disk=sync_disk, ingestion_rate=ingestion_rate,
-                     prev_disk_id=(prev_file.disk_id if prev_file else None))
+                     prev_disk_id=(prev_file.disk_id if prev_file else None),
+                     update_disk_info=not prev_file)
     ngamsLib.makeFileReadOnly(resultPlugIn.getCompleteFilename())
 
     # Update information about main disk (both the in-memory object and the DB)
@@ -627,8 +724,12 @@ def postFileRecepHandling(srvObj,
 
     if prev_file:
         srvObj.db.replace_file(prev_file.size, prev_file.disk_id, resultPlugIn.getFileSize(), tgtDiskInfo.getDiskId())
+        # Like in the DB, the file moves from one disk to the other
+        moved = 1 if prev_file.disk_id != tgtDiskInfo.getDiskId() else 0
+        ngamsDiskUtils.findTargetDiskUpdateCache(prev_file.disk_id, -prev_file.size, -moved)
+        ngamsDiskUtils.findTargetDiskUpdateCache(tgtDiskInfo.getDiskId(), resultPlugIn.getFileSize(), moved)
     else:
-        srvObj.getDb().updateDiskInfo(resultPlugIn.getFileSize(), resultPlugIn.getDiskId())
+        ngamsDiskUtils.findTargetDiskUpdateCache(tgtDiskInfo.getDiskId(), resultPlugIn.getFileSize())
 
 #     mainDiskInfo = ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(),
 #                                                      resultPlugIn)
@@ -35,16 +35,19 @@ to manage the contents in the cache archive when running the NG/AMS Server
 as a cache archive.
 """
 import base64
+import functools
 import logging
 import os
+import threading
 import time
 
 from six.moves import cPickle # @UnresolvedImport
 import sqlite3 as sqlite
 
-from ngamsLib.ngamsCore import rmFile, genLog, loadPlugInEntryPoint
+from ngamsLib.ngamsCore import rmFile, genLog, loadPlugInEntryPoint, NGAMS_CACHE_EVICTION_POLICIES
 from ngamsLib import ngamsDbCore, ngamsHighLevelLib, ngamsDbm, ngamsDiskInfo, ngamsCacheEntry, ngamsThreadGroup, ngamsLib,\
     utils
+from . import ngamsFileUtils
 
 
 logger = logging.getLogger(__name__)
@@ -67,6 +70,12 @@ NGAMS_CACHE_CACHE_DEL  = 5
 NGAMS_CACHE_LAST_CHECK = 6
 NGAMS_CACHE_CACHE_TIME = 7
 NGAMS_CACHE_ENTRY_OBJ  = 8
+NGAMS_CACHE_LAST_ACCESS  = 9
+NGAMS_CACHE_ACCESS_COUNT = 10
+
+# Maximum number of removed files remembered to detect files that are
+# brought back into the cache.
+NGAMS_CACHE_MAX_EVICTED = 100000
 
 
 # DBM used by the ARCHIVE, CLONE, REARCHIVE, REGISTER Command (and other
@@ -148,13 +157,17 @@ def createCacheDbms(srvObj, ready_evt):
                        "cache_delete INTEGER, " +\
                        "last_check REAL, " +\
                        "cache_time REAL, " +\
-                       "cache_entry_obj TEXT)"
+                       "cache_entry_obj TEXT, " +\
+                       "last_access REAL, " +\
+                       "access_count INTEGER DEFAULT 0)"
             srvObj._cacheContDbmsCur.execute(sqlQuery)
 
             # Add an index for quicker INSERT/SELECT
             srvObj._cacheContDbmsCur.execute('CREATE INDEX cache_index ON ngas_cache(disk_id, file_id, file_version)')
         else:
             raise
+    _upgradeCacheDbms(srvObj._cacheContDbmsCur)
+    srvObj._cacheContDbms.commit()
 
     # Create the DBM to hold information about new files that are registered
     # on this node (to be inserted into the Local Cache Contents DBMS).
@@ -197,6 +210,288 @@ def createCacheDbms(srvObj, ready_evt):
                                                      writePerm = 1)
 
 
+def _upgradeCacheDbms(cursor):
+    """
+    Add the columns and tables used to keep track of the accesses to the
+    cached files, which are missing in Cache Contents DBMS created by older
+    versions of the server.
+
+    cursor:     Cursor on the local Cache Contents DBMS.
+
+    Returns:    Void.
+    """
+    cursor.execute("PRAGMA table_info(ngas_cache)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if "last_access" not in columns:
+        cursor.execute("ALTER TABLE ngas_cache ADD COLUMN last_access REAL")
+    if "access_count" not in columns:
+        cursor.execute("ALTER TABLE ngas_cache ADD COLUMN " +\
+                       "access_count INTEGER DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS cache_file_index ON " +\
+                   "ngas_cache(file_id, file_version)")
+
+    # Files removed from the cache, to detect when they are brought back.
+    # arc_list is the ARC list (1: accessed once, 2: accessed more than once)
+    # the file was in when removed.
+    cursor.execute("CREATE TABLE IF NOT EXISTS ngas_cache_evicted (" +\
+                   "file_id TEXT, " +\
+                   "file_version INTEGER, " +\
+                   "file_size INTEGER, " +\
+                   "arc_list INTEGER, " +\
+                   "evict_time REAL)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS cache_evicted_index ON " +\
+                   "ngas_cache_evicted(file_id, file_version)")
+
+
+class CacheAccessLog(object):
+    """
+    Keeps track of the accesses to the files in the cache. Accesses are
+    recorded in memory when files are retrieved, and written into the local
+    Cache Contents DBMS in batches by the Cache Control Thread. Statistics
+    about the usage of the cache are kept as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.refetched_files = 0
+        self.refetched_bytes = 0
+        # Target fraction of the cache for files not retrieved since they
+        # were stored in it (ARC)
+        self.arc_p = 0.5
+        self.last_flush = time.time()
+
+    def access(self, fileId, fileVersion, hit):
+        """Records a retrieval of the given file, found or not in the cache"""
+        with self._lock:
+            if not hit:
+                self.misses += 1
+                return
+            self.hits += 1
+            key = (fileId, int(fileVersion))
+            count = self._pending[key][0] if key in self._pending else 0
+            self._pending[key] = (count + 1, time.time())
+
+    def pop_pending(self):
+        """Returns and forgets the accesses not yet written into the DBMS"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def keep_pending(self, pending):
+        """Puts back accesses that could not be written into the DBMS yet"""
+        with self._lock:
+            for key, (count, lastAccess) in pending.items():
+                if key in self._pending:
+                    newCount, newLastAccess = self._pending[key]
+                    count, lastAccess = count + newCount, max(lastAccess, newLastAccess)
+                self._pending[key] = (count, lastAccess)
+
+    def refetched(self, fileSize):
+        """Records that a file previously removed is back in the cache"""
+        with self._lock:
+            self.refetched_files += 1
+            self.refetched_bytes += fileSize
+
+    def hit_ratio(self):
+        """Fraction of retrievals served from the cache"""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.
+
+    def __str__(self):
+        return ("%d hits, %d misses, hit ratio: %.3f, "
+                "re-fetched: %d files, %d bytes") %\
+               (self.hits, self.misses, self.hit_ratio(),
+                self.refetched_files, self.refetched_bytes)
+
+
+def recordCacheAccess(srvObj,
+                      fileId,
+                      fileVersion,
+                      hit):
+    """
+    Record the retrieval of a file when operating as a cache archive.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    fileId:       File ID of the retrieved file (string).
+
+    fileVersion:  Version of the retrieved file (integer).
+
+    hit:          Whether the file was found in the cache (boolean).
+
+    Returns:      Void.
+    """
+    if not srvObj.getCachingActive():
+        return
+    srvObj.getCacheAccessLog().access(fileId, fileVersion, hit)
+
+
+_UPDATE_ACCESS_CACHE_DBMS = "UPDATE ngas_cache SET last_access = ?, " +\
+                            "access_count = access_count + ? WHERE " +\
+                            "file_id = ? AND file_version = ?"
+
+def flushCacheAccesses(srvObj):
+    """
+    Write the accesses recorded since the last call into the local Cache
+    Contents DBMS, in a single transaction.
+
+    Files retrieved right after being archived might not be in the DBMS yet,
+    so the accesses to files not found in it are kept until the next call.
+    If the files are not found then either, the accesses are discarded.
+
+    srvObj:     Reference to server object (ngamsServer).
+
+    Returns:    Void.
+    """
+    accessLog = srvObj.getCacheAccessLog()
+    lastFlush, accessLog.last_flush = accessLog.last_flush, time.time()
+    pending = accessLog.pop_pending()
+    if not pending:
+        return
+    logger.debug("Writing %d accessed files into the Cache DBMS", len(pending))
+    notFound = {}
+    with srvObj._cacheContDbmsSem:
+        cursor = srvObj._cacheContDbmsCur
+        for (fileId, fileVersion), (count, lastAccess) in pending.items():
+            cursor.execute(_UPDATE_ACCESS_CACHE_DBMS,
+                           (lastAccess, count, fileId, fileVersion))
+            if not cursor.rowcount:
+                notFound[(fileId, fileVersion)] = (count, lastAccess)
+        srvObj._cacheContDbms.commit()
+
+    keep = {key: access for key, access in notFound.items()
+            if access[1] >= lastFlush}
+    for fileId, fileVersion in set(notFound) - set(keep):
+        logger.info("File %s/%d not found in the Cache DBMS, discarding its accesses",
+                    fileId, fileVersion)
+    accessLog.keep_pending(keep)
+
+
+def _addEvictedEntry(srvObj,
+                     fileId,
+                     fileVersion,
+                     fileSize,
+                     accessCount):
+    """
+    Remember that a file has been removed from the cache.
+    """
+    arcList = 2 if accessCount else 1
+    with srvObj._cacheContDbmsSem:
+        cursor = srvObj._cacheContDbmsCur
+        cursor.execute("INSERT INTO ngas_cache_evicted VALUES (?, ?, ?, ?, ?)",
+                       (fileId, int(fileVersion), fileSize, arcList,
+                        time.time()))
+        cursor.execute("DELETE FROM ngas_cache_evicted WHERE rowid <= " +\
+                       "(SELECT max(rowid) FROM ngas_cache_evicted) - ?",
+                       (NGAMS_CACHE_MAX_EVICTED,))
+        srvObj._cacheContDbms.commit()
+
+
+def _checkRefetched(srvObj,
+                    fileId,
+                    fileVersion,
+                    fileSize):
+    """
+    Check if a file entering the cache had been removed from it before. If so
+    update the statistics, and adapt the ARC target size of the list of files
+    accessed only once, like ARC does on a hit in its ghost lists.
+    """
+    with srvObj._cacheContDbmsSem:
+        cursor = srvObj._cacheContDbmsCur
+        cursor.execute("SELECT arc_list FROM ngas_cache_evicted " +\
+                       "WHERE file_id = ? AND file_version = ?",
+                       (fileId, int(fileVersion)))
+        res = cursor.fetchall()
+        if not res:
+            return
+        cursor.execute("SELECT sum(arc_list = 1), sum(arc_list = 2) " +\
+                       "FROM ngas_cache_evicted")
+        b1, b2 = [n or 0 for n in cursor.fetchone()]
+        cursor.execute("DELETE FROM ngas_cache_evicted " +\
+                       "WHERE file_id = ? AND file_version = ?",
+                       (fileId, int(fileVersion)))
+        srvObj._cacheContDbms.commit()
+
+    accessLog = srvObj.getCacheAccessLog()
+    accessLog.refetched(fileSize)
+    if res[-1][0] == 1:
+        accessLog.arc_p = min(1., accessLog.arc_p + 0.1 * max(1., float(b2) / b1))
+    else:
+        accessLog.arc_p = max(0., accessLog.arc_p - 0.1 * max(1., float(b1) / b2))
+    logger.debug("File %s/%d brought back into the cache, ARC target is now %.2f",
+                 fileId, int(fileVersion), accessLog.arc_p)
+
+
+_EVICTION_ORDER = {
+    "FIFO": "cache_time",
+    "LRU":  "coalesce(last_access, cache_time)",
+    "LFU":  "access_count, coalesce(last_access, cache_time)",
+}
+
+def _evictionCandidates(srvObj,
+                        policy,
+                        target,
+                        byVolume):
+    """
+    Generate the entries of the local Cache Contents DBMS in the order in
+    which they should be removed from the cache according to the given
+    policy. The caller must hold the DBMS semaphore.
+
+    srvObj:     Reference to server object (ngamsServer).
+
+    policy:     Eviction policy, see NGAMS_CACHE_EVICTION_POLICIES (string).
+
+    target:     Volume (bytes) or number of files the cache should be
+                reduced to. Only used by ARC (integer).
+
+    byVolume:   Whether target is a volume or a number of files (boolean).
+
+    Returns:    Generator of entries in the ngas_cache table (tuple).
+    """
+    def entries(cursor):
+        for fileInfoList in iter(functools.partial(cursor.fetchmany, 10000), []):
+            for sqlFileInfo in fileInfoList:
+                yield sqlFileInfo
+
+    conn = srvObj._cacheContDbms
+    if policy != "ARC":
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM ngas_cache ORDER BY " + _EVICTION_ORDER[policy])
+        for sqlFileInfo in entries(cursor):
+            yield sqlFileInfo
+        return
+
+    # ARC keeps files not retrieved since they were stored in the cache,
+    # i.e., accessed only once (T1), and files retrieved from the cache (T2) in
+    # separate LRU lists, removing files from T1 while it is bigger than its
+    # (adaptive) target size and from T2 otherwise.
+    weight = lambda x: int(x[NGAMS_CACHE_FILE_SIZE]) if byVolume else 1
+    cursor = conn.cursor()
+    cursor.execute("SELECT %s FROM ngas_cache WHERE access_count = 0" %\
+                   ("sum(file_size)" if byVolume else "count(*)"))
+    t1Weight = cursor.fetchone()[0] or 0
+    t1, t2 = conn.cursor(), conn.cursor()
+    t1.execute("SELECT * FROM ngas_cache WHERE access_count = 0 ORDER BY " +\
+               _EVICTION_ORDER["LRU"])
+    t2.execute("SELECT * FROM ngas_cache WHERE access_count > 0 ORDER BY " +\
+               _EVICTION_ORDER["LRU"])
+    t1, t2 = entries(t1), entries(t2)
+    t1Target = srvObj.getCacheAccessLog().arc_p * target
+    while True:
+        if t1Weight > t1Target:
+            sqlFileInfo = next(t1, None) or next(t2, None)
+        else:
+            sqlFileInfo = next(t2, None) or next(t1, None)
+        if sqlFileInfo is None:
+            return
+        if not sqlFileInfo[NGAMS_CACHE_ACCESS_COUNT]:
+            t1Weight -= weight(sqlFileInfo)
+        yield sqlFileInfo
+
+
 def addEntryNewFilesDbm(srvObj,
                         diskId,
                         fileId,
@@ -661,6 +956,9 @@ def checkNewFilesDbm(srvObj):
                             lastCheck = timeNow,
                             cacheTime = timeNow,
                             cacheEntryObj = cacheEntryObject)
+        _checkRefetched(srvObj, cacheEntryObject.getFileId(),
+                        cacheEntryObject.getFileVersion(),
+                        cacheEntryObject.getFileSize())
 
 
 # Template for query to update the last check field for the file in the
@@ -919,15 +1217,18 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
     #
     # 2. Check that the volume of the files residing in the cache is not
     #    exceeding the defined limit. If there are more files than this limit,
-    #    files are deleted FIFO-wise until reaching the maximum limit -10%.
+    #    files are deleted according to the eviction policy (FIFO-wise by
+    #    default) until reaching the maximum limit -10%.
     #
     # 3. Check if there are more files in the cache than the specified
-    #    limit. If there are more files, files are deleted FIFO-wise, until
-    #    going below the maximum limit -10%.
+    #    limit. If there are more files, files are deleted according to the
+    #    eviction policy, until going below the maximum limit -10%.
     #
     # 4. Execute the Cache Control Plug-In (if specified in the
     #    configuration).
 
+    policy = srvObj.getCfg().getCachingEvictionPolicy()
+
     # 0. Go through the explicitDel queue to remove files
 
     # 1. Evaluate if there are files residing in the cache for more than
@@ -998,8 +1299,8 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
             # to avoid having to clean-up constantly due to this rule.
             maxCacheSize *= 0.9
 
-            # Schedule files FIFO-wise for removal from the cache.
-            sqlQuery = "SELECT * FROM ngas_cache ORDER BY cache_time"
+            # Schedule files for removal from the cache according to the
+            # eviction policy.
             # Dump the results into a temporary DBM.
             delFilesDbm = createTmpDbm(srvObj, "MAX_VOL_FILES_INFO")
             # Encapsulate this in a try clause to be able to semaphore protect
@@ -1007,37 +1308,34 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
             # access the DBMS.
             try:
                 srvObj._cacheContDbmsSem.acquire()
-                srvObj._cacheContDbmsCur.execute(sqlQuery)
-                while (cacheSum > maxCacheSize):
-                    fileInfoList = srvObj._cacheContDbmsCur.fetchmany(10000)
-                    if (not fileInfoList): break
-                    for sqlFileInfo in fileInfoList:
-                        if (check_can_be_deleted):
-                            try:
-                                if (not checkIfFileCanBeDeleted(srvObj,
-                                                                sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                                                                sqlFileInfo[NGAMS_CACHE_FILE_VER],
-                                                                sqlFileInfo[NGAMS_CACHE_DISK_ID])):
-                                    logger.info("Cannot delete file from the cache: %s/%s/%s",
-                                          str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
-                                    continue
-                            except Exception as cee:
-                                if (str(cee).lower().find('file not found in ngas db') > -1):
-                                    logger.warning("file already gone, still mark for deletion: %s/%s/%s",
-                                            str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
-                                else:
-                                    raise
-
-                        msg = "CACHE-CRITERIA: Maximum Cache Size " +\
-                              "Exceeded: %s/%s/%s"
-                        logger.info(msg,
-                              sqlFileInfo[NGAMS_CACHE_DISK_ID],
-                              sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                              str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
-                        delFilesDbm.addIncKey(sqlFileInfo)
-                        fileSize = int(sqlFileInfo[NGAMS_CACHE_FILE_SIZE])
-                        cacheSum -= fileSize
-                        if (cacheSum < maxCacheSize): break
+                for sqlFileInfo in _evictionCandidates(srvObj, policy,
+                                                       maxCacheSize, True):
+                    if (check_can_be_deleted):
+                        try:
+                            if (not checkIfFileCanBeDeleted(srvObj,
+                                                            sqlFileInfo[NGAMS_CACHE_FILE_ID],
+                                                            sqlFileInfo[NGAMS_CACHE_FILE_VER],
+                                                            sqlFileInfo[NGAMS_CACHE_DISK_ID])):
+                                logger.info("Cannot delete file from the cache: %s/%s/%s",
+                                      str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
+                                continue
+                        except Exception as cee:
+                            if (str(cee).lower().find('file not found in ngas db') > -1):
+                                logger.warning("file already gone, still mark for deletion: %s/%s/%s",
+                                        str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
+                            else:
+                                raise
+
+                    msg = "CACHE-CRITERIA: Maximum Cache Size " +\
+                          "Exceeded: %s/%s/%s"
+                    logger.info(msg,
+                          sqlFileInfo[NGAMS_CACHE_DISK_ID],
+                          sqlFileInfo[NGAMS_CACHE_FILE_ID],
+                          str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
+                    delFilesDbm.addIncKey(sqlFileInfo)
+                    fileSize = int(sqlFileInfo[NGAMS_CACHE_FILE_SIZE])
+                    cacheSum -= fileSize
+                    if (cacheSum < maxCacheSize): break
                 srvObj._cacheContDbms.commit()
                 srvObj._cacheContDbmsSem.release()
             except:
@@ -1067,11 +1365,8 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
         else:
             numberOfFiles = int(numberOfFiles)
         if (numberOfFiles > maxFiles):
-            # Remove files from the cache, FIFO-wise, until the number of
-            # files is 10% below the specified limit.
-            # It seems that ROWCOUNT is not implemented for SELECT
-            # for SQLite. We do it the brute way ...
-            sqlQuery = "SELECT * FROM ngas_cache ORDER BY cache_time"
+            # Remove files from the cache according to the eviction policy,
+            # until the number of files is 10% below the specified limit.
             noOfFilesToRemove = int(1.10 * float(numberOfFiles - maxFiles))
             count = 0
             # Dump the results into a temporary DBM.
@@ -1081,20 +1376,18 @@ def checkCacheContents(srvObj, stopEvt, check_can_be_deleted):
             # access the DBMS.
             try:
                 srvObj._cacheContDbmsSem.acquire()
-                srvObj._cacheContDbmsCur.execute(sqlQuery)
-                while (count < noOfFilesToRemove):
-                    fileInfoList = srvObj._cacheContDbmsCur.fetchmany(10000)
-                    if (not fileInfoList): break
-                    for sqlFileInfo in fileInfoList:
-                        msg = "CACHE-CRITERIA: Maximum Number of Files in " +\
-                              "Cache Exceeded: %s/%s/%s"
-                        logger.info(msg,
-                              sqlFileInfo[NGAMS_CACHE_DISK_ID],
-                              sqlFileInfo[NGAMS_CACHE_FILE_ID],
-                              str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
-                        delFilesDbm.addIncKey(sqlFileInfo)
-                        count += 1
-                        if (count >= noOfFilesToRemove): break
+                for sqlFileInfo in _evictionCandidates(srvObj, policy,
+                                                       numberOfFiles - noOfFilesToRemove,
+                                                       False):
+                    msg = "CACHE-CRITERIA: Maximum Number of Files in " +\
+                          "Cache Exceeded: %s/%s/%s"
+                    logger.info(msg,
+                          sqlFileInfo[NGAMS_CACHE_DISK_ID],
+                          sqlFileInfo[NGAMS_CACHE_FILE_ID],
+                          str(sqlFileInfo[NGAMS_CACHE_FILE_VER]))
+                    delFilesDbm.addIncKey(sqlFileInfo)
+                    count += 1
+                    if (count >= noOfFilesToRemove): break
                 srvObj._cacheContDbms.commit()
                 srvObj._cacheContDbmsSem.release()
             except:
@@ -1195,6 +1488,7 @@ def removeFile(srvObj,
              diskInfoObj.getDiskId(), fileId, str(fileVersion))
         srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskInfoObj.getDiskId(), fileId,
                                       fileVersion)
+        ngamsFileUtils.invalidate_file_location(fileId)
     except Exception as e:
         msg = genLog("NGAMS_ER_DEL_FILE_DB", [diskInfoObj.getDiskId(),
                                               fileId, fileVersion, str(e)])
@@ -1225,7 +1519,8 @@ def cleanUpCache(srvObj):
     """
     # We dump info for all files at once, into a temporary DBM, since during
     # the cleaning up queries will be done in the associated SQLite DBMS.
-    sqlQuery = "SELECT disk_id, file_id, file_version, filename " +\
+    sqlQuery = "SELECT disk_id, file_id, file_version, filename, " +\
+               "file_size, access_count " +\
                "FROM ngas_cache WHERE cache_delete = 1"
     cleanUpDbm = createTmpDbm(srvObj, "CLEAN-UP_FILE_INFO")
     try:
@@ -1255,6 +1550,8 @@ def cleanUpCache(srvObj):
         fileId      = sqlFileInfo[1]
         fileVersion = sqlFileInfo[2]
         filename    = sqlFileInfo[3]
+        fileSize    = sqlFileInfo[4]
+        accessCount = sqlFileInfo[5]
 
         logger.info("Deleting entry from the cache: %s/%s/%s",
              str(sqlFileInfo[0]), str(sqlFileInfo[1]), str(sqlFileInfo[2]))
@@ -1284,6 +1581,8 @@ def cleanUpCache(srvObj):
         #   - Remove from Cache Content DBMS's:
         try:
             delEntryFromCacheDbms(srvObj, diskId, fileId, fileVersion)
+            _addEvictedEntry(srvObj, fileId, fileVersion, fileSize,
+                             accessCount)
         except:
             msg = "Error removing file information from the Cache Table in " +\
                   "the local DBMS and in the RDBMS for file " +\
@@ -1328,12 +1627,17 @@ def cacheControlThread(srvObj, ready_evt, check_can_be_deleted, stopEvt):
             # Contents DBMS.
             checkNewFilesDbm(srvObj)
 
+            # Write the accesses to the cached files recorded since the last
+            # iteration.
+            flushCacheAccesses(srvObj)
+
             # Go through local Cache Contents DBMS. Check for each item if it
             # can be deleted.
             checkCacheContents(srvObj, stopEvt, check_can_be_deleted)
 
             # Delete each item, marked for deletion.
             cleanUpCache(srvObj)
+            logger.debug("Cache usage: %s", srvObj.getCacheAccessLog())
             ###################################################################
 
             ###################################################################
@@ -32,15 +32,23 @@ This module contains the code for the Data Check Thread, which is used
 to check the data holding in connection with one NGAS host.
 """
 
+import functools
 import glob
+import heapq
 import logging
 import os
 import random
+import sqlite3
 import time
 import threading
 
 from six.moves import cPickle # @UnresolvedImport
 
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir # @UnresolvedImport
+
 from . import ngamsFileUtils
 from ngamsLib.ngamsCore import NGAMS_DATA_CHECK_THR, \
     NGAMS_CACHE_DIR, checkCreatePath, isoTime2Secs, \
@@ -52,6 +60,37 @@ from ngamsLib import ngamsDbCore, ngamsDbm, ngamsHighLevelLib, ngamsLib
 
 logger = logging.getLogger(__name__)
 
+# Work-lists are built by sorting this many entries in memory at a time
+# (spilling them to disk) and merging the resulting runs
+_WORKLIST_RUN_SIZE = 100000
+
+# Number of entries pickled together in a work-list
+_WORKLIST_BATCH_SIZE = 1000
+
+_WORKLIST_VERSION = 1
+
+# Per-file columns stored in the work-list entries. Columns common to all the
+# files of the disk are stored only once in the work-list header
+_WORKLIST_COLS = (ngamsDbCore.SUM1_FILENAME, ngamsDbCore.SUM1_CHECKSUM,
+                  ngamsDbCore.SUM1_CHECKSUM_PI, ngamsDbCore.SUM1_FILE_ID,
+                  ngamsDbCore.SUM1_VERSION, ngamsDbCore.SUM1_FILE_SIZE,
+                  ngamsDbCore.SUM1_FILE_STATUS, ngamsDbCore.SUM1_FILE_IGNORE)
+_WORKLIST_DISK_COLS = (ngamsDbCore.SUM1_SLOT_ID, ngamsDbCore.SUM1_MT_PT,
+                       ngamsDbCore.SUM1_DISK_ID, ngamsDbCore.SUM1_HOST_ID)
+_ENTRY_FILENAME = 0
+_ENTRY_FILE_SIZE = 5
+_ENTRY_FILE_IGNORE = 7
+
+# Files of a work-list are sorted by inode in windows of this many files
+_INODE_SORT_WINDOW = 1000
+
+# Bit of ngas_files.file_status set by ngamsDbNgasFiles.set_valid_checksum()
+# when a file is found to be invalid
+_INVALID_CHECKSUM_BIT = 0x80
+
+# Files that are never taken into account when walking a disk
+_IGNORED_FILES = (NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, NGAMS_VOLUME_INFO_FILE)
+
 class StopDataCheckThreadException(Exception):
     pass
 
@@ -85,6 +124,7 @@ class Stats(object):
         self.mbs_checked = 0
         self.files = files
         self.files_checked = 0
+        self.files_skipped = 0
 
 
 def _initFileCheckStatus(srvObj, amountMb, noOfFiles):
@@ -180,320 +220,625 @@ def _updateFileCheckStatus(srvObj,
              stats.mbs, stats.files, stats.files_checked)
 
 
-def collect_files_on_disk(stopEvt, disks):
+def _skipFileCheck(stats, fileSize):
+    """
+    Takes a file that doesn't need to be verified out of the statistics of
+    the checking.
+    """
+    with stats.lock:
+        stats.files_skipped += 1
+        stats.files -= 1
+        stats.mbs -= float(fileSize) / 1048576.0
+
+
+class CheckState(object):
+    """
+    Records, for each file verified by the Data Check Thread, when it was
+    verified and the modification time, size and inode the file had then.
+    It is kept in an SQLite DB in the NG/AMS cache directory, as it refers
+    only to the files of this host.
+
+    When checking incrementally, files are verified again only if they
+    changed, were previously found to be invalid, or haven't been verified
+    for ``fullCycle`` seconds. Other files are verified at a rolling rate,
+    such that a data check cycle samples a fraction of them proportional to
+    the time since the previous check of their disk.
+    """
 
-    all_files = {}
+    def __init__(self, filename, fullCycle):
+        self.fullCycle = fullCycle
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.samplingRates = {}
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ngas_checked_files ("
+                          "disk_id TEXT, file_name TEXT, verified REAL, "
+                          "mtime REAL, size INTEGER, inode INTEGER, "
+                          "PRIMARY KEY (disk_id, file_name))")
+        self.conn.commit()
+
+    def startCycle(self, disks_to_check, now):
+        """
+        Calculates, for each disk to be checked, the fraction of its
+        unchanged files to be verified during this cycle.
+        """
+        for diskId, diskInfoObj in disks_to_check.items():
+            lastCheck = diskInfoObj.getLastCheck()
+            if not lastCheck or self.fullCycle <= 0:
+                rate = 1.0
+            else:
+                rate = min(1.0, max(0.0, now - lastCheck) / self.fullCycle)
+            self.samplingRates[diskId] = rate
+
+    def needsCheck(self, fileInfo, st, now):
+        """
+        Returns whether the given file has to be verified. ``st`` is the
+        result of os.stat() for the file, or None if it couldn't be stat'ed.
+        """
+        if st is None:
+            return True
+        status = fileInfo[ngamsDbCore.SUM1_FILE_STATUS]
+        if status and int(status, 2) & _INVALID_CHECKSUM_BIT:
+            return True
+        with self.lock:
+            row = self.conn.execute("SELECT verified, mtime, size, inode "
+                                    "FROM ngas_checked_files "
+                                    "WHERE disk_id=? AND file_name=?",
+                                    (fileInfo[ngamsDbCore.SUM1_DISK_ID],
+                                     fileInfo[ngamsDbCore.SUM1_FILENAME])).fetchone()
+        if row is None:
+            return True
+        verified, mtime, size, inode = row
+        if (mtime, size, inode) != (st.st_mtime, st.st_size, st.st_ino):
+            return True
+        if now - verified >= self.fullCycle:
+            return True
+        samplingRate = self.samplingRates.get(fileInfo[ngamsDbCore.SUM1_DISK_ID], 1.0)
+        return random.random() < samplingRate
+
+    def update(self, fileInfo, st, valid, now):
+        """
+        Records the result of verifying the given file. Invalid files are
+        forgotten so they are verified again in the next cycle.
+        """
+        diskId = fileInfo[ngamsDbCore.SUM1_DISK_ID]
+        filename = fileInfo[ngamsDbCore.SUM1_FILENAME]
+        with self.lock:
+            if valid and st is not None:
+                self.conn.execute("INSERT OR REPLACE INTO ngas_checked_files "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  (diskId, filename, now, st.st_mtime,
+                                   st.st_size, st.st_ino))
+            else:
+                self.conn.execute("DELETE FROM ngas_checked_files "
+                                  "WHERE disk_id=? AND file_name=?",
+                                  (diskId, filename))
+            self.pending += 1
+            if self.pending >= 1000:
+                self.conn.commit()
+                self.pending = 0
+
+    def prune(self, now):
+        """
+        Forgets files not verified for two full cycles, which don't exist
+        anymore.
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM ngas_checked_files "
+                              "WHERE verified < ?", (now - 2 * self.fullCycle,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def _pathKey(filename):
+    """
+    Returns the key used to sort files by their path relative to the mount
+    point of their disk. Paths are compared component by component, which is
+    the order in which _walkDisk() yields them.
+    """
+    return [c for c in os.path.normpath(filename).split(os.sep) if c]
 
-    # Loop over disks
-    for diskId, diskInfoObj in disks.items():
 
-        # Walk over the mount point and collect all files
-        mount_pt = diskInfoObj.getMountPoint()
-        for dirpath, dirs, files in os.walk(mount_pt):
-            _stopDataCheckThr(stopEvt)
+def _writeEntries(fd, entries):
+    """
+    Writes the given work-list entries in pickled batches into ``fd``.
+    """
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= _WORKLIST_BATCH_SIZE:
+            cPickle.dump(batch, fd, cPickle.HIGHEST_PROTOCOL)
+            batch = []
+    if batch:
+        cPickle.dump(batch, fd, cPickle.HIGHEST_PROTOCOL)
+
+
+def _readEntries(fd):
+    """
+    Yields the work-list entries written with _writeEntries() into ``fd``.
+    """
+    while True:
+        try:
+            batch = cPickle.load(fd)
+        except EOFError:
+            return
+        for entry in batch:
+            yield entry
+
+
+def _readRun(filename, runIdx):
+    with open(filename, 'rb') as fd:
+        for entry in _readEntries(fd):
+            yield _pathKey(entry[_ENTRY_FILENAME]), runIdx, entry
+
 
-            # Ignore staging and hidden directories
-            dirs[:] = [d for d in dirs if d != NGAMS_STAGING_DIR and not d.startswith('.')]
+class WorkList(object):
+    """
+    The list of files of a disk to be checked by the Data Check Thread.
+
+    Work-lists are stored on disk. They start with a header containing the
+    columns common to all the files of the disk, together with the number
+    and total size of the files to be checked, followed by one entry per file
+    registered on the disk sorted by path. Entries of files marked to be
+    ignored are kept in the work-list (so they are not reported as not
+    registered) but are not handed out for checking.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._fd = None
+        self._entries = None
+        with open(filename, 'rb') as fd:
+            header = cPickle.load(fd)
+        if header.get('version') != _WORKLIST_VERSION:
+            raise ValueError("Unsupported work-list version in %s: %r" %
+                             (filename, header.get('version')))
+        self.disk = header['disk']
+        self.files = header['files']
+        self.size = header['size']
+
+    @staticmethod
+    def create(filename, disk, entries, files, size):
+        """
+        Writes a new work-list containing the given (sorted) entries.
+
+        filename:  Name of the work-list file (string).
+
+        disk:      Values for the columns in _WORKLIST_DISK_COLS (list).
+
+        entries:   The work-list entries, sorted by path (iterable).
+
+        files:     Number of files to be checked (integer).
+
+        size:      Total size of the files to be checked (integer).
+
+        Returns:   The new work-list (WorkList).
+        """
+        header = {'version': _WORKLIST_VERSION, 'disk': list(disk),
+                  'files': files, 'size': size}
+        with open(filename, 'wb') as fd:
+            cPickle.dump(header, fd, cPickle.HIGHEST_PROTOCOL)
+            _writeEntries(fd, entries)
+        return WorkList(filename)
+
+    def __iter__(self):
+        """
+        Iterates over all the entries of the work-list.
+        """
+        with open(self.filename, 'rb') as fd:
+            cPickle.load(fd)
+            for entry in _readEntries(fd):
+                yield entry
+
+    def fileInfo(self, entry):
+        """
+        Returns the information of a work-list entry in the format of
+        ngamsDbCore.getFileSummary1().
+        """
+        fileInfo = [None] * len(ngamsDbCore.getNgasSummary1Def())
+        for col, val in zip(_WORKLIST_DISK_COLS, self.disk):
+            fileInfo[col] = val
+        for col, val in zip(_WORKLIST_COLS, entry):
+            fileInfo[col] = val
+        return fileInfo
 
-            # Ignore NGAS Disk Info files
-            files[:] = [f for f in files if f not in (NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, NGAMS_VOLUME_INFO_FILE)]
+    def rewind(self):
+        """
+        (Re)starts handing out the files to be checked from the beginning.
+        """
+        self.close()
+        self._entries = iter(self)
+
+    def getNext(self):
+        """
+        Returns the information of the next file to be checked, in the format
+        of ngamsDbCore.getFileSummary1(), or None if there are no more files.
+        """
+        if self._entries is None:
+            self.rewind()
+        for entry in self._entries:
+            if not entry[_ENTRY_FILE_IGNORE]:
+                return self.fileInfo(entry)
+        return None
+
+    def close(self):
+        if self._entries is not None:
+            self._entries.close()
+            self._entries = None
+
+
+def _dumpWorkList(srvObj, diskInfo, filename, tmpFilePat, stopEvt):
+    """
+    Dumps the information about the files registered on the given disk
+    into a new work-list.
 
-            for filename in files:
-                filename = os.path.join(dirpath, filename)
-                all_files[filename] = diskId
+    The files are read from the DB through a cursor. Entries are sorted in
+    memory in runs of _WORKLIST_RUN_SIZE entries, which are spilled to
+    temporary files and merged into the final work-list if needed. The
+    statistics for the checking are computed in the same pass.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    diskInfo:     Information about the disk (ngamsDiskInfo).
+
+    filename:     Name of the work-list file (string).
+
+    tmpFilePat:   Pattern for temporary files (string).
+
+    Returns:      The work-list for the disk (WorkList).
+    """
+    diskId = diskInfo.getDiskId()
+    disk = [None] * len(_WORKLIST_DISK_COLS)
+    disk[_WORKLIST_DISK_COLS.index(ngamsDbCore.SUM1_SLOT_ID)] = diskInfo.getSlotId()
+    disk[_WORKLIST_DISK_COLS.index(ngamsDbCore.SUM1_MT_PT)] = diskInfo.getMountPoint()
+    disk[_WORKLIST_DISK_COLS.index(ngamsDbCore.SUM1_DISK_ID)] = diskId
+    disk[_WORKLIST_DISK_COLS.index(ngamsDbCore.SUM1_HOST_ID)] = diskInfo.getHostId()
+
+    files = srvObj.getDb().getFileSummary1(diskIds=[diskId],
+                                           ignore=None, fileStatus=[],
+                                           lowLimIngestDate=None,
+                                           order=0)
+    sortKey = lambda entry: _pathKey(entry[_ENTRY_FILENAME])
+    entries = []
+    runs = []
+    noOfFiles = 0
+    size = 0
+    for fileInfo in files:
+        entry = tuple(fileInfo[col] for col in _WORKLIST_COLS)
+        entries.append(entry)
+        if not entry[_ENTRY_FILE_IGNORE]:
+            noOfFiles += 1
+            size += entry[_ENTRY_FILE_SIZE] or 0
+        if len(entries) >= _WORKLIST_RUN_SIZE:
+            _stopDataCheckThr(stopEvt)
+            entries.sort(key=sortKey)
+            runFile = "%s_RUN_%s_%d" % (tmpFilePat, diskId, len(runs))
+            with open(runFile, 'wb') as fd:
+                _writeEntries(fd, entries)
+            runs.append(runFile)
+            entries = []
+    entries.sort(key=sortKey)
+
+    # Everything fitted in a single run, otherwise merge all runs
+    if runs:
+        iterables = [_readRun(runFile, i) for i, runFile in enumerate(runs)]
+        iterables.append((sortKey(e), len(runs), e) for e in entries)
+        entries = (e for _, _, e in heapq.merge(*iterables))
+
+    tmpFilename = tmpFilePat + "_" + os.path.basename(filename)
+    WorkList.create(tmpFilename, disk, entries, noOfFiles, size)
+    for runFile in runs:
+        rmFile(runFile)
+    mvFile(tmpFilename, filename)
+    logger.debug("Dumped work-list for disk %s with %d files (%d runs)",
+                 diskId, noOfFiles, len(runs))
+    return WorkList(filename)
+
+
+def _walkDisk(stopEvt, mount_pt, path=()):
+    """
+    Yields the path components (relative to ``mount_pt``) of all the files
+    found under ``mount_pt`` sorted by path, as given by _pathKey(). Staging
+    and hidden directories and the NGAS disk information files are skipped.
+    """
+    _stopDataCheckThr(stopEvt)
+    entries = sorted(scandir(os.path.join(mount_pt, *path)),
+                     key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            if (entry.is_symlink() or entry.name == NGAMS_STAGING_DIR or
+                entry.name.startswith('.')):
+                continue
+            for filePath in _walkDisk(stopEvt, mount_pt, path + (entry.name,)):
+                yield filePath
+        elif entry.name not in _IGNORED_FILES:
+            yield list(path + (entry.name,))
+
+
+def _findUnregisteredFiles(stopEvt, diskId, mount_pt, workList):
+    """
+    Finds the files on a disk that are not registered in its work-list.
+    Both the files on disk and the work-list are sorted by path, so this is
+    done by merging them without keeping either of them in memory.
+
+    Returns:  Dictionary with the full names of the files that are not
+              registered as keys and ``diskId`` as values (dict).
+    """
+    unregistered = {}
+    registered = (_pathKey(entry[_ENTRY_FILENAME]) for entry in workList)
+    regPath = next(registered, None)
+    for filePath in _walkDisk(stopEvt, mount_pt):
+        while regPath is not None and regPath < filePath:
+            regPath = next(registered, None)
+        if regPath != filePath:
+            unregistered[os.path.join(mount_pt, *filePath)] = diskId
+    return unregistered
 
-    logger.info("Found %d files to check in %d disks", len(all_files), len(disks))
-    return all_files
 
 def _dumpFileInfo(srvObj, disks_to_check, tmpFilePat, stopEvt):
     """
-    Function that dumps the information about the files. One DBM is created
-    per disk. This is named:
+    Function that dumps the information about the files. One work-list is
+    created per disk. This is named:
 
-       <Mount Root Point>/cache/DATA-CHECK-THREAD_QUEUE_<Disk ID>.bsddb
+       <Mount Root Point>/cache/DATA-CHECK-THREAD_QUEUE_<Disk ID>.worklist
 
     If problems are found for a file, these are stored in DBM files named:
 
        <Mount Root Point>/cache/DATA-CHECK-THREAD_ERRORS_<Disk ID>.bsddb
 
-    The function handles the DBM files in the following way:
+    The function handles these files in the following way:
 
-       1. Check for each DBM file found, if this disk is still in the system.
-          If not, the Queue and Error DBM files are removed.
+       1. Check for each work-list found, if this disk is still in the system.
+          If not, the work-list and Error DBM files are removed.
 
        2. Go through the list of disks in the system. If they don't have
-          the two DBM files listed above, these are initialized. The file
+          the two files listed above, these are initialized. The file
           information for all the files stored on the disk is dumped into
-          the Queue DBM file. Only files marked to be ignored are not dumped.
+          the work-list.
 
-       3. Finally, build up a DBM with references to all files found
-          on this system
+       3. Finally, walk the disks and merge the files found with the
+          work-lists to find the files that are not registered.
 
     srvObj:       Reference to server object (ngamsServer).
 
     tmpFilePat:   Pattern for temporary files (string).
 
-    Returns:      Void.
+    Returns:      Tuple with the files found on disk that are not registered
+                  (dict), the work-list and Error DBM of each disk (dict)
+                  and the statistics for the checking (Stats).
     """
     cacheDir = os.path.join(srvObj.getCfg().getRootDirectory(), NGAMS_CACHE_DIR)
     checkCreatePath(os.path.normpath(cacheDir))
 
     ###########################################################################
-    # Loop over the Queue/Error DBM files found, check if the disk is
-    # still in the system/scheduled for checking.
+    # Loop over the work-lists/Error DBM files found, check if the disk is
+    # still in the system/scheduled for checking. Queue DBMs from previous
+    # versions are simply removed.
     ###########################################################################
-    logger.debug("Loop over/check existing Queue/Error DBM Files ...")
-    dbmFileList = glob.glob(cacheDir + "/" + NGAMS_DATA_CHECK_THR +\
-                            "_QUEUE_*.bsddb")
+    logger.debug("Loop over/check existing work-lists/Error DBM Files ...")
+    rmFile("%s/%s_QUEUE_*.bsddb" % (cacheDir, NGAMS_DATA_CHECK_THR))
+    workListFiles = glob.glob(cacheDir + "/" + NGAMS_DATA_CHECK_THR +\
+                              "_QUEUE_*.worklist")
     dbmObjDic = {}
-    for dbmFile in dbmFileList:
+    for workListFile in workListFiles:
         _stopDataCheckThr(stopEvt)
-        diskId = dbmFile.split("_")[-1].split(".")[0]
+        diskId = workListFile.split("_")[-1].split(".")[0]
         if diskId not in disks_to_check:
-            filePat = "%s/%s*%s.bsddb" % (cacheDir,NGAMS_DATA_CHECK_THR,diskId)
-            rmFile(filePat)
-        else:
-            # Add references to Queue/Error DBM.
-            queueDbmFile = "%s/%s_QUEUE_%s.bsddb" %\
-                           (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-            queueDbm = ngamsDbm.ngamsDbm(queueDbmFile, 0, 1)
-            errorDbmFile = "%s/%s_ERRORS_%s.bsddb" %\
-                           (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-            errorDbm = ngamsDbm.ngamsDbm(errorDbmFile, 0, 1)
-            dbmObjDic[diskId] = (queueDbm, errorDbm)
-    logger.debug("Looped over/checked existing Queue/Error DBM Files")
+            rmFile("%s/%s*%s.*" % (cacheDir, NGAMS_DATA_CHECK_THR, diskId))
+            continue
+        try:
+            workList = WorkList(workListFile)
+        except Exception:
+            logger.warning("Discarding unreadable work-list %s", workListFile)
+            rmFile(workListFile)
+            continue
+        # Add references to work-list/Error DBM.
+        errorDbmFile = "%s/%s_ERRORS_%s.bsddb" %\
+                       (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
+        errorDbm = ngamsDbm.ngamsDbm(errorDbmFile, 0, 1)
+        dbmObjDic[diskId] = (workList, errorDbm)
+    logger.debug("Looped over/checked existing work-lists/Error DBM Files")
     ###########################################################################
 
     ###########################################################################
     # Loop over the disks mounted in this system and check if they have a
-    # Queue/Error DBM file. In case the DBM files are not available, create
-    # these.
+    # work-list/Error DBM file. In case they are not available, create them.
     ###########################################################################
-    logger.debug("Create DBM files for disks to be checked ...")
+    logger.debug("Create work-lists for disks to be checked ...")
     startDbFileRd = time.time()
-    for diskId in disks_to_check.keys():
+    for diskId, diskInfoObj in disks_to_check.items():
         _stopDataCheckThr(stopEvt)
 
         if diskId in dbmObjDic:
             continue
 
-        # The disk is ripe for checking but still has no Queue/Error DBM
-        # DBs allocated.
-        queueDbmFile = "%s/%s_QUEUE_%s.bsddb" %\
+        # The disk is ripe for checking but still has no work-list/Error DBM
+        # allocated.
+        workListFile = "%s/%s_QUEUE_%s.worklist" %\
                        (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
-        tmpQueueDbmFile = tmpFilePat + "_" + os.path.basename(queueDbmFile)
-        queueDbm = ngamsDbm.ngamsDbm(tmpQueueDbmFile, 0, 1)
-
-        # Now, retrieve the files on the given disk, and store the info
-        # in the Queue DBM file.
-        files = srvObj.getDb().getFileSummary1(diskIds=[diskId],
-                                               ignore=0, fileStatus=[],
-                                               lowLimIngestDate=None,
-                                               order=0)
-        for fileInfo in files:
-            fileId  = fileInfo[ngamsDbCore.SUM1_FILE_ID]
-            fileVer = fileInfo[ngamsDbCore.SUM1_VERSION]
-            fileKey = ngamsLib.genFileKey(None, fileId, fileVer)
-            queueDbm.add(fileKey, fileInfo)
-        queueDbm.sync()
-
-        # Rename DCC Queue DBM from the temporary to the final name.
-        mvFile(tmpQueueDbmFile, queueDbmFile)
-        queueDbm = ngamsDbm.ngamsDbm(queueDbmFile, 0, 1)
+        workList = _dumpWorkList(srvObj, diskInfoObj, workListFile,
+                                 tmpFilePat, stopEvt)
 
         # Create Error DBM + add these in the DBM Dictionary for the disk.
         errorDbmFile = "%s/%s_ERRORS_%s.bsddb" %\
                        (cacheDir, NGAMS_DATA_CHECK_THR, diskId)
         errorDbm = ngamsDbm.ngamsDbm(errorDbmFile, 0, 1)
-        dbmObjDic[diskId] = (queueDbm, errorDbm)
+        dbmObjDic[diskId] = (workList, errorDbm)
 
         _stopDataCheckThr(stopEvt)
     logger.debug("Queried info for files to be checked from DB. Time: %.3fs",
          time.time() - startDbFileRd)
-    logger.debug("Checked that disks scheduled for checking have DBM files")
+    logger.debug("Checked that disks scheduled for checking have work-lists")
     ###########################################################################
 
-    # These are all files recursively found on the disks
-    # Later on we check whether they are registered or not, and check them (or not)
+    # Walk the disks and merge the files found with the work-lists. Files
+    # registered while we were doing this are sorted out after checking,
+    # see _crossCheckNonRegFiles()
     start = time.time()
-    files_on_disk = collect_files_on_disk(stopEvt, disks_to_check)
-    end = time.time()
-    logger.debug("Collected references to %d files on disks in %.3f [s]",
-                 len(files_on_disk), end - start)
-
-    # Don't take these into account
-    logger.debug("Retrieving information about files to be ignored ...")
-    files = srvObj.getDb().getFileSummarySpuriousFiles1(srvObj.getHostId(), fetch_size=1000)
-    for fileInfo in files:
-        if (fileInfo[ngamsDbCore.SUM1_FILE_IGNORE]):
-            filename = os.path.\
-                       normpath(fileInfo[ngamsDbCore.SUM1_MT_PT] + "/" +\
-                                fileInfo[ngamsDbCore.SUM1_FILENAME])
-            if filename in files_on_disk:
-                del files_on_disk[filename]
-    logger.debug("Retrieved information about files to be ignored")
-    ###########################################################################
+    unregistered = {}
+    for diskId, diskInfoObj in disks_to_check.items():
+        unregistered.update(_findUnregisteredFiles(stopEvt, diskId,
+                                                   diskInfoObj.getMountPoint(),
+                                                   dbmObjDic[diskId][0]))
+    logger.debug("Found %d files not registered on %d disks in %.3f [s]",
+                 len(unregistered), len(disks_to_check), time.time() - start)
 
     ###########################################################################
-    # Initialize the statistics parameters for the checking.
+    # Initialize the statistics parameters for the checking, these were
+    # computed while dumping the work-lists.
     ###########################################################################
     logger.debug("Initialize the statistics for the checking cycle ...")
     amountMb = 0.0
     noOfFiles = 0
     for diskId in disks_to_check.keys():
-        queueDbm = dbmObjDic[diskId][0]
-        #################################################################################################
-        #jagonzal: Replace looping aproach to avoid exceptions coming from the next() method underneath
-        #          when iterating at the end of the table that are prone to corrupt the hash table object
-        #queueDbm.initKeyPtr()
-        #while (1):
-        #    fileKey, fileInfo = queueDbm.getNext()
-        #    if (not fileKey): break
-        for fileKey,dbVal in queueDbm.iteritems():
-            # jagonzal: We need to reformat the values and skip administrative elements #################
-            if b"__" in fileKey: continue
-            fileInfo = cPickle.loads(dbVal)
-            #############################################################################################
-            noOfFiles += 1
-            amountMb += float(fileInfo[ngamsDbCore.SUM1_FILE_SIZE]) / 1048576.0
-        #################################################################################################
+        workList = dbmObjDic[diskId][0]
+        noOfFiles += workList.files
+        amountMb += float(workList.size) / 1048576.0
 
     stats = _initFileCheckStatus(srvObj, amountMb, noOfFiles)
     ###########################################################################
 
-    return files_on_disk, dbmObjDic, stats
+    return unregistered, dbmObjDic, stats
 
-def _schedNextFile(srvObj,
-                   threadId, disk_ids, diskSchedDic, dbmObjDic, reqFileInfoSem):
+def _groupDisksByVolume(disks_to_check):
     """
-    Function that returns the information about the next file to be checked
-    according to the checking scheme.
+    Groups the disks to check by the physical volume (i.e., the device) their
+    mount points are in, so that only one checker reads from each volume.
 
-    The function keeps track of which disk has been allocated to which
-    Checking Sub-Thread and allocates only files from the given disk to that
-    thread.
+    Returns:  List of lists of Disk IDs, one per volume (list).
+    """
+    volumes = {}
+    for diskId, diskInfoObj in disks_to_check.items():
+        try:
+            dev = os.stat(diskInfoObj.getMountPoint()).st_dev
+        except OSError:
+            # Checking will report the problem
+            dev = diskId
+        volumes.setdefault(dev, []).append(diskId)
+    return sorted(sorted(diskIds) for diskIds in volumes.values())
 
-    srvObj:       Reference to server object (ngamsServer).
 
-    threadId:     ID of the sub-thread (string).
+def _inode(fileInfo):
+    filename = os.path.join(fileInfo[ngamsDbCore.SUM1_MT_PT],
+                            fileInfo[ngamsDbCore.SUM1_FILENAME])
+    try:
+        return os.stat(filename).st_ino
+    except OSError:
+        return 0
 
-    Returns:      List with information (format see
-                  ngamsDbCore.getFileSummary1()) for file to be checked. If
-                  there are no more files to check, None is returned
-                  (list/None).
-    """
 
-    with reqFileInfoSem:
-        while True:
-            fileInfo = None
-            if threadId not in diskSchedDic:
-                if (disk_ids):
-                    idx = random.randint(0, (len(disk_ids) - 1))
-                    diskId = disk_ids[idx]
-                    # Check if that disk is already being checked by other
-                    # threads. If yes, we don't initialize the key pointer.
-                    beingChecked = 0
-                    for thrId in diskSchedDic.keys():
-                        if (diskSchedDic[thrId] == diskId):
-                            beingChecked = 1
-                            break
-                    if (not beingChecked):
-                        dbmObjDic[diskId][0].initKeyPtr()
-                    fileKey, fileInfo = dbmObjDic[diskId][0].getNext()
-                    diskSchedDic[threadId] = diskId
-                else:
-                    break
-            else:
-                diskId = diskSchedDic[threadId]
-                fileKey, fileInfo = dbmObjDic[diskId][0].getNext()
+def _orderedFiles(workList, window=_INODE_SORT_WINDOW):
+    """
+    Yields the files to be checked from ``workList`` in an order suitable for
+    reading them sequentially. Work-lists are sorted by path already, and
+    files are further sorted by inode number in windows of ``window`` files,
+    which usually follows the order of the data on disk more closely.
+    """
+    workList.rewind()
+    batch = []
+    for fileInfo in iter(workList.getNext, None):
+        batch.append(fileInfo)
+        if len(batch) >= window:
+            for f in sorted(batch, key=_inode):
+                yield f
+            batch = []
+    for f in sorted(batch, key=_inode):
+        yield f
+
+
+class _RateLimiter(object):
+    """
+    Limits the rate at which data is read from a volume to ``mbs`` MB/s.
+    """
 
-            if (fileInfo):
-                # We got a file key + file info list, return the info.
-                break
-            else:
-                # There are no more file info lists for the given Disk ID,
-                # remove that Disk ID from the list and try to switch to
-                # another disk. Also set, the time for the last check of that
-                # disk.
-                dbmObjDic[diskId][0].cleanUp()
-                rmFile(dbmObjDic[diskId][0].getDbmName())
-                srvObj.getDb().setLastCheckDisk(diskId, time.time())
-                if diskId in disk_ids:
-                    idx = disk_ids.index(diskId)
-                    del disk_ids[idx]
-                for thrId in list(diskSchedDic):
-                    if (diskSchedDic[thrId] == diskId):
-                        del diskSchedDic[thrId]
-                if (disk_ids):
-                    idx = random.randint(0, (len(disk_ids) - 1))
-                    nextDiskId = disk_ids[idx]
-                    diskSchedDic[threadId] = nextDiskId
-                else:
-                    break
+    def __init__(self, mbs):
+        self.rate = mbs * 1048576.0
+        self.next_time = time.time()
+        self.lock = threading.Lock()
 
-        return fileInfo
+    def consume(self, stopEvt, size):
+        """
+        Accounts for ``size`` bytes to be read, sleeping as much as needed to
+        stay within the rate. Returns False if ``stopEvt`` was set meanwhile.
+        """
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.time()
+            self.next_time = max(self.next_time, now) + size / self.rate
+            delay = self.next_time - now
+        if delay > 0:
+            return not stopEvt.wait(delay)
+        return True
+
+
+def _schedNextVolume(volumes, volumesLock):
+    """
+    Returns the Disk IDs of the next volume to be checked, or None if all
+    volumes are being checked or were checked already.
+    """
+    with volumesLock:
+        if volumes:
+            return volumes.pop(0)
+        return None
 
 
 checksum_allow_evt = None
 checksum_stop_evt = None
-def do_checksum(blocksize, filename, checksum_variant):
+def do_checksum(blocksize, filename, checksum_variant, threads=1, max_rate=0):
+    # Reads are throttled block by block, so files are read at an even pace
+    rateLimiter = _RateLimiter(max_rate)
+    throttle = functools.partial(rateLimiter.consume, checksum_stop_evt)
     return ngamsFileUtils.get_checksum_interruptible(blocksize, filename, checksum_variant,
-                                                     checksum_allow_evt, checksum_stop_evt)
+                                                     checksum_allow_evt, checksum_stop_evt,
+                                                     threads=threads, throttle=throttle)
 
-def _dataCheckSubThread(srvObj,
-                        threadId,
-                        stopEvt,
-                        all_files,
-                        disk_ids,
-                        diskSchedDic,
-                        dbmObjDic,
-                        reqFileInfoSem,
-                        stats):
-    """
-    Sub-thread scheduled to carry out the actual checking. This makes
-    it possible to do the checking in several threads simultaneously if
-    the NGAS Host has multiple CPUs.
-
-    srvObj:       Reference to server object (ngamsServer).
-
-    threadId:     ID allocated to this thread (string).
+def _statFile(fileInfo):
+    filename = os.path.join(fileInfo[ngamsDbCore.SUM1_MT_PT],
+                            fileInfo[ngamsDbCore.SUM1_FILENAME])
+    try:
+        return os.stat(filename)
+    except OSError:
+        return None
 
-    Returns:      Void.
+def _checkDisk(srvObj, diskId, stopEvt, dbmObjDic, stats, checkState,
+               executor):
     """
-
-    # The globals are set at process creation time,
-    # in ngamsServer#handleStartUp
-    def external_process_executor(*args, **kwargs):
-        return srvObj.workers_pool.apply(do_checksum, args, kwargs)
-
-    while (1):
+    Checks all the files of the work-list of the given disk. If
+    ``checkState`` is given, files are checked incrementally.
+    """
+    workList = dbmObjDic[diskId][0]
+    scan = srvObj.getCfg().getDataCheckScan()
+    for fileInfo in _orderedFiles(workList):
 
         try:
             _stopDataCheckThr(stopEvt)
 
-            # Get the info for the next file to check + check it.
-            fileInfo = _schedNextFile(srvObj, threadId, disk_ids, diskSchedDic, dbmObjDic, reqFileInfoSem)
-            if (not fileInfo):
-                logger.debug("No more files in queue to check - exiting")
-                _updateFileCheckStatus(srvObj, None, None, None, None, [], stats, dbmObjDic, 1)
-                return
-
-            # Remove the entry for this file in the File Reference DBM to
-            # indicate that the file is registered in the DB.
-            filename = os.path.normpath(fileInfo[ngamsDbCore.SUM1_MT_PT]+"/" +\
-                                        fileInfo[ngamsDbCore.SUM1_FILENAME])
-            filename = str(filename)
-
-            if filename in all_files:
-                del all_files[filename]
+            # Skip files that don't need to be verified again yet. The file
+            # is stat'ed before being checked, so changes during the check
+            # cause it to be verified again in the next cycle
+            if checkState:
+                now = time.time()
+                st = _statFile(fileInfo)
+                if not checkState.needsCheck(fileInfo, st, now):
+                    _skipFileCheck(stats, fileInfo[ngamsDbCore.SUM1_FILE_SIZE] or 0)
+                    continue
 
             # Update the overall status of the checking.
             tmpReport = []
-            ngamsFileUtils.checkFile(srvObj, fileInfo, tmpReport,
-                                     srvObj.getCfg().getDataCheckScan(),
-                                     executor=external_process_executor)
+            verified = ngamsFileUtils.checkFile(srvObj, fileInfo, tmpReport,
+                                                scan, executor=executor)
             _stopDataCheckThr(stopEvt)
 
+            # Files are recorded as verified only if their checksum was
+            # actually calculated and matched
+            if checkState and not scan:
+                checkState.update(fileInfo, st, verified, now)
+
             if (not tmpReport): tmpReport = [[]]
             _updateFileCheckStatus(srvObj,
                                    fileInfo[ngamsDbCore.SUM1_FILE_SIZE],
@@ -505,14 +850,74 @@ def _dataCheckSubThread(srvObj,
                                    dbmObjDic)
 
         except StopDataCheckThreadException:
-            return
+            raise
         except Exception:
             logger.exception("Exception encountered in Data Check Sub-Thread")
-            try:
-                suspend(stopEvt, 2)
-            except StopDataCheckThreadException:
+            suspend(stopEvt, 2)
+
+    # There are no more files for the given Disk ID, set the time for the
+    # last check of that disk.
+    workList.close()
+    rmFile(workList.filename)
+    srvObj.getDb().setLastCheckDisk(diskId, time.time())
+
+def _dataCheckSubThread(srvObj,
+                        threadId,
+                        stopEvt,
+                        volumes,
+                        volumesLock,
+                        dbmObjDic,
+                        stats,
+                        checkState):
+    """
+    Sub-thread scheduled to carry out the actual checking. Each sub-thread
+    checks one volume at a time, so volumes are read in parallel but each of
+    them is read by one sub-thread only.
+
+    srvObj:       Reference to server object (ngamsServer).
+
+    threadId:     ID allocated to this thread (string).
+
+    volumes:      Disk IDs of the volumes still to be checked, as returned by
+                  _groupDisksByVolume() (list).
+
+    volumesLock:  Lock protecting ``volumes`` (threading.Lock).
+
+    checkState:   State used to check files incrementally, or None to check
+                  all files (CheckState|None).
+
+    Returns:      Void.
+    """
+
+    # The globals are set at process creation time,
+    # in ngamsServer#handleStartUp
+    # Each volume is read by one sub-thread, one file at a time, so limiting
+    # the rate of each checksum calculation limits that of the volume
+    checksumThreads = srvObj.getCfg().getChecksumThreads()
+    maxDiskRate = srvObj.getCfg().getDataCheckMaxDiskRate()
+    def external_process_executor(*args, **kwargs):
+        kwargs['threads'] = checksumThreads
+        kwargs['max_rate'] = maxDiskRate
+        return srvObj.workers_pool.apply(do_checksum, args, kwargs)
+
+    try:
+        while True:
+            _stopDataCheckThr(stopEvt)
+
+            diskIds = _schedNextVolume(volumes, volumesLock)
+            if diskIds is None:
+                logger.debug("No more volumes to check - exiting")
+                _updateFileCheckStatus(srvObj, None, None, None, None, [], stats, dbmObjDic, 1)
                 return
 
+            logger.debug("Checking volume with disks: %s", ", ".join(diskIds))
+            for diskId in diskIds:
+                _checkDisk(srvObj, diskId, stopEvt, dbmObjDic, stats,
+                           checkState, external_process_executor)
+
+    except StopDataCheckThreadException:
+        return
+
 
 def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
     """
@@ -548,6 +953,8 @@ def _genReport(srvObj, unregistered, diskDic, dbmObjDic, stats):
         report += hdrForm % ("Total Time (hours)", "%.3f" % (checkTime / 3600))
         report += hdrForm % ("Rate (MB/s)", "%.3f" % stats.check_rate)
         report += hdrForm % ("Files Checked", stats.files_checked)
+        if stats.files_skipped:
+            report += hdrForm % ("Files Unchanged", stats.files_skipped)
         report += hdrForm % ("Data Checked (MB)", "%.5f" % stats.mbs_checked)
         report += hdrForm % ("Inconsistencies",  str(noOfProbs + unRegFiles))
         report += separator
@@ -678,32 +1085,25 @@ def get_disks_to_check(srvObj):
     logger.info("Will check %d disks that are mounted in this system", len(disks_to_check))
     return disks_to_check
 
-def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
-
-    # Get list of disks that need checking
-    disks_to_check = get_disks_to_check(srvObj)
-
-    # Get the information about the files in those disks that we should check.
-    tmpFilePat = ngamsHighLevelLib.\
-                 genTmpFilename(srvObj.getCfg(),
-                                NGAMS_DATA_CHECK_THR)
-    try:
-        all_files, dbmObjDic, stats = _dumpFileInfo(srvObj, disks_to_check, tmpFilePat, stopEvt)
-    finally:
-        rmFile(tmpFilePat + "*")
+def _runSubThreads(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt,
+                   disks_to_check, dbmObjDic, stats, checkState):
+    """
+    Runs the sub-threads checking the files of the given disks and waits
+    until they finish.
 
-    # is allocated for each up to the limit defined in the
-    # configuration.
-    n_threads = min(len(disks_to_check), srvObj.getCfg().getDataCheckMaxProcs())
+    Returns:   Time at which the checking finished (float).
+    """
+    # A sub-thread is allocated for each volume up to the limit defined in
+    # the configuration.
+    volumes = _groupDisksByVolume(disks_to_check)
+    volumesLock = threading.Lock()
+    n_threads = min(len(volumes), srvObj.getCfg().getDataCheckMaxProcs())
 
-    diskSchedDic = {}
-    reqFileInfoSem = threading.Lock()
-    disk_ids = list(disks_to_check.keys())
     threads = {}
     for n in range(n_threads):
         threadName = "%s-%d" % (NGAMS_DATA_CHECK_THR, n)
-        args = (srvObj, threadName, stopEvt, all_files, disk_ids, diskSchedDic,
-                dbmObjDic, reqFileInfoSem, stats)
+        args = (srvObj, threadName, stopEvt, volumes, volumesLock,
+                dbmObjDic, stats, checkState)
         logger.debug("Starting Data Check Sub-Thread: %s", threadName)
         t = threading.Thread(target=_dataCheckSubThread, name=threadName, args=args)
         t.setDaemon= True
@@ -722,7 +1122,7 @@ def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
             # Be nice and join sub-threads
             for t in threads.values():
                 t.join(10)
-                if t.isAlive():
+                if t.is_alive():
                     logger.warning("Thread %r didn't cleanly shut down within 10 seconds", t)
 
             # Let's stop ourselves now
@@ -731,15 +1131,45 @@ def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
         else:
             # Check if all the sub-threads are still running
             # or if the check cycle is completed.
-            threads = {n: t for n, t in threads.items() if t.isAlive()}
+            threads = {n: t for n, t in threads.items() if t.is_alive()}
             if not threads:
-                lastCheckTime = time.time()
-                break
+                return time.time()
+
+def _data_check_cycle(srvObj, stopEvt, checksum_allow_evt, checksum_stop_evt):
+
+    # Get list of disks that need checking
+    disks_to_check = get_disks_to_check(srvObj)
+
+    # Get the information about the files in those disks that we should check.
+    tmpFilePat = ngamsHighLevelLib.\
+                 genTmpFilename(srvObj.getCfg(),
+                                NGAMS_DATA_CHECK_THR)
+    try:
+        unregistered, dbmObjDic, stats = _dumpFileInfo(srvObj, disks_to_check, tmpFilePat, stopEvt)
+    finally:
+        rmFile(tmpFilePat + "*")
+
+    # Files are checked incrementally if configured so
+    checkState = None
+    cfg = srvObj.getCfg()
+    if cfg.getDataCheckIncremental():
+        cacheDir = os.path.join(cfg.getRootDirectory(), NGAMS_CACHE_DIR)
+        checkState = CheckState(os.path.join(cacheDir, NGAMS_DATA_CHECK_THR + "_STATE.sqlite"),
+                                isoTime2Secs(cfg.getDataCheckFullCycle()))
+        checkState.startCycle(disks_to_check, time.time())
+    try:
+        lastCheckTime = _runSubThreads(srvObj, stopEvt, checksum_allow_evt,
+                                       checksum_stop_evt, disks_to_check,
+                                       dbmObjDic, stats, checkState)
+        if checkState:
+            checkState.prune(lastCheckTime)
+    finally:
+        if checkState:
+            checkState.close()
 
-    # Check again for non-registered files.
-    # The sub-threads remove individual items from all_files after they
-    # check each file, so any files left there were not checked
-    unregistered = _crossCheckNonRegFiles(srvObj, all_files, disks_to_check)
+    # Check again for non-registered files, some of them might have been
+    # registered after the work-lists were dumped
+    unregistered = _crossCheckNonRegFiles(srvObj, unregistered, disks_to_check)
 
     # Send out check report if any discrepancies found + send
     # out notification message according to configuration.
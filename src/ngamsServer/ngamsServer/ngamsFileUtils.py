@@ -36,13 +36,19 @@ import binascii
 import collections
 import contextlib
 import functools
+import hashlib
+import itertools
 import logging
+import multiprocessing.pool
+import operator
 import os
 import re
 import struct
+import threading
 import time
 
 import six
+from six.moves import queue  # @UnresolvedImport
 
 from ngamsLib import ngamsDbCore, ngamsDiskInfo, ngamsFileInfo, \
     ngamsLib, ngamsStatus, ngamsHighLevelLib, ngamsHttpUtils
@@ -58,6 +64,18 @@ try:
 except ImportError:
     _crc32c_available = False
 
+_xxhash_available = True
+try:
+    import xxhash
+except ImportError:
+    _xxhash_available = False
+
+_blake3_available = True
+try:
+    import blake3
+except ImportError:
+    _blake3_available = False
+
 logger = logging.getLogger(__name__)
 
 # The checksum_info fields are:
@@ -66,10 +84,17 @@ logger = logging.getLogger(__name__)
 #  * final: Converts the final checksum to get the final value
 #  * from_bytes: converts a sequence of bytes into a checksum value
 #
-# In NGAS checksum values are treated as integers (and then stored as their
+#  * equals: compares two checksum values
+#  * combine: for CRC variants, combines the checksums of two consecutive
+#    pieces of data, given the length of the second one, into the checksum of
+#    both. None for variants that cannot be combined
+#
+# In NGAS CRC values are treated as integers (and then stored as their
 # string representation in the database), which is why the `final` and
-# `from_bytes` functions need to be aligned.
-checksum_info = collections.namedtuple('crc_info', 'init method final from_bytes equals')
+# `from_bytes` functions need to be aligned. Cryptographic and other hash
+# variants use their hexadecimal digest instead, and their running value is
+# the hash object itself (None initially).
+checksum_info = collections.namedtuple('crc_info', 'init method final from_bytes equals combine')
 
 
 def parse_host_id(host_id):
@@ -304,6 +329,180 @@ def lookup_partner_site_file(ngas_server,
     return file_attribute_list
 
 
+def _select_local_file(srvObj, reqPropsObj, fileId, candidates, diskInfoDic):
+    """
+    Returns the first of the local `candidates` whose file is accessible,
+    or None if there is none.
+    """
+
+    # Check first if the local system supports retrieve requests.
+    # (if relevant).
+    if (reqPropsObj and reqPropsObj.getCmd() == NGAMS_RETRIEVE_CMD and
+        not srvObj.getCfg().getAllowRetrieveReq()):
+        return None
+
+    for candidate in candidates:
+        _, fileInfoObj, host = candidate
+        diskInfoObj = diskInfoDic[fileInfoObj.getDiskId()]
+
+        # Check if the file is accessible.
+        filename = os.path.normpath(diskInfoObj.getMountPoint()+"/" +\
+                                    fileInfoObj.getFilename())
+        logger.debug("Checking if local file with name: %s is available", filename)
+        if (not os.path.exists(filename)):
+            logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
+        else:
+            logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
+            return candidate
+    return None
+
+
+def _probe_remote_file(srvObj, fileId, fileInfoObj, hostInfo, cancelled):
+    """
+    Checks via a STATUS/file_access request if the given file is accessible
+    on the remote host described by `hostInfo`. The check is abandoned if
+    the `cancelled` event is set before the request is sent.
+    """
+    host = hostInfo.getHostId()
+    port = hostInfo.getSrvPort()
+    logger.debug("Checking if file with ID/Version: %s/%s " +\
+                 "is available on host/port: %s/%s",
+                 fileInfoObj.getFileId(), str(fileInfoObj.getFileVersion()),
+                 host, str(port))
+
+    # If a server hosting a file is suspended, it is woken up
+    # to be able to check if the file is really accessible.
+    if (hostInfo.getSrvSuspended() == 1):
+        if cancelled.is_set():
+            return False
+        logger.debug("Server hosting requested file (%s/%s) is suspended " + \
+                     "- waking up server ...",
+                     host, str(port))
+        try:
+            ngamsSrvUtils.wakeUpHost(srvObj, host)
+            logger.debug("Suspended server hosting requested file (%s/%s) " +\
+                         "has been woken up",
+                         host, str(port))
+        except Exception:
+            logger.exception("Error waking up server hosting selected " +\
+                    "file")
+            return False
+
+    # The file is hosted on a host, which is not suspended or
+    # which was successfully woken up.
+    if cancelled.is_set():
+        return False
+    pars = [["file_access", fileInfoObj.getFileId()]]
+    if (fileInfoObj.getFileVersion() != -1):
+        pars.append(["file_version", fileInfoObj.getFileVersion()])
+    authHdr = ngamsSrvUtils.genIntAuthHdr(srvObj)
+    resp = ngamsHttpUtils.httpGet(hostInfo.getIpAddress(), port, NGAMS_STATUS_CMD,
+                                  pars=pars, auth=authHdr)
+    with contextlib.closing(resp):
+        data = resp.read()
+    statusObj = ngamsStatus.ngamsStatus().unpackXmlDoc(data, 1)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Result of File Access Query: %s",
+                     re.sub("\n", "", str(statusObj.genXml().toprettyxml('  ', '\n'))))
+    if ((statusObj.getMessage().\
+         find("NGAMS_INFO_FILE_AVAIL") == -1)):
+        logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
+        return False
+    logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
+    return True
+
+
+def _probe_remote_files(srvObj, fileId, candidates, hostDic):
+    """
+    Checks concurrently which of the remote `candidates` (all with the same
+    priority) is accessible, and returns the first one found to be so, or None
+    if there is none. Once a candidate is found the rest of the checks are
+    cancelled, and their results ignored.
+    """
+
+    cancelled = threading.Event()
+    results = queue.Queue()
+    def probe(candidate):
+        _, fileInfoObj, host = candidate
+        try:
+            available = _probe_remote_file(srvObj, fileId, fileInfoObj,
+                                           hostDic[host], cancelled)
+        except Exception:
+            logger.exception("Error while checking if file %s is available on host %s",
+                             fileId, host)
+            available = False
+        results.put((candidate, available))
+
+    if len(candidates) == 1:
+        probe(candidates[0])
+    else:
+        for candidate in candidates:
+            t = threading.Thread(target=probe, args=(candidate,),
+                                 name='FileProbe-%s' % candidate[2])
+            t.daemon = True
+            t.start()
+
+    try:
+        for _ in candidates:
+            candidate, available = results.get()
+            if available:
+                return candidate
+    finally:
+        cancelled.set()
+    return None
+
+
+class _file_location_cache(object):
+    """
+    A cache holding the results of recent file location lookups, indexed by
+    File ID. Entries expire after a given amount of time, and can be
+    explicitly invalidated when files are added or removed.
+    """
+
+    _MAX_FILES = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locations = {}
+
+    def get(self, fileId, key):
+        now = time.time()
+        with self._lock:
+            entry = self._locations.get(fileId, {}).get(key)
+        if entry is None or entry[0] < now:
+            return None
+        return list(entry[1])
+
+    def put(self, ttl, fileId, key, location):
+        now = time.time()
+        with self._lock:
+            if len(self._locations) >= self._MAX_FILES:
+                self._locations = {
+                    fid: entries for fid, entries in self._locations.items()
+                    if any(expiration >= now for expiration, _ in entries.values())
+                }
+                if len(self._locations) >= self._MAX_FILES:
+                    self._locations.clear()
+            self._locations.setdefault(fileId, {})[key] = (now + ttl, tuple(location))
+
+    def invalidate(self, fileId=None):
+        with self._lock:
+            if fileId is None:
+                self._locations.clear()
+            else:
+                self._locations.pop(fileId, None)
+
+_file_locations = _file_location_cache()
+
+def invalidate_file_location(fileId=None):
+    """
+    Forgets the cached locations of file `fileId`, or of all files if
+    no File ID is given.
+    """
+    _file_locations.invalidate(fileId)
+
+
 def _locateArchiveFile(srvObj,
                        fileId,
                        fileVersion,
@@ -425,97 +624,33 @@ def _locateArchiveFile(srvObj,
 
     # Check if the files are accessible - when the first accessible file
     # in the fileList is found, the information is returned as the file wanted.
-    # To check the file accessibility, it is also checked if the NG/AMS
-    # 'responsible' for the file, allows for Retrieve Requests (only done
-    # in connection with a Retrieve Request).
+    # Candidates are sorted by location, and those in the same location
+    # have the same priority, so they are checked together.
     logger.debug("Checking which of the candidate files should be selected ...")
-    foundFile   = 0
+    selected = None
     for fileVer in fileVerList:
-        if (foundFile): break
-
-        for fileInfo in candFileDic[fileVer]:
-            location    = fileInfo[0]
-            fileInfoObj = fileInfo[1]
-            host        = fileInfo[2]
-            diskInfoObj = diskInfoDic[fileInfoObj.getDiskId()]
-            port        = hostDic[host].getSrvPort()
-
-            logger.debug("Checking candidate file with ID: %s on host/port: %s/%s. " + \
-                         "Location: %s",
-                         fileInfoObj.getFileId(), host, str(port), location)
-
-            # If the file is stored locally we check if it is accessible,
-            # otherwise we send a STATUS/file_access request to the
-            # host in question.
-            if (location == NGAMS_HOST_LOCAL):
-                # Check first if the local system supports retrieve requests.
-                # (if relevant).
-                if (reqPropsObj):
-                    if (reqPropsObj.getCmd() == NGAMS_RETRIEVE_CMD):
-                        if (not srvObj.getCfg().getAllowRetrieveReq()):
-                            continue
-
-                # Check if the file is accessible.
-                filename = os.path.normpath(diskInfoObj.getMountPoint()+"/" +\
-                                            fileInfoObj.getFilename())
-                logger.debug("Checking if local file with name: %s is available", filename)
-                if (not os.path.exists(filename)):
-                    logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
-                else:
-                    logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
-                    foundFile = 1
-                    break
+        groups = itertools.groupby(candFileDic[fileVer], key=operator.itemgetter(0))
+        for location, candidates in groups:
+            if location == NGAMS_HOST_LOCAL:
+                selected = _select_local_file(srvObj, reqPropsObj, fileId,
+                                              list(candidates), diskInfoDic)
             else:
-                logger.debug("Checking if file with ID/Version: %s/%s " +\
-                             "is available on host/port: %s/%s",
-                             fileInfoObj.getFileId(), str(fileInfoObj.getFileVersion()),
-                             host, str(port))
-
-                # If a server hosting a file is suspended, it is woken up
-                # to be able to check if the file is really accessible.
-                if (hostDic[host].getSrvSuspended() == 1):
-                    logger.debug("Server hosting requested file (%s/%s) is suspended " + \
-                                 "- waking up server ...",
-                                 host, str(port))
-                    try:
-                        ngamsSrvUtils.wakeUpHost(srvObj, host)
-                        logger.debug("Suspended server hosting requested file (%s/%s) " +\
-                                     "has been woken up",
-                                     host, str(port))
-                    except Exception:
-                        logger.exception("Error waking up server hosting selected " +\
-                                "file")
-                        continue
-
-                # The file is hosted on a host, which is not suspended or
-                # which was successfully woken up.
-                pars = [["file_access", fileInfoObj.getFileId()]]
-                if (fileInfoObj.getFileVersion() != -1):
-                    pars.append(["file_version", fileInfoObj.getFileVersion()])
-                ipAddress = hostDic[host].getIpAddress()
-                authHdr = ngamsSrvUtils.genIntAuthHdr(srvObj)
-                resp = ngamsHttpUtils.httpGet(ipAddress, port, NGAMS_STATUS_CMD,
-                                        pars=pars, auth=authHdr)
-                with contextlib.closing(resp):
-                    data = resp.read()
-                statusObj = ngamsStatus.ngamsStatus().unpackXmlDoc(data, 1)
-
-                if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug("Result of File Access Query: %s",
-                                 re.sub("\n", "", str(statusObj.genXml().toprettyxml('  ', '\n'))))
-                if ((statusObj.getMessage().\
-                     find("NGAMS_INFO_FILE_AVAIL") == -1)):
-                    logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
-                else:
-                    logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
-                    foundFile = 1
-                    break
+                selected = _probe_remote_files(srvObj, fileId,
+                                               list(candidates), hostDic)
+            if selected:
+                break
+        if selected:
+            break
 
     # If no file was found we raise an exception.
-    if (not foundFile):
+    if not selected:
         errMsg = genLog("NGAMS_ER_UNAVAIL_FILE", [fileId])
         raise Exception(errMsg)
 
+    location, fileInfoObj, host = selected
+    diskInfoObj = diskInfoDic[fileInfoObj.getDiskId()]
+    port = hostDic[host].getSrvPort()
+
     # The file was found, get the info necessary for the acquiring the file.
     ipAddress = hostDic[host].getIpAddress()
     srcFileInfo = [location, host, ipAddress, port,
@@ -579,6 +714,17 @@ def locateArchiveFile(srvObj,
 
     Returns:      List with information about file location (list).
     """
+
+    # Locations found recently are reused for a short while
+    ttl = srvObj.getCfg().getFileLocationCacheTime()
+    cmd = reqPropsObj.getCmd() if reqPropsObj else None
+    key = ('locate', fileVersion, diskId, hostId, cmd, include_compression)
+    if ttl > 0:
+        location = _file_locations.get(fileId, key)
+        if location is not None:
+            logger.debug("Using cached location for file %s: %r", fileId, location)
+            return location
+
     # Get a list with the candidate files matching the query conditions.
     res = srvObj.getDb().getFileInfoFromFileId(fileId, fileVersion, diskId,
                                                  ignore=0, dbCursor=False)
@@ -589,8 +735,11 @@ def locateArchiveFile(srvObj,
         file_info = ngamsFileInfo.ngamsFileInfo().unpackSqlResult(r)
         all_info.append((file_info, r[-2], r[-1]))
 
-    return _locateArchiveFile(srvObj, fileId, fileVersion, diskId, hostId,
-                              reqPropsObj, all_info, include_compression)
+    location = _locateArchiveFile(srvObj, fileId, fileVersion, diskId, hostId,
+                                  reqPropsObj, all_info, include_compression)
+    if ttl > 0:
+        _file_locations.put(ttl, fileId, key, location)
+    return location
 
 
 def quickFileLocate(srvObj,
@@ -621,6 +770,14 @@ def quickFileLocate(srvObj,
                           <Mountpoint>, <Filename>, <File Version>,
                           <format>) (tuple).
     """
+    ttl = srvObj.getCfg().getFileLocationCacheTime()
+    key = ('quick', fileVersion, diskId, hostId, domain, include_compression)
+    if ttl > 0:
+        location = _file_locations.get(fileId, key)
+        if location is not None:
+            logger.debug("Using cached location for file %s: %r", fileId, location)
+            return location
+
     res = srvObj.getDb().getFileSummary3(fileId, hostId, domain, diskId,
                                          fileVersion, cursor=False,
                                          include_compression=include_compression)
@@ -630,7 +787,10 @@ def quickFileLocate(srvObj,
             location = NGAMS_HOST_LOCAL
         else:
             location = NGAMS_HOST_CLUSTER
-        return [location] + list(res[0])
+        location = [location] + list(res[0])
+        if ttl > 0:
+            _file_locations.put(ttl, fileId, key, location)
+        return location
 
     return (8 if not include_compression else 9) * (None,)
 
@@ -646,11 +806,14 @@ def checkFile(srvObj,
     is used internally by this method; otherwise `get_checksum` is used.
     If `executor` is given, then it is used to carry out the execution of the
     checksum calculation; otherwise `get_checksum` is used.
+    Returns whether the checksum of the file was calculated and matched
+    the one stored in the DB.
     """
 
     executor = executor or get_checksum
 
     foundProblem  = 0
+    verified      = False
     fileInfo      = sum1FileInfo
     diskId        = fileInfo[ngamsDbCore.SUM1_DISK_ID]
     slotId        = fileInfo[ngamsDbCore.SUM1_SLOT_ID]
@@ -740,7 +903,7 @@ def checkFile(srvObj,
                     # up so we ignore it here.
                     rmFile(fileChecked)
                     logger.exception("Error while checking file %s", filename)
-                    return
+                    return False
             else:
                 checksumFile = ""
             if not checksumDb and checksumFile:
@@ -756,12 +919,15 @@ def checkFile(srvObj,
                                     fileId, fileVersion, slotId, diskId,
                                     filename])
             elif not checksum_info.equals(checksumDb, checksumFile):
+                foundProblem = 1
                 logger.error("File %s has inconsistent checksum! file/db: %s / %s",
                              filename, str(checksumFile), checksumDb)
                 checkReport.append(["ERROR: Inconsistent checksum found",
                                     fileId, fileVersion, slotId, diskId,
                                     filename])
                 srvObj.db.set_valid_checksum(fileId, fileVersion, diskId, False)
+            else:
+                verified = True
 
         # If file is OK but is marked as 'bad', reset the flag.
         if not foundProblem:
@@ -772,6 +938,7 @@ def checkFile(srvObj,
 
         # Reset file indicating which data file is being checked.
         rmFile(fileChecked)
+        return verified
     except Exception:
         if (fileCheckedFo): fileCheckedFo.close()
         # Reset file indicating which data file is being checked.
@@ -813,6 +980,21 @@ CHECKSUM_NULL = -1
 CHECKSUM_CRC32_INCONSISTENT = 0
 CHECKSUM_CRC32C = 1
 CHECKSUM_CRC32Z = 2
+CHECKSUM_MD5 = 3
+CHECKSUM_SHA256 = 4
+CHECKSUM_XXH3 = 5
+CHECKSUM_BLAKE3 = 6
+
+_checksum_names = {
+    CHECKSUM_CRC32_INCONSISTENT: 'crc32',
+    CHECKSUM_CRC32C: 'crc32c',
+    CHECKSUM_CRC32Z: 'crc32z',
+    CHECKSUM_MD5: 'md5',
+    CHECKSUM_SHA256: 'sha256',
+    CHECKSUM_XXH3: 'xxh3',
+    CHECKSUM_BLAKE3: 'blake3',
+}
+_checksum_variants = {name: variant for variant, name in _checksum_names.items()}
 
 def _normalize_variant(variant_or_name):
 
@@ -828,12 +1010,10 @@ def _normalize_variant(variant_or_name):
         # filename when invoked.
         # These two are the names stored at the database of those plugins, although
         # the second one is simply a dummy name
-        if variant in ('ngamsGenCrc32', 'StreamCrc32', 'crc32'):
+        if variant in ('ngamsGenCrc32', 'StreamCrc32'):
             variant = CHECKSUM_CRC32_INCONSISTENT
-        elif variant == 'crc32c':
-            variant = CHECKSUM_CRC32C
-        elif variant == 'crc32z':
-            variant = CHECKSUM_CRC32Z
+        elif variant in _checksum_variants:
+            variant = _checksum_variants[variant]
         else:
             variant = int(variant)
 
@@ -848,14 +1028,80 @@ def _filter_none(cond):
         return cond(x, y)
     return wrapped
 
+def _gf2_matrix_times(mat, vec):
+    s = 0
+    for row in mat:
+        if not vec:
+            break
+        if vec & 1:
+            s ^= row
+        vec >>= 1
+    return s
+
+def _gf2_matrix_square(mat):
+    return [_gf2_matrix_times(mat, row) for row in mat]
+
+def _crc32_combiner(poly):
+    """
+    Returns a function that combines two CRCs calculated with the given
+    (reflected) polynomial, as zlib's crc32_combine does
+    """
+    def combine(crc1, crc2, len2):
+        crc1 &= 0xffffffff
+        crc2 &= 0xffffffff
+        if len2 <= 0:
+            return crc1
+
+        # Operator for one zero bit, and then for two and four zero bits
+        odd = [poly] + [1 << n for n in range(31)]
+        even = _gf2_matrix_square(odd)
+        odd = _gf2_matrix_square(even)
+
+        # Apply len2 zero bytes to crc1
+        while True:
+            even = _gf2_matrix_square(odd)
+            if len2 & 1:
+                crc1 = _gf2_matrix_times(even, crc1)
+            len2 >>= 1
+            if not len2:
+                break
+            odd = _gf2_matrix_square(even)
+            if len2 & 1:
+                crc1 = _gf2_matrix_times(odd, crc1)
+            len2 >>= 1
+            if not len2:
+                break
+        return crc1 ^ crc2
+    return combine
+
+_crc32_combine = _crc32_combiner(0xedb88320)
+_crc32c_combine = _crc32_combiner(0x82f63b78)
+
+def _hash_checksum_info(new):
+    """Returns the checksum_info for a hash created by calling `new`"""
+    def method(data, h):
+        if h is None:
+            h = new()
+        h.update(data)
+        return h
+    def final(h):
+        return (h or new()).hexdigest()
+    def from_bytes(x):
+        return binascii.hexlify(x).decode('ascii')
+    def equals(x, y):
+        return str(x).strip().lower() == str(y).strip().lower()
+    return checksum_info(None, method, final, from_bytes, _filter_none(equals), None)
+
 def get_checksum_info(variant_or_name):
     """
-    Given a CRC variant, this method returns the method that should be
-    continuously called to calculate the CRC of a given byte stream.
+    Given a checksum variant, this method returns the method that should be
+    continuously called to calculate the checksum of a given byte stream.
 
     The variant_or_name argument can be a number, where 0 is python's binascii
-    crc32 implementation and 1 is Intel's SSE 4.2 CRC32c implementation, or a
-    name indicating one of the old NGAMS plug-in names for performing CRC.
+    crc32 implementation, 1 is Intel's SSE 4.2 CRC32c implementation, 2 is
+    the masked binascii crc32, 3 is MD5, 4 is SHA-256, 5 is xxHash's XXH3 (64
+    bits) and 6 is BLAKE3, or the name of one of them or of the old NGAMS
+    plug-ins for performing CRC.
     The special value -1 means that no checksum is performed, and thus this
     method returns None
     """
@@ -868,41 +1114,106 @@ def get_checksum_info(variant_or_name):
         # python version <2.6 returned signed/unsigned depending on the platform,
         # 2.6+ returns always signed, 3+ returns always unsigned).
         fmt = '!i' if six.PY2 else '!I'
-        return checksum_info(0, binascii.crc32, lambda x: x, lambda x: struct.unpack(fmt, x)[0], _filter_none(lambda x, y: (int(x) & 0xffffffff) == (int(y) & 0xffffffff)))
+        return checksum_info(0, binascii.crc32, lambda x: x, lambda x: struct.unpack(fmt, x)[0], _filter_none(lambda x, y: (int(x) & 0xffffffff) == (int(y) & 0xffffffff)), _crc32_combine)
     elif variant == CHECKSUM_CRC32C:
         if not _crc32c_available:
             raise Exception('Intel SSE 4.2 CRC32c instruction is not available')
-        return checksum_info(0, crc32c.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)))
+        return checksum_info(0, crc32c.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)), _crc32c_combine)
     elif variant == CHECKSUM_CRC32Z:
         # A consistent way of using binascii.crc32.
-        return checksum_info(0, binascii.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)))
+        return checksum_info(0, binascii.crc32, lambda x: x & 0xffffffff, lambda x: struct.unpack('!I', x)[0], _filter_none(lambda x, y: int(x) == int(y)), _crc32_combine)
+    elif variant == CHECKSUM_MD5:
+        return _hash_checksum_info(hashlib.md5)
+    elif variant == CHECKSUM_SHA256:
+        return _hash_checksum_info(hashlib.sha256)
+    elif variant == CHECKSUM_XXH3:
+        if not _xxhash_available:
+            raise Exception('xxhash package is not available')
+        return _hash_checksum_info(xxhash.xxh3_64)
+    elif variant == CHECKSUM_BLAKE3:
+        if not _blake3_available:
+            raise Exception('blake3 package is not available')
+        return _hash_checksum_info(blake3.blake3)
     raise Exception('Unknown CRC variant: %r' % (variant_or_name,))
 
 def get_checksum_name(variant_or_name):
     """
-    Given a CRC variant, this method returns the name used to denote that
-    variant.
-
-    The variant_or_name argument can be a number, where 0 is python's binascii
-    crc32 implementation and 1 is Intel's SSE 4.2 CRC32c implementation, or a
-    name indicating one of the old NGAMS plug-in names for performing CRC.
+    Given a checksum variant, this method returns the name used to denote that
+    variant (see get_checksum_info).
     The special value -1 means that no checksum is performed, and thus this
-    method returns 'nocrc'
+    method returns None
     """
     variant = _normalize_variant(variant_or_name)
     if variant == CHECKSUM_NULL:
         return None
-    if variant == CHECKSUM_CRC32_INCONSISTENT:
-        return 'crc32'
-    elif variant == CHECKSUM_CRC32C:
-        return 'crc32c'
-    elif variant == CHECKSUM_CRC32Z:
-        return 'crc32z'
+    if variant in _checksum_names:
+        return _checksum_names[variant]
     raise Exception('Unknown CRC variant: %d' % (variant_or_name,))
 
-def get_checksum(blocksize, fin, checksum_variant):
+# Files are checksummed in segments of at least this size in parallel
+_MIN_CHECKSUM_SEGMENT_SIZE = 16 * 1024 * 1024
+
+def _checksum_segments(blocksize, filename, crc_info, threads, read_block=None):
+    """
+    Calculates the checksum of `filename` by splitting it in up to `threads`
+    segments that are checksummed concurrently and then combined. Returns
+    None if the file is not worth splitting or the checksum variant doesn't
+    allow combining checksums.
+
+    `read_block`, if given, is invoked before each block is read; it should
+    return False to abort the calculation.
+    """
+    if threads <= 1 or crc_info.combine is None:
+        return None
+    size = os.path.getsize(filename)
+    n_segments = min(threads, size // _MIN_CHECKSUM_SEGMENT_SIZE)
+    if n_segments <= 1:
+        return None
+
+    # Segments are aligned to the block size
+    segment_size = -(-size // n_segments)
+    segment_size = -(-segment_size // blocksize) * blocksize
+    segments = [(offset, min(segment_size, size - offset))
+                for offset in range(0, size, segment_size)]
+
+    def checksum_segment(segment):
+        offset, length = segment
+        crc_m = crc_info.method
+        crc = crc_info.init
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            while length > 0:
+                if read_block and not read_block():
+                    return None
+                block = f.read(min(blocksize, length))
+                if not block:
+                    raise IOError('Unexpected end of file in %s' % (filename,))
+                crc = crc_m(block, crc)
+                length -= len(block)
+        return crc
+
+    pool = multiprocessing.pool.ThreadPool(len(segments))
+    try:
+        crcs = pool.map(checksum_segment, segments)
+    finally:
+        pool.close()
+        pool.join()
+    if None in crcs:
+        return None
+
+    crc = crcs[0]
+    for (_, length), segment_crc in zip(segments[1:], crcs[1:]):
+        crc = crc_info.combine(crc, segment_crc, length)
+    return crc
+
+def get_checksum(blocksize, fin, checksum_variant, threads=1, final=True):
     """
     Returns the checksum of a file (or file object) using the given checksum type.
+
+    If `threads` is greater than 1, and the checksum type allows it,
+    big files are checksummed in that many segments concurrently.
+    If `final` is False the running checksum value is returned, which can be
+    used to continue calculating the checksum over more data.
     """
     crc_info = get_checksum_info(checksum_variant)
     if crc_info is None:
@@ -910,6 +1221,13 @@ def get_checksum(blocksize, fin, checksum_variant):
 
     crc_m = crc_info.method
 
+    # Big enough files can be checksummed in parallel
+    crc = None
+    if isinstance(fin, six.string_types):
+        crc = _checksum_segments(blocksize, fin, crc_info, threads)
+    if crc is not None:
+        return crc_info.final(crc) if final else crc
+
     # fin can be a filename, in which case we open (and then close) it
     my_fileobj = None
     fileobj = fin
@@ -933,11 +1251,13 @@ def get_checksum(blocksize, fin, checksum_variant):
             except:
                 pass
 
-    crc = crc_info.final(crc)
+    if final:
+        crc = crc_info.final(crc)
     return crc
 
 def get_checksum_interruptible(blocksize, filename, checksum_variant,
-                               checksum_allow_evt, checksum_stop_evt):
+                               checksum_allow_evt, checksum_stop_evt,
+                               threads=1, throttle=None):
     """
     Like get_checksum, but the inner loop's execution is conditioned by two
     events to signal a full stop, and whether the execution of the inner loop
@@ -945,16 +1265,32 @@ def get_checksum_interruptible(blocksize, filename, checksum_variant,
 
     When the caller sets the `stop_evt`, the `allowed_evt` should also be set;
     otherwise the execution will hang indefinitely.
+
+    If `throttle` is given, it is invoked with the block size before each
+    block is read, possibly from several threads; it can sleep to limit the
+    read rate, and should return False to abort the calculation.
     """
     crc_info = get_checksum_info(checksum_variant)
     if crc_info is None:
         return None
+
+    def read_block():
+        checksum_allow_evt.wait()
+        if throttle and not throttle(blocksize):
+            return False
+        return not checksum_stop_evt.is_set()
+
+    crc = _checksum_segments(blocksize, filename, crc_info, threads, read_block)
+    if crc is not None:
+        return crc_info.final(crc)
+    if checksum_stop_evt.is_set():
+        return
+
     crc_m = crc_info.method
     crc = crc_info.init
     with open(filename, 'rb') as f:
         for block in iter(functools.partial(f.read, blocksize), b''):
-            checksum_allow_evt.wait()
-            if checksum_stop_evt.is_set():
+            if not read_block():
                 return
             crc = crc_m(block, crc)
     crc = crc_info.final(crc)
@@ -986,7 +1322,9 @@ def check_checksum(srvObj, fio, filename):
         blockSize = srvObj.getCfg().getBlockSize()
         if blockSize == -1:
             blockSize = 4096
-        current_checksum = str(get_checksum(blockSize, filename, crc_variant))
+        threads = srvObj.getCfg().getChecksumThreads()
+        current_checksum = str(get_checksum(blockSize, filename, crc_variant,
+                                            threads=threads))
         if not checksum_info.equals(current_checksum, stored_checksum):
             msg = "Illegal checksum (found: %s, expected %s) on file %s/%s/%s" % \
                   (current_checksum, stored_checksum, fio.getDiskId(), fio.getFileId(), fio.getFileVersion())
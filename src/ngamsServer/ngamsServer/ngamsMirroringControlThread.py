@@ -41,7 +41,6 @@ import base64
 import contextlib
 import copy
 import errno
-import functools
 import logging
 import os
 import random
@@ -63,7 +62,7 @@ from ngamsLib.ngamsCore import \
     NGAMS_MIR_CONTROL_THR, \
     NGAMS_REARCHIVE_CMD,\
     NGAMS_STATUS_CMD,  \
-    decompressFile, get_contact_ip, rmFile, toiso8601
+    decompress_stream, get_contact_ip, rmFile, toiso8601
 from ngamsLib import ngamsFileInfo, ngamsStatus, ngamsHighLevelLib, ngamsDbm, \
     ngamsMirroringRequest, ngamsLib, ngamsHttpUtils
 
@@ -593,13 +592,10 @@ def retrieve_file_list(ngams_server, mirror_source, node, port, status_cmd_pars,
                     raise Exception("Error accessing NGAS Node: %s/%d. Error: %s"
                                     % (node, port, status_obj.getMessage()))
 
-                with open(raw_file_list_compressed, 'wb') as raw_file_obj:
-                    response_read_buffer = functools.partial(response.read, 65536)
-                    for response_buffer in iter(response_read_buffer, ''):
-                        raw_file_obj.write(response_buffer)
-
-            # Decompress the file (it is always transferred compressed)
-            file_list_raw = decompressFile(raw_file_list_compressed)
+                # Decompress the file list as it is received (it is always transferred compressed)
+                file_list_raw = raw_file_list_compressed[:-3]
+                with open(file_list_raw, 'wb') as raw_file_obj:
+                    decompress_stream(response, raw_file_obj)
 
             # Get the File List ID in connection with this request if not already extracted.
             # Get the number of remaining items to retrieve info about. It is necessary to scan through the beginning
@@ -49,6 +49,11 @@ import time
 import traceback
 import uuid
 
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
 import six
 from six.moves import reduce # @UnresolvedImport
 from six.moves import socketserver # @UnresolvedImport
@@ -64,7 +69,8 @@ from ngamsLib.ngamsCore import genLog, getNgamsVersion, \
     NGAMS_SUCCESS, NGAMS_FAILURE, NGAMS_OFFLINE_STATE,\
     NGAMS_IDLE_SUBSTATE, NGAMS_BUSY_SUBSTATE, NGAMS_NOTIF_ERROR,\
     NGAMS_NOT_SET, NGAMS_XML_MT, NGAMS_RETRIEVE_CMD, loadPlugInEntryPoint,\
-    isoTime2Secs, toiso8601
+    isoTime2Secs, toiso8601, NGAMS_HTTP_PARTIAL_CONTENT, \
+    NGAMS_HTTP_RANGE_NOT_SATISFIABLE
 from ngamsLib import ngamsHighLevelLib, ngamsLib, ngamsEvent, ngamsHttpUtils,\
     utils, logutils
 from ngamsLib import ngamsDb, ngamsConfig, ngamsReqProps, pysendfile
@@ -91,12 +97,21 @@ def get_all_ipaddrs():
     return [addr['addr'] for addrs in inet_addrs for addr in addrs if 'addr' in addr]
 
 class thread_pool_mixin(socketserver.ThreadingMixIn):
-    """Uses a thread pool to process requests"""
+    """
+    Uses a thread pool to process requests.
+
+    When HTTP keep-alive is enabled, connections that become idle between
+    requests are handed back to this class instead of holding on to a thread
+    of the pool. Idle connections are watched by a separate thread, and are
+    submitted again to the pool when a new request arrives through them, or
+    closed after they have been idle for too long.
+    """
 
     def __init__(self, ngamsServer):
         import multiprocessing.pool
 
-        max_reqs = ngamsServer.cfg.getMaxSimReqs()
+        cfg = ngamsServer.cfg
+        max_reqs = cfg.getMaxSimReqs()
         self._ngamsServer = ngamsServer
         self._pool = multiprocessing.pool.ThreadPool(processes=max_reqs)
 
@@ -104,6 +119,32 @@ class thread_pool_mixin(socketserver.ThreadingMixIn):
         # but haven't been picked up yet, declared in TCPServer
         self.request_queue_size = max_reqs
 
+        # HTTP/1.1 keep-alive support, only available if we can watch
+        # idle connections without a thread per connection
+        self.keepalive = bool(cfg.getKeepAlive())
+        if self.keepalive and selectors is None:
+            logger.warning("HTTP keep-alive not supported in this python version, disabling it")
+            self.keepalive = False
+        self.keepalive_timeout = cfg.getKeepAliveTimeOut()
+        self.keepalive_max_requests = cfg.getKeepAliveMaxRequests()
+
+        # Connections to keep open, idle connections,
+        # and number of requests served by each connection
+        self._keep_conns = {}
+        self._idle_conns = {}
+        self._conn_requests = {}
+        self._idle_lock = threading.Lock()
+        self._idle_monitor = None
+        if self.keepalive:
+            self._selector = selectors.DefaultSelector()
+            self._waker_r, self._waker_w = socket.socketpair()
+            self._selector.register(self._waker_r, selectors.EVENT_READ)
+            self._idle_stop = threading.Event()
+            self._idle_monitor = threading.Thread(target=self._watch_idle_connections,
+                                                  name='KeepAliveMonitor')
+            self._idle_monitor.daemon = True
+            self._idle_monitor.start()
+
     def process_request(self, request, client_address):
         """process the request in a thread of the pool"""
 
@@ -111,10 +152,94 @@ class thread_pool_mixin(socketserver.ThreadingMixIn):
             logger.error("Maximum number of serving threads reached, rejecting request")
             wfile = request.makefile('wb')
             wfile.write(b'HTTP/1.0 503 Service Unavailable\r\n\r\n')
+            wfile.close()
+            self._forget_connection(request)
+            self.shutdown_request(request)
             return
 
         self._pool.apply_async(self.process_request_thread, args=(request, client_address))
 
+    def shutdown_request(self, request):
+        # Connections kept alive are watched until a new request arrives
+        with self._idle_lock:
+            keep = self._keep_conns.pop(request, None)
+        if keep is None or self._idle_stop.is_set():
+            socketserver.TCPServer.shutdown_request(self, request)
+            return
+        client_address, nrequests = keep
+        with self._idle_lock:
+            self._idle_conns[request] = (client_address, time.time())
+            self._conn_requests[request] = nrequests
+            self._selector.register(request, selectors.EVENT_READ)
+        self._waker_w.send(b'x')
+
+    def pop_connection_requests(self, request):
+        """Returns the number of requests already served through ``request``"""
+        with self._idle_lock:
+            return self._conn_requests.pop(request, 0)
+
+    def keep_connection(self, request, client_address, nrequests):
+        """
+        Keeps the ``request`` connection open after its handler finishes,
+        until a new request arrives through it
+        """
+        with self._idle_lock:
+            self._keep_conns[request] = (client_address, nrequests)
+
+    def _forget_connection(self, request):
+        with self._idle_lock:
+            self._conn_requests.pop(request, None)
+
+    def _watch_idle_connections(self):
+
+        poll_period = min(1, self.keepalive_timeout)
+        while not self._idle_stop.is_set():
+
+            ready = []
+            for key, _ in self._selector.select(timeout=poll_period):
+                if key.fileobj is self._waker_r:
+                    self._waker_r.recv(4096)
+                    continue
+                ready.append(key.fileobj)
+
+            # Connections with new requests are submitted to the pool again,
+            # connections idle for too long are closed
+            now = time.time()
+            expired = []
+            with self._idle_lock:
+                ready = [(request, self._idle_conns.pop(request)[0]) for request in ready]
+                for request, _ in ready:
+                    self._selector.unregister(request)
+                for request, (_, idle_since) in list(self._idle_conns.items()):
+                    if now - idle_since >= self.keepalive_timeout:
+                        del self._idle_conns[request]
+                        del self._conn_requests[request]
+                        self._selector.unregister(request)
+                        expired.append(request)
+
+            for request, client_address in ready:
+                self.process_request(request, client_address)
+            for request in expired:
+                logger.debug("Closing connection idle for more than %d [s]", self.keepalive_timeout)
+                socketserver.TCPServer.shutdown_request(self, request)
+
+    def stop_idle_monitor(self):
+        """Stops watching idle connections, closing all of them"""
+        if not self._idle_monitor:
+            return
+        self._idle_stop.set()
+        self._waker_w.send(b'x')
+        self._idle_monitor.join()
+        with self._idle_lock:
+            idle_conns = list(self._idle_conns)
+            self._idle_conns.clear()
+            self._conn_requests.clear()
+        for request in idle_conns:
+            socketserver.TCPServer.shutdown_request(self, request)
+        self._selector.close()
+        self._waker_r.close()
+        self._waker_w.close()
+
 class ngamsHttpServer(thread_pool_mixin, BaseHTTPServer.HTTPServer):
     """Class providing pooled multithreaded HTTP server functionality"""
 
@@ -131,6 +256,63 @@ class ngamsHttpServer(thread_pool_mixin, BaseHTTPServer.HTTPServer):
             context.load_cert_chain(certfile=ngamsServer._cert)
             self.socket = context.wrap_socket(self.socket, server_side=True)
 
+    def shutdown(self):
+        BaseHTTPServer.HTTPServer.shutdown(self)
+        self.stop_idle_monitor()
+
+
+class _request_body(object):
+    """
+    Wraps the incoming stream of an HTTP request to keep track of how much of
+    the request body has been read. Under HTTP keep-alive a body that hasn't
+    been fully read prevents further requests from being read from the same
+    connection.
+    """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.size = size
+        self.readin = 0
+
+    def read(self, *args):
+        buf = self.f.read(*args)
+        self.readin += len(buf)
+        return buf
+
+    def readline(self, *args):
+        buf = self.f.readline(*args)
+        self.readin += len(buf)
+        return buf
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    @property
+    def consumed(self):
+        return self.readin >= self.size
+
+# Headers from a proxied response that only apply
+# to the connection between us and the other server
+_PROXY_SKIP_HDRS = ('connection', 'keep-alive', 'transfer-encoding', 'server', 'date')
+
+def _resolve_ranges(ranges, size):
+    """
+    Turns the (first, last) byte ranges requested by a client into absolute
+    (first, last) inclusive positions within a file of ``size`` bytes,
+    leaving out those that cannot be satisfied
+    """
+    resolved = []
+    for first, last in ranges:
+        if first is None:
+            if not last:
+                continue
+            first, last = max(0, size - last), size - 1
+        elif first >= size:
+            continue
+        else:
+            last = size - 1 if last is None else min(last, size - 1)
+        resolved.append((first, last))
+    return resolved
 
 class _atomic_counter(object):
     """A simple atomic counter"""
@@ -171,8 +353,49 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         req_num = self.req_count.inc()
         threading.current_thread().setName('R-%d' % req_num)
 
+        # Speak HTTP/1.1 if we are keeping connections alive, and keep track
+        # of how many requests have been served through this connection
+        if self.server.keepalive:
+            self.protocol_version = 'HTTP/1.1'
+        self.nrequests = self.server.pop_connection_requests(self.request)
+        self._sent_hdrs = set()
+
         BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
 
+    def handle(self):
+        """
+        Handles requests coming through this connection. Under HTTP keep-alive
+        the connection is handed back to the server when it becomes idle
+        instead of waiting here for the next request.
+        """
+
+        if not self.server.keepalive:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+            return
+
+        while True:
+            self.handle_one_request()
+            self.nrequests += 1
+            if self.close_connection:
+                return
+
+            # Pipelined requests are handled straight away
+            if not self._has_pending_data():
+                self.server.keep_connection(self.request, self.client_address, self.nrequests)
+                return
+
+    def _has_pending_data(self):
+        """Whether data for the next request has already been read"""
+        if getattr(self.request, 'pending', None) and self.request.pending():
+            return True
+        try:
+            self.connection.settimeout(0)
+            return bool(self.rfile.peek(1))
+        except (socket.error, ValueError, AttributeError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
     def version_string(self):
         return self.server_version
 
@@ -201,6 +424,14 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.reply_sent = False
         self.headers_sent = False
 
+        # Keep track of how much of the request body is read
+        try:
+            size = int(self.headers.get('content-length', 0) or 0)
+        except ValueError:
+            size = 0
+            self.close_connection = True
+        self.rfile = _request_body(self.rfile, size)
+
         path = self.path.strip("?/ ")
         try:
             self.ngasServer.reqCallBack(self, self.client_address, self.command,
@@ -219,6 +450,10 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         except Exception:
             logger.exception("Error while handling request", extra={'to_syslog': True})
             raise
+        finally:
+            body, self.rfile = self.rfile, self.rfile.f
+            if not body.consumed or 'transfer-encoding' in self.headers:
+                self.close_connection = True
 
     # The three methods we support
     do_GET  = reqHandle
@@ -227,9 +462,28 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     # Richer end_headers method to keep track of call
     def end_headers(self):
+        if not self.close_connection and self._must_close():
+            self.send_header('Connection', 'close')
         BaseHTTPServer.BaseHTTPRequestHandler.end_headers(self)
         self.headers_sent = True
 
+    def send_header(self, keyword, value):
+        BaseHTTPServer.BaseHTTPRequestHandler.send_header(self, keyword, value)
+        self._sent_hdrs.add(keyword.lower())
+
+    def _must_close(self):
+        """Whether the connection needs to be closed after this response"""
+
+        # The client needs a Content-Length (or a chunked body) to find out
+        # where the response ends, and must be able to find where the next
+        # request starts
+        if not self._sent_hdrs.intersection(('content-length', 'transfer-encoding')):
+            return True
+        body = self.rfile
+        if isinstance(body, _request_body) and not body.consumed:
+            return True
+        return self.nrequests + 1 >= self.server.keepalive_max_requests
+
     # Richer send_response method to pass down headers
     def send_response(self, code, message=None, hdrs={}):
         """Sends the initial status line plus headers to the client, can't be called twice"""
@@ -238,6 +492,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if self.reply_sent:
             raise Exception("Tried to send two responses :(")
         self.reply_sent = True
+        self._sent_hdrs = set()
 
         BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message=message)
         for k, v in hdrs.items():
@@ -252,59 +507,136 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         location = 'http://%s:%d%s' % (host, port, path)
 
         logger.info("Redirecting client to %s", location)
-        self.send_response(NGAMS_HTTP_REDIRECT, hdrs={'Location': location})
+        self.send_response(NGAMS_HTTP_REDIRECT, hdrs={'Location': location,
+                                                      'Content-Length': 0})
         self.end_headers()
 
     def redirect_to_url(self, url, http_status=NGAMS_HTTP_REDIRECT):
         """Permanent Redirects the client to the requested url"""
 
         logger.info("Redirecting client to %s", url)
-        self.send_response(http_status, hdrs={'Location': url})
+        self.send_response(http_status, hdrs={'Location': url, 'Content-Length': 0})
         self.end_headers()
 
-    def send_file(self, f, mime_type, start_byte=0, fname=None, hdrs={}):
+    def send_file(self, f, mime_type, start_byte=0, fname=None, hdrs={},
+                  end_byte=None):
         """
         Sends file ``f`` of type ``mime_type`` to the client. Optionally a different
-        starting byte to start the transmission from, and a different name for
-        the file to present the data to the user can be given.
+        starting byte to start the transmission from, a last byte (inclusive)
+        to finish it at, and a different name for the file to present the
+        data to the user can be given.
         """
 
         fname = fname or os.path.basename(f)
         size = getFileSize(f)
+        if end_byte is not None:
+            end_byte = min(end_byte, size - 1) if size else None
 
-        self.send_file_headers(fname, mime_type, size, start_byte, hdrs=hdrs)
-        self.write_file_data(f, size, start_byte)
+        self.send_file_headers(fname, mime_type, size, start_byte, hdrs=hdrs,
+                               end_byte=end_byte)
+        self.write_file_data(f, size, start_byte, end_byte=end_byte)
 
-    def send_file_headers(self, fname, mime_type, size, start_byte=0, hdrs={}):
+    def send_file_headers(self, fname, mime_type, size, start_byte=0, hdrs={},
+                          end_byte=None):
         """Sends the headers advertising file ``fname``, but without its data.
         Headers set by this method take precedence over values given by the
         caller via the ``hdrs`` optional argument"""
 
+        last_byte = size - 1 if end_byte is None else end_byte
         _hdrs = {'Content-Type': mime_type,
                 'Content-Disposition': 'attachment; filename="%s"' % fname,
-                'Content-Length': str(size - start_byte)}
-        if start_byte:
+                'Content-Length': str(last_byte - start_byte + 1)}
+        code = 200
+        if start_byte or end_byte is not None:
             _hdrs['Accept-Ranges'] = 'bytes'
-            _hdrs["Content-Range"] = "bytes %d-%d/%d" % (start_byte, size - 1, size)
+            _hdrs["Content-Range"] = "bytes %d-%d/%d" % (start_byte, last_byte, size)
+            code = NGAMS_HTTP_PARTIAL_CONTENT
 
         hdrs.update(_hdrs)
-        self.send_response(200, hdrs=hdrs)
+        self.send_response(code, hdrs=hdrs)
         self.end_headers()
 
-    def write_file_data(self, f, size, start_byte=0):
-        """sends file ``f``, hopefully using ``sendfile(2)``"""
+    def send_file_ranges(self, f, mime_type, ranges, fname=None, hdrs={}):
+        """
+        Sends the byte ``ranges`` of file ``f`` requested by the client via a
+        Range header. ``ranges`` is a list of (first, last) inclusive byte
+        positions, where ``first`` is ``None`` for suffix ranges (``last``
+        being the suffix length) and ``last`` is ``None`` for ranges extending
+        until the end of the file.
+
+        A single satisfiable range is sent as a normal 206 response, while
+        several are sent as a ``multipart/byteranges`` 206 response. If no range
+        can be satisfied a 416 response is sent instead.
+        """
+
+        fname = fname or os.path.basename(f)
+        size = getFileSize(f)
+
+        # Empty files cannot satisfy any range, we simply send them whole
+        if not size:
+            self.send_file(f, mime_type, fname=fname, hdrs=hdrs)
+            return
+
+        ranges = _resolve_ranges(ranges, size)
+        if not ranges:
+            logger.info("None of the requested ranges can be satisfied for %s", f)
+            self.send_response(NGAMS_HTTP_RANGE_NOT_SATISFIABLE,
+                               hdrs={'Content-Range': 'bytes */%d' % size,
+                                     'Content-Length': 0})
+            self.end_headers()
+            return
+
+        if len(ranges) == 1:
+            start_byte, end_byte = ranges[0]
+            self.send_file_headers(fname, mime_type, size, start_byte,
+                                   hdrs=hdrs, end_byte=end_byte)
+            self.write_file_data(f, size, start_byte, end_byte=end_byte)
+            return
+
+        # Multiple ranges are sent as the different parts of a multipart message
+        boundary = uuid.uuid4().hex
+        part_hdrs = []
+        for i, (start_byte, end_byte) in enumerate(ranges):
+            part_hdrs.append(six.b(
+                '%s--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' %
+                ('\r\n' if i else '', boundary, mime_type, start_byte, end_byte, size)))
+        trailer = six.b('\r\n--%s--\r\n' % boundary)
+        content_length = sum(len(h) for h in part_hdrs) + len(trailer)
+        content_length += sum(end_byte - start_byte + 1 for start_byte, end_byte in ranges)
+
+        hdrs.update({
+            'Content-Type': 'multipart/byteranges; boundary=%s' % boundary,
+            'Content-Disposition': 'attachment; filename="%s"' % fname,
+            'Content-Length': str(content_length),
+            'Accept-Ranges': 'bytes'
+        })
+        self.send_response(NGAMS_HTTP_PARTIAL_CONTENT, hdrs=hdrs)
+        self.end_headers()
+        for part_hdr, (start_byte, end_byte) in zip(part_hdrs, ranges):
+            self.wfile.write(part_hdr)
+            self.write_file_data(f, size, start_byte, end_byte=end_byte)
+        self.wfile.write(trailer)
+
+    def write_file_data(self, f, size, start_byte=0, end_byte=None):
+        """sends file ``f``, hopefully using ``sendfile(2)``. If ``end_byte``
+        is given then only the data up to that byte (inclusive) is sent"""
 
         if not self.headers_sent:
             raise RuntimeError('Trying to send file data but HTTP headers not sent')
 
+        count = None
+        if end_byte is not None:
+            count = end_byte - start_byte + 1
+            size = count
+
         self.wfile.flush()
         logger.info("Sending %s (%d bytes) to client, starting at byte %d", f, size, start_byte)
         with open(f, 'rb') as fin:
             st = time.time()
             if self.ngasServer.get_server_access_proto() == "https":
-                pysendfile.sendfile_send(self.connection, fin, start_byte)
+                pysendfile.sendfile_send(self.connection, fin, start_byte, count)
             else:
-                pysendfile.sendfile(self.connection, fin, start_byte)
+                pysendfile.sendfile(self.connection, fin, start_byte, count)
             howlong = time.time() - st
             size_mb = size / 1024. / 1024.
         logger.info("Sent %s at %.3f [MB/s]", f, size_mb / howlong)
@@ -341,6 +673,50 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         self.wfile.write(data)
 
+    def send_chunked_data(self, chunks, mime_type, code=200, message=None, fname=None, hdrs={}):
+        """
+        Sends back the data yielded by the ``chunks`` iterable, which is of type
+        ``mime_type``, using chunked transfer encoding. This allows sending
+        data whose size is not known in advance without holding it all in
+        memory. HTTP/1.0 clients get the data as-is instead, and the connection
+        is closed after it is sent. Returns the number of bytes sent.
+        """
+
+        hdrs = dict(hdrs)
+        hdrs['Content-Type'] = mime_type
+        if fname:
+            hdrs['Content-Disposition'] = 'attachment; filename="%s"' % fname
+
+        chunked = self.request_version != 'HTTP/1.0'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+            hdrs['Transfer-Encoding'] = 'chunked'
+            if self.close_connection:
+                hdrs['Connection'] = 'close'
+        else:
+            self.close_connection = True
+        logger.info("Sending data of type %s %sand headers %r", mime_type,
+                    'using chunked transfer encoding ' if chunked else '', hdrs)
+
+        self.send_response(code, message=message, hdrs=hdrs)
+        self.end_headers()
+
+        size = 0
+        start_time = time.time()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if chunked:
+                chunk = b''.join((six.b('%x\r\n' % len(chunk)), chunk, b'\r\n'))
+            self.wfile.write(chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+        elapsed_time = max(time.time() - start_time, 0.000001)
+        logger.info("Sent %d bytes of data at %.3f [MB/s]", size, size / 1024. / 1024. / elapsed_time)
+        return size
+
     def send_status(self, message, status=NGAMS_SUCCESS, code=None, http_message=None, hdrs={}):
         """Creates and sends an NGAS status XML document back to the client"""
 
@@ -392,48 +768,42 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                      'accept-encoding', 'transfer-encoding', 'authorization')
         hdrs = {k: v for k, v in self.headers.items() if k.lower() not in _STD_HDRS}
 
-        # Forward GET or POST request, get back code/msg/hdrs/data
+        # Forward GET or POST request, and stream the response back in blocks
+        start = time.time()
         if self.command == 'GET':
             resp = ngamsHttpUtils.httpGetUrl(url, hdrs=hdrs, timeout=timeout,
                                              auth=authHttpHdrVal)
-            with contextlib.closing(resp):
-                code, data = resp.status, resp.read()
-            hdrs = {h[0]: h[1] for h in resp.getheaders()}
-
+            size = 0
         else:
             # During HTTP post we need to pass down a EOF-aware,
             # read()-able object
-            data = ngamsHttpUtils.sizeaware(self.rfile, int(self.headers['content-length']))
+            size = int(self.headers['content-length'])
+            data = ngamsHttpUtils.sizeaware(self.rfile, size)
 
             mime_type = ''
             if 'content-type' in self.headers:
                 mime_type = self.headers['content-type']
 
-            code, _, hdrs, data = ngamsHttpUtils.httpPostUrl(url, data, mime_type,
-                                                             hdrs=hdrs,
-                                                             timeout=timeout,
-                                                             auth=authHttpHdrVal)
-
-        # Our code calculates the content length already, let's not send it twice
-        # Similarly, let's avoid Content-Type rewriting
-        # Here "hdrs" is not a one of the nice email.message.Message objects
-        # which allows for case-insensitive lookup, but simply a dictionary,
-        # so we are forced to perform a case-sensitive lookup
-        logger.info("Received response from %s:%d, sending to client", host, port)
-        logger.info("Headers from response: %r", hdrs)
-        if 'content-length' in hdrs:
-            del hdrs['content-length']
-        if 'Content-Length' in hdrs:
-            del hdrs['Content-Length']
-        mime_type = ''
-        if 'content-type' in hdrs:
-            mime_type = hdrs['content-type']
-            del hdrs['content-type']
-        if 'Content-Type' in hdrs:
-            mime_type = hdrs['Content-Type']
-            del hdrs['Content-Type']
-
-        self.send_data(data, mime_type, code=code, hdrs=hdrs)
+            resp = ngamsHttpUtils.httpPostStream(host, port, path, data, mime_type,
+                                                 hdrs=hdrs, timeout=timeout,
+                                                 auth=authHttpHdrVal)
+
+        # Headers relevant only to the connection with the other server
+        # are not passed down, the rest (e.g., Content-Length or Content-Range)
+        # make it into the response
+        with contextlib.closing(resp):
+            logger.info("Received response from %s:%d, sending to client", host, port)
+            hdrs = {k: v for k, v in resp.getheaders() if k.lower() not in _PROXY_SKIP_HDRS}
+            logger.info("Headers from response: %r", hdrs)
+            resp_size = resp.getheader('content-length')
+            resp_size = None if resp_size is None else int(resp_size)
+            block_size = srv.getCfg().getBlockSize()
+            sent = self.write_stream_data(resp, hdrs, resp_size, block_size=block_size)
+
+        # Account for the amount of proxied data
+        reqPropsObj = self.ngas_request
+        reqPropsObj.setBytesReceived(size + sent)
+        reqPropsObj.incIoTime(time.time() - start)
 
     def remote_proxy_request(self, request, host, port, timeout=300):
         """Proxy the current request to remote host ``host``:``port``"""
@@ -475,35 +845,42 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.write_stream_data(response, response_headers, size, 0, block_size)
 
     def write_stream_data(self, response, headers, size, start_byte=0, block_size=65536):
-        """Streams the data from the remote host"""
+        """
+        Streams the data from the remote host. If ``size`` is ``None`` data is
+        streamed until the remote host closes the connection. Returns the
+        number of bytes sent.
+        """
 
-        logger.info("Sending %d bytes of data and headers %r", size, headers)
+        logger.info("Sending %s bytes of data and headers %r",
+                    'unknown' if size is None else size, headers)
 
         self.send_response(response.status, hdrs=headers)
         self.end_headers()
 
-        logger.info("Sending %d bytes to client, starting at byte %d", size, start_byte)
+        logger.info("Sending data to client, starting at byte %d", start_byte)
         data_sent = start_byte
         data_to_send = size
         start_time = time.time()
 
         # TODO: Should we do something about https here?
-        while data_sent < data_to_send:
+        while data_to_send is None or data_sent < data_to_send:
             stream_buffer = response.read(block_size)
             stream_buffer_size = len(stream_buffer)
+            if stream_buffer_size == 0:
+                if data_to_send is not None:
+                    logger.error("Data stream is incomplete. Only received %d bytes, expected %d bytes.",
+                                 data_sent, data_to_send)
+                break
             self.wfile.write(stream_buffer)
             data_sent += stream_buffer_size
-            if stream_buffer_size == 0 and data_sent < data_to_send:
-                logger.error("Data stream is incomplete. Only received %d bytes, expected %d bytes.",
-                             data_sent, data_to_send)
-                break
 
         elapsed_time = time.time() - start_time
         # Avoid divide by zeros later on, let's say it took us 1 [us] to do this
         if elapsed_time == 0:
             elapsed_time = 0.000001
-        size_mb = size / 1024. / 1024.
+        size_mb = (data_sent - start_byte) / 1024. / 1024.
         logger.info("Sent data stream at %.3f [MB/s]", size_mb / elapsed_time)
+        return data_sent - start_byte
 
 
 class logging_config(object):
@@ -708,6 +1085,7 @@ class ngamsServer(object):
         self._cacheCtrlPiDelDbm         = None
         self._cacheCtrlPiFilesDbm       = None
         self._cacheCtrlPiThreadGr       = None
+        self._cacheAccessLog            = ngamsCacheControlThread.CacheAccessLog()
         self._dataMoverOnly             = False
 
         # The listening end
@@ -873,6 +1251,14 @@ class ngamsServer(object):
         """
         return self.getCfg().getCachingEnabled()
 
+    def getCacheAccessLog(self):
+        """
+        Return the log of the accesses to the files in the cache.
+
+        Returns:  Cache access log (ngamsCacheControlThread.CacheAccessLog).
+        """
+        return self._cacheAccessLog
+
     def getDataMoverOnlyActive(self):
         """
         Return the value of the Data Mover Only Flag.
@@ -1757,6 +2143,10 @@ class ngamsServer(object):
                 httpRef.connection.settimeout(timeout)
                 httpRef.send_status(errMsg, status=NGAMS_FAILURE, code=400)
 
+            # The reply might have been only partially sent
+            else:
+                httpRef.close_connection = True
+
         finally:
             reqPropsObj.setCompletionTime(1)
             self.request_db.update(reqPropsObj)
@@ -2209,6 +2599,7 @@ class ngamsServer(object):
 
         # Reset the parameters for the suspension.
         self.getDb().resetWakeUpCall(self.getHostId(), 1)
+        ngamsHighLevelLib.invalidate_host_info(self.getHostId())
 
         # Create a mime-type to DAPI dictionary
         for stream in self.getCfg().getStreamList():
@@ -2266,6 +2657,7 @@ class ngamsServer(object):
         Returns:       Reference to object itself.
         """
         self.getDb().reqWakeUpCall(self.getHostId(), wakeUpHostId, wakeUpTime)
+        ngamsHighLevelLib.invalidate_host_info(self.getHostId())
         self.getHostInfoObj().\
                                 setSrvSuspended(1).\
                                 setSrvReqWakeUpSrv(wakeUpHostId).\
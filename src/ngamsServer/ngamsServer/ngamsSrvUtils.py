@@ -231,6 +231,9 @@ def handleOnline(srvObj,
     # Re-load Configuration + check disk configuration.
     srvObj.loadCfg()
 
+    # The topology of the system might have changed
+    ngamsHighLevelLib.invalidate_host_info()
+
     hostId = srvObj.getHostId()
     for stream in srvObj.getCfg().getStreamList():
         srvObj.getMimeTypeDic()[stream.getMimeType()] = stream.getPlugIn()
@@ -367,6 +370,7 @@ def handleOffline(srvObj,
         srvObj.remote_subscription_creation_task.stop()
 
     logger.debug("Prepare NG/AMS for Offline State ...")
+    ngamsHighLevelLib.invalidate_host_info()
 
     # Unsubscribe possible subscriptions. This is tried only once.
     if (srvObj.getCfg().getAutoUnsubscribe()):
@@ -428,6 +432,7 @@ def wakeUpHost(srvObj,
     try:
         plugInMethod = loadPlugInEntryPoint(wakeUpPi)
         plugInMethod(srvObj, suspHost)
+        ngamsHighLevelLib.invalidate_host_info(suspHost)
 
         ipAddress = srvObj.getDb().getIpFromHostId(suspHost)
         ngamsHighLevelLib.pingServer(ipAddress, portNo,
@@ -34,6 +34,7 @@ This module contains the code for the (Data) Subscription Thread, which is
 used to handle the delivery of data to Subscribers.
 """
 
+import bisect
 import logging
 import threading
 import time
@@ -47,9 +48,9 @@ from . import ngamsCacheControlThread
 from ngamsLib.ngamsCore import NGAMS_SUBSCRIPTION_THR, isoTime2Secs,\
     NGAMS_SUBSCR_BACK_LOG, NGAMS_DELIVERY_THR,\
     NGAMS_HTTP_INT_AUTH_USER, NGAMS_REARCHIVE_CMD, NGAMS_FAILURE,\
-    NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, getFileSize, rmFile, loadPlugInEntryPoint,\
+    NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, getFileSize, loadPlugInEntryPoint,\
     toiso8601, NGAMS_HTTP_HDR_CHECKSUM, NGAMS_HTTP_HDR_FILE_INFO, fromiso8601
-from ngamsLib import ngamsDbm, ngamsStatus, ngamsHighLevelLib, ngamsFileInfo, ngamsDbCore,\
+from ngamsLib import ngamsStatus, ngamsFileInfo, ngamsDbCore,\
     ngamsHttpUtils
 
 
@@ -288,74 +289,148 @@ def _addFileDeliveryDic(subscrId,
         finally:
             fileDeliveryCountDic_Sem.release()
 
-def _checkIfDeliverFile(srvObj,
-                        subscrObj,
-                        fileInfo,
-                        deliverReqDic,
-                        deliveredStatus,
-                        scheduledStatus,
-                        fileDeliveryCountDic,
-                        fileDeliveryCountDic_Sem,
-                        explicitFileDelivery = False):
+class _DeliveryCandidates(object):
+    """
+    Files that are candidates for being delivered to Subscribers. Files are
+    kept in memory sorted by Ingestion Date, so the files falling within the
+    delivery window of each Subscriber can be selected at once instead of
+    checking each file against each Subscriber.
     """
-    Analyze if a file should be delivered to a Subscriber.
 
-    srvObj:           Reference to server object (ngamsServer).
+    def __init__(self):
+        self._files = {}
+        self._dates = None
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._files)
+
+    def add(self, fileInfo):
+        """
+        Adds a file (in DB Summary 2 or internal format), replacing any
+        previous entry for the same File ID and File Version.
+        """
+        fileInfo = _convertFileInfo(fileInfo)
+        fileIngDate = fromiso8601(fileInfo[FILE_DATE], local=True)
+        self._files[_fileKey(fileInfo[FILE_ID], fileInfo[FILE_VER])] = (fileIngDate, fileInfo)
+        self._dates = self._sorted = None
+
+    def get(self, fileId, fileVersion):
+        """
+        Returns the information about a file (internal format), or None if
+        the file is not a candidate.
+        """
+        entry = self._files.get(_fileKey(fileId, fileVersion))
+        return entry[1] if entry else None
+
+    def since(self, date):
+        """
+        Returns the files (internal format) ingested at or after the given
+        date, or all files if no date is given, sorted by Ingestion Date.
+        """
+        if self._sorted is None:
+            entries = sorted(self._files.values(), key=lambda x: x[0])
+            self._dates = [fileIngDate for fileIngDate, _ in entries]
+            self._sorted = [fileInfo for _, fileInfo in entries]
+        if date is None:
+            return self._sorted
+        return self._sorted[bisect.bisect_left(self._dates, date):]
+
+
+def _deliveryStartDate(subscrObj,
+                       deliveredStatus,
+                       scheduledStatus,
+                       explicitFileDelivery = False):
+    """
+    Returns the Ingestion Date of the oldest file that should be delivered
+    to a Subscriber, or None if files should be delivered regardless of their
+    Ingestion Date.
 
-    subscrObj:        Subscriber object (ngamsSubscriber).
+    A file is delivered to a Subscriber if:
 
-    fileInfo:         List with file infomation as returned by
-                      ngams.getFileSummary2() (sub-list) (list).
+    1. (File-Ingestion-Date >= Subscription-Date) and
+       (Last-File-Ingestion-Date = None)
+    2. (File-Ingestion-Date >= Subscription-Date) and
+       (File-Ingestion-Date >= Last-File-Ingestion-Date)
 
-    deliverReqDic:    Dictionary with Subscriber IDs as keys referring
-                      to lists with the information about the files to
-                      deliver to each of the Subscribers (dictionary/list).
+    The second condition is not checked for files referenced explicitly.
+
+    subscrObj:        Subscriber object (ngamsSubscriber).
 
     deliveredStatus:  Dictionary that contains the Subscriber IDs as keys
                       and where the corresponding value is the time
                       for the last file delivery
                       (dictionary/string (ISO 8601)).
 
-    Returns:          Void.
-    """
-    lastDelivery        = deliveredStatus[subscrObj.getId()]
-    if (subscrObj.getId() in scheduledStatus):
-        lastSchedule = scheduledStatus[subscrObj.getId()]
-    else:
-        lastSchedule = None
-    if lastSchedule is not None:
-        lastSchedule = fromiso8601(lastSchedule, local=True)
+    scheduledStatus:  Dictionary that contains the Subscriber IDs as keys
+                      and where the corresponding value is the Ingestion Date
+                      of the last file scheduled for delivery
+                      (dictionary/string (ISO 8601)).
 
-    fileInfo            = _convertFileInfo(fileInfo)
-    fileId              = fileInfo[FILE_ID]
-    filename            = fileInfo[FILE_NM]
-    fileVersion         = fileInfo[FILE_VER]
-    fileIngDate         = fromiso8601(fileInfo[FILE_DATE], local=True)
-    fileBackLogBuffered = fileInfo[FILE_BL]
+    Returns:          Ingestion Date (number) or None.
+    """
     subs_start = subscrObj.getStartDate()
+    if subs_start is None:
+        return None
+    if explicitFileDelivery:
+        return subs_start
 
+    lastDelivery = deliveredStatus[subscrObj.getId()]
+    lastSchedule = scheduledStatus.get(subscrObj.getId())
+    if lastSchedule is not None:
+        lastSchedule = fromiso8601(lastSchedule, local=True)
     if lastDelivery is not None and lastSchedule is not None and lastSchedule > lastDelivery:
         # assume what have been scheduled are already delivered, this avoids multiple schedules for the same file across multiple main thread iterations
         # (so that we do not have to block the main iteration anymore)
         # if a file is scheduled but fail to deliver, it will be picked up by backlog in the future
         lastDelivery = lastSchedule
 
-    deliverFile = False
-    if subs_start is None:
-        deliverFile = True
-    elif fileIngDate >= subs_start:
-        deliverFile = explicitFileDelivery or lastDelivery is None or fileIngDate >= lastDelivery
-
-    # Register the file if we should deliver this file to the Subscriber.
-    if deliverFile:
-        filterMatched = _checkIfFilterPluginSayYes(srvObj, subscrObj, filename, fileId, fileVersion, fpiMode = FPI_MODE_METADATA_ONLY)
-        if (filterMatched):
+    if lastDelivery is None:
+        return subs_start
+    return max(subs_start, lastDelivery)
+
+
+def _scheduleFiles(srvObj,
+                   subscrObj,
+                   candidates,
+                   deliverReqDic,
+                   deliveredStatus,
+                   scheduledStatus,
+                   fileDeliveryCountDic,
+                   fileDeliveryCountDic_Sem,
+                   explicitFileDelivery = False):
+    """
+    Add the candidate files that should be delivered to a Subscriber to its
+    delivery list. Files are first selected by their Ingestion Date (see
+    _deliveryStartDate), and the Filter Plug-In of the Subscriber (if any)
+    is then applied on the selected files.
+
+    srvObj:           Reference to server object (ngamsServer).
+
+    subscrObj:        Subscriber object (ngamsSubscriber).
+
+    candidates:       Files to consider (_DeliveryCandidates).
+
+    deliverReqDic:    Dictionary with Subscriber IDs as keys referring
+                      to lists with the information about the files to
+                      deliver to each of the Subscribers (dictionary/list).
+
+    Returns:          Void.
+    """
+    startDate = _deliveryStartDate(subscrObj, deliveredStatus, scheduledStatus,
+                                   explicitFileDelivery)
+    files = candidates.since(startDate)
+    logger.debug('%d out of %d files ingested since %s are candidates for subscriber %s',
+                 len(files), len(candidates),
+                 toiso8601(startDate) if startDate is not None else None,
+                 subscrObj.getId())
+
+    for fileInfo in files:
+        if _checkIfFilterPluginSayYes(srvObj, subscrObj, fileInfo[FILE_NM],
+                                      fileInfo[FILE_ID], fileInfo[FILE_VER],
+                                      fpiMode = FPI_MODE_METADATA_ONLY):
             _addFileDeliveryDic(subscrObj.getId(), fileInfo,
-                                                deliverReqDic, fileDeliveryCountDic, fileDeliveryCountDic_Sem, srvObj)
-        #debug_chen
-        logger.debug('File %s is accepted to delivery list', fileId)
-    else:
-        logger.debug('File %s is out, ingDate = %s, lastDelivery = %s', fileId, toiso8601(fileIngDate), toiso8601(lastDelivery))
+                                deliverReqDic, fileDeliveryCountDic, fileDeliveryCountDic_Sem, srvObj)
 
 
 def _convertFileInfo(fileInfo):
@@ -995,6 +1070,21 @@ def getSubscrQueueStatus(srvObj, subscrId, fileId, fileVersion, diskId):
         logger.error("Fail to query persistent queue: %s", str(ex))
         return None
 
+def getSubscrQueueStatuses(srvObj, subscrId, fileInfoList):
+    """
+    Return both status and comment of the given files (already converted,
+    see _convertFileInfo(fileInfo)) found in the persistent queue, indexed by
+    (file_id, file_version, disk_id)
+    """
+    if not fileInfoList:
+        return {}
+    fileIds = [_convertFileInfo(fileInfo)[FILE_ID] for fileInfo in fileInfoList]
+    try:
+        return srvObj.getDb().getSubscrQueueStatuses(subscrId, fileIds)
+    except Exception as ex:
+        logger.error("Fail to query persistent queue: %s", str(ex))
+        return {}
+
 def addToSubscrQueue(srvObj, subscrId, fileInfo, quChunks):
     """
     Insert into the persistent subscription queue,
@@ -1019,6 +1109,22 @@ def addToSubscrQueue(srvObj, subscrId, fileInfo, quChunks):
         if (fileInfo[FILE_BL] == NGAMS_SUBSCR_BACK_LOG):
             quChunks.put(fileInfo)
 
+def queueFiles(srvObj, subscrId, fileInfoList, quChunks):
+    """
+    Add the files scheduled for delivery to a subscriber to its queue.
+    Which files are already in the persistent queue (i.e., already scheduled,
+    being delivered or delivered) is queried at once; these are skipped,
+    except back-logged files, which are checked by the delivery threads.
+    """
+    queueStatus = getSubscrQueueStatuses(srvObj, subscrId, fileInfoList)
+    for fileInfo in fileInfoList:
+        fileInfo = _convertFileInfo(fileInfo)
+        if (fileInfo[FILE_ID], fileInfo[FILE_VER], fileInfo[FILE_DISK_ID]) in queueStatus:
+            if (fileInfo[FILE_BL] == NGAMS_SUBSCR_BACK_LOG):
+                quChunks.put(fileInfo)
+            continue
+        addToSubscrQueue(srvObj, subscrId, fileInfo, quChunks)
+
 def stageFile(srvObj, filename):
     fspi = srvObj.getCfg().getFileStagingPlugIn()
     if not fspi:
@@ -1058,10 +1164,6 @@ def subscriptionThread(srvObj,
             if (len(dm_hosts) < 1):
                 raise Exception("Invalid data mover hosts configuration!")
 
-    fileDicDbm = None
-    fileDicDbmName = ngamsHighLevelLib.genTmpFilename(srvObj.getCfg(),
-                                                      NGAMS_SUBSCRIPTION_THR +\
-                                                      "_FILE_DIC")
     # Similar to Deliver Status Dictionary, the Schedule Status Dictionary
     # indicates for each Subscriber when the last file was scheduled (but
     # possibly not delivered yet)
@@ -1116,20 +1218,13 @@ def subscriptionThread(srvObj,
             # Subscriber.
             deliverReqDic = {}
 
-            # Generate dictionary to keep information about each file, which
-            # might be a candidate for being delivered to Subscribers.
-            # The format is:
-            #
-            # {<File Key>: [[<File Info>, ...], ...], ...}
-            #
-            # The key in this Dictionary is the File ID (pointing to lists
-            # with the file information, one for each version.
+            # Keep information about each file, which might be a candidate
+            # for being delivered to Subscribers.
             #
             # If no specific Subscribers are specified, we only query
             # information about the files specified, otherwise, we have to
             # query information about all files available on this host.
-            rmFile(fileDicDbmName + "*")
-            fileDicDbm = ngamsDbm.ngamsDbm(fileDicDbmName, writePerm=1)
+            candidates = _DeliveryCandidates()
 
             if (dataMoverOnly and srvObj.getSubcrBackLogCount() <= 1000): # do not bring in too many new files if back-logged files are piling up
                 for subscrId in srvObj.getSubscriberDic().keys():
@@ -1153,8 +1248,8 @@ def subscriptionThread(srvObj,
                     lastIngDate = None
                     for fileInfo in files:
                         fileInfo = _convertFileInfo(fileInfo)
-                        fileDicDbm.add(_fileKey(fileInfo[FILE_ID], fileInfo[FILE_VER]), fileInfo)
-                        if (fileInfo[FILE_DATE] > lastIngDate): #just in case the cursor result is not sorted!
+                        candidates.add(fileInfo)
+                        if (lastIngDate is None or fileInfo[FILE_DATE] > lastIngDate): #just in case the cursor result is not sorted!
                             lastIngDate = fileInfo[FILE_DATE]
                         count += 1
                         _checkStopSubscriptionThread(srvObj)
@@ -1186,10 +1281,7 @@ def subscriptionThread(srvObj,
                 else:
                     logger.debug('Fetching all ingested files')
                 for fileInfo in files:
-                    fileInfo = _convertFileInfo(fileInfo)
-                    fileDicDbm.add(_fileKey(fileInfo[FILE_ID],
-                                            fileInfo[FILE_VER]),
-                                   fileInfo)
+                    candidates.add(fileInfo)
                     _checkStopSubscriptionThread(srvObj)
             elif (fileRefs != []): # this is still possible even for data mover (due to recovered subscriptionList during server start)
                 # fileRefDic: Dictionary indicating which versions for each
@@ -1215,9 +1307,7 @@ def subscriptionThread(srvObj,
                     # explicitly specified.
                     fileInfo = _convertFileInfo(fileInfo)
                     if fileInfo[FILE_VER] in fileRefDic[fileInfo[FILE_ID]]:
-                        fileDicDbm.add(_fileKey(fileInfo[FILE_ID],
-                                                fileInfo[FILE_VER]),
-                                       fileInfo)
+                        candidates.add(fileInfo)
                     _checkStopSubscriptionThread(srvObj)
 
             # The Deliver Status Dictionary indicates for each Subscriber
@@ -1238,59 +1328,50 @@ def subscriptionThread(srvObj,
                 subscrLastDel = subscrStat[1]
                 deliveredStatus[subscrId] = subscrLastDel
 
-            # Deliver file to a Subscriber if:
-            #
-            # 1. (File-Ingestion-Date >= Subscription-Date) and
-            #    (Last-File-Ingestion-Date = None)
-            # 2. (File-Ingestion-Date >= Subscription-Date) and
-            #    (File-Ingestion-Date >= Last-File-Ingestion-Date)
-            # 3. If the Filter Plug-In indicates a match (if a Filter Plug-In
-            #    is specified).
+            # Files are delivered to a Subscriber if they were ingested within
+            # its delivery window (see _deliveryStartDate), and if the Filter
+            # Plug-In indicates a match (if a Filter Plug-In is specified).
 
             # First check for each file referenced explicitly (new files
             # archived since last run of Subscription Thread) if they should
             # be delivered to one or more of the Subscribers.
-            for fileRef in fileRefs:
-                fileId      = fileRef[0]
-                fileVersion = fileRef[1]
-
-                # Check that this file is contained in the File Dictionary
-                # of possible candiate files, and resolve the reference to the
-                # information for that file at the same time.
-                if (fileDicDbm.hasKey(_fileKey(fileId, fileVersion))):
-                    tmpFileInfo = fileDicDbm.get(_fileKey(fileId, fileVersion))
-                else:
-                    errMsg = "File Scheduled for delivery to Subscribers " +\
-                             "(File ID: " + fileId + "/File Version: " +\
-                             str(fileVersion) + ") not registered in the NGAS DB"
-                    logger.warning(errMsg)
-                    continue
+            if fileRefs:
+                refCandidates = _DeliveryCandidates()
+                for fileRef in fileRefs:
+                    fileId      = fileRef[0]
+                    fileVersion = fileRef[1]
+
+                    # Check that this file is contained in the possible
+                    # candidate files, and resolve the reference to the
+                    # information for that file at the same time.
+                    tmpFileInfo = candidates.get(fileId, fileVersion)
+                    if tmpFileInfo is None:
+                        errMsg = "File Scheduled for delivery to Subscribers " +\
+                                 "(File ID: " + fileId + "/File Version: " +\
+                                 str(fileVersion) + ") not registered in the NGAS DB"
+                        logger.warning(errMsg)
+                        continue
+                    refCandidates.add(tmpFileInfo)
 
-                # Loop to determine for each Subscriber whether to deliver
-                # the file or not to this or not.
-                for subscrId in srvObj.getSubscriberDic().keys():
-                    subscrObj = srvObj.getSubscriberDic()[subscrId]
-                    _checkIfDeliverFile(srvObj, subscrObj, tmpFileInfo,
-                                        deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem, explicitFileDelivery = True)
+                # Determine for each Subscriber which of the files to deliver.
+                for subscrObj in srvObj.getSubscriberDic().values():
+                    _scheduleFiles(srvObj, subscrObj, refCandidates,
+                                   deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem, explicitFileDelivery = True)
 
             # Then check if for each of the Subscribers referenced explicitly
             # (new Subscribers) for each file Online on this system, if we
             # should deliver data to these.
             if (not dataMoverOnly):
                 for subscrObj in subscrObjs:
-                    # Loop over each file and check if it should be delivered.
-                    for fileKey in fileDicDbm.keys():
-                        fileInfo = fileDicDbm.get(fileKey)
-                        _checkIfDeliverFile(srvObj, subscrObj, fileInfo,
-                                            deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem)
+                    _scheduleFiles(srvObj, subscrObj, candidates,
+                                   deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem)
             else:  # Third, if datamover, add those files
                 for subscrId in srvObj.getSubscriberDic().keys():
                     subscrObj = srvObj.getSubscriberDic()[subscrId]
                     logger.debug('Checking files for data mover %s', subscrId)
-                    for fileKey in fileDicDbm.keys():
-                        fileInfo = fileDicDbm.get(fileKey)
-                        _checkIfDeliverFile(srvObj, subscrObj, fileInfo,
-                                            deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem)
+                    _scheduleFiles(srvObj, subscrObj, candidates,
+                                   deliverReqDic, deliveredStatus, scheduledStatus, fileDeliveryCountDic, fileDeliveryCountDic_Sem)
+            del candidates
 
             # Then finally check if there are back-logged files to deliver.
             # selectDiskId = srvObj.getCachingActive()
@@ -1382,11 +1463,8 @@ def subscriptionThread(srvObj,
                     allFiles = []
                 #if (srvObj.getSubcrBackLogCount() > 0):
                 logger.debug('Put %d new files in the queue for subscriber %s', len(allFiles), subscrId)
-                for jdx in range(len(allFiles)):
-                    ffinfo = allFiles[jdx]
-                    addToSubscrQueue(srvObj, subscrId, ffinfo, quChunks)
-                    #quChunks.put(allFiles[jdx])
-                    # Deliver the data - spawn off a Delivery Thread to do this job
+                queueFiles(srvObj, subscrId, allFiles, quChunks)
+                # Deliver the data - spawn off a Delivery Thread to do this job
                 logger.debug('Number of elements in Queue %s: %d', subscrId, quChunks.qsize())
                 if subscrId not in deliveryThreadDic:
                     deliveryThreads = []
@@ -1402,11 +1480,6 @@ def subscriptionThread(srvObj,
 
                     deliveryThreadDic[subscrId] = deliveryThreads
         except Exception as e:
-            try:
-                del fileDicDbm
-            except:
-                pass
-            rmFile(fileDicDbmName + "*")
             if (str(e).find("_STOP_SUBSCRIPTION_THREAD_") != -1): break
             errMsg = "Error occurred during execution of the Data " +\
                      "Subscription Thread."
@@ -20,6 +20,7 @@
 #    MA 02111-1307  USA
 #
 import os
+import sys
 
 from setuptools import setup, find_packages
 
@@ -32,6 +33,10 @@ with open('../../VERSION') as vfile:
 
 install_requires = ['ngamsCore', 'python-daemon', 'netifaces']
 
+# os.scandir is available only in python 3.5+
+if sys.version_info[0:2] < (3, 5):
+    install_requires.append('scandir')
+
 # Users might opt out from depending on crc32c
 # Our code is able to cope with that situation already
 if 'NGAS_NO_CRC32C' not in os.environ:
@@ -0,0 +1,248 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+
+"""
+Compares the throughput of MIMEMultipartParser against that of
+LegacyMIMEMultipartParser when parsing a container of in-memory files.
+
+Run with: python -m test.benchmark_mime_multipart [-h]
+"""
+
+import argparse
+import email.parser
+import functools
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import six
+
+from ngamsLib import ngamsMIMEMultipart
+
+
+logger = logging.getLogger(__name__)
+CRLF = ngamsMIMEMultipart.CRLF
+
+class LegacyMIMEMultipartParser(ngamsMIMEMultipart.MIMEMultipartParser):
+    """
+    The previous MIMEMultipartParser implementation, which accumulates and
+    re-scans the unprocessed data on each read.
+    """
+
+    def _parse(self):
+        self._recurse()
+
+    def _recurse(self):
+
+        rdSize = self._readSize
+        readingFile = False
+        state = self._ReadingState.headers
+        prevBuf = None
+        boundary = None
+        boundaries = []
+
+        # Kick the loop of with bytesRead = 1, but stop
+        # if any reading yields 0 bytes
+        bytesRead = 1
+        while True:
+
+            # Don't try to over-read during the last reading
+            if self._bytesToRead < rdSize:
+                rdSize = self._bytesToRead
+
+            # Read, read, read...
+            t = time.time()
+            buf = self._fd.read(rdSize)
+            self._readingTime += (time.time() - t)
+
+            bytesRead = len(buf)
+            self._bytesToRead -= bytesRead
+            self._bytesRead   += bytesRead
+
+            # Anything coming from a previous iteration gets prefixed
+            if prevBuf:
+                buf = prevBuf + buf
+            prevBuf = None
+
+            # On the first stage we read the MIME multipart headers and parse them
+            # If found, we start reading delimiters; otherwise we keep reading data
+            if state == self._ReadingState.headers:
+                idx = buf.find(CRLF + CRLF)
+                if idx != -1:
+                    logger.debug('Processing headers')
+                    headers  = buf[:idx+4]
+                    buf      = buf[idx+4:]
+                    if six.PY3:
+                        msg = email.parser.BytesHeaderParser().parsebytes(headers, headersonly=True)  # @UndefinedVariable
+                    else:
+                        msg = email.parser.HeaderParser().parsestr(headers, headersonly=True)
+
+                    # It's a new container, recurse
+                    mimeType = msg.get_content_type()
+                    if 'multipart/mixed' == mimeType:
+
+                        # Save the current boundary for later
+                        if boundary:
+                            boundaries.append(boundary)
+
+                        boundary      = six.b(msg.get_param('boundary'))
+                        containerName = msg.get_param('container_name')
+                        logger.debug('MIME multipart boundary: %s', boundary)
+
+                        # Fail if we're missing any of these
+                        if not boundary or not containerName:
+                            msg = 'Either \'boundary\' or \'container_name\' are not specified in the Content-Type header'
+                            raise Exception(msg)
+
+                        self._handler.startContainer(containerName)
+                        state = self._ReadingState.delimiter
+
+                    # It's a file within the container
+                    else:
+                        filename = msg.get_filename()
+                        if not filename:
+                            raise Exception('No filename found in internal multipart part header')
+                        state = self._ReadingState.data
+                        self._handler.startFile(filename)
+                        readingFile = True
+
+                # Read more data until we reach the end of the headers
+                else:
+                    prevBuf = buf
+                    continue
+
+            # We can read delimiters either because we've just started
+            # reading the body of the MIME multipart message or because
+            # we just finished reading a particular part of the multipart
+            if state == self._ReadingState.delimiter:
+
+                # We come from reading a previous multipart part
+                if readingFile:
+                    self._handler.endFile()
+                readingFile = False
+
+                # Look for both delimiter and final delimiter
+                delIdx  = buf.find(CRLF + b'--' + boundary + CRLF)
+                fDelIdx = buf.find(CRLF + b'--' + boundary + b'--')
+                if delIdx != -1:
+                    # We don't actually need the delimiter itself
+                    # delimiter = buf[:delIdx + 4 + len(boundary) + 2]
+                    logger.debug('File delimiter found')
+                    buf       = buf[delIdx + 4 + len(boundary) + 2:]
+                    state     = self._ReadingState.headers
+                    prevBuf = buf
+                    continue
+                elif fDelIdx != -1:
+                    # delimiter = buf[:fDelIdx + 4 + len(boundary) + 2]
+                    logger.debug('Final delimiter found')
+                    # Take out the final delimiter and start
+                    # using the previous boundary
+                    self._handler.endContainer()
+                    state = self._ReadingState.delimiter
+                    if boundaries:
+                        boundary = boundaries.pop()
+                        buf = buf[fDelIdx + 4 + len(boundary) + 2:]
+                        prevBuf = buf
+                        continue;
+                    else:
+                        break
+                else:
+                    prevBuf = buf
+                    continue
+
+            # When reading data, look for the next delimiter
+            # When found, finish writing data, and pass the
+            # delimiter to the ReadingState.delimiter state
+            if state == self._ReadingState.data:
+                delIdx  = buf.find(CRLF + b'--' + boundary)
+                if delIdx != -1:
+                    logger.debug('Found end of file %s because we found boundary: %s', filename, boundary)
+                    state = self._ReadingState.delimiter
+                    prevBuf = buf[delIdx:]
+                    buf = buf[:delIdx]
+
+                buf = self._handler.handleData(buf, state == self._ReadingState.data)
+                if buf and len(buf):
+                    if prevBuf:
+                        raise Exception('No data should be returned when delimiter has been found')
+                    prevBuf = buf
+
+            # If nothing was read, and nothing
+            # was left for the next iteration, stop
+            if not prevBuf and not bytesRead:
+                break
+
+def _create_message(n_files, file_size):
+    data = os.urandom(file_size)
+    finfos = [ngamsMIMEMultipart.file_info('application/octet-stream', 'file-%d' % i,
+                                           file_size, functools.partial(io.BytesIO, data))
+              for i in range(n_files)]
+    cinfo = ngamsMIMEMultipart.container_info('toplevel', finfos)
+    reader = ngamsMIMEMultipart.ContainerReader(cinfo)
+    return b''.join(iter(functools.partial(reader.read, 1024 * 1024), b''))
+
+def _parse(parser_class, message, read_size, write_size, target):
+    if target:
+        handler = ngamsMIMEMultipart.FilesystemWriterHandler(write_size, basePath=target)
+    else:
+        handler = ngamsMIMEMultipart.ContainerBuilderHandler()
+    parser = parser_class(handler, io.BytesIO(message), len(message), read_size)
+    start = time.time()
+    parser.parse()
+    return time.time() - start
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--files', type=int, default=10, help='Number of files in the container')
+    parser.add_argument('-s', '--file-size', type=int, default=10 * 1024 * 1024, help='Size of each file, in bytes')
+    parser.add_argument('-r', '--read-sizes', default='1024,8192,65536,1048576',
+                        help='Comma-separated list of read sizes, in bytes')
+    parser.add_argument('-w', '--write-size', type=int, default=65536,
+                        help='Write block size used when writing files to disk')
+    parser.add_argument('-d', '--disk', action='store_true',
+                        help='Write the files to disk using a FilesystemWriterHandler')
+    args = parser.parse_args()
+
+    message = _create_message(args.files, args.file_size)
+    size_mb = len(message) / 1024. / 1024.
+    print("Parsing a %.1f MB message with %d files" % (size_mb, args.files))
+    print("%10s  %12s  %12s  %8s" % ('read size', 'legacy MB/s', 'new MB/s', 'speedup'))
+
+    for read_size in [int(x) for x in args.read_sizes.split(',')]:
+        times = []
+        for parser_class in (LegacyMIMEMultipartParser,
+                             ngamsMIMEMultipart.MIMEMultipartParser):
+            target = tempfile.mkdtemp() if args.disk else None
+            try:
+                times.append(_parse(parser_class, message, read_size, args.write_size, target))
+            finally:
+                if target:
+                    shutil.rmtree(target)
+        legacy, new = times
+        print("%10d  %12.1f  %12.1f  %7.1fx" % (read_size, size_mb / legacy, size_mb / new, legacy / new))
+
+if __name__ == '__main__':
+    main()
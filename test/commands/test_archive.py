@@ -35,6 +35,7 @@ Contains the Test Suite for the ARCHIVE Command.
 import contextlib
 import functools
 import glob
+import hashlib
 import os
 import subprocess
 import time
@@ -1459,6 +1460,41 @@ class ngamsArchiveCmdTest(ngamsTestSuite):
             else:
                 self.assertNotIn('NGAMS_ER_FILE_NOK', stat.getMessage())
 
+    def test_hash_checksums(self):
+        """Files can be checksummed with hash variants, and later checked"""
+
+        file_id = "SmallFile.fits"
+        filename = "src/SmallFile.fits"
+        _, db = self.prepExtSrv()
+        with open(self.resource(filename), 'rb') as f:
+            data = f.read()
+        expected = [('md5', hashlib.md5(data).hexdigest()),
+                    ('sha256', hashlib.sha256(data).hexdigest())]
+        for variant, _ in expected:
+            self.archive(filename, cmd="QARCHIVE", mimeType='application/octet-stream',
+                         pars=[['crc_variant', variant]])
+
+        res = db.query2("SELECT checksum, checksum_plugin FROM ngas_files WHERE file_id = {} ORDER BY file_version ASC", (file_id,))
+        self.assertEqual(expected, [(str(r[1]), str(r[0])) for r in res])
+        for version in (1, 2):
+            stat = self.get_status('CHECKFILE', pars=[("file_id", file_id), ("file_version", version)])
+            self.assertNotIn('NGAMS_ER_FILE_NOK', stat.getMessage())
+
+    def test_pipelined_ingest(self):
+        """Check that pipelined ingestion stores the same data and checksums"""
+
+        filename = "src/SmallFile.fits"
+        expected_checksum = ngamsFileUtils.get_checksum(4096, self.resource(filename), 'crc32')
+        cfg = (('NgamsCfg.ArchiveHandling[1].IngestPipelineDepth', '3'),
+               ('NgamsCfg.Server[1].BlockSize', '4096'))
+        _, db = self.prepExtSrv(cfgProps=cfg)
+        self.archive(filename, cmd="QARCHIVE", mimeType='application/octet-stream')
+
+        res = db.query2("SELECT checksum FROM ngas_files WHERE file_id = {}", ("SmallFile.fits",))
+        self.assertEqual(str(expected_checksum), str(res[0][0]))
+        self.retrieve("SmallFile.fits", targetFile=tmp_path())
+        self.checkFilesEq(filename, tmp_path("SmallFile.fits"), "Retrieved file incorrect")
+
     @unittest.skip("Run manually when necessary")
     def test_performance_of_parallel_crc32(self):
 
@@ -358,6 +358,23 @@ class ngamsContainerTest(ngamsTestSuite):
     def test_archive_retrieve_in_cluster_tar(self):
         self._test_archive_retrieve_in_cluster(True)
 
+    def test_retrieve_remote_hierarchy_tar(self):
+        """Remote members are prefetched without changing the tarball"""
+
+        prefetch = [["NgamsCfg.Server[1].ContainerPrefetch", "2"]]
+        self.prepCluster(((8888, prefetch), 8889))
+        self.carchive(8889, self.toplevel, 'application/octet-stream')
+        self.cretrieve(8888, 'toplevel', targetDir=tmp_path('tgt'), as_tar=True)
+        self._assertEqualsDir(self.toplevel, tmp_path('tgt', 'toplevel'))
+
+    def test_retrieve_local_hierarchy_tar_prefetch(self):
+        """Prefetching has no effect on containers without remote members"""
+
+        self.prepExtSrv(cfgProps=[["NgamsCfg.Server[1].ContainerPrefetch", "2"]])
+        self.carchive(self.toplevel, 'application/octet-stream')
+        self.cretrieve('toplevel', targetDir=tmp_path(), as_tar=True)
+        self._assertEqualsDir(self.toplevel, tmp_path('toplevel'))
+
     def _assertEqualsDir(self, dir1, dir2):
 
         # Entries in dir are the same
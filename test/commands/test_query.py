@@ -19,10 +19,11 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
 #    MA 02111-1307  USA
 #
+import contextlib
 import json
 
 from ..ngamsTestLib import ngamsTestSuite
-from ngamsLib import utils
+from ngamsLib import utils, ngamsHttpUtils
 
 
 class ngamsQueryCmdTest(ngamsTestSuite):
@@ -78,4 +79,36 @@ class ngamsQueryCmdTest(ngamsTestSuite):
         stat = self.assert_query(pars=[['query', 'disks_list'], ['format', 'json']])
         results = json.loads(utils.b2s(stat.getData()))
         self.assertEqual(0, int(results[0]['number_of_files']))
-        self.assertEqual(cfg.getArchiveName(), results[0]['archive'])
\ No newline at end of file
+        self.assertEqual(cfg.getArchiveName(), results[0]['archive'])
+
+    def test_streamed_results(self):
+        """Check that results in the streaming formats are sent in chunks and
+        can be read incrementally by the client"""
+
+        self.prepExtSrv()
+        self.archive("src/SmallFile.fits")
+        self.archive("src/SmallFile.fits")
+        stat = self.assert_query(pars=[['query', 'files_list'], ['format', 'json']])
+        expected = json.loads(utils.b2s(stat.getData()))
+
+        # The body is chunked, so there is no Content-Length
+        pars = [('query', 'files_list'), ('format', 'jsonl')]
+        resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'QUERY', pars=pars)
+        with contextlib.closing(resp):
+            self.assertEqual(200, resp.status)
+            self.assertEqual('chunked', resp.getheader('Transfer-Encoding'))
+            self.assertIsNone(resp.getheader('Content-Length'))
+            self.assertEqual(len(expected), len(resp.read().splitlines()))
+
+        rows = list(self.client.query('files_list', out_format='jsonl'))
+        self.assertEqual(expected, rows)
+        self.assertEqual({1, 2}, set(int(r['file_version']) for r in rows))
+
+        rows = list(self.client.query('files_list', out_format='csv'))
+        self.assertEqual(len(expected), len(rows))
+        self.assertEqual({'1', '2'}, set(r['file_version'] for r in rows))
+        self.assertTrue(all(r['file_id'] == "TEST.2001-05-08T15:25:00.123" for r in rows))
+
+        # No results
+        rows = list(self.client.query('files_like', out_format='csv', pars=[('like', 'nothing%')]))
+        self.assertEqual([], rows)
@@ -98,7 +98,6 @@ class ngamsRegisterCmdTest(ngamsTestSuite):
 
     Missing Test Cases:
     - wait=0/1
-    - Register file already registered.
     - Register illegal file.
     - Non-existing file/path.
     - File/path not on NGAS Disk.
@@ -195,3 +194,60 @@ class ngamsRegisterCmdTest(ngamsTestSuite):
         fname = self.copy_to_ngas(file_suffix=".log")
         status = self.get_status_fail(NGAMS_REGISTER_CMD, (("path", fname),))
         self.assertIn("mime-type", status.getMessage().lower())
+
+    def _prep_reg_plugin_srv(self, threads=1, **pars):
+        pars = ','.join(['skip_checksum='] + ['%s=%s' % x for x in pars.items()])
+        cfg = (('NgamsCfg.Register[1].Threads', str(threads)),
+               ('NgamsCfg.Register[1].PlugIn[1].Name', 'test.support.ngamsTestRegPlugIn'),
+               ('NgamsCfg.Register[1].PlugIn[1].PlugInPars', pars))
+        _, db = self.prepExtSrv(cfgProps=cfg)
+        return db
+
+    def _copy_files(self, n):
+        for i in range(n):
+            tgt = self.ngas_path(TEST_PATH + "SmallFile%d.fits" % i)
+            checkCreatePath(os.path.dirname(tgt))
+            self.cp("src/SmallFile.fits", tgt)
+
+    def _registered_files(self, db):
+        sql = "SELECT file_version, file_name FROM ngas_files WHERE file_id = {0} ORDER BY file_version"
+        return [(int(v), name) for v, name in db.query2(sql, args=('TEST.2001-05-08T15:25:00.123',))]
+
+    def test_register_directory(self):
+        """All files under a directory are registered in alphabetical order"""
+
+        db = self._prep_reg_plugin_srv(threads=4)
+        self._copy_files(10)
+        self.get_status(NGAMS_REGISTER_CMD, (("path", self.ngas_path(TEST_PATH)),))
+        expected = [(i + 1, 'saf/test/SmallFile%d.fits' % i) for i in range(10)]
+        self.assertEqual(expected, self._registered_files(db))
+
+    def test_register_already_registered(self):
+        """Files already registered are rejected by path, before running the plug-in"""
+
+        calls = tmp_path('register_calls')
+        db = self._prep_reg_plugin_srv(calls=calls)
+        self._copy_files(2)
+        fname = self.ngas_path(TEST_PATH + "SmallFile0.fits")
+        self.get_status(NGAMS_REGISTER_CMD, (("path", fname),))
+        self.get_status(NGAMS_REGISTER_CMD, (("path", fname),))
+        self.assertEqual([(1, 'saf/test/SmallFile0.fits')], self._registered_files(db))
+
+        # A copy of the file under a different path is a new version
+        self.get_status(NGAMS_REGISTER_CMD, (("path", self.ngas_path(TEST_PATH)),))
+        self.assertEqual([(1, 'saf/test/SmallFile0.fits'), (2, 'saf/test/SmallFile1.fits')],
+                         self._registered_files(db))
+        with open(calls) as f:
+            self.assertEqual([fname, self.ngas_path(TEST_PATH + "SmallFile1.fits")],
+                             f.read().splitlines())
+
+    def test_register_versioned_filenames(self):
+        """Files moved by the plug-in to names containing their version keep them"""
+
+        db = self._prep_reg_plugin_srv(threads=4, versioned=1)
+        self._copy_files(10)
+        self.get_status(NGAMS_REGISTER_CMD, (("path", self.ngas_path(TEST_PATH)),))
+        expected = [(i + 1, 'saf/test/SmallFile%d.fits.%d' % (i, i + 1)) for i in range(10)]
+        self.assertEqual(expected, self._registered_files(db))
+        for _, name in expected:
+            self.assertTrue(os.path.isfile(self.ngas_path("FitsStorage2-Main-3", name)))
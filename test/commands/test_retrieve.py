@@ -31,10 +31,14 @@
 This module contains the Test Suite for the RETRIEVE Command.
 """
 
+import binascii
 import contextlib
 import io
 import os
 
+import six
+import trustme
+
 from ngamsLib import ngamsHttpUtils
 from ngamsLib.ngamsCore import getHostName
 from ..ngamsTestLib import ngamsTestSuite, genTmpFilename, unzip, tmp_path
@@ -457,9 +461,8 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
         self.prepExtSrv()
         self.archive("src/SmallFile.fits")
 
-        # Partial retrieval only supports a start offset, so using only
-        # a suffix length or a begin/end range should fail
-        ranges = ['0-1', '-1']
+        # Reversed and empty ranges, or any of them in a multi-range request
+        ranges = ['2-1', '-', '0-1,', '0-1,2-1']
 
         # Not a number, missing -, negative number
         ranges += ['a-', 'a', '0', '-100-']
@@ -511,4 +514,195 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
                     piece_by_piece.write(data)
 
         self.assertEqual(file_size, piece_by_piece.tell())
-        self.assertEqual(full.getvalue(), piece_by_piece.getvalue())
\ No newline at end of file
+        self.assertEqual(full.getvalue(), piece_by_piece.getvalue())
+
+    def test_bounded_partial_retrieval(self):
+
+        self.prepExtSrv()
+        data = self._archive_random_file(1024)
+
+        # The last byte is inclusive, and is capped to the file size
+        for first, last in ((0, 0), (0, 1023), (10, 99), (1000, 5000)):
+            response = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'RETRIEVE',
+                                              pars=(('file_id', 'source'),),
+                                              hdrs={'Range': 'bytes=%d-%d' % (first, last)})
+            with contextlib.closing(response):
+                last = min(last, len(data) - 1)
+                self.assertEqual('bytes %d-%d/%d' % (first, last, len(data)),
+                                 response.getheader('Content-Range'))
+                self.assertEqual(data[first:last + 1], response.read())
+
+    def _get_range(self, range_spec):
+        return ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'RETRIEVE',
+                                      pars=(('file_id', 'source'),),
+                                      hdrs={'Range': 'bytes=' + range_spec})
+
+    def test_suffix_and_unsatisfiable_ranges(self):
+
+        self.prepExtSrv()
+        data = self._archive_random_file(1024)
+
+        for range_spec, expected_range, expected_data in (
+                ('-10', '1014-1023', data[-10:]),
+                ('-2000', '0-1023', data),
+                ('0-', '0-1023', data)):
+            with contextlib.closing(self._get_range(range_spec)) as response:
+                self.assertEqual(206, response.status)
+                self.assertEqual('bytes %s/1024' % expected_range,
+                                 response.getheader('Content-Range'))
+                self.assertEqual(expected_data, response.read())
+
+        # Ranges beyond the end of the file, or zero-length suffixes
+        for range_spec in ('1024-', '2000-3000', '-0', '1024-1030,-0'):
+            with contextlib.closing(self._get_range(range_spec)) as response:
+                self.assertEqual(416, response.status)
+                self.assertEqual('bytes */1024', response.getheader('Content-Range'))
+                self.assertEqual(b'', response.read())
+
+    def test_multiple_ranges(self):
+
+        self.prepExtSrv()
+        data = self._archive_random_file(1024)
+
+        # Unsatisfiable ranges are left out
+        with contextlib.closing(self._get_range('0-9,100-199,-24,5000-')) as response:
+            self.assertEqual(206, response.status)
+            content_type = response.getheader('Content-Type')
+            self.assertTrue(content_type.startswith('multipart/byteranges; boundary='))
+            boundary = content_type.split('=', 1)[1]
+            body = response.read()
+
+        expected = []
+        for first, last in ((0, 9), (100, 199), (1000, 1023)):
+            expected.append(('--%s\r\nContent-Type: application/octet-stream\r\n'
+                             'Content-Range: bytes %d-%d/1024\r\n\r\n' %
+                             (boundary, first, last)).encode('ascii'))
+            expected.append(data[first:last + 1])
+            expected.append(b'\r\n')
+        expected.append(('--%s--\r\n' % boundary).encode('ascii'))
+        self.assertEqual(b''.join(expected), body)
+
+    def test_parallel_retrieval(self):
+
+        self.prepExtSrv()
+        data = self._archive_random_file(1024 * 1024 + 3)
+
+        target = tmp_path("retrieved")
+        for n_streams in (2, 3, 7):
+            status = self.retrieve('source', targetFile=target, n_streams=n_streams,
+                                   block_size=4096, verify_checksum=True)
+            self.assertIn('in %d streams' % n_streams, status.getMessage())
+            with open(target, 'rb') as f:
+                self.assertEqual(data, f.read())
+
+    def test_proxied_partial_retrieval(self):
+
+        self.prepCluster((8000, 8011))
+        data = os.urandom(1024 * 1024)
+        with open(tmp_path("source"), 'wb') as f:
+            f.write(data)
+        self.archive(8011, tmp_path("source"), mimeType='application/octet-stream')
+
+        # The contacted server streams the file back from the other node,
+        # keeping the size and range information of the original response
+        response = ngamsHttpUtils.httpGet('127.0.0.1', 8000, 'RETRIEVE',
+                                          pars=(('file_id', 'source'),),
+                                          hdrs={'Range': 'bytes=1000-'})
+        with contextlib.closing(response):
+            self.assertEqual(206, response.status)
+            self.assertEqual(str(len(data) - 1000), response.getheader('Content-Length'))
+            self.assertEqual('bytes 1000-%d/%d' % (len(data) - 1, len(data)),
+                             response.getheader('Content-Range'))
+            self.assertEqual(data[1000:], response.read())
+
+    def _archive_random_file(self, size):
+        data = os.urandom(size)
+        with open(tmp_path("source"), 'wb') as f:
+            f.write(data)
+        self.archive(tmp_path("source"), mimeType='application/octet-stream')
+        return data
+
+    def _assert_retrieved(self, data):
+        target = tmp_path("retrieved")
+        self.retrieve('source', targetFile=target, block_size=1000,
+                      verify_checksum=True)
+        with open(target, 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test_checksum_headers(self):
+
+        self.prepExtSrv()
+        data = self._archive_random_file(1024 * 1024)
+
+        # Checksums are sent only on request
+        crc = str(binascii.crc32(data) & 0xffffffff)
+        for pars, expected in (((), None), ((('send_checksum', '1'),), crc)):
+            pars = (('file_id', 'source'),) + pars
+            response = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'RETRIEVE', pars=pars)
+            with contextlib.closing(response):
+                self.assertEqual(expected, response.getheader('NGAS-File-CRC'))
+                response.read()
+
+        self._assert_retrieved(data)
+
+    def test_https_retrieval(self):
+
+        ca = trustme.CA()
+        with ca.cert_pem.tempfile() as ca_temp_path:
+            os.environ["NGAS_CA_PATH"] = ca_temp_path
+            try:
+                server_cert = ca.issue_cert(
+                    u"localhost", six.u(getHostName()), u"127.0.0.1",
+                )
+                cert_file = genTmpFilename(suffix='pem')
+                server_cert.private_key_and_cert_chain_pem.write_to_path(cert_file)
+                self.prepExtSrv(cert_file=cert_file)
+                data = self._archive_random_file(1024 * 1024)
+                self._assert_retrieved(data)
+            finally:
+                del os.environ["NGAS_CA_PATH"]
+
+    def test_location_cache(self):
+
+        _, db = self.prepExtSrv(cfgProps=[["NgamsCfg.Server[1].FileLocationCacheTime", "60"]])
+        self.archive("src/SmallFile.fits")
+        file_id = "TEST.2001-05-08T15:25:00.123"
+
+        # Lookups are cached, both the quick and the full ones
+        for quick_location in ('0', '1'):
+            self.retrieve(file_id, targetFile=tmp_path(),
+                          pars=[('quick_location', quick_location)])
+
+        # Cached locations are used without looking the file up in the DB again,
+        # so retrievals work even if the file is hidden from the DB
+        sql = "UPDATE ngas_files SET file_id = {0} WHERE file_id = {1}"
+        db.query2(sql, args=('hidden', file_id))
+        for quick_location in ('0', '1'):
+            self.retrieve(file_id, targetFile=tmp_path(),
+                          pars=[('quick_location', quick_location)])
+        db.query2(sql, args=(file_id, 'hidden'))
+
+        # All copies of the file are discarded, forgetting their location
+        for f in list(self.client.query('files_list')):
+            pars = [('disk_id', f['disk_id']), ('file_id', file_id),
+                    ('file_version', '1'), ('execute', '1')]
+            self.get_status('DISCARD', pars=pars)
+        for quick_location in ('0', '1'):
+            self.retrieve_fail(file_id, targetFile=tmp_path(),
+                               pars=[('quick_location', quick_location)])
+
+    def test_unavailable_candidates(self):
+
+        # The file's latest version is in a node that crashed,
+        # we should still get the previous version from the other node
+        self.prepCluster((8000, 8011, 8012))
+        self.archive(8011, "src/SmallFile.fits")
+        self.archive(8012, "src/SmallFile.fits")
+        srv_info = [s for s in self.extSrvInfo if s.port == 8012][0]
+        self.extSrvInfo.remove(srv_info)
+        srv_info.proc.kill()
+        srv_info.proc.wait()
+
+        file_id = "TEST.2001-05-08T15:25:00.123"
+        self.retrieve(8000, file_id, targetFile=tmp_path(),
+                      pars=[('quick_location', '0')])
@@ -31,6 +31,9 @@
 This module contains the Test Suite for the STATUS Command.
 """
 
+import gzip
+import xml.dom.minidom
+
 from ngamsLib.ngamsCore import toiso8601
 from ..ngamsTestLib import ngamsTestSuite, getNcu11, genTmpFilename
 
@@ -194,3 +197,46 @@ class ngamsStatusCmdTest(ngamsTestSuite):
         run_checks()
         self.archive('src/SmallFile.fits', 'application/octet-stream')
         run_checks()
+
+    def test_filelist_stream(self):
+        """Checks that STATUS?file_list&stream=1 pages through the files"""
+
+        self.prepExtSrv()
+        for _ in range(3):
+            self.archive('src/SmallFile.fits', 'application/octet-stream')
+
+        def file_list(*pars):
+            fname = genTmpFilename(suffix='.xml.gz')
+            self.status(output=fname, pars=(('file_list', 1),) + pars)
+            with gzip.open(fname) as f:
+                dom = xml.dom.minidom.parseString(f.read())
+            file_list = dom.getElementsByTagName('FileList')[0]
+            versions = [int(el.getAttribute('FileVersion'))
+                        for el in dom.getElementsByTagName('FileStatus')]
+            return (file_list.getAttribute('Id'),
+                    file_list.getAttribute('Status'), versions)
+
+        # Files are replicated, so copies are skipped with unique=1
+        list_id, status, versions = file_list(('stream', 1), ('unique', 1),
+                                              ('max_elements', 2))
+        self.assertEqual('REMAINING_DATA_OBJECTS: 1', status)
+        self.assertEqual([1, 2], versions)
+        _, status, versions = file_list(('file_list_id', list_id), ('max_elements', 2))
+        self.assertEqual('REMAINING_DATA_OBJECTS: 0', status)
+        self.assertEqual([3], versions)
+
+        # The list is gone once it has been fully retrieved
+        self.status_fail(pars=(('file_list', 1), ('file_list_id', list_id)))
+
+        # Everything in one go, and only files ingested after a given date
+        _, status, versions = file_list(('stream', 1), ('max_elements', 0))
+        self.assertEqual('REMAINING_DATA_OBJECTS: 0', status)
+        self.assertEqual([1, 1, 2, 2, 3, 3], versions)
+        list_id, status, versions = file_list(('stream', 1), ('max_elements', 3))
+        self.assertEqual('REMAINING_DATA_OBJECTS: 3', status)
+        self.assertEqual([1, 1, 2], versions)
+        _, status, versions = file_list(('file_list_id', list_id), ('max_elements', 3))
+        self.assertEqual('REMAINING_DATA_OBJECTS: 0', status)
+        self.assertEqual([2, 3, 3], versions)
+        _, _, versions = file_list(('stream', 1), ('from_ingestion_date', toiso8601()))
+        self.assertEqual([], versions)
@@ -0,0 +1,54 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2012
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Test Registration Plug-In registering FITS files like ngamsFitsRegPlugIn.
+
+The following parameters are accepted:
+
+  - calls:      Name of a file where the name of each file handled by the
+                plug-in is appended.
+  - versioned:  If given, files are moved to a name ending with their version.
+"""
+
+from ngamsPlugIns import ngamsFitsRegPlugIn
+
+
+def ngamsTestRegPlugIn(srvObj, reqPropsObj, parDic):
+    """
+    Test Registration Plug-In.
+
+    srvObj:       Reference to NG/AMS Server Object (ngamsServer).
+
+    reqPropsObj:  NG/AMS request properties object (ngamsReqProps).
+
+    Returns:      Standard NG/AMS Data Archiving Plug-In Status as generated
+                  by: ngamsPlugInApi.genDapiSuccessStat() (ngamsDapiStatus).
+    """
+    if 'calls' in parDic:
+        with open(parDic['calls'], 'a') as f:
+            f.write(reqPropsObj.getStagingFilename() + '\n')
+    res = ngamsFitsRegPlugIn.ngamsFitsRegPlugIn(srvObj, reqPropsObj, parDic)
+    if 'versioned' in parDic:
+        suffix = '.%d' % res.getFileVersion()
+        res.setRelFilename(res.getRelFilename() + suffix)
+        res.setCompleteFilename(res.getCompleteFilename() + suffix)
+    return res
@@ -20,8 +20,12 @@
 #    MA 02111-1307  USA
 #
 
+import sqlite3
+import threading
 import time
+import unittest
 
+from ngamsServer import ngamsCacheControlThread
 from .ngamsTestLib import ngamsTestSuite
 
 
@@ -77,4 +81,114 @@ class ngamsCacheThreadTest(ngamsTestSuite):
         self._test_delete_from_cache(False)
 
     def test_dont_delete_from_cache(self):
-        self._test_delete_from_cache(True)
\ No newline at end of file
+        self._test_delete_from_cache(True)
+
+
+class FakeCacheServer(object):
+    """Holds the local Cache Contents DBMS like the server does"""
+
+    def __init__(self):
+        self._cacheContDbms = sqlite3.connect(':memory:', check_same_thread=False)
+        self._cacheContDbmsCur = self._cacheContDbms.cursor()
+        self._cacheContDbmsSem = threading.Semaphore(1)
+        self._cacheAccessLog = ngamsCacheControlThread.CacheAccessLog()
+
+    def getCachingActive(self):
+        return True
+
+    def getCacheAccessLog(self):
+        return self._cacheAccessLog
+
+
+class ngamsCacheEvictionTest(unittest.TestCase):
+    """Unit tests for the access tracking and eviction policies of the cache"""
+
+    def setUp(self):
+        self.srv = FakeCacheServer()
+        # A table as created by older versions, without access information
+        cursor = self.srv._cacheContDbmsCur
+        cursor.execute("CREATE TABLE ngas_cache (disk_id TEXT, file_id TEXT, "
+                       "file_version INTEGER, filename TEXT, file_size INTEGER, "
+                       "cache_delete INTEGER, last_check REAL, cache_time REAL, "
+                       "cache_entry_obj TEXT)")
+        for cache_time, file_id in enumerate('ABC'):
+            cursor.execute("INSERT INTO ngas_cache (disk_id, file_id, "
+                           "file_version, filename, file_size, cache_delete, "
+                           "last_check, cache_time, cache_entry_obj) VALUES "
+                           "('disk', ?, 1, ?, 10, 0, 0, ?, '')",
+                           (file_id, file_id, cache_time))
+        ngamsCacheControlThread._upgradeCacheDbms(cursor)
+
+    def _eviction_order(self, policy, target=2, by_volume=False):
+        candidates = ngamsCacheControlThread._evictionCandidates(self.srv, policy,
+                                                                 target, by_volume)
+        return [x[ngamsCacheControlThread.NGAMS_CACHE_FILE_ID] for x in candidates]
+
+    def test_eviction_policies(self):
+        """Files are evicted in the order given by the different policies"""
+
+        # C is never accessed, B once and A three times, last
+        record = ngamsCacheControlThread.recordCacheAccess
+        record(self.srv, 'B', 1, True)
+        for _ in range(3):
+            record(self.srv, 'A', 1, True)
+        record(self.srv, 'D', 1, False)
+        ngamsCacheControlThread.flushCacheAccesses(self.srv)
+        res = self.srv._cacheContDbmsCur.execute(
+            "SELECT file_id, access_count FROM ngas_cache ORDER BY file_id")
+        self.assertEqual([('A', 3), ('B', 1), ('C', 0)], res.fetchall())
+        self.assertEqual(0.8, self.srv.getCacheAccessLog().hit_ratio())
+
+        self.assertEqual(['A', 'B', 'C'], self._eviction_order('FIFO'))
+        self.assertEqual(['C', 'B', 'A'], self._eviction_order('LRU'))
+        self.assertEqual(['C', 'B', 'A'], self._eviction_order('LFU'))
+
+        # ARC: C is the only file not retrieved since it was stored, i.e.,
+        # accessed once (T1), and is within its target size, so files
+        # retrieved from the cache (T2) go first
+        self.assertEqual(['B', 'A', 'C'], self._eviction_order('ARC'))
+        self.assertEqual(['B', 'A', 'C'], self._eviction_order('ARC', 20, True))
+        self.srv.getCacheAccessLog().arc_p = 0
+        self.assertEqual(['C', 'B', 'A'], self._eviction_order('ARC'))
+
+    def test_accesses_not_in_cache(self):
+        """Accesses to files not in the Cache DBMS yet are kept for a while"""
+
+        access_log = self.srv.getCacheAccessLog()
+        record = ngamsCacheControlThread.recordCacheAccess
+        record(self.srv, 'D', 1, True)
+        record(self.srv, 'E', 1, True)
+        ngamsCacheControlThread.flushCacheAccesses(self.srv)
+        self.assertEqual({('D', 1), ('E', 1)}, set(access_log._pending))
+
+        # D makes it into the cache, E doesn't
+        self.srv._cacheContDbmsCur.execute(
+            "INSERT INTO ngas_cache (disk_id, file_id, file_version, filename, "
+            "file_size, cache_delete, last_check, cache_time, cache_entry_obj) "
+            "VALUES ('disk', 'D', 1, 'D', 10, 0, 0, 3, '')")
+        record(self.srv, 'D', 1, True)
+        ngamsCacheControlThread.flushCacheAccesses(self.srv)
+        res = self.srv._cacheContDbmsCur.execute(
+            "SELECT access_count FROM ngas_cache WHERE file_id = 'D'")
+        self.assertEqual([(2,)], res.fetchall())
+        self.assertEqual({}, access_log._pending)
+
+    def test_refetched(self):
+        """Files brought back into the cache after being removed are detected"""
+
+        access_log = self.srv.getCacheAccessLog()
+        ngamsCacheControlThread._addEvictedEntry(self.srv, 'A', 1, 10, 0)
+        ngamsCacheControlThread._addEvictedEntry(self.srv, 'B', 1, 20, 2)
+        ngamsCacheControlThread._checkRefetched(self.srv, 'C', 1, 30)
+        self.assertEqual((0, 0), (access_log.refetched_files, access_log.refetched_bytes))
+
+        # A was removed while accessed only once, so ARC's T1 target grows
+        ngamsCacheControlThread._checkRefetched(self.srv, 'A', 1, 10)
+        self.assertEqual((1, 10), (access_log.refetched_files, access_log.refetched_bytes))
+        self.assertAlmostEqual(0.6, access_log.arc_p)
+        ngamsCacheControlThread._checkRefetched(self.srv, 'A', 1, 10)
+        self.assertEqual(1, access_log.refetched_files)
+
+        ngamsCacheControlThread._checkRefetched(self.srv, 'B', 1, 20)
+        self.assertEqual((2, 30), (access_log.refetched_files, access_log.refetched_bytes))
+        self.assertAlmostEqual(0.5, access_log.arc_p)
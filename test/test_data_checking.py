@@ -32,8 +32,11 @@ This module contains the Test Suite for the Data Consistency Checking Thread.
 """
 
 import os
+import threading
 import time
 
+from ngamsLib import ngamsDbCore
+from ngamsServer import ngamsDataCheckThread, ngamsFileUtils
 from .ngamsTestLib import ngamsTestSuite, tmp_path
 
 
@@ -164,4 +167,306 @@ class ngamsDataCheckingThreadTest(ngamsTestSuite):
                    'AND file_version = 1')
             db.query2(sql, args=('123', 'TEST.2001-05-08T15:25:00.123'))
 
-        self._test_data_check_thread(6, 0, 2, corrupt=change_checksum)
\ No newline at end of file
+        self._test_data_check_thread(6, 0, 2, corrupt=change_checksum)
+
+
+class _FakeDb(object):
+
+    def __init__(self, files):
+        self.files = files
+
+    def getFileSummary1(self, **kwargs):
+        return iter(self.files)
+
+
+class _FakeSrv(object):
+
+    def __init__(self, files):
+        self.db = _FakeDb(files)
+
+    def getDb(self):
+        return self.db
+
+
+class _FakeDiskInfo(object):
+
+    def __init__(self, mount_pt):
+        self.mount_pt = mount_pt
+
+    def getDiskId(self):
+        return 'disk-1'
+
+    def getSlotId(self):
+        return '1'
+
+    def getMountPoint(self):
+        return self.mount_pt
+
+    def getHostId(self):
+        return 'host'
+
+
+class _FakeCheckCfg(object):
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def getRootDirectory(self):
+        return self.root_dir
+
+    def getCRCVariant(self):
+        return 'crc32'
+
+    def getBlockSize(self):
+        return 4096
+
+
+class _FakeCheckSrv(object):
+
+    def __init__(self, root_dir):
+        self.cfg = _FakeCheckCfg(root_dir)
+        self.db = self
+        self.valid = {}
+
+    def getCfg(self):
+        return self.cfg
+
+    def getDb(self):
+        return self
+
+    def getHostId(self):
+        return 'host'
+
+    def set_valid_checksum(self, file_id, file_version, disk_id, valid):
+        self.valid[file_id] = valid
+
+
+class ngamsDataCheckWorkListTest(ngamsTestSuite):
+    """Checks the work-lists used by the Data Check Thread"""
+
+    def _file_info(self, filename, size, ignore=0):
+        fileInfo = [None] * len(ngamsDbCore.getNgasSummary1Def())
+        fileInfo[ngamsDbCore.SUM1_FILENAME] = filename
+        fileInfo[ngamsDbCore.SUM1_FILE_ID] = os.path.basename(filename)
+        fileInfo[ngamsDbCore.SUM1_VERSION] = 1
+        fileInfo[ngamsDbCore.SUM1_FILE_SIZE] = size
+        fileInfo[ngamsDbCore.SUM1_FILE_IGNORE] = ignore
+        return fileInfo
+
+    def test_worklist(self):
+        """Files are handed out sorted, and unregistered files are found"""
+
+        mount_pt = tmp_path('worklist_disk')
+        names = ['b/1', 'a/2', 'a-b', 'a/1', 'c', 'a/b/c', 'd', 'e/f']
+        files = [self._file_info(name, i) for i, name in enumerate(names[:-1])]
+        files.append(self._file_info(names[-1], 1000, ignore=1))
+
+        # On disk: every registered file, plus an unregistered one and files
+        # that are never reported
+        for name in names + ['a/x', 'NgasDiskInfo', '.hidden/x', 'staging/y']:
+            path = os.path.join(mount_pt, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb'):
+                pass
+
+        # Force the entries to be spilled and merged
+        self.addCleanup(setattr, ngamsDataCheckThread, '_WORKLIST_RUN_SIZE',
+                        ngamsDataCheckThread._WORKLIST_RUN_SIZE)
+        ngamsDataCheckThread._WORKLIST_RUN_SIZE = 3
+        stopEvt = threading.Event()
+        worklist = ngamsDataCheckThread._dumpWorkList(
+            _FakeSrv(files), _FakeDiskInfo(mount_pt), tmp_path('disk-1.worklist'),
+            tmp_path('DATA-CHECK'), stopEvt)
+
+        # Statistics skip ignored files, which are not handed out either
+        self.assertEqual(7, worklist.files)
+        self.assertEqual(sum(range(7)), worklist.size)
+        checked = []
+        worklist.rewind()
+        for fileInfo in iter(worklist.getNext, None):
+            self.assertEqual(mount_pt, fileInfo[ngamsDbCore.SUM1_MT_PT])
+            self.assertEqual('disk-1', fileInfo[ngamsDbCore.SUM1_DISK_ID])
+            checked.append(fileInfo[ngamsDbCore.SUM1_FILENAME])
+        self.assertEqual(['a/1', 'a/2', 'a/b/c', 'a-b', 'b/1', 'c', 'd'], checked)
+
+        unregistered = ngamsDataCheckThread._findUnregisteredFiles(
+            stopEvt, 'disk-1', mount_pt, worklist)
+        self.assertEqual({os.path.join(mount_pt, 'a/x'): 'disk-1'}, unregistered)
+
+    def test_volumes_and_ordering(self):
+        """Disks are grouped by volume, files are ordered by inode"""
+
+        mount_pts = [tmp_path('volume_disk_%d' % i) for i in range(2)]
+        for mount_pt in mount_pts:
+            if not os.path.isdir(mount_pt):
+                os.makedirs(mount_pt)
+        disks = {'disk-%d' % i: _FakeDiskInfo(mount_pt)
+                 for i, mount_pt in enumerate(mount_pts)}
+        disks['disk-x'] = _FakeDiskInfo(tmp_path('volume_disk_missing'))
+
+        # Both disks share the same device, the missing one is on its own
+        volumes = ngamsDataCheckThread._groupDisksByVolume(disks)
+        self.assertEqual([['disk-0', 'disk-1'], ['disk-x']], volumes)
+
+        # Files are handed out sorted by inode within each window
+        names = ['f%d' % i for i in range(5)]
+        for name in reversed(names):
+            with open(os.path.join(mount_pts[0], name), 'wb'):
+                pass
+        files = [self._file_info(name, 1) for name in names]
+        worklist = ngamsDataCheckThread._dumpWorkList(
+            _FakeSrv(files), _FakeDiskInfo(mount_pts[0]),
+            tmp_path('disk-0.worklist'), tmp_path('DATA-CHECK'),
+            threading.Event())
+        inodes = [os.stat(os.path.join(mount_pts[0], name)).st_ino for name in names]
+        ordered = [ngamsDataCheckThread._inode(f)
+                   for f in ngamsDataCheckThread._orderedFiles(worklist, 3)]
+        self.assertEqual(sorted(inodes[:3]) + sorted(inodes[3:]), ordered)
+
+    def test_rate_limiter(self):
+        """The rate limiter throttles reads only when a rate is set"""
+
+        stopEvt = threading.Event()
+        limiter = ngamsDataCheckThread._RateLimiter(10)
+        start = time.time()
+        for _ in range(3):
+            self.assertTrue(limiter.consume(stopEvt, 1024 * 1024))
+        self.assertGreaterEqual(time.time() - start, 0.25)
+        start = time.time()
+        self.assertTrue(ngamsDataCheckThread._RateLimiter(0).consume(stopEvt, 1024 ** 3))
+        self.assertLess(time.time() - start, 0.1)
+
+        # Sleeps are interrupted when stopping
+        stopEvt.set()
+        start = time.time()
+        self.assertFalse(limiter.consume(stopEvt, 1024 ** 3))
+        self.assertLess(time.time() - start, 0.1)
+
+    def test_paced_reads(self):
+        """Checksum calculations read each block at the limited rate"""
+
+        filename = tmp_path('paced_file')
+        with open(filename, 'wb') as f:
+            f.write(b'x' * 1024 * 1024)
+
+        # Record when each block is read
+        allowEvt, stopEvt = threading.Event(), threading.Event()
+        allowEvt.set()
+        limiter = ngamsDataCheckThread._RateLimiter(4)
+        reads = []
+        def throttle(size):
+            result = limiter.consume(stopEvt, size)
+            reads.append(time.time())
+            return result
+
+        checksum = ngamsFileUtils.get_checksum_interruptible(
+            128 * 1024, filename, 'crc32', allowEvt, stopEvt, throttle=throttle)
+        self.assertEqual(ngamsFileUtils.get_checksum(4096, filename, 'crc32'), checksum)
+
+        # 128 KB blocks at 4 MB/s: one block every 1/32 s
+        self.assertEqual(8, len(reads))
+        for previous, current in zip(reads, reads[1:]):
+            self.assertGreaterEqual(current - previous, 1 / 32. * 0.8)
+
+        # The checksum worker limits the rate it reads files at
+        self.addCleanup(setattr, ngamsDataCheckThread, 'checksum_allow_evt',
+                        ngamsDataCheckThread.checksum_allow_evt)
+        self.addCleanup(setattr, ngamsDataCheckThread, 'checksum_stop_evt',
+                        ngamsDataCheckThread.checksum_stop_evt)
+        ngamsDataCheckThread.checksum_allow_evt = allowEvt
+        ngamsDataCheckThread.checksum_stop_evt = stopEvt
+        start = time.time()
+        self.assertEqual(checksum, ngamsDataCheckThread.do_checksum(
+            128 * 1024, filename, 'crc32', max_rate=4))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+    def test_incremental_state(self):
+        """Only new, changed, invalid or sampled files are checked again"""
+
+        mount_pt = tmp_path('incremental_disk')
+        if not os.path.isdir(mount_pt):
+            os.makedirs(mount_pt)
+        filename = os.path.join(mount_pt, 'f')
+        with open(filename, 'wb') as f:
+            f.write(b'data')
+        fileInfo = self._file_info('f', 4)
+        fileInfo[ngamsDbCore.SUM1_MT_PT] = mount_pt
+        fileInfo[ngamsDbCore.SUM1_DISK_ID] = 'disk-1'
+        fileInfo[ngamsDbCore.SUM1_FILE_STATUS] = '00000000'
+
+        disk = _FakeDiskInfo(mount_pt)
+        disk.getLastCheck = lambda: 1000
+        state = ngamsDataCheckThread.CheckState(tmp_path('state.sqlite'), 100)
+        self.addCleanup(state.close)
+        state.startCycle({'disk-1': disk}, 1010)
+        self.assertAlmostEqual(0.1, state.samplingRates['disk-1'])
+
+        # New files are checked
+        st = ngamsDataCheckThread._statFile(fileInfo)
+        self.assertTrue(state.needsCheck(fileInfo, st, 1010))
+        state.update(fileInfo, st, True, 1010)
+
+        # Unchanged files are sampled until a full cycle passes
+        state.samplingRates['disk-1'] = 0
+        self.assertFalse(state.needsCheck(fileInfo, st, 1050))
+        self.assertTrue(state.needsCheck(fileInfo, st, 1110))
+        state.samplingRates['disk-1'] = 1
+        self.assertTrue(state.needsCheck(fileInfo, st, 1050))
+        state.samplingRates['disk-1'] = 0
+
+        # Changed, missing and invalid files are always checked
+        with open(filename, 'ab') as f:
+            f.write(b'more')
+        self.assertTrue(state.needsCheck(fileInfo, ngamsDataCheckThread._statFile(fileInfo), 1050))
+        self.assertTrue(state.needsCheck(fileInfo, None, 1050))
+        fileInfo[ngamsDbCore.SUM1_FILE_STATUS] = '10000000'
+        self.assertTrue(state.needsCheck(fileInfo, st, 1050))
+        fileInfo[ngamsDbCore.SUM1_FILE_STATUS] = '00000000'
+
+        # Invalid files are forgotten, as are those not seen for long
+        state.update(fileInfo, st, False, 1050)
+        self.assertTrue(state.needsCheck(fileInfo, st, 1050))
+        state.update(fileInfo, st, True, 1050)
+        state.prune(1300)
+        self.assertTrue(state.needsCheck(fileInfo, st, 1300))
+
+    def test_check_file_result(self):
+        """Only files whose checksum was calculated and matched are verified"""
+
+        root_dir = tmp_path('check_file_root')
+        mount_pt = os.path.join(root_dir, 'disk')
+        for d in (os.path.join(root_dir, 'cache'), mount_pt):
+            if not os.path.isdir(d):
+                os.makedirs(d)
+        with open(os.path.join(mount_pt, 'f'), 'wb') as f:
+            f.write(b'data')
+        checksum = ngamsFileUtils.get_checksum(4096, os.path.join(mount_pt, 'f'), 'crc32')
+
+        fileInfo = self._file_info('f', 4)
+        fileInfo[ngamsDbCore.SUM1_MT_PT] = mount_pt
+        fileInfo[ngamsDbCore.SUM1_DISK_ID] = 'disk-1'
+        fileInfo[ngamsDbCore.SUM1_CHECKSUM] = str(checksum)
+        fileInfo[ngamsDbCore.SUM1_CHECKSUM_PI] = 'crc32'
+
+        def check(skipCheckSum=0, executor=None):
+            srv = _FakeCheckSrv(root_dir)
+            report = []
+            verified = ngamsFileUtils.checkFile(srv, fileInfo, report,
+                                                skipCheckSum, executor=executor)
+            return verified, report, srv.valid.get('f')
+
+        self.assertEqual((True, [], True), check())
+
+        # Skipped or failed checksum calculations don't verify the file
+        self.assertFalse(check(skipCheckSum=1)[0])
+        def failing_executor(*args):
+            raise IOError("EIO")
+        self.assertEqual((False, [], None), check(executor=failing_executor))
+
+        # Wrong checksums are reported, and flagged in the DB
+        fileInfo[ngamsDbCore.SUM1_CHECKSUM] = str(checksum + 1)
+        verified, report, valid = check()
+        self.assertFalse(verified)
+        self.assertFalse(valid)
+        self.assertEqual("ERROR: Inconsistent checksum found", report[0][0])
@@ -20,7 +20,12 @@
 #    MA 02111-1307  USA
 #
 
-from ngamsLib import ngamsDb, ngamsDiskInfo, ngamsFileInfo
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+from ngamsLib import ngamsDb, ngamsDiskInfo, ngamsFileInfo, ngamsHostInfo
+from ngamsLib import ngamsHighLevelLib, ngamsDiskUtils
 from test import ngamsTestLib
 
 class DbTests(ngamsTestLib.ngamsTestSuite):
@@ -47,4 +52,331 @@ class DbTests(ngamsTestLib.ngamsTestSuite):
         file_info.setFileId('file-id')
         file_info.write('host-id', self.db, genSnapshot=0)
         res = list(self.db.getFileInfoList('disk-id', fileId="*"))
-        self.assertEqual(1, len(res))
\ No newline at end of file
+        self.assertEqual(1, len(res))
+
+    def _write_disk(self):
+        disk_info = ngamsDiskInfo.ngamsDiskInfo()
+        disk_info.setDiskId('disk-id')
+        disk_info.setMountPoint(ngamsTestLib.tmp_path())
+        disk_info.setNumberOfFiles(0)
+        disk_info.setBytesStored(0)
+        disk_info.write(self.db)
+
+    def _write_file(self, file_id, size=100):
+        file_info = ngamsFileInfo.ngamsFileInfo()
+        file_info.setDiskId('disk-id')
+        file_info.setFileId(file_id)
+        file_info.setFileVersion(1)
+        file_info.setFileSize(size)
+        file_info.write('host-id', self.db, genSnapshot=0, updateDiskInfo=1)
+
+    def _assert_disk_status(self, number_of_files, bytes_stored):
+        disk_info = ngamsDiskInfo.ngamsDiskInfo().read(self.db, 'disk-id')
+        self.assertEqual(number_of_files, disk_info.getNumberOfFiles())
+        self.assertEqual(bytes_stored, disk_info.getBytesStored())
+
+    def test_write_file_entry_updates_disk(self):
+        """New file entries update their disk, existing ones are only updated"""
+
+        self._write_disk()
+        self._write_file('file-id')
+        self._assert_disk_status(1, 100)
+        self._write_file('file-id', size=200)
+        self._assert_disk_status(1, 100)
+        res = self.db.query2("SELECT file_size FROM ngas_files WHERE file_id = {0}", ('file-id',))
+        self.assertEqual([(200,)], [tuple(r) for r in res])
+
+        # Registration fails altogether if the disk is unknown
+        file_info = ngamsFileInfo.ngamsFileInfo()
+        file_info.setDiskId('unknown-disk-id')
+        file_info.setFileId('file-id-2')
+        self.assertRaises(Exception, file_info.write, 'host-id', self.db,
+                          genSnapshot=0, updateDiskInfo=1)
+        self.assertEqual(0, len(self.db.query2("SELECT * FROM ngas_files WHERE file_id = {0}", ('file-id-2',))))
+
+    def test_write_file_entries(self):
+        """Several file entries are written together, disks are updated separately"""
+
+        self._write_disk()
+        self._write_file('file-0')
+        file_infos = []
+        for i in range(10):
+            file_info = ngamsFileInfo.ngamsFileInfo()
+            file_info.setDiskId('disk-id').setFileId('file-%d' % i).setFileVersion(1)
+            file_info.setFilename('dir/file-%d' % i).setFileSize(10)
+            file_infos.append(file_info)
+
+        # file-0 exists already, so it's only updated
+        new_entries = self.db.writeFileEntries('host-id', file_infos, genSnapshot=0)
+        self.assertEqual({'disk-id': (9, 90)}, new_entries)
+        self._assert_disk_status(1, 100)
+        self.db.updateDiskFileStatus('disk-id', 90, 9)
+        self._assert_disk_status(10, 190)
+
+        filenames = sorted(self.db.getFilenames('disk-id', 'dir/'))
+        self.assertEqual(['dir/file-%d' % i for i in range(10)], filenames)
+        self.assertEqual(['dir/file-1'], list(self.db.getFilenames('disk-id', 'dir/file-1')))
+        self.assertEqual([], list(self.db.getFilenames('disk-id', 'dir_')))
+
+    def test_subscr_queue_statuses(self):
+        """The persistent subscription queue status of several files is read at once"""
+
+        for i in range(3):
+            self.db.addSubscrQueueEntry('subscr-id', 'file-%d' % i, 1, 'disk-id', 'file-%d' % i,
+                                        '2018-01-01T00:00:00.000', 'application/octet-stream', i - 2, 0)
+        self.db.addSubscrQueueEntry('subscr-id-2', 'file-0', 1, 'disk-id', 'file-0',
+                                    '2018-01-01T00:00:00.000', 'application/octet-stream', 0, 0)
+
+        file_ids = ['file-%d' % i for i in range(5)] * 2
+        statuses = self.db.getSubscrQueueStatuses('subscr-id', file_ids)
+        self.assertEqual({('file-0', 1, 'disk-id'): -2,
+                          ('file-1', 1, 'disk-id'): -1,
+                          ('file-2', 1, 'disk-id'): 0},
+                         {k: v[0] for k, v in statuses.items()})
+        self.assertEqual({}, self.db.getSubscrQueueStatuses('subscr-id', []))
+
+    def test_group_commit(self):
+        """Concurrent file registrations are grouped into fewer transactions"""
+
+        self.db.close()
+        cfg = self.env_aware_cfg()
+        self.point_to_sqlite_database(cfg, ngamsTestLib.tmp_path('ngas.sqlite'))
+        cfg.storeVal('NgamsCfg.Db[1].GroupCommit', 'true')
+        self.db = ngamsDb.from_config(cfg, maxpool=1)
+
+        # Slow down transactions so registrations pile up while committing
+        transaction = self.db.transaction
+        def slow_transaction():
+            time.sleep(0.01)
+            return transaction()
+        self.db.transaction = slow_transaction
+
+        self._write_disk()
+        pool = ThreadPool(8)
+        pool.map(self._write_file, ['file-%d' % i for i in range(40)])
+        pool.close()
+        self._assert_disk_status(40, 4000)
+        self.assertEqual(40, len(self.db.query2("SELECT * FROM ngas_files")))
+        commits, requests = self.db.getGroupCommitStats()
+        self.assertEqual(40, requests)
+        self.assertLess(commits, 40)
+
+    def test_write_file_entry_race(self):
+        """Entries inserted concurrently after the UPDATE are updated on retry"""
+
+        self._write_disk()
+        self._write_file('file-id')
+
+        # The first attempt doesn't see the existing entry, like if it was
+        # inserted by another transaction that hadn't committed yet
+        write_file_entry = self.db._write_file_entry
+        calls = []
+        def racing_write_file_entry(t, update_sql, *args):
+            calls.append(update_sql)
+            if len(calls) == 1:
+                update_sql += " AND 1 = 0"
+            return write_file_entry(t, update_sql, *args)
+        self.db._write_file_entry = racing_write_file_entry
+
+        self._write_file('file-id', size=200)
+        self.assertEqual(2, len(calls))
+        self._assert_disk_status(1, 100)
+        res = self.db.query2("SELECT file_size FROM ngas_files WHERE file_id = {0}", ('file-id',))
+        self.assertEqual([(200,)], [tuple(r) for r in res])
+
+    def test_query_cache(self):
+        """Prepared SQL statements are reused"""
+
+        self._write_disk()
+        hits, misses, _ = self.db.getQueryCacheStats()
+        sql = "SELECT disk_id FROM ngas_disks WHERE disk_id LIKE {0} AND mount_point LIKE '%'"
+        for _ in range(3):
+            res = self.db.query2(sql, ('disk%',))
+            self.assertEqual('disk-id', res[0][0])
+        new_hits, new_misses, size = self.db.getQueryCacheStats()
+        self.assertEqual(1, new_misses - misses)
+        self.assertEqual(2, new_hits - hits)
+        self.assertGreater(size, 0)
+
+        # Same SQL with a different number of arguments is a different statement
+        self.db.query2("SELECT disk_id FROM ngas_disks")
+        self.assertEqual(new_misses + 1, self.db.getQueryCacheStats()[1])
+
+    def test_host_info_cache(self):
+        """Host information is cached, and forgotten when updated"""
+
+        host_info = ngamsHostInfo.ngamsHostInfo()
+        host_info.setHostId('host-id').setDomain('domain').\
+                  setIpAddress('127.0.0.1').setSrvPort(7777).\
+                  setClusterName('host-id')
+        self.db.writeHostInfo(host_info)
+
+        cfg = self.env_aware_cfg()
+        cfg.storeVal('NgamsCfg.Server[1].HostInfoCacheTime', '60')
+        def resolved_port():
+            host_dic = ngamsHighLevelLib.resolveHostAddress('host-id', self.db,
+                                                            cfg, ['host-id'])
+            return host_dic['host-id'].getSrvPort()
+
+        ngamsHighLevelLib.invalidate_host_info()
+        hits, misses, _ = ngamsHighLevelLib.getHostInfoCacheStats()
+        for _ in range(3):
+            self.assertEqual(7777, resolved_port())
+        new_hits, new_misses, size = ngamsHighLevelLib.getHostInfoCacheStats()
+        self.assertEqual(1, new_misses - misses)
+        self.assertEqual(2, new_hits - hits)
+        self.assertEqual(1, size)
+
+        # Changes done behind our back are not seen until the entry expires...
+        self.db.query2("UPDATE ngas_hosts SET srv_port = 8888")
+        self.assertEqual(7777, resolved_port())
+
+        # ... but those done by the server are
+        host_info.setSrvPort(9999)
+        ngamsHighLevelLib.updateSrvHostInfo(self.db, host_info)
+        self.assertEqual(9999, resolved_port())
+
+    def _write_target_disk(self, disk_id, slot_id, bytes_stored):
+        mount_point = ngamsTestLib.tmp_path(disk_id)
+        os.makedirs(mount_point)
+        disk_info = ngamsDiskInfo.ngamsDiskInfo()
+        disk_info.setDiskId(disk_id).setHostId('host-id').setSlotId(slot_id).\
+                  setMounted(1).setMountPoint(mount_point).setNumberOfFiles(0).\
+                  setAvailableMb(1000).setBytesStored(bytes_stored)
+        disk_info.write(self.db)
+        return disk_info
+
+    def test_target_disk_cache(self):
+        """Target disks are selected without querying the DB"""
+
+        cfg = self.env_aware_cfg()
+        cfg.storeVal('NgamsCfg.Server[1].RootDirectory', ngamsTestLib.tmp_path())
+        cfg.storeVal('NgamsCfg.ArchiveHandling[1].Replication', '0')
+        cfg.storeVal('NgamsCfg.ArchiveHandling[1].TargetDiskCacheTime', '60')
+        disk_1 = self._write_target_disk('disk-1', 'FitsStorage1-Main-1', 100)
+        self._write_target_disk('disk-2', 'FitsStorage2-Main-3', 200)
+        def find_target_disk(req_space=None):
+            return ngamsDiskUtils.findTargetDisk('host-id', self.db, cfg,
+                                                 'application/octet-stream',
+                                                 sendNotification=0,
+                                                 reqSpace=req_space)
+        def n_queries():
+            hits, misses, _ = self.db.getQueryCacheStats()
+            return hits + misses
+
+        # The fullest disk is selected, the DB is queried only the first time
+        ngamsDiskUtils.findTargetDiskResetCache()
+        self.assertEqual('disk-2', find_target_disk().getDiskId())
+        queries = n_queries()
+        target = find_target_disk()
+        self.assertEqual('disk-2', target.getDiskId())
+        self.assertEqual('FitsStorage2', target.getStorageSetId())
+        self.assertRaises(Exception, find_target_disk, 2000 * 1048576)
+        self.assertEqual(queries, n_queries())
+
+        # Files registered by the server are accounted for
+        file_info = ngamsFileInfo.ngamsFileInfo()
+        file_info.setDiskId('disk-1').setFileId('file-id').setFileVersion(1).setFileSize(200)
+        file_info.write('host-id', self.db, genSnapshot=0, updateDiskInfo=1)
+        ngamsDiskUtils.findTargetDiskUpdateCache('disk-1', 200)
+        queries = n_queries()
+        self.assertEqual('disk-1', find_target_disk().getDiskId())
+        self.assertEqual(queries, n_queries())
+
+        # Changes not concerning the disks don't empty the cache
+        self.db.triggerEvents()
+        self.db.setLastCheckDisk('disk-2', time.time())
+        queries = n_queries()
+        self.assertEqual('disk-1', find_target_disk().getDiskId())
+        self.assertEqual(queries, n_queries())
+
+        # Other changes to the disks are seen immediately
+        self.db.updateDiskFileStatus('disk-2', 300)
+        self.assertEqual('disk-2', find_target_disk().getDiskId())
+        disk_1.setCompleted(1).write(self.db)
+        self.assertEqual('disk-2', find_target_disk().getDiskId())
+
+        # Equally full disks: the oldest one first, then those without date
+        disks = {}
+        for disk_id, installation_date in (('d1', None), ('d2', 2000), ('d3', 1000)):
+            disks[disk_id] = ngamsDiskInfo.ngamsDiskInfo().setDiskId(disk_id).\
+                setMountPoint('/root/' + disk_id).setBytesStored(100).\
+                setInstallationDate(installation_date)
+        self.assertEqual('d3', ngamsDiskUtils._getBestTargetDisk(disks, ['d1', 'd2', 'd3'], '/root'))
+        self.assertEqual('d2', ngamsDiskUtils._getBestTargetDisk(disks, ['d1', 'd2'], '/root'))
+
+    def test_valid_checksum_status(self):
+        """Checksum validity is flagged in and cleared from the file status"""
+
+        self._write_disk()
+        file_info = ngamsFileInfo.ngamsFileInfo()
+        file_info.setDiskId('disk-id').setFileId('file-id').setFileVersion(1)
+        file_info.setFileStatus('00000000')
+        file_info.write('host-id', self.db, genSnapshot=0)
+        def file_status():
+            return self.db.query2("SELECT file_status FROM ngas_files")[0][0]
+
+        self.db.set_valid_checksum('file-id', 1, 'disk-id', False)
+        self.assertEqual('10000000', file_status())
+        self.db.set_available_for_deletion('file-id', 1, 'disk-id')
+        self.assertEqual('10000100', file_status())
+        self.db.set_valid_checksum('file-id', 1, 'disk-id', True)
+        self.assertEqual('00000100', file_status())
+
+    def test_read_container_hierarchy(self):
+        """Container hierarchies and their file locations are read in bulk"""
+
+        self._write_disk()
+        self.db.query2("UPDATE ngas_disks SET host_id = 'host-id'")
+        host_info = ngamsHostInfo.ngamsHostInfo()
+        host_info.setHostId('host-id').setDomain('domain').\
+                  setIpAddress('127.0.0.1').setSrvPort(7777).setClusterName('host-id')
+        self.db.writeHostInfo(host_info)
+
+        # root -> 5 children -> 3 grandchildren each, one file in each container
+        root_id = self.db.createContainer('root')
+        cont_ids = [root_id]
+        for i in range(5):
+            child_id = self.db.createContainer('child-%d' % i, parentContainerId=root_id)
+            cont_ids.append(child_id)
+            for j in range(3):
+                cont_ids.append(self.db.createContainer('grandchild-%d' % j, parentContainerId=child_id))
+        for i, cont_id in enumerate(cont_ids):
+            file_id = 'file-%d' % i
+            for version in (1, 2):
+                file_info = ngamsFileInfo.ngamsFileInfo()
+                file_info.setDiskId('disk-id').setFileId(file_id).setFileVersion(version)
+                file_info.setFilename(file_id).setFileSize(version).setFileStatus('00000000')
+                file_info.setFormat('application/octet-stream')
+                file_info.write('host-id', self.db, genSnapshot=0)
+            self.db.addFileToContainer(cont_id, file_id, False)
+
+        def n_queries():
+            hits, misses, _ = self.db.getQueryCacheStats()
+            return hits + misses
+        queries = n_queries()
+        root = self.db.readHierarchy(root_id, True)
+        # One for the root, one per level (+1 to find there are no more) and one for the files
+        self.assertEqual(5, n_queries() - queries)
+
+        self.assertEqual('root', root.getContainerName())
+        self.assertEqual(5, len(root.getContainers()))
+        all_conts = [root]
+        for child in root.getContainers():
+            self.assertIs(root, child.getParentContainer())
+            self.assertEqual(3, len(child.getContainers()))
+            all_conts += [child] + child.getContainers()
+        self.assertEqual(sorted(cont_ids), sorted(c.getContainerId() for c in all_conts))
+        for cont in all_conts:
+            files = cont.getFilesInfo()
+            self.assertEqual(1, len(files))
+            self.assertEqual(2, files[0].getFileVersion())
+
+        queries = n_queries()
+        locations = self.db.getContainerFileLocations(cont_ids)
+        self.assertEqual(1, n_queries() - queries)
+        self.assertEqual(2 * len(cont_ids), len(locations))
+        self.assertEqual([('host-id', '127.0.0.1', 7777, ngamsTestLib.tmp_path(), 'file-0', 2,
+                           'application/octet-stream', 2)],
+                         [tuple(l) for l in locations[('file-0', 2)]])
+        self.assertIsNone(self.db.readHierarchy('unknown-container-id', True))
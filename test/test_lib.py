@@ -20,9 +20,19 @@
 #    MA 02111-1307  USA
 #
 
+import binascii
+import gzip
+import hashlib
+import io
+import os
+import random
+import tempfile
+import threading
 import unittest
+import zlib
 
 from ngamsLib import ngamsCore, ngamsLib
+from ngamsServer import ngamsFileUtils
 
 class NgamsLibTests(unittest.TestCase):
 
@@ -44,4 +54,108 @@ class NgamsLibTests(unittest.TestCase):
         """Double-checks that filenames are properly escaped"""
 
         self.assertEqual('_', ngamsCore.to_valid_filename('?'))
-        self.assertEqual('__', ngamsCore.to_valid_filename('??'))
\ No newline at end of file
+        self.assertEqual('__', ngamsCore.to_valid_filename('??'))
+
+    def _roundtrip(self, data, threads, block_size=1024):
+        compressed = io.BytesIO()
+        ngamsCore.compress_stream(io.BytesIO(data), compressed,
+                                  block_size=block_size, threads=threads)
+        compressed = compressed.getvalue()
+        # Readable by the standard gzip module as well
+        self.assertEqual(data, gzip.GzipFile(fileobj=io.BytesIO(compressed)).read())
+        decompressed = io.BytesIO()
+        ngamsCore.decompress_stream(io.BytesIO(compressed), decompressed,
+                                    block_size=100)
+        self.assertEqual(data, decompressed.getvalue())
+
+    def test_compress_stream(self):
+        """Streams are compressed into valid gzip streams, with and without threads"""
+        rnd = random.Random(0)
+        data = b''.join(rnd.choice([b'a', b'b', b'c']) for _ in range(10000))
+        for threads in (1, 4):
+            for content in (b'', b'x', data):
+                self._roundtrip(content, threads)
+            self._roundtrip(data, threads, block_size=2500)
+
+        # Truncated streams are detected
+        compressed = io.BytesIO()
+        ngamsCore.compress_stream(io.BytesIO(data), compressed)
+        truncated = io.BytesIO(compressed.getvalue()[:-10])
+        self.assertRaises(zlib.error, ngamsCore.decompress_stream,
+                          truncated, io.BytesIO())
+
+    def test_compress_file(self):
+        """compressFile/decompressFile replace the original file"""
+        data = b'some data to compress\n' * 1000
+        fd, fname = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            for threads in (1, 3):
+                compressed = ngamsCore.compressFile(fname, threads=threads)
+                self.assertEqual(fname + '.gz', compressed)
+                self.assertFalse(os.path.exists(fname))
+                self.assertEqual(fname, ngamsCore.decompressFile(compressed))
+                self.assertFalse(os.path.exists(compressed))
+                with open(fname, 'rb') as f:
+                    self.assertEqual(data, f.read())
+            self.assertRaises(Exception, ngamsCore.decompressFile, fname)
+
+            # Truncated files are detected, and left untouched
+            compressed = ngamsCore.compressFile(fname)
+            with open(compressed, 'rb+') as f:
+                f.truncate(os.path.getsize(compressed) - 4)
+            self.assertRaises(Exception, ngamsCore.decompressFile, compressed)
+            self.assertTrue(os.path.exists(compressed))
+            self.assertFalse(os.path.exists(fname))
+        finally:
+            ngamsCore.rmFile(fname + '*')
+
+
+class ChecksumTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp()
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.data)
+        self.addCleanup(os.remove, self.fname)
+        self.addCleanup(setattr, ngamsFileUtils, '_MIN_CHECKSUM_SEGMENT_SIZE',
+                        ngamsFileUtils._MIN_CHECKSUM_SEGMENT_SIZE)
+        ngamsFileUtils._MIN_CHECKSUM_SEGMENT_SIZE = 1024 * 1024
+
+    def test_crc_combine(self):
+        data1, data2 = self.data[:1000], self.data[1000:]
+        combined = ngamsFileUtils._crc32_combine(binascii.crc32(data1),
+                                                 binascii.crc32(data2),
+                                                 len(data2))
+        self.assertEqual(binascii.crc32(self.data) & 0xffffffff, combined)
+
+    def test_parallel_checksum(self):
+        variants = ['crc32', 'crc32z']
+        if ngamsFileUtils._crc32c_available:
+            variants.append('crc32c')
+        for variant in variants + ['md5', 'sha256']:
+            serial = ngamsFileUtils.get_checksum(65536, self.fname, variant)
+            parallel = ngamsFileUtils.get_checksum(65536, self.fname, variant, threads=4)
+            info = ngamsFileUtils.get_checksum_info(variant)
+            self.assertTrue(info.equals(serial, parallel), variant)
+
+        # Interruptible calculation, in parallel too
+        allow_evt, stop_evt = threading.Event(), threading.Event()
+        allow_evt.set()
+        crc = ngamsFileUtils.get_checksum_interruptible(65536, self.fname, 'crc32z',
+                                                        allow_evt, stop_evt, threads=4)
+        self.assertEqual(binascii.crc32(self.data) & 0xffffffff, crc)
+        stop_evt.set()
+        self.assertIsNone(ngamsFileUtils.get_checksum_interruptible(
+            65536, self.fname, 'crc32z', allow_evt, stop_evt, threads=4))
+
+    def test_hash_variants(self):
+        self.assertEqual(hashlib.md5(self.data).hexdigest(),
+                         ngamsFileUtils.get_checksum(65536, self.fname, 3))
+        info = ngamsFileUtils.get_checksum_info('sha256')
+        self.assertEqual('sha256', ngamsFileUtils.get_checksum_name(4))
+        self.assertTrue(info.equals(hashlib.sha256(self.data).hexdigest().upper(),
+                                    ngamsFileUtils.get_checksum(65536, self.fname, 'sha256')))
+        self.assertEqual(hashlib.sha256(b'').hexdigest(), info.final(info.init))
@@ -96,7 +96,9 @@ class ngamsMIMEMultipartTest(ngamsTestLib.ngamsTestSuite):
         self._createDirectories()
         if not onlyDirs:
             self._createFiles()
+        return self._readMIMEMessage()
 
+    def _readMIMEMessage(self):
         cinfo = ngamsMIMEMultipart.cinfo_from_filesystem('toplevel', 'application/octet-stream')
         bs = 65536
         output = io.BytesIO()
@@ -170,6 +172,31 @@ class ngamsMIMEMultipartTest(ngamsTestLib.ngamsTestSuite):
             parser = ngamsMIMEMultipart.MIMEMultipartParser(handler, inputContent, len(message), size)
             parser.parse()
 
+    def test_MultipartParserWritesFiles(self):
+        """Files are written as sent regardless of the reading and writing sizes"""
+
+        self._createDirectories()
+        self._createFiles()
+        # Contents that look like the beginning of a delimiter,
+        # and a file bigger than the reading sizes
+        with open(self.myfiles[0], 'wb') as f:
+            f.write(b'\r\n--\r\n-' * 1000)
+        with open(self.myfiles[1], 'wb') as f:
+            f.write(os.urandom(300000))
+        message = self._readMIMEMessage()
+
+        for read_size, write_size in ((1, 1024), (100, 10), (4096, 65536), (65536, 4096)):
+            target = ngamsTestLib.tmp_path('received')
+            handler = ngamsMIMEMultipart.FilesystemWriterHandler(write_size, True, target)
+            parser = ngamsMIMEMultipart.MIMEMultipartParser(handler, io.BytesIO(message), len(message), read_size)
+            parser.parse()
+            self.assertEqual(len(message), parser.getBytesRead())
+            self.assertEqual(len(self.myfiles), len(handler.getFileDataList()))
+            for fname in self.myfiles:
+                with open(fname, 'rb') as f1, open(os.path.join(target, fname), 'rb') as f2:
+                    self.assertEqual(f1.read(), f2.read(), "%s differs" % (fname,))
+            rmFile(target)
+
     def test_FileInfoReader(self):
 
         size = random.randint(10, 100)
@@ -43,6 +43,8 @@ import time
 import unittest
 import uuid
 
+from six.moves import http_client  # @UnresolvedImport
+
 from ngamsLib import ngamsHttpUtils
 from ngamsLib.ngamsCore import NGAMS_HTTP_SERVICE_NA
 from .ngamsTestLib import ngamsTestSuite, save_to_tmp, tmp_path
@@ -114,6 +116,113 @@ class ngamsServerTest(ngamsTestSuite):
         with contextlib.closing(resp):
             self.assertEqual(NGAMS_HTTP_SERVICE_NA, resp.status)
 
+    def test_keepalive(self):
+
+        cfg = (('NgamsCfg.Server[1].KeepAlive', '1'),
+               ('NgamsCfg.Server[1].KeepAliveTimeOut', '2'),
+               ('NgamsCfg.Server[1].KeepAliveMaxRequests', '3'),
+               ('NgamsCfg.Server[1].MaxSimReqs', '2'))
+        self.prepExtSrv(cfgProps=cfg)
+
+        # The same connection is used until the server reaches the cap
+        conn = http_client.HTTPConnection('127.0.0.1', 8888, timeout=10)
+        sock = None
+        for i in range(3):
+            conn.request('GET', '/STATUS')
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(200, resp.status)
+            self.assertEqual(11, resp.version)
+            if i == 0:
+                sock = conn.sock
+            elif i == 1:
+                self.assertIs(sock, conn.sock)
+        self.assertEqual('close', resp.getheader('Connection'))
+        self.assertIsNone(conn.sock)
+
+        # Idle kept-alive connections don't hold on to the server's threads
+        idle_conns = []
+        for _ in range(4):
+            idle_conn = http_client.HTTPConnection('127.0.0.1', 8888, timeout=10)
+            idle_conn.request('GET', '/STATUS')
+            idle_conn.getresponse().read()
+            idle_conns.append(idle_conn)
+        self.status()
+
+        # Idle connections are eventually closed by the server
+        time.sleep(3)
+        for idle_conn in idle_conns:
+            self.assertEqual(b'', idle_conn.sock.recv(1))
+            idle_conn.close()
+
+    def test_http_connection_pool(self):
+
+        self.prepExtSrv(cfgProps=(('NgamsCfg.Server[1].KeepAlive', '1'),))
+
+        # Fully-read responses give their connection back to the pool
+        pool = ngamsHttpUtils.pool
+        pool.clear()
+        hits = pool.hits
+        for _ in range(5):
+            resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'STATUS')
+            with contextlib.closing(resp):
+                self.assertEqual(200, resp.status)
+                resp.read()
+        self.assertEqual(hits + 4, pool.hits)
+
+        # Partially-read ones don't
+        resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'STATUS')
+        with contextlib.closing(resp):
+            resp.read(1)
+        misses = pool.misses
+        resp = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'STATUS')
+        with contextlib.closing(resp):
+            resp.read()
+        self.assertEqual(misses + 1, pool.misses)
+        pool.clear()
+
+    def test_http_connection_pool_no_resend(self):
+        """Requests already sent through a reused connection are not sent again"""
+
+        srv_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv_sock.bind(('127.0.0.1', 0))
+        srv_sock.listen(5)
+        port = srv_sock.getsockname()[1]
+        received = []
+
+        def serve():
+            with contextlib.closing(srv_sock):
+                conn, _ = srv_sock.accept()
+                with contextlib.closing(conn):
+                    received.append(conn.recv(65536))
+                    conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+                    # The connection goes down after the second request is
+                    # received, as if the server died while executing it
+                    received.append(conn.recv(65536))
+                srv_sock.settimeout(1)
+                try:
+                    conn, _ = srv_sock.accept()
+                    received.append(conn.recv(65536))
+                    conn.close()
+                except socket.timeout:
+                    pass
+
+        t = threading.Thread(target=serve)
+        t.start()
+        ngamsHttpUtils.pool.clear()
+        try:
+            resp = ngamsHttpUtils.httpGet('127.0.0.1', port, 'STATUS')
+            with contextlib.closing(resp):
+                self.assertEqual(200, resp.status)
+                resp.read()
+            self.assertRaises((socket.error, http_client.BadStatusLine),
+                              ngamsHttpUtils.httpGet, '127.0.0.1', port, 'REMFILE')
+        finally:
+            t.join()
+            ngamsHttpUtils.pool.clear()
+        self.assertEqual(2, len(received))
+        self.assertIn(b'REMFILE', received[1])
+
     def test_reload_command(self):
         """Checks that commands can be reloaded successfully"""
         self.prepExtSrv()
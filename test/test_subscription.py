@@ -42,8 +42,9 @@ import six
 import requests
 import trustme
 
-from ngamsLib import ngamsHttpUtils, ngamsDb, ngamsSubscriber
-from ngamsLib.ngamsCore import getHostName, toiso8601
+from ngamsLib import ngamsHttpUtils, ngamsDb, ngamsDbCore, ngamsSubscriber
+from ngamsLib.ngamsCore import getHostName, toiso8601, NGAMS_SUBSCR_BACK_LOG
+from ngamsServer import ngamsSubscriptionThread
 from .ngamsTestLib import ngamsTestSuite, tmp_path, genTmpFilename
 
 try:
@@ -493,3 +494,96 @@ class ngamsSubscriptionTest(ngamsTestSuite):
         self.assertEqual('SmallFile.fits', archive_evt.file_id)
 
         self.retrieve(sub_port, 'SmallFile.fits', fileVersion=2, targetFile=tmp_path())
+
+
+class _FakeDb(object):
+
+    def __init__(self, queued):
+        self.queued = queued
+        self.added = []
+
+    def getSubscrQueueStatuses(self, subscrId, fileIds):
+        return self.queued
+
+    def addSubscrQueueEntry(self, subscrId, fileId, fileVersion, diskId, *args):
+        self.added.append(fileId)
+
+
+class _FakeSrv(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    def getDb(self):
+        return self.db
+
+
+def _file_info(file_id, ing_date, back_log=None):
+    file_info = [None] * (len(ngamsDbCore.getNgasSummary2Def()) + 1)
+    file_info[ngamsSubscriptionThread.FILE_ID] = file_id
+    file_info[ngamsSubscriptionThread.FILE_NM] = '/data/' + file_id
+    file_info[ngamsSubscriptionThread.FILE_VER] = 1
+    file_info[ngamsSubscriptionThread.FILE_DATE] = toiso8601(ing_date, local=True)
+    file_info[ngamsSubscriptionThread.FILE_DISK_ID] = 'disk-id'
+    file_info[ngamsSubscriptionThread.FILE_BL] = back_log
+    return file_info
+
+def _file_ids(file_infos):
+    return [f[ngamsSubscriptionThread.FILE_ID] for f in file_infos]
+
+
+class ngamsSubscriptionSchedulingTest(unittest.TestCase):
+    """Checks the selection of the files to deliver to subscribers"""
+
+    def test_delivery_start_date(self):
+        """Files are delivered from the latest of the start, delivery and schedule dates"""
+
+        start_date = ngamsSubscriptionThread._deliveryStartDate
+        subscr = ngamsSubscriber.ngamsSubscriber(url='http://host/path', subscrId='sub',
+                                                 startDate=1000)
+        iso = lambda t: toiso8601(t, local=True)
+
+        # Without a start date files are delivered regardless of their date
+        no_start = ngamsSubscriber.ngamsSubscriber(url='http://host/path', subscrId='sub')
+        self.assertIsNone(start_date(no_start, {'sub': 2000}, {'sub': iso(3000)}))
+
+        # Files referenced explicitly are checked against the start date only
+        self.assertEqual(1000, start_date(subscr, {'sub': 2000}, {'sub': iso(3000)},
+                                          explicitFileDelivery=True))
+
+        # Otherwise the last delivery counts, or the last schedule if later
+        self.assertEqual(1000, start_date(subscr, {'sub': None}, {}))
+        self.assertEqual(1000, start_date(subscr, {'sub': 500}, {}))
+        self.assertEqual(2000, start_date(subscr, {'sub': 2000}, {}))
+        self.assertEqual(2000, start_date(subscr, {'sub': 2000}, {'sub': iso(1500)}))
+        self.assertEqual(3000, start_date(subscr, {'sub': 2000}, {'sub': iso(3000)}))
+
+    def test_delivery_candidates(self):
+        """Candidates are selected by ingestion date, boundary included"""
+
+        candidates = ngamsSubscriptionThread._DeliveryCandidates()
+        for file_id, ing_date in (('b', 2000), ('a', 1000), ('c', 3000)):
+            candidates.add(_file_info(file_id, ing_date))
+        self.assertEqual(3, len(candidates))
+        self.assertEqual(['a', 'b', 'c'], _file_ids(candidates.since(None)))
+        self.assertEqual(['b', 'c'], _file_ids(candidates.since(2000)))
+        self.assertEqual(['c'], _file_ids(candidates.since(2000.001)))
+        self.assertEqual([], _file_ids(candidates.since(3000.001)))
+
+        # Files added again replace their previous entry
+        candidates.add(_file_info('a', 4000))
+        self.assertEqual(3, len(candidates))
+        self.assertEqual(['b', 'c', 'a'], _file_ids(candidates.since(2000)))
+        self.assertEqual('/data/a', candidates.get('a', 1)[ngamsSubscriptionThread.FILE_NM])
+        self.assertIsNone(candidates.get('a', 2))
+
+    def test_queue_files(self):
+        """Files already in the persistent queue are queued only if back-logged"""
+
+        db = _FakeDb({('a', 1, 'disk-id'): (0, None), ('b', 1, 'disk-id'): (-2, None)})
+        files = [_file_info('a', 1000), _file_info('b', 2000, NGAMS_SUBSCR_BACK_LOG),
+                 _file_info('c', 3000), _file_info('d', 4000, NGAMS_SUBSCR_BACK_LOG)]
+        queue = six.moves.queue.Queue()
+        ngamsSubscriptionThread.queueFiles(_FakeSrv(db), 'sub', files, queue)
+        self.assertEqual(['c', 'd'], db.added)
+        self.assertEqual(['b', 'c', 'd'], _file_ids(queue.get_nowait() for _ in range(queue.qsize())))